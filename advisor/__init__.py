@@ -0,0 +1,3 @@
+"""
+Wealth Solutions Advisor - módulos de soporte de la aplicación Streamlit.
+"""
@@ -0,0 +1,523 @@
+"""
+Análisis con OpenAI: conversación completa, hilos y Pre-Meeting Brief.
+
+Las funciones reciben la API Key de forma explícita y no cachean nada: la
+caché la pone advisor.engine.AdvisorEngine.
+"""
+import json
+
+from advisor import ledger, telemetry
+
+
+def OpenAI(*args, **kwargs):
+    """Cliente de OpenAI; el SDK se importa en la primera llamada (~0,4 s en frío)."""
+    from openai import OpenAI as _OpenAI
+    return _OpenAI(*args, **kwargs)
+
+
+def _record_usage(response):
+    """Anota los tokens de la respuesta en la traza y en el libro de consumo."""
+    telemetry.record_usage(response)
+    ledger.note_usage(response)
+
+
+def analyze_with_ai(text_data, num_emails, api_key, model="gpt-4o"):
+    """
+    Analiza emails con OpenAI GPT-4 con manejo robusto de errores.
+    
+    Args:
+        text_data: Texto concatenado de todos los emails
+        num_emails: Cantidad de emails analizados
+        api_key: API Key de OpenAI
+        model: Modelo de OpenAI a usar
+    
+    Returns:
+        tuple: (resultado_json, mensaje_error)
+    """
+    
+    # === VALIDACIONES PREVIAS ===
+    if not text_data or not text_data.strip():
+        return None, "❌ No hay contenido de emails para analizar."
+    
+    if num_emails <= 0:
+        return None, "❌ El número de emails debe ser mayor a 0."
+    
+    # Validar que la API key existe
+    if not api_key or api_key == "":
+        return None, "🔑 Falta configurar OPENAI_KEY en secrets.toml"
+    
+    # === LÍMITE DE TOKENS ===
+    # GPT-4o tiene límite de contexto. Vamos a truncar si es necesario
+    MAX_CHARS_FOR_AI = 80000  # Margen de seguridad
+    prompt_span = telemetry.start_span("ai.prompt", input_chars=len(text_data))
+    
+    if len(text_data) > MAX_CHARS_FOR_AI:
+        text_data = text_data[:MAX_CHARS_FOR_AI]
+        text_data += "\n\n[NOTA: Contenido truncado por límite de tokens]"
+        ledger.note_truncated()
+    
+    # === CONSTRUCCIÓN DEL PROMPT ===
+    prompt = f"""
+    Actúa como un Senior Private Banker. Analiza el historial de {num_emails} correos.
+    
+    OBJETIVO 1: NARRATIVA. Genera un campo 'resumen_exhaustivo' (6-8 líneas) contando la historia de la conversación.
+    OBJETIVO 2: SENTIMIENTO. Analiza CADA UNO de los {num_emails} correos y asigna un score (-10 a +10).
+    
+    JSON Estricto:
+    {{
+        "resumen_exhaustivo": "Texto narrativo...",
+        "urgencia": "Alta|Media|Baja",
+        "perfil_cliente": "Estado actual...",
+        "accion_recomendada": "Acción comercial...",
+        "borrador_respuesta": "Email...",
+        "analisis_sentimiento": [
+            {{ "email_num": 1, "sentimiento_score": 5, "explicacion": "..." }},
+            ... (UN OBJETO POR CADA EMAIL) ...
+            {{ "email_num": {num_emails}, "sentimiento_score": -2, "explicacion": "..." }}
+        ],
+        "insights_clave": ["Insight 1", "Insight 2"]
+    }}
+    """
+    prompt_span.end(prompt_chars=len(prompt) + len(text_data), truncated=len(text_data) > MAX_CHARS_FOR_AI)
+    
+    try:
+        # === LLAMADA A OPENAI CON TIMEOUT ===
+        client = OpenAI(
+            api_key=api_key,
+            timeout=60.0  # Timeout de 60 segundos
+        )
+        
+        with telemetry.span("openai.chat", **{"gen_ai.system": "openai", "gen_ai.request.model": model}):
+            response = client.chat.completions.create(
+                model=model,
+                response_format={"type": "json_object"},
+                messages=[
+                    {"role": "system", "content": prompt},
+                    {"role": "user", "content": text_data}
+                ],
+                temperature=0.2,
+                max_tokens=4000  # Límite explícito
+            )
+            _record_usage(response)
+        
+        # === PARSEAR RESPUESTA ===
+        validate_span = telemetry.start_span("ai.validate")
+        try:
+            result = json.loads(response.choices[0].message.content)
+        except json.JSONDecodeError as json_err:
+            validate_span.end(valid_json=False)
+            return None, f"❌ La IA devolvió un formato inválido. Error: {str(json_err)}"
+        
+        # === VALIDAR ESTRUCTURA DEL JSON ===
+        required_fields = [
+            'resumen_exhaustivo',
+            'urgencia',
+            'perfil_cliente',
+            'accion_recomendada',
+            'borrador_respuesta',
+            'analisis_sentimiento',
+            'insights_clave'
+        ]
+        
+        missing_fields = [field for field in required_fields if field not in result]
+        
+        if missing_fields:
+            # Si faltan campos críticos, crear valores por defecto
+            if 'resumen_exhaustivo' not in result:
+                result['resumen_exhaustivo'] = "⚠️ No se pudo generar el resumen completo."
+            if 'urgencia' not in result:
+                result['urgencia'] = "Media"
+            if 'perfil_cliente' not in result:
+                result['perfil_cliente'] = "Cliente con actividad reciente."
+            if 'accion_recomendada' not in result:
+                result['accion_recomendada'] = "Revisar la conversación y responder según contexto."
+            if 'borrador_respuesta' not in result:
+                result['borrador_respuesta'] = "Estimado/a cliente,\n\nGracias por tu mensaje. Estamos revisando tu solicitud.\n\nSaludos cordiales."
+            if 'analisis_sentimiento' not in result:
+                result['analisis_sentimiento'] = []
+            if 'insights_clave' not in result:
+                result['insights_clave'] = ["Revisar el historial de emails manualmente para más detalles."]
+        
+        # === VALIDAR ANÁLISIS DE SENTIMIENTO ===
+        sentimientos = result.get('analisis_sentimiento', [])
+        
+        # Si la IA no generó sentimientos, crear estructura básica
+        if not sentimientos or len(sentimientos) == 0:
+            result['analisis_sentimiento'] = [
+                {
+                    "email_num": i + 1,
+                    "sentimiento_score": 0,
+                    "explicacion": "Análisis no disponible"
+                }
+                for i in range(num_emails)
+            ]
+        
+        # Si hay menos sentimientos que emails, rellenar
+        elif len(sentimientos) < num_emails:
+            for i in range(len(sentimientos), num_emails):
+                result['analisis_sentimiento'].append({
+                    "email_num": i + 1,
+                    "sentimiento_score": 0,
+                    "explicacion": "Análisis no disponible"
+                })
+        
+        # Validar que los scores estén en rango válido
+        for sent in result['analisis_sentimiento']:
+            score = sent.get('sentimiento_score', 0)
+            if not isinstance(score, (int, float)) or score < -10 or score > 10:
+                sent['sentimiento_score'] = 0
+        
+        validate_span.end(valid_json=True, missing_fields=len(missing_fields))
+        return result, None
+    
+    except Exception as e:
+        error_msg = str(e)
+        
+        # === MANEJO DE ERRORES ESPECÍFICOS ===
+        if "rate_limit" in error_msg.lower():
+            return None, "⏳ Has alcanzado el límite de consultas de OpenAI. Intenta de nuevo en unos minutos."
+        
+        elif "invalid_api_key" in error_msg.lower() or "authentication" in error_msg.lower():
+            return None, "🔑 La API Key de OpenAI no es válida. Verifica tu configuración en secrets.toml"
+        
+        elif "timeout" in error_msg.lower():
+            return None, "⏱️ La consulta tardó demasiado. Intenta con menos emails o un período más corto."
+        
+        elif "context_length_exceeded" in error_msg.lower():
+            return None, f"📏 El contenido es demasiado largo para procesar ({len(text_data)} caracteres). Reduce el número de emails."
+        
+        elif "insufficient_quota" in error_msg.lower():
+            return None, "💳 Tu cuenta de OpenAI no tiene créditos suficientes. Recarga tu saldo."
+        
+        else:
+            # Error genérico con detalles
+            return None, f"❌ Error al comunicarse con OpenAI: {error_msg[:300]}"
+
+
+def generate_fallback_analysis(evidence, target_email):
+    """
+    Genera un análisis básico local cuando OpenAI falla.
+    Permite al usuario seguir trabajando con los emails.
+    """
+    num_emails = len(evidence)
+    
+    # Contar origen de emails
+    from_client = sum(1 for e in evidence if e['Origen'] == 'CLIENTE')
+    from_bank = num_emails - from_client
+    
+    # Detectar último origen
+    last_origin = evidence[-1]['Origen'] if evidence else 'DESCONOCIDO'
+    
+    # Análisis básico sin IA
+    return {
+        'resumen_exhaustivo': f"Se analizaron {num_emails} emails con {target_email}. El cliente envió {from_client} mensajes y el banco {from_bank}. El último mensaje fue del {last_origin}. ⚠️ Análisis automático no disponible - revisa los emails manualmente.",
+        'urgencia': 'Media',
+        'perfil_cliente': f"Cliente con {num_emails} interacciones recientes. {'Espera respuesta del banco.' if last_origin == 'CLIENTE' else 'Última respuesta enviada por el banco.'}",
+        'accion_recomendada': 'Revisar el historial de emails manualmente en el Explorador Avanzado.',
+        'borrador_respuesta': f"Estimado/a cliente,\n\nHemos recibido tu mensaje y estamos revisando tu solicitud.\n\nTe responderemos a la brevedad.\n\nSaludos cordiales,\nEquipo de Banca Privada",
+        'analisis_sentimiento': [
+            {
+                'email_num': i + 1,
+                'sentimiento_score': 0,
+                'explicacion': 'Análisis automático no disponible'
+            }
+            for i in range(num_emails)
+        ],
+        'insights_clave': [
+            '⚠️ El análisis de IA no está disponible temporalmente',
+            f'Total de {num_emails} emails en la conversación',
+            'Revisa los emails manualmente en la pestaña "Explorador Avanzado"'
+        ]
+    }
+
+
+def analyze_thread_structure(thread_text, api_key, model="gpt-4o"):
+    """Genera el Timeline Visual y el Análisis Ejecutivo Profundo"""
+    client = OpenAI(api_key=api_key)
+    
+    # PROMPT DE ALTO NIVEL (SENIOR ANALYST ROLE)
+    prompt = """
+    Actúa como un Analista Senior de Información y UX Writer especializado en gestión ejecutiva.
+    Analiza el siguiente hilo de correos completo como una conversación única y orgánica.
+    
+    OBJETIVO:
+    Transformar el hilo en un informe de inteligencia visual. No quiero un resumen lineal.
+    Debes identificar intenciones ocultas, fricciones, quién impulsa y quién bloquea.
+    
+    INPUT: Texto completo del hilo de correos.
+    
+    OUTPUT: Genera una respuesta EXCLUSIVAMENTE en formato Markdown siguiendo esta estructura estricta:
+    
+    ### 🧭 Timeline del Hilo
+    (Genera una lista de hitos. Usa fechas aproximadas si no son exactas. NO resumas cada mail, solo hitos clave).
+    
+    * 🔵 **[DD/MM] – [Fase: Inicio / Seguimiento / Bloqueo / Escalado / Resolución]**
+        * **Actor:** [Nombre de la persona principal]
+        * **Hecho clave:** [Acción concisa. Ej: Solicita confirmación jurídica]
+        * **Impacto:** [Consecuencia real. Ej: El proceso depende ahora de un tercero]
+    
+    (Repite el bloque anterior para cada hito relevante del hilo)
+    
+    ---
+    
+    ### 📌 Estado Actual
+    * **Estado:** [PENDIENTE | BLOQUEADO | CERRADO] (Elige uno con criterio estricto)
+    * **Atasco:** [Explica brevemente dónde está el cuello de botella real o la pelota]
+    * **Responsable actual:** [Nombre de la persona que debe mover ficha ahora]
+    
+    ### 🧠 Conclusión Ejecutiva
+    [Párrafo de 3-4 líneas. Demuestra comprensión profunda. ¿Es un problema operativo, de decisión o de falta de información? ¿Qué riesgo hay si no se avanza? Ve más allá de lo evidente.]
+    
+    ### ▶️ Próximos Pasos
+    * 1. **Acción:** [Acción concreta] | **Responsable:** [Nombre] | **Objetivo:** [Para qué]
+    (Añade más si son necesarios)
+    """
+    
+    try:
+        with telemetry.span("openai.chat", **{"gen_ai.system": "openai", "gen_ai.request.model": model}):
+            response = client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": prompt}, 
+                    {"role": "user", "content": thread_text}
+                ],
+                temperature=0.1 # Temperatura baja para máxima precisión y respeto al formato
+            )
+            _record_usage(response)
+        return response.choices[0].message.content
+    except Exception as e:
+        return f"Error al generar inteligencia: {str(e)}"
+
+
+def build_brief_text(evidence):
+    """Texto compacto (500 caracteres por email) que se envía al generar el Brief."""
+    from advisor.evidence import EvidenceFrame
+    return EvidenceFrame.from_records(evidence).brief_text()
+
+
+def generate_meeting_brief(text_data, num_emails, target_email, api_key, model="gpt-4o"):
+    """Genera un Pre-Meeting Brief ejecutivo"""
+    client = OpenAI(api_key=api_key)
+    
+    prompt = f"""
+    Actúa como un Asistente Ejecutivo Senior de Banca Privada.
+    
+    El RM tiene una reunión próximamente con el cliente {target_email}.
+    Has analizado los últimos {num_emails} emails.
+    
+    Genera un PRE-MEETING BRIEF que se pueda leer en 60 segundos.
+    
+    Devuelve un JSON con esta estructura EXACTA:
+    
+    {{
+        "contexto_rapido": "2-3 líneas explicando el estado actual de la relación y el mood del cliente",
+        "temas_reunion": [
+            {{
+                "prioridad": "URGENTE|IMPORTANTE|INFORMATIVO",
+                "tema": "Título del tema",
+                "detalle": "Qué discutir o confirmar",
+                "contexto": "Por qué es relevante ahora"
+            }}
+        ],
+        "pendientes_cliente": [
+            "Acción 1 que el cliente debe hacer/enviar",
+            "Acción 2 pendiente del cliente"
+        ],
+        "pendientes_banco": [
+            "Acción 1 que tú/el banco debe hacer",
+            "Acción 2 pendiente de tu lado"
+        ],
+        "talking_points": [
+            "Frase exacta para abrir tema 1",
+            "Frase exacta para abrir tema 2"
+        ],
+        "timeline_reciente": [
+            {{
+                "fecha": "DD/MM",
+                "quien": "CLIENTE|BANCO",
+                "que_paso": "Descripción breve de la acción"
+            }}
+        ],
+        "documentos_mencionar": [
+            "Nombre de documento o email que debes referenciar en la reunión"
+        ]
+    }}
+    
+    IMPORTANTE:
+    - temas_reunion: Máximo 5, ordenados por prioridad
+    - timeline_reciente: Solo los últimos 5 hitos relevantes
+    - talking_points: Frases naturales y profesionales
+    - Sé específico, no genérico
+    """
+    
+    try:
+        with telemetry.span("openai.chat", **{"gen_ai.system": "openai", "gen_ai.request.model": model}):
+            response = client.chat.completions.create(
+                model=model,
+                response_format={"type": "json_object"},
+                messages=[
+                    {"role": "system", "content": prompt},
+                    {"role": "user", "content": text_data}
+                ],
+                temperature=0.3
+            )
+            _record_usage(response)
+        with telemetry.span("ai.validate"):
+            result = json.loads(response.choices[0].message.content)
+        return result, None
+    except Exception as e:
+        return None, f"Error al generar brief: {str(e)}"
+
+
+# --- HISTORIAL COMPLETO (RESÚMENES JERÁRQUICOS) ---
+
+MAX_CHARS_FOR_SUMMARY = 60000
+
+
+def _json_completion(prompt, text_data, api_key, model, max_tokens):
+    """Llamada JSON común de los resúmenes del historial. Returns: (json, mensaje_error)"""
+    if not api_key:
+        return None, "🔑 Falta configurar OPENAI_KEY en secrets.toml"
+    if len(text_data) > MAX_CHARS_FOR_SUMMARY:
+        text_data = text_data[:MAX_CHARS_FOR_SUMMARY] + "\n\n[NOTA: Contenido truncado por límite de tokens]"
+        ledger.note_truncated()
+    try:
+        client = OpenAI(api_key=api_key, timeout=60.0)
+        with telemetry.span("openai.chat", **{"gen_ai.system": "openai", "gen_ai.request.model": model}):
+            response = client.chat.completions.create(
+                model=model,
+                response_format={"type": "json_object"},
+                messages=[
+                    {"role": "system", "content": prompt},
+                    {"role": "user", "content": text_data}
+                ],
+                temperature=0.2,
+                max_tokens=max_tokens
+            )
+            _record_usage(response)
+        with telemetry.span("ai.validate"):
+            return json.loads(response.choices[0].message.content), None
+    except json.JSONDecodeError as json_err:
+        return None, f"❌ La IA devolvió un formato inválido. Error: {str(json_err)}"
+    except Exception as e:
+        return None, f"❌ Error al comunicarse con OpenAI: {str(e)[:300]}"
+
+
+def summarize_period(text_data, period, from_summaries, api_key, model="gpt-4o"):
+    """
+    Resumen de un periodo (mes, trimestre o año) del historial de un cliente.
+    
+    Args:
+        text_data: Emails del mes (evidence.brief_text()) o resúmenes de sus hijos
+        period: Nombre del periodo ("marzo 2025", "T1 2025"...)
+        from_summaries: True si text_data son resúmenes de periodos más cortos
+    
+    Returns:
+        tuple: (resumen_json, mensaje_error)
+    """
+    source = "los resúmenes de sus periodos" if from_summaries else "los emails"
+    prompt = f"""
+    Actúa como un Senior Private Banker. Resume la relación con el cliente durante {period} a partir de {source}.
+    Será la memoria permanente de ese periodo: conserva hechos, cifras, productos y decisiones, no opiniones genéricas.
+    
+    JSON Estricto:
+    {{
+        "resumen": "4-6 líneas con lo que pasó en el periodo",
+        "temas": ["Tema 1", "Tema 2"],
+        "sentimiento_medio": 0,
+        "urgencia": "Alta|Media|Baja",
+        "hitos": [{{ "fecha": "DD/MM/AAAA", "hecho": "..." }}],
+        "pendientes": ["Lo que quedó abierto al final del periodo"]
+    }}
+    
+    sentimiento_medio va de -10 a +10. Máximo 5 hitos.
+    """
+    result, err = _json_completion(prompt, text_data, api_key, model, max_tokens=900)
+    if err:
+        return None, err
+    result.setdefault('resumen', "")
+    result.setdefault('temas', [])
+    result.setdefault('hitos', [])
+    result.setdefault('pendientes', [])
+    score = result.get('sentimiento_medio')
+    if not isinstance(score, (int, float)) or score < -10 or score > 10:
+        result['sentimiento_medio'] = None
+    return result, None
+
+
+def analyze_full_history(summaries_text, target_email, api_key, model="gpt-4o"):
+    """
+    Análisis de toda la relación con el cliente a partir de los resúmenes de
+    sus periodos (años, trimestres y meses recientes).
+    
+    Returns:
+        tuple: (resultado_json, mensaje_error)
+    """
+    if not summaries_text or not summaries_text.strip():
+        return None, "❌ No hay resúmenes del historial para analizar."
+    
+    prompt = f"""
+    Actúa como un Senior Private Banker. Tienes los resúmenes cronológicos de toda la relación con {target_email}
+    (años cerrados, trimestres del año en curso y meses recientes).
+    
+    JSON Estricto:
+    {{
+        "resumen_relacion": "8-10 líneas con la historia completa de la relación",
+        "etapas": [{{ "periodo": "2024", "descripcion": "...", "sentimiento": 0 }}],
+        "tendencia_sentimiento": "Mejorando|Estable|Empeorando",
+        "urgencia": "Alta|Media|Baja",
+        "perfil_cliente": "Quién es el cliente hoy y cómo ha cambiado",
+        "riesgos": ["Riesgo 1"],
+        "oportunidades": ["Oportunidad 1"],
+        "accion_recomendada": "Acción comercial...",
+        "insights_clave": ["Insight 1", "Insight 2"]
+    }}
+    
+    Las etapas son las fases de la relación en orden cronológico; su sentimiento va de -10 a +10.
+    """
+    result, err = _json_completion(prompt, summaries_text, api_key, model, max_tokens=2000)
+    if err:
+        return None, err
+    for field in ('etapas', 'riesgos', 'oportunidades', 'insights_clave'):
+        result.setdefault(field, [])
+    result.setdefault('resumen_relacion', "⚠️ No se pudo generar el resumen de la relación.")
+    result.setdefault('urgencia', "Media")
+    return result, None
+
+
+# --- ESCÁNER DE ALERTAS ---
+
+def score_new_emails(text_data, api_key, model="gpt-4o"):
+    """
+    Sentimiento y urgencia de emails nuevos de clientes (escáner de alertas).
+    
+    Args:
+        text_data: Un bloque por email con su ID, cliente, asunto y cuerpo
+    
+    Returns:
+        tuple: ({id: {'sentimiento_score', 'urgencia'}}, mensaje_error)
+    """
+    prompt = """
+    Actúa como un Senior Private Banker. Puntúa cada email de un cliente de banca privada.
+    
+    JSON Estricto:
+    {
+        "emails": [{ "id": "ID del email", "sentimiento_score": 0, "urgencia": "Alta|Media|Baja" }]
+    }
+    
+    sentimiento_score va de -10 (muy molesto) a +10 (muy satisfecho). urgencia es Alta si el cliente
+    exige una respuesta inmediata, amenaza con irse o hay un problema con su dinero. Un elemento por email.
+    """
+    result, err = _json_completion(prompt, text_data, api_key, model, max_tokens=1200)
+    if err:
+        return None, err
+    scores = {}
+    for item in result.get('emails') or []:
+        if not isinstance(item, dict) or not item.get('id'):
+            continue
+        score = item.get('sentimiento_score')
+        if not isinstance(score, (int, float)) or score < -10 or score > 10:
+            score = None
+        urgency = item.get('urgencia') if item.get('urgencia') in ('Alta', 'Media', 'Baja') else None
+        scores[str(item['id'])] = {'sentimiento_score': score, 'urgencia': urgency}
+    return scores, None
@@ -0,0 +1,277 @@
+"""
+Alertas de la cartera a partir del correo nuevo, en SQLite.
+
+Los RM solo se enteraban de que un cliente estaba molesto al abrirlo. El
+escáner (AdvisorEngine.scan_alerts; ``python -m advisor scan`` desde cron o
+con --every) pide a Gmail solo lo añadido desde la pasada anterior
+(users.history.list desde el historyId guardado aquí para ese buzón). Se queda con los
+mensajes de clientes de la cartera, puntúa solo los emails nuevos del cliente
+(cada puntuación se guarda y no se repite) y levanta tres tipos de alerta:
+
+- drop: un email del cliente cae ALERT_DROP puntos o más por debajo de su
+  sentimiento habitual (el del último análisis o, si no hay, el que ha ido
+  viendo el escáner); sin referencia, cuando el score llega a ALERT_NEGATIVE
+- unanswered: el último mensaje es del cliente y lleva más de
+  ALERT_PENDING_HOURS sin respuesta del banco
+- urgent: la IA marca un email nuevo con urgencia Alta
+
+Cada alerta se guarda una sola vez (cliente + tipo + mensaje) y queda abierta
+hasta que el RM la marca como vista. La app las enseña en el sidebar al entrar.
+"""
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+from advisor.registry import normalize
+
+ALERTS_DB = "portfolio_alerts.sqlite3"
+ALERT_DROP = 5.0             # Caída frente al sentimiento habitual del cliente
+ALERT_NEGATIVE = -5.0        # Score que alerta aunque no haya referencia
+ALERT_PENDING_HOURS = 48.0   # Horas sin responder a un email del cliente
+BASELINE_ALPHA = 0.2         # Peso de cada email nuevo en el sentimiento habitual del escáner
+
+ALERT_LABELS = {
+    'drop': "📉 Caída de sentimiento",
+    'unanswered': "⏳ Sin responder",
+    'urgent': "🔴 Urgencia alta",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scan_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS scanned_messages (
+    message_id TEXT PRIMARY KEY,
+    client TEXT NOT NULL,
+    origin TEXT NOT NULL,
+    sent_at REAL NOT NULL,
+    subject TEXT,
+    score REAL,
+    urgency TEXT,
+    scanned_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_scanned_client ON scanned_messages(client, sent_at);
+CREATE TABLE IF NOT EXISTS client_activity (
+    client TEXT PRIMARY KEY,
+    last_client_at REAL,
+    last_client_message TEXT,
+    last_bank_at REAL,
+    baseline REAL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS alerts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    client TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    message_id TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    detail TEXT,
+    score REAL,
+    acknowledged_at REAL,
+    UNIQUE (client, kind, message_id)
+);
+CREATE INDEX IF NOT EXISTS idx_alerts_open ON alerts(acknowledged_at, created_at);
+"""
+
+_ALERT_COLUMNS = "id, client, kind, message_id, created_at, detail, score, acknowledged_at"
+
+
+class AlertStore:
+    """Cursor del escáner, mensajes ya vistos y alertas, seguro entre hilos y procesos (WAL)."""
+
+    def __init__(self, path=ALERTS_DB):
+        self.path = path
+        self._init_lock = threading.Lock()
+        self._ready = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        if not self._ready:
+            with self._init_lock:
+                if not self._ready:
+                    directory = os.path.dirname(self.path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.executescript(SCHEMA)
+                    self._ready = True
+        return conn
+
+    # --- CURSOR ---
+    def cursor(self, account):
+        """historyId de Gmail hasta el que se ha escaneado el buzón ``account`` (None si nunca)."""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT value FROM scan_state WHERE key = ?", (f"history_id:{normalize(account)}",)).fetchone()
+        return int(row['value']) if row and row['value'] else None
+
+    def set_cursor(self, account, history_id):
+        account = normalize(account)
+        with closing(self._connect()) as conn:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO scan_state (key, value) VALUES (?, ?), (?, ?)",
+                    (f"history_id:{account}", str(history_id), f"scanned_at:{account}", str(time.time()))
+                )
+
+    def last_scan(self, account):
+        """Marca de tiempo de la última pasada completa sobre el buzón (None si nunca)."""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT value FROM scan_state WHERE key = ?", (f"scanned_at:{normalize(account)}",)).fetchone()
+        return float(row['value']) if row and row['value'] else None
+
+    # --- MENSAJES ---
+    def known(self, message_ids):
+        """Ids de ``message_ids`` que ya se procesaron en alguna pasada."""
+        message_ids = list(message_ids)
+        found = set()
+        with closing(self._connect()) as conn:
+            for i in range(0, len(message_ids), 500):
+                chunk = message_ids[i:i + 500]
+                rows = conn.execute(
+                    f"SELECT message_id FROM scanned_messages WHERE message_id IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                found.update(row['message_id'] for row in rows)
+        return found
+
+    def ingest(self, messages, baselines=None, now=None):
+        """
+        Guarda los mensajes nuevos de clientes y levanta las alertas drop y urgent.
+
+        Args:
+            messages: Lista de dicts {'id', 'client', 'origin' ('CLIENTE'|'BANCO'),
+                      'sent_at', 'subject', 'score', 'urgency'} en orden cronológico
+            baselines: {cliente: sentimiento medio del último análisis} (registro)
+            now: Marca de tiempo de la pasada
+
+        Returns:
+            list: alertas nuevas (dicts)
+        """
+        baselines = baselines or {}
+        now = now or time.time()
+        new_alerts = []
+        with closing(self._connect()) as conn:
+            with conn:
+                for msg in messages:
+                    client = normalize(msg['client'])
+                    inserted = conn.execute(
+                        "INSERT OR IGNORE INTO scanned_messages (message_id, client, origin, sent_at, subject, score, "
+                        "urgency, scanned_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (msg['id'], client, msg['origin'], msg['sent_at'], msg['subject'], msg.get('score'),
+                         msg.get('urgency'), now)
+                    ).rowcount
+                    if not inserted:
+                        continue
+
+                    activity = conn.execute("SELECT * FROM client_activity WHERE client = ?", (client,)).fetchone()
+                    activity = dict(activity) if activity else {'last_client_at': None, 'last_client_message': None,
+                                                                 'last_bank_at': None, 'baseline': None}
+                    if msg['origin'] == 'BANCO':
+                        activity['last_bank_at'] = max(activity['last_bank_at'] or 0, msg['sent_at'])
+                        if activity['last_bank_at'] >= (activity['last_client_at'] or 0):
+                            # El banco ya respondió: la alerta de espera deja de tener sentido
+                            conn.execute(
+                                "UPDATE alerts SET acknowledged_at = ? WHERE client = ? AND kind = 'unanswered' "
+                                "AND acknowledged_at IS NULL", (now, client)
+                            )
+                    else:
+                        if msg['sent_at'] >= (activity['last_client_at'] or 0):
+                            activity['last_client_at'] = msg['sent_at']
+                            activity['last_client_message'] = msg['id']
+                        score = msg.get('score')
+                        if score is not None:
+                            reference = baselines.get(client)
+                            if reference is None:
+                                reference = activity['baseline']
+                            if (reference is not None and score <= reference - ALERT_DROP) or \
+                                    (reference is None and score <= ALERT_NEGATIVE):
+                                detail = f"Score {score:+.0f}" + (f" (habitual {reference:+.1f})" if reference is not None else "")
+                                new_alerts += self._raise(conn, client, 'drop', msg, f"{detail} · {msg['subject']}", score, now)
+                            previous = activity['baseline']
+                            activity['baseline'] = score if previous is None else \
+                                previous + BASELINE_ALPHA * (score - previous)
+                        if msg.get('urgency') == 'Alta':
+                            new_alerts += self._raise(conn, client, 'urgent', msg, msg['subject'], score, now)
+
+                    conn.execute(
+                        "INSERT OR REPLACE INTO client_activity (client, last_client_at, last_client_message, "
+                        "last_bank_at, baseline) VALUES (?, ?, ?, ?, ?)",
+                        (client, activity['last_client_at'], activity['last_client_message'],
+                         activity['last_bank_at'], activity['baseline'])
+                    )
+        return new_alerts
+
+    @staticmethod
+    def _raise(conn, client, kind, msg, detail, score, now):
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO alerts (client, kind, message_id, created_at, detail, score) VALUES (?, ?, ?, ?, ?, ?)",
+            (client, kind, msg['id'], now, detail, score)
+        )
+        if not cursor.rowcount:
+            return []
+        return [{'id': cursor.lastrowid, 'client': client, 'kind': kind, 'message_id': msg['id'],
+                 'created_at': now, 'detail': detail, 'score': score, 'acknowledged_at': None}]
+
+    def check_unanswered(self, now=None, hours=ALERT_PENDING_HOURS):
+        """Levanta las alertas unanswered de los clientes que esperan respuesta. Returns: alertas nuevas"""
+        now = now or time.time()
+        new_alerts = []
+        with closing(self._connect()) as conn:
+            with conn:
+                rows = conn.execute(
+                    "SELECT a.client, a.last_client_at, a.last_client_message, m.subject "
+                    "FROM client_activity AS a LEFT JOIN scanned_messages AS m ON m.message_id = a.last_client_message "
+                    "WHERE a.last_client_at > COALESCE(a.last_bank_at, 0) AND a.last_client_at <= ?",
+                    (now - hours * 3600,)
+                ).fetchall()
+                for row in rows:
+                    waited = (now - row['last_client_at']) / 3600
+                    msg = {'id': row['last_client_message']}
+                    new_alerts += self._raise(conn, row['client'], 'unanswered', msg,
+                                              f"{waited:.0f} h esperando · {row['subject'] or ''}", None, now)
+        return new_alerts
+
+    # --- LECTURA ---
+    def open_alerts(self, limit=50):
+        """Alertas sin marcar como vistas, la más reciente primero."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                f"SELECT {_ALERT_COLUMNS} FROM alerts WHERE acknowledged_at IS NULL "
+                "ORDER BY created_at DESC, id DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def count_open(self):
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM alerts WHERE acknowledged_at IS NULL").fetchone()[0]
+
+    def open_counts(self):
+        """Alertas abiertas por cliente: {cliente: n}."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT client, COUNT(*) AS n FROM alerts WHERE acknowledged_at IS NULL GROUP BY client"
+            ).fetchall()
+        return {row['client']: row['n'] for row in rows}
+
+    def activity(self):
+        """Último email del cliente y del banco que ha visto el escáner: {cliente: {...}}."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT * FROM client_activity").fetchall()
+        return {row['client']: dict(row) for row in rows}
+
+    def acknowledge(self, alert_id=None, client=None):
+        """Marca como vista una alerta (o todas las de un cliente)."""
+        sql, params = "UPDATE alerts SET acknowledged_at = ? WHERE acknowledged_at IS NULL", [time.time()]
+        if alert_id is not None:
+            sql += " AND id = ?"
+            params.append(alert_id)
+        if client is not None:
+            sql += " AND client = ?"
+            params.append(normalize(client))
+        with closing(self._connect()) as conn:
+            with conn:
+                return conn.execute(sql, params).rowcount
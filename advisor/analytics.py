@@ -0,0 +1,296 @@
+"""
+Analítica del sentimiento de las relaciones (NumPy, sin IA).
+
+El dashboard solo enseñaba la media simple de ``sentimiento_score``. Aquí se
+calculan, por cliente:
+
+- Sentimiento reciente: media ponderada en el tiempo (un email de hace
+  HALF_LIFE_DAYS días pesa la mitad que uno de hoy) y la media móvil con la
+  misma ponderación para el gráfico.
+- Tendencia: pendiente de la recta de regresión, en puntos cada 30 días.
+- Volatilidad: desviación típica de los saltos entre emails consecutivos.
+- Tiempo de respuesta CLIENTE → BANCO: desde el primer email de cada racha
+  del cliente hasta la siguiente respuesta del banco (mediana y p90), y
+  cuánto lleva esperando si el último mensaje es suyo.
+- Punto de cambio: el corte que mejor separa la serie en dos tramos de media
+  distinta (test t con varianza conjunta sobre sumas acumuladas).
+
+Todo opera sobre matrices (clientes × emails) rellenas con NaN: un cliente es
+una matriz de una fila y la cartera entera se calcula con las mismas
+operaciones, sin bucles por cliente. SentimentAnalytics.at_risk() ordena las
+relaciones por risk_score.
+"""
+import time
+import warnings
+
+import numpy as np
+
+DAY_S = 86400.0
+HALF_LIFE_DAYS = 30.0
+SLOPE_WINDOW_DAYS = 30.0
+CHANGE_MIN_SEGMENT = 3      # Emails mínimos a cada lado del punto de cambio
+CHANGE_MIN_STAT = 3.0       # Estadístico t mínimo para dar el cambio por bueno
+CHANGE_MIN_SHIFT = 2.0      # Salto mínimo de la media (escala -10..10)
+
+# Peso de cada señal en risk_score (0-100); cada señal se normaliza a 0..1
+RISK_WEIGHTS = {
+    'recent': 0.35,      # Sentimiento reciente bajo
+    'trend': 0.20,       # Tendencia a la baja
+    'volatility': 0.10,  # Relación inestable
+    'change': 0.15,      # Caída brusca detectada
+    'pending': 0.20,     # El cliente espera respuesta
+}
+RISK_SCALES = {'recent': 15.0, 'trend': 3.0, 'volatility': 6.0, 'change': 6.0, 'pending': 72.0}
+
+
+# --- SERIES ---
+def client_series(columns):
+    """
+    Serie de un cliente desde sus EvidenceColumns (advisor.query).
+
+    Returns:
+        tuple: (días desde epoch, scores, es_del_cliente) como arrays, en
+        orden cronológico y sin los emails de fecha desconocida
+    """
+    keep = [pos for pos, d in enumerate(columns.date) if d is not None]
+    t = np.array([columns.date[pos].timestamp() / DAY_S for pos in keep], dtype=np.float64)
+    x = np.array([np.nan if columns.score[pos] is None else columns.score[pos] for pos in keep], dtype=np.float64)
+    c = np.array([columns.origin[pos] == 'CLIENTE' for pos in keep], dtype=bool)
+    order = np.argsort(t, kind='stable')
+    return t[order], x[order], c[order]
+
+
+def pack(series):
+    """
+    Apila series de distinta longitud en matrices (clientes × emails).
+
+    Returns:
+        tuple: (T, X, C); T y X rellenas con NaN, C con False
+    """
+    width = max((len(t) for t, _, _ in series), default=0) or 1   # Al menos una columna (NaN)
+    T = np.full((len(series), width), np.nan)
+    X = np.full((len(series), width), np.nan)
+    C = np.zeros((len(series), width), dtype=bool)
+    for row, (t, x, c) in enumerate(series):
+        T[row, :len(t)] = t
+        X[row, :len(x)] = x
+        C[row, :len(c)] = c
+    return T, X, C
+
+
+def _compact(values, valid, *others):
+    """Mueve los valores válidos de cada fila al principio, conservando su orden."""
+    order = np.argsort(~valid, axis=1, kind='stable')
+    taken = [np.take_along_axis(a, order, axis=1) for a in (values, valid) + others]
+    return taken
+
+
+def _row_quantile(values, q):
+    """Cuantil ``q`` de cada fila ignorando NaN (np.nanpercentile recorre fila a fila)."""
+    ordered = np.sort(values, axis=1)   # NaN al final
+    count = (~np.isnan(values)).sum(axis=1)
+    pos = q * np.maximum(count - 1, 0)
+    lo = np.floor(pos).astype(int)[:, None]
+    hi = np.ceil(pos).astype(int)[:, None]
+    low, high = np.take_along_axis(ordered, lo, axis=1)[:, 0], np.take_along_axis(ordered, hi, axis=1)[:, 0]
+    return np.where(count > 0, low + (high - low) * (pos - lo[:, 0]), np.nan)
+
+
+def rolling_mean(t, x, half_life_days=HALF_LIFE_DAYS):
+    """
+    Media móvil ponderada en el tiempo de una serie (para el gráfico).
+
+    En cada email pesan todos los anteriores con 0.5 ** (antigüedad / vida media).
+    """
+    valid = ~np.isnan(x) & ~np.isnan(t)
+    age = t[:, None] - t[None, :]
+    weights = np.where((age >= 0) & valid[None, :], 0.5 ** (np.maximum(age, 0) / half_life_days), 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (weights @ np.where(valid, x, 0.0)) / weights.sum(axis=1)
+
+
+# --- MÉTRICAS VECTORIZADAS ---
+def compute(T, X, C, now=None, half_life_days=HALF_LIFE_DAYS):
+    """
+    Métricas de todas las filas a la vez.
+
+    Args:
+        T, X, C: Matrices de pack() (días desde epoch, scores, origen cliente)
+        now: Referencia en segundos desde epoch (por defecto, ahora)
+        half_life_days: Vida media de la ponderación temporal
+
+    Returns:
+        dict: {nombre: array de una posición por fila}
+    """
+    now_days = (now if now is not None else time.time()) / DAY_S
+    rows = np.arange(T.shape[0])
+
+    with warnings.catch_warnings(), np.errstate(invalid='ignore', divide='ignore'):
+        warnings.simplefilter("ignore", RuntimeWarning)  # Filas sin datos: NaN
+
+        # === SENTIMIENTO ===
+        Xs, scored, Ts = _compact(X, ~np.isnan(X) & ~np.isnan(T), T)
+        n = scored.sum(axis=1)
+        x0 = np.where(scored, Xs, 0.0)
+
+        mean = x0.sum(axis=1) / n
+        last_t = np.nanmax(np.where(scored, Ts, np.nan), axis=1)
+        w = np.where(scored, np.exp2((Ts - last_t[:, None]) / half_life_days), 0.0)
+        recent = (w * x0).sum(axis=1) / w.sum(axis=1)
+
+        t_mean = np.where(scored, Ts, 0.0).sum(axis=1) / n
+        dt = np.where(scored, Ts - t_mean[:, None], 0.0)
+        dx = np.where(scored, Xs - mean[:, None], 0.0)
+        var_t = (dt * dt).sum(axis=1)
+        slope = np.where(var_t > 0, (dt * dx).sum(axis=1) / var_t * SLOPE_WINDOW_DAYS, np.nan)
+
+        steps = np.diff(np.where(scored, Xs, np.nan), axis=1)
+        volatility = np.where(n >= 3, np.nanstd(steps, axis=1) if steps.shape[1] else np.nan, np.nan)
+
+        # === PUNTO DE CAMBIO ===
+        width = Xs.shape[1]
+        k = np.arange(1, width + 1, dtype=np.float64)[None, :]   # Emails en el primer tramo
+        S = np.cumsum(x0, axis=1)
+        S2 = np.cumsum(x0 * x0, axis=1)
+        total = S[rows, np.maximum(n - 1, 0)][:, None]
+        total2 = S2[rows, np.maximum(n - 1, 0)][:, None]
+        k2 = n[:, None] - k
+        m1 = S / k
+        m2 = (total - S) / k2
+        within = total2 - k * m1 ** 2 - k2 * m2 ** 2
+        sigma = np.sqrt(np.maximum(within / np.maximum(n[:, None] - 2, 1), 0.25))
+        stat = np.abs(m2 - m1) / (sigma * np.sqrt(1 / k + 1 / k2))
+        stat = np.where((k >= CHANGE_MIN_SEGMENT) & (k2 >= CHANGE_MIN_SEGMENT), stat, -np.inf)
+        best = np.argmax(stat, axis=1)
+        best_stat = stat[rows, best]
+        shift = (m2 - m1)[rows, best]
+        has_change = (best_stat >= CHANGE_MIN_STAT) & (np.abs(shift) >= CHANGE_MIN_SHIFT)
+        change_at = np.where(has_change, Ts[rows, np.minimum(best + 1, width - 1)], np.nan)  # Primer email del tramo nuevo
+        change_shift = np.where(has_change, shift, np.nan)
+
+        # === TIEMPO DE RESPUESTA CLIENTE -> BANCO ===
+        order = np.argsort(T, axis=1, kind='stable')   # NaN al final
+        Tm = np.take_along_axis(T, order, axis=1)
+        Cm = np.take_along_axis(C, order, axis=1)
+        sent = ~np.isnan(Tm)
+        client = Cm & sent
+        previous_client = np.zeros_like(client)
+        previous_client[:, 1:] = client[:, :-1]
+        run_start = client & ~previous_client
+        bank = sent & ~Cm
+
+        # Todas las filas en un solo eje: cada fila desplazada más allá de la anterior
+        base = np.nanmin(Tm) if sent.any() else 0.0
+        span = (np.nanmax(Tm) - base + 1.0) if sent.any() else 1.0
+        flat = np.where(sent, Tm - base, 0.0) + rows[:, None] * (span + 1.0)
+        bank_times = flat[bank]
+        bank_rows = np.broadcast_to(rows[:, None], Tm.shape)[bank]
+        start_times = flat[run_start]
+        start_rows = np.broadcast_to(rows[:, None], Tm.shape)[run_start]
+        reply = np.searchsorted(bank_times, start_times, side='right')
+        answered = np.zeros(len(start_times), dtype=bool)
+        lags = np.full(Tm.shape, np.nan)
+        waiting = np.full(Tm.shape, np.nan)
+        positions = np.flatnonzero(run_start.ravel())
+        if len(bank_times):
+            reply_clipped = np.minimum(reply, len(bank_times) - 1)
+            answered = (reply < len(bank_times)) & (bank_rows[reply_clipped] == start_rows)
+            lags.flat[positions[answered]] = (bank_times[reply_clipped] - start_times)[answered] * 24
+        waiting.flat[positions[~answered]] = (now_days - Tm.flat[positions[~answered]]) * 24
+
+        response_median = _row_quantile(lags, 0.5)
+        response_p90 = _row_quantile(lags, 0.9)
+        pending_hours = np.nanmax(waiting, axis=1)
+        last_contact_days = now_days - np.nanmax(np.where(sent, Tm, np.nan), axis=1)
+
+    # === RIESGO ===
+    signals = {
+        'recent': np.clip((5.0 - recent) / RISK_SCALES['recent'], 0, 1),
+        'trend': np.clip(-slope / RISK_SCALES['trend'], 0, 1),
+        'volatility': np.clip(volatility / RISK_SCALES['volatility'], 0, 1),
+        'change': np.clip(-change_shift / RISK_SCALES['change'], 0, 1),
+        'pending': np.clip(pending_hours / RISK_SCALES['pending'], 0, 1),
+    }
+    risk = sum(RISK_WEIGHTS[name] * np.nan_to_num(value) for name, value in signals.items()) * 100
+
+    return {
+        'emails': sent.sum(axis=1), 'scored': n, 'mean': mean, 'recent': recent, 'slope': slope,
+        'volatility': volatility, 'change_at': change_at, 'change_shift': change_shift,
+        'change_stat': np.where(has_change, best_stat, np.nan),
+        'response_median_h': response_median, 'response_p90_h': response_p90,
+        'replies': np.isfinite(lags).sum(axis=1), 'pending_hours': pending_hours,
+        'last_contact_days': last_contact_days, 'risk_score': risk,
+        **{f"risk_{name}": np.nan_to_num(value) for name, value in signals.items()}
+    }
+
+
+def _clean(value):
+    """Escalar de NumPy a Python (NaN -> None) para pintar o serializar."""
+    value = value.item() if hasattr(value, 'item') else value
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+
+def client_report(key, columns, now=None):
+    """
+    Métricas de un cliente y su media móvil para el gráfico.
+
+    Returns:
+        tuple: (métricas de row(), fechas "YYYY-MM-DD HH:MM" en orden
+        cronológico, media móvil en cada una)
+    """
+    t, x, c = client_series(columns)
+    dates = [d.strftime('%Y-%m-%d %H:%M') for d in sorted(d for d in columns.date if d is not None)]
+    trend = rolling_mean(t, x)
+    return SentimentAnalytics([key], [(t, x, c)], now=now).row(), dates, [_clean(v) for v in trend]
+
+
+class SentimentAnalytics:
+    """Métricas de una o varias relaciones, en columnas (una posición por cliente)."""
+
+    def __init__(self, keys, series, now=None, half_life_days=HALF_LIFE_DAYS):
+        """
+        Args:
+            keys: Identificador de cada serie (email del cliente)
+            series: Lista de (tiempos, scores, origen) de client_series()
+            now: Referencia en segundos desde epoch (por defecto, ahora)
+        """
+        self.keys = list(keys)
+        self.positions = {key: pos for pos, key in enumerate(self.keys)}
+        self.columns = compute(*pack(series), now=now, half_life_days=half_life_days)
+
+    @classmethod
+    def for_client(cls, key, columns, now=None):
+        """Métricas de un solo cliente desde sus EvidenceColumns."""
+        return cls([key], [client_series(columns)], now=now)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def row(self, key=None):
+        """Métricas de un cliente como dict (el único si no se indica)."""
+        pos = 0 if key is None else self.positions[key]
+        result = {'key': self.keys[pos]}
+        result.update((name, _clean(values[pos])) for name, values in self.columns.items())
+        result['reasons'] = self.reasons(pos)
+        return result
+
+    def reasons(self, pos):
+        """Señales que más pesan en el riesgo de un cliente, de mayor a menor."""
+        labels = {
+            'recent': "sentimiento reciente bajo",
+            'trend': "tendencia a la baja",
+            'volatility': "relación inestable",
+            'change': "caída brusca del sentimiento",
+            'pending': "espera respuesta del banco",
+        }
+        weighted = [(RISK_WEIGHTS[name] * self.columns[f"risk_{name}"][pos], label) for name, label in labels.items()]
+        return [label for weight, label in sorted(weighted, reverse=True) if weight >= 0.05]
+
+    def at_risk(self, limit=10, min_score=0.0):
+        """Las ``limit`` relaciones con más riesgo (dicts de row())."""
+        risk = self.columns['risk_score']
+        candidates = np.flatnonzero(risk >= min_score)
+        top = candidates[np.argsort(-risk[candidates], kind='stable')[:limit]]
+        return [self.row(self.keys[pos]) for pos in top]
@@ -0,0 +1,138 @@
+"""
+Gestión de las credenciales OAuth de Google de una sesión.
+
+El token de acceso de Google dura una hora. En lugar de comprobarlo en cada
+rerun (y descubrir que caducó a mitad de una descarga con invalid_grant),
+CredentialManager conoce la caducidad y lo renueva en segundo plano unos
+minutos antes.
+
+La renovación se hace sobre el mismo objeto Credentials (refresh() lo
+actualiza en su sitio), así que las descargas que ya están en marcha en los
+workers usan el token nuevo en su siguiente petición sin tener que hacer nada.
+"""
+import threading
+import weakref
+from datetime import datetime, timezone
+
+REFRESH_MARGIN_S = 300   # Renovar 5 minutos antes de que caduque
+RETRY_AFTER_S = 60       # Reintento si la renovación falla por la red
+
+
+class CredentialManager:
+    """Credenciales de una sesión con renovación anticipada."""
+
+    def __init__(self, creds, refresh_margin=REFRESH_MARGIN_S):
+        """
+        Args:
+            creds: google.oauth2.credentials.Credentials (o compatible)
+            refresh_margin: Segundos antes de la caducidad en los que se renueva
+        """
+        self.credentials = creds
+        self.refresh_margin = refresh_margin
+        self.refreshes = 0
+        self.last_refresh = None
+        self.error = None  # Mensaje si la sesión ya no se puede renovar (hay que volver a entrar)
+        self._lock = threading.Lock()
+        self._timer = None
+
+    # --- ESTADO ---
+    def seconds_left(self):
+        """Segundos hasta la caducidad del token (None si no se conoce)."""
+        expiry = getattr(self.credentials, 'expiry', None)
+        if expiry is None:
+            return None
+        now = datetime.now(timezone.utc).replace(tzinfo=None)  # google-auth guarda expiry en UTC sin tz
+        return (expiry - now).total_seconds()
+
+    def needs_refresh(self, margin=None):
+        left = self.seconds_left()
+        margin = self.refresh_margin if margin is None else margin
+        return left is not None and left <= margin
+
+    @property
+    def can_refresh(self):
+        return bool(getattr(self.credentials, 'refresh_token', None))
+
+    def status(self):
+        """Resumen para la barra lateral."""
+        return {
+            'expires_in_s': self.seconds_left(),
+            'refreshes': self.refreshes,
+            'last_refresh': self.last_refresh,
+            'error': self.error,
+        }
+
+    # --- RENOVACIÓN ---
+    def refresh(self):
+        """
+        Renueva el token ahora (un solo hilo a la vez).
+
+        Returns:
+            tuple: (ok, mensaje_error)
+        """
+        from google.auth.exceptions import RefreshError
+        from google.auth.transport.requests import Request
+
+        with self._lock:
+            # Otro hilo pudo renovarlo mientras esperábamos el lock
+            if not self.needs_refresh():
+                return True, None
+            try:
+                self.credentials.refresh(Request())
+            except RefreshError as e:
+                # invalid_grant: el usuario revocó el acceso o la sesión caducó del todo
+                self.error = f"🔐 Tu sesión de Google ha caducado ({str(e)[:120]}). Vuelve a iniciar sesión."
+                return False, self.error
+            except Exception as e:
+                # Fallo de red: se reintenta más tarde, el token actual aún vale
+                return False, f"⚠️ No se pudo renovar el token de Google: {str(e)[:200]}"
+            self.refreshes += 1
+            self.last_refresh = datetime.now()
+            return True, None
+
+    def fresh(self):
+        """
+        Credenciales listas para lanzar una tarea: si caducan dentro del margen
+        se renuevan antes de devolverlas.
+
+        Returns:
+            tuple: (credenciales, mensaje_error)
+        """
+        if self.error:
+            return None, self.error
+        if self.needs_refresh() and self.can_refresh:
+            ok, err = self.refresh()
+            if not ok and self.error:
+                return None, err
+        return self.credentials, None
+
+    # --- SEGUNDO PLANO ---
+    def start(self):
+        """Programa la próxima renovación (no hace nada si no se conoce la caducidad)."""
+        self.stop()
+        left = self.seconds_left()
+        if left is None or not self.can_refresh or self.error:
+            return
+        delay = max(0.0, left - self.refresh_margin)
+        # El timer solo guarda una referencia débil: si la sesión desaparece, no renueva más
+        self._timer = threading.Timer(delay, _background_refresh, args=(weakref.ref(self),))
+        self._timer.daemon = True
+        self._timer.start()
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+
+def _background_refresh(manager_ref):
+    manager = manager_ref()
+    if manager is None or manager.error:
+        return
+    ok, _ = manager.refresh()
+    if ok:
+        manager.start()
+    elif not manager.error:
+        manager._timer = threading.Timer(RETRY_AFTER_S, _background_refresh, args=(manager_ref,))
+        manager._timer.daemon = True
+        manager._timer.start()
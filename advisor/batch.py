@@ -0,0 +1,334 @@
+"""
+Precálculo nocturno de toda la cartera.
+
+Encola los clientes del registro (advisor.registry) en la cola de trabajo
+(advisor.workqueue), los de más prioridad primero: urgencia del último
+análisis, días sin contacto y alertas abiertas. Un pool de procesos descarga
+sus emails y ejecuta analyze_with_ai y generate_meeting_brief. Los resultados
+se guardan en el PrecomputeStore, así la app los sirve al instante por la
+mañana.
+
+Uso:
+    python -m advisor batch --token token.json --workers 4
+
+Cada cliente se reserva en la cola mientras se procesa: si el proceso se cae,
+relanzar el mismo comando continúa donde se quedó, y varios procesos (o
+máquinas) con la misma cola se reparten el trabajo. Los fallos se reintentan
+una vez antes de darlos por perdidos.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+
+from advisor.alerts import AlertStore
+from advisor.config import EngineConfig
+from advisor.query import EvidenceColumns
+from advisor.registry import ClientRegistry, normalize
+from advisor.snapshots import snapshot_scope
+from advisor.store import PrecomputeStore
+from advisor.workqueue import (
+    DONE, FAILED, LEASE_SECONDS, LEASED, PENDING, SKIPPED, WorkQueue, client_priority, portfolio_priorities,
+    worker_id
+)
+
+QUEUE_NAME = "precompute"
+HEARTBEAT_S = LEASE_SECONDS / 3   # Renovación de las reservas de los clientes en curso
+DEFAULT_NUM_EMAILS = 15    # Mismo valor por defecto que el slider de la app
+DEFAULT_MAX_AGE_HOURS = 18  # Un resultado de anoche sigue siendo válido por la mañana
+
+
+def precompute_client(target_email, token_path, config, num_emails, addresses=None):
+    """
+    Trabajo de un worker: Gmail + análisis + brief de un cliente.
+
+    Se ejecuta en un proceso hijo, por eso crea su propio motor y carga sus
+    propias credenciales. La DiskCache evita repetir llamadas a OpenAI si se
+    reanuda una ejecución interrumpida.
+
+    Returns:
+        dict: {'status': 'done'|'error', 'payload', 'error', 'timings'}
+    """
+    from advisor import gmail
+    from advisor.cache import DiskCache
+    from advisor.engine import AdvisorEngine
+
+    engine = AdvisorEngine(config, cache=DiskCache(config.cache_dir))
+    creds = gmail.load_credentials(token_path)
+
+    # === GMAIL + ANÁLISIS ===
+    outcome = engine.analyze_client(
+        creds, target_email, num_emails=num_emails, use_precomputed=False, fallback=False, addresses=addresses
+    )
+    timings = outcome['timings']
+
+    if outcome['error'] or not outcome['evidence']:
+        return {'status': 'error', 'error': outcome['error'] or "Sin emails", 'timings': timings}
+
+    if outcome['ai_error']:
+        # No guardamos el modo básico: la app volverá a intentarlo en vivo
+        return {'status': 'error', 'error': outcome['ai_error'], 'timings': timings}
+
+    # === BRIEF ===
+    brief = engine.client_brief(creds, target_email, evidence=outcome['evidence'], use_precomputed=False)
+    timings['brief_s'] = brief['timings'].get('total_s', 0.0)
+    timings['total_s'] = round(timings['total_s'] + timings['brief_s'], 3)
+
+    return {
+        'status': 'done',
+        'payload': {
+            'analysis': outcome['analysis'],
+            'evidence': outcome['evidence'].to_records(),
+            'brief': brief['brief'],
+            'ranking': outcome['ranking'].to_dict(),
+            'history_id': outcome['evidence'].history_id,
+            'scope': snapshot_scope(num_emails, addresses=addresses),   # Direcciones que vio (ver load)
+            'timings': timings
+        },
+        'error': brief['error'],
+        'timings': timings
+    }
+
+
+def format_timings(timings):
+    parts = [
+        f"{label} {timings[key]:.1f}s"
+        for key, label in (('fetch_s', 'gmail'), ('analysis_s', 'IA'), ('brief_s', 'brief'), ('total_s', 'total'))
+        if key in timings
+    ]
+    return " · ".join(parts)
+
+
+def run_batch(clients, token_path, config, num_emails=DEFAULT_NUM_EMAILS, workers=4,
+              store=None, max_age_hours=DEFAULT_MAX_AGE_HOURS, force=False, log=print, registry=None,
+              queue=None, alerts=None):
+    """
+    Precalcula la cartera en un pool de procesos, por orden de prioridad.
+
+    Si hay una ejecución a medias con los mismos parámetros en la cola, la
+    continúa (se reparte el trabajo con otros procesos que la estén atendiendo
+    y se añaden los clientes que falten); si no, o con ``force``, encola una
+    nueva, salvo que otro proceso tenga clientes en curso.
+
+    Args:
+        clients: Lista de emails de clientes
+        token_path: Fichero de credenciales OAuth (authorized_user)
+        config: EngineConfig (se envía a cada worker)
+        num_emails: Emails por cliente
+        workers: Procesos en paralelo
+        store: PrecomputeStore destino
+        max_age_hours: Se saltan los clientes con un resultado más reciente
+        force: Recalcular aunque exista un resultado reciente
+        log: Función de salida para el informe
+        registry: ClientRegistry donde anotar el resumen de cada análisis y la
+                  matriz de la cartera (opcional; da la urgencia para la prioridad)
+        queue: WorkQueue (por defecto, la de config.queue_path)
+        alerts: AlertStore con la actividad y las alertas abiertas (prioridad)
+
+    Returns:
+        dict: Estado final de la ejecución (incluye timings por cliente y 'queue' con stats())
+    """
+    store = store or PrecomputeStore(config.precompute_dir)
+    queue = queue or WorkQueue(config.queue_path)
+    owner = worker_id()
+    portfolio = None
+    if registry is not None:
+        from advisor.portfolio import PortfolioMatrix
+        portfolio = PortfolioMatrix(config.portfolio_path, registry)
+    params = {'num_emails': num_emails, 'max_age_hours': max_age_hours}
+
+    def split(candidates):
+        """(prioridades de los que hay que procesar, los que ya están al día)."""
+        pending, skipped = [], []
+        for client in candidates:
+            addresses = registry.addresses(client) if registry is not None else None
+            scope = snapshot_scope(num_emails, addresses=addresses)
+            if not force and store.load(client, num_emails, max_age_hours=max_age_hours, scope=scope):
+                skipped.append(client)
+            else:
+                pending.append(client)
+        priorities = portfolio_priorities(registry.clients(), alerts) if registry is not None else {}
+        return {c: priorities.get(normalize(c), client_priority()) for c in pending}, skipped
+
+    # === COLA ===
+    recovered = queue.recover(QUEUE_NAME)
+    unfinished = queue.unfinished(QUEUE_NAME, params)
+    if unfinished and not force:
+        queued = {item['client'] for item in queue.items(QUEUE_NAME)}
+        pending, skipped = split([c for c in clients if normalize(c) not in queued])
+        queue.add(QUEUE_NAME, pending, params, skipped)
+        line = f"Reanudando la ejecución anterior: {unfinished} clientes sin terminar"
+        if pending:
+            line += f" + {len(pending)} nuevos en la cartera"
+        if recovered:
+            line += f" ({recovered} recuperados de un proceso caído)"
+        log(line)
+    else:
+        pending, skipped = split(clients)
+        _, error = queue.start_run(QUEUE_NAME, pending, params, skipped)
+        if error:
+            log(error)
+            return {'run_id': None, 'started_at': None, 'finished_at': None, 'params': params, 'clients': {},
+                    'queue': queue.stats(QUEUE_NAME), 'error': error}
+        log(f"Nueva ejecución: {len(pending)} clientes pendientes de {len(clients)} ({workers} workers)")
+
+    total = queue.unfinished(QUEUE_NAME)
+    done_count = 0
+    in_flight = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            while len(in_flight) < workers:
+                item = queue.lease(QUEUE_NAME, owner)
+                if item is None:
+                    break
+                client = item['client']
+                future = pool.submit(
+                    precompute_client, client, token_path, config, num_emails,
+                    registry.addresses(client) if registry is not None else None
+                )
+                in_flight[future] = item
+
+            if not in_flight:
+                retry_at = queue.next_available(QUEUE_NAME)
+                if retry_at is None:
+                    break   # Nada pendiente (lo que quede reservado es de otro proceso vivo)
+                time.sleep(min(max(retry_at - time.time(), 0.5), HEARTBEAT_S))
+                continue
+
+            finished, running = wait(in_flight, timeout=HEARTBEAT_S, return_when=FIRST_COMPLETED)
+            for future in running:
+                queue.heartbeat(in_flight[future]['id'], owner)
+
+            for future in finished:
+                item = in_flight.pop(future)
+                client = item['client']
+                try:
+                    outcome = future.result()
+                except Exception as e:
+                    outcome = {'status': 'error', 'error': str(e), 'timings': {}}
+
+                if outcome['status'] == 'done':
+                    payload = outcome['payload']
+                    store.save(client, num_emails, payload)
+                    if registry is not None:
+                        registry.record_analysis(
+                            client, payload['analysis'], emails_analyzed=len(payload['evidence']),
+                            history_id=payload.get('history_id')
+                        )
+                        portfolio.record(client, EvidenceColumns(payload['evidence'], payload['analysis']))
+                    kept = queue.complete(item['id'], owner, timings=outcome['timings'])
+                    mark = "✓"
+                else:
+                    status = queue.fail(item['id'], outcome.get('error') or "Error", owner, timings=outcome['timings'])
+                    kept = status is not None
+                    mark = "↻" if status == PENDING else "✗"   # ↻: se reintentará
+
+                if not kept:
+                    # La reserva caducó y la tiene otro proceso: él lo cuenta
+                    log(f"      ⚠ {client:<40} reserva perdida (lo ha retomado otro proceso)")
+                    continue
+                if mark != "↻":
+                    done_count += 1
+                line = f"[{done_count:>3}/{total}] {mark} {client:<40} {format_timings(outcome['timings'])}"
+                if outcome.get('error'):
+                    line += f"  ({outcome['error'][:80]})"
+                log(line)
+
+    # === RESUMEN ===
+    items = queue.items(QUEUE_NAME)
+    stats = queue.stats(QUEUE_NAME)
+    finished_at = stats['last_finished_at'] or time.time()
+    state = {
+        'run_id': datetime.fromtimestamp(stats['started_at'] or finished_at).strftime('%Y%m%d_%H%M%S'),
+        'started_at': stats['started_at'],
+        'finished_at': finished_at,
+        'params': params,
+        'clients': {
+            item['client']: {
+                'status': 'error' if item['status'] == FAILED else item['status'],
+                'timings': item['timings'],
+                'error': item['error'],
+                'finished_at': item['finished_at']
+            }
+            for item in items
+        },
+        'queue': stats,
+    }
+
+    results = state['clients'].values()
+    totals = sorted(r['timings']['total_s'] for r in results if r['status'] == 'done' and 'total_s' in r['timings'])
+    summary = (
+        f"Hecho: {stats[DONE]} ok, {stats[FAILED]} con error, {stats[SKIPPED]} ya estaban al día"
+    )
+    if stats[LEASED]:
+        summary += f", {stats[LEASED]} en curso en otro proceso"
+    if totals:
+        summary += f" · mediana {totals[len(totals) // 2]:.1f}s/cliente · máx {totals[-1]:.1f}s"
+    if state['started_at']:
+        summary += f" · {finished_at - state['started_at']:.0f}s en total"
+    log(summary)
+
+    return state
+
+
+def add_arguments(parser):
+    """Opciones del precálculo (compartidas con ``python -m advisor batch``)."""
+    parser.add_argument("--token", required=True, help="Credenciales OAuth de Gmail (JSON authorized_user)")
+    parser.add_argument("--registry", help="Registro de clientes (SQLite)")
+    parser.add_argument("--history", help="client_history.json antiguo (se importa al crear el registro)")
+    parser.add_argument("--store", help="Directorio de resultados")
+    parser.add_argument("--queue", help="Cola de trabajo (SQLite)")
+    parser.add_argument("--emails", type=int, default=DEFAULT_NUM_EMAILS, help="Emails por cliente")
+    parser.add_argument("--workers", type=int, default=4, help="Procesos en paralelo")
+    parser.add_argument("--max-age-hours", type=float, default=DEFAULT_MAX_AGE_HOURS,
+                        help="No recalcular clientes con un resultado más reciente")
+    parser.add_argument("--force", action="store_true", help="Recalcular todos los clientes")
+
+
+def run_from_args(args, config):
+    """Ejecuta el precálculo a partir de los argumentos ya parseados."""
+    if args.registry:
+        config.registry_path = args.registry
+    if args.history:
+        config.history_file = args.history
+    if args.store:
+        config.precompute_dir = args.store
+    if args.queue:
+        config.queue_path = args.queue
+
+    if not config.openai_api_key:
+        print("Falta la API Key de OpenAI (OPENAI_API_KEY o .streamlit/secrets.toml)", file=sys.stderr)
+        return 2
+
+    registry = ClientRegistry(config.registry_path, legacy_path=config.history_file)
+    clients = registry.recent()
+    if not clients:
+        print("El registro de clientes está vacío", file=sys.stderr)
+        return 1
+
+    state = run_batch(
+        clients,
+        args.token,
+        config,
+        num_emails=args.emails,
+        workers=args.workers,
+        max_age_hours=args.max_age_hours,
+        force=args.force,
+        registry=registry,
+        alerts=AlertStore(config.alerts_path) if os.path.exists(config.alerts_path) else None
+    )
+    if state.get('error'):
+        return 1
+    return 0 if all(r['status'] != 'error' for r in state['clients'].values()) else 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precálculo nocturno de la cartera de clientes")
+    add_arguments(parser)
+    return run_from_args(parser.parse_args(argv), EngineConfig.from_env())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
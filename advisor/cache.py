@@ -0,0 +1,90 @@
+"""
+Cachés intercambiables para el motor.
+
+El motor solo usa ``get(key)`` / ``set(key, value, ttl)``: la app le pasa una
+MemoryCache compartida por el proceso, la CLI una DiskCache que sobrevive entre
+ejecuciones y los benchmarks una NullCache para medir siempre en frío.
+"""
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+MISS = object()  # Centinela: distingue "no está" de un valor None guardado
+
+
+def make_key(namespace, *parts):
+    """Clave estable (sha256) a partir de un espacio de nombres y argumentos."""
+    raw = json.dumps([namespace, *parts], sort_keys=True, ensure_ascii=False, default=str)
+    return f"{namespace}:{hashlib.sha256(raw.encode('utf-8')).hexdigest()}"
+
+
+class NullCache:
+    """No guarda nada."""
+
+    def get(self, key):
+        return MISS
+
+    def set(self, key, value, ttl=None):
+        pass
+
+
+class MemoryCache:
+    """LRU en memoria con caducidad, segura entre hilos."""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return MISS
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.time():
+                del self._data[key]
+                return MISS
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+
+class DiskCache:
+    """Un fichero pickle por clave; compartible entre procesos."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest() + ".pkl")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                expires_at, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return MISS
+        if expires_at is not None and expires_at < time.time():
+            return MISS
+        return value
+
+    def set(self, key, value, ttl=None):
+        os.makedirs(self.directory, exist_ok=True)
+        expires_at = time.time() + ttl if ttl else None
+        tmp_path = f"{self._path(key)}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump((expires_at, value), f)
+        os.replace(tmp_path, self._path(key))
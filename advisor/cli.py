@@ -0,0 +1,226 @@
+"""
+Línea de comandos del motor.
+
+    python -m advisor analyze cliente@empresa.com --token token.json [--json] [--brief-pdf brief.pdf]
+    python -m advisor batch --token token.json --workers 4
+    python -m advisor risk --limit 20
+    python -m advisor portfolio --backfill
+    python -m advisor scan --token token.json --every 15
+
+La configuración sale de .streamlit/secrets.toml y de las variables de entorno
+(ver advisor.config); las credenciales de Gmail, del fichero --token.
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import datetime
+
+from advisor import batch, gmail
+from advisor.alerts import ALERT_PENDING_HOURS
+from advisor.cache import DiskCache
+from advisor.config import EngineConfig
+from advisor.engine import AdvisorEngine
+from advisor.reports import generate_analysis_summary_text
+
+
+def _parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def cmd_analyze(args, config):
+    """Analiza un cliente y muestra el resumen (o el JSON completo)."""
+    engine = AdvisorEngine(config, cache=DiskCache(config.cache_dir))
+    creds = gmail.load_credentials(args.token)
+
+    outcome = engine.analyze_client(
+        creds,
+        args.email,
+        num_emails=None if args.desde else args.emails,
+        fecha_desde=args.desde,
+        fecha_hasta=args.hasta,
+        use_precomputed=not args.no_precomputed,
+        fallback=True,
+        addresses=args.also
+    )
+
+    if outcome['error'] or not outcome['evidence']:
+        print(outcome['error'] or f"📭 No se encontraron emails con {args.email}.", file=sys.stderr)
+        return 1
+    if outcome['ai_error']:
+        print(f"⚠️ Modo básico: {outcome['ai_error']}", file=sys.stderr)
+
+    if args.json:
+        json.dump(
+            {**{k: outcome[k] for k in ('analysis', 'ai_error', 'precomputed_at', 'timings', 'snapshot', 'diff')},
+             'evidence': outcome['evidence'].to_records()},
+            sys.stdout, ensure_ascii=False, indent=2, default=str
+        )
+        print()
+    else:
+        print(generate_analysis_summary_text(outcome['analysis'], outcome['evidence'], args.email))
+
+    if args.brief_pdf:
+        brief = engine.client_brief(creds, args.email, evidence=outcome['evidence'], num_emails=args.emails,
+                                    addresses=args.also)
+        if brief['error'] or not brief['brief']:
+            print(brief['error'] or "No se pudo generar el brief", file=sys.stderr)
+            return 1
+        with open(args.brief_pdf, "wb") as f:
+            f.write(engine.brief_pdf_bytes(brief['brief'], args.email))
+        print(f"Brief guardado en {args.brief_pdf}", file=sys.stderr)
+
+    return 0
+
+
+def cmd_risk(args, config):
+    """Relaciones con más riesgo de la cartera, desde la última instantánea de cada cliente."""
+    from advisor.analytics import SentimentAnalytics, client_series
+    from advisor.query import EvidenceColumns
+    from advisor.snapshots import SnapshotStore
+
+    snapshots = SnapshotStore(config.snapshot_path).latest_per_client()
+    if not snapshots:
+        print("📭 No hay análisis guardados todavía (se guardan al analizar cada cliente).", file=sys.stderr)
+        return 1
+
+    series = [client_series(EvidenceColumns(s['evidence'], s['analysis'])) for s in snapshots]
+    analytics = SentimentAnalytics([s['client'] for s in snapshots], series)
+    top = analytics.at_risk(limit=args.limit, min_score=args.min_score)
+
+    if args.json:
+        json.dump(top, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+        return 0
+
+    print(f"{'riesgo':>6}  {'cliente':<36}{'reciente':>9}{'tend/30d':>9}{'espera h':>9}  motivos")
+    for row in top:
+        recent = f"{row['recent']:+.1f}" if row['recent'] is not None else "–"
+        slope = f"{row['slope']:+.1f}" if row['slope'] is not None else "–"
+        pending = f"{row['pending_hours']:.0f}" if row['pending_hours'] is not None else "–"
+        print(f"{row['risk_score']:>6.1f}  {row['key']:<36}{recent:>9}{slope:>9}{pending:>9}  {', '.join(row['reasons'])}")
+    print(f"{len(top)} de {len(analytics)} clientes", file=sys.stderr)
+    return 0
+
+
+def cmd_portfolio(args, config):
+    """Clientes que más han empeorado en los últimos 30 días, desde la matriz de la cartera."""
+    from advisor.portfolio import PortfolioMatrix, deteriorated
+    from advisor.query import EvidenceColumns
+    from advisor.registry import ClientRegistry
+    from advisor.snapshots import SnapshotStore
+
+    registry = ClientRegistry(config.registry_path, legacy_path=config.history_file)
+    matrix = PortfolioMatrix(config.portfolio_path, registry)
+    if args.backfill:
+        # Primera carga: la última instantánea de cada cliente de la cartera
+        snapshots = [s for s in SnapshotStore(config.snapshot_path).latest_per_client() if registry.resolve(s['client'])]
+        for snapshot in snapshots:
+            matrix.record(snapshot['client'], EvidenceColumns(snapshot['evidence'], snapshot['analysis']))
+        print(f"📥 {len(snapshots)} clientes cargados en la matriz de la cartera", file=sys.stderr)
+
+    start = time.perf_counter()
+    report = matrix.report(registry.portfolio_rows())
+    ranking = deteriorated(report, limit=args.limit, min_drop=args.min_drop)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    rows = [{
+        'client': report['clients'][pos],
+        'recent': round(float(report['recent'][pos]), 2),
+        'baseline': round(float(report['baseline'][pos]), 2),
+        'change': round(float(report['change'][pos]), 2),
+        'recent_emails': int(report['recent_volume'][pos]),
+    } for pos in ranking]
+    if args.json:
+        json.dump(rows, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+        return 0
+
+    print(f"{'cliente':<40}{'30 días':>9}{'anterior':>10}{'cambio':>8}{'emails':>8}")
+    for row in rows:
+        print(f"{row['client']:<40}{row['recent']:>9.1f}{row['baseline']:>10.1f}{row['change']:>+8.1f}{row['recent_emails']:>8}")
+    print(f"{len(rows)} de {len(report['clients'])} clientes empeoran · {elapsed_ms:.0f} ms", file=sys.stderr)
+    return 0
+
+
+def cmd_scan(args, config):
+    """Escáner de alertas: una pasada (para cron) o una cada ``--every`` minutos."""
+    from advisor.alerts import ALERT_LABELS, AlertStore
+    from advisor.registry import ClientRegistry
+
+    engine = AdvisorEngine(config, cache=DiskCache(config.cache_dir))
+    registry = ClientRegistry(config.registry_path, legacy_path=config.history_file)
+    alerts = AlertStore(config.alerts_path)
+    creds = gmail.load_credentials(args.token)
+
+    while True:
+        outcome = engine.scan_alerts(creds, registry, alerts, pending_hours=args.pending_hours)
+        stamp = datetime.now().strftime('%Y-%m-%d %H:%M')
+        if outcome['error']:
+            print(f"[{stamp}] {outcome['error']}", file=sys.stderr)
+        else:
+            print(f"[{stamp}] {outcome['messages']} emails nuevos · {outcome['client_messages']} de clientes · "
+                  f"{outcome['scored']} puntuados · {len(outcome['alerts'])} alertas nuevas "
+                  f"({outcome['timings'].get('total_s', 0):.1f}s)", file=sys.stderr)
+            if outcome['warning']:
+                print(f"  ⚠️ {outcome['warning']}", file=sys.stderr)
+            for alert in outcome['alerts']:
+                print(f"  {ALERT_LABELS[alert['kind']]}  {alert['client']}  {alert['detail']}")
+        if not args.every:
+            return 1 if outcome['error'] else 0
+        time.sleep(args.every * 60)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m advisor", description="Wealth Solutions Advisor sin interfaz")
+    parser.add_argument("--secrets", default=None, help="Ruta a secrets.toml (por defecto .streamlit/secrets.toml)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p_analyze = subparsers.add_parser("analyze", help="Analizar un cliente")
+    p_analyze.add_argument("email", help="Email del cliente")
+    p_analyze.add_argument("--token", required=True, help="Credenciales OAuth de Gmail (JSON authorized_user)")
+    p_analyze.add_argument("--also", action="append", metavar="EMAIL",
+                           help="Otra dirección del mismo cliente (se puede repetir)")
+    p_analyze.add_argument("--emails", type=int, default=15, help="Número de emails (modo cantidad)")
+    p_analyze.add_argument("--desde", type=_parse_date, help="Fecha inicio AAAA-MM-DD (modo rango)")
+    p_analyze.add_argument("--hasta", type=_parse_date, help="Fecha fin AAAA-MM-DD (modo rango)")
+    p_analyze.add_argument("--json", action="store_true", help="Salida JSON completa")
+    p_analyze.add_argument("--brief-pdf", help="Generar además el Pre-Meeting Brief en este PDF")
+    p_analyze.add_argument("--no-precomputed", action="store_true", help="Ignorar el precálculo nocturno")
+
+    p_batch = subparsers.add_parser("batch", help="Precálculo nocturno de toda la cartera")
+    batch.add_arguments(p_batch)
+
+    p_risk = subparsers.add_parser("risk", help="Relaciones con más riesgo de la cartera")
+    p_risk.add_argument("--limit", type=int, default=20, help="Número de clientes a mostrar")
+    p_risk.add_argument("--min-score", type=float, default=0.0, help="Riesgo mínimo (0-100)")
+    p_risk.add_argument("--json", action="store_true", help="Salida JSON")
+
+    p_portfolio = subparsers.add_parser("portfolio", help="Clientes que más empeoran este mes")
+    p_portfolio.add_argument("--limit", type=int, default=20, help="Número de clientes a mostrar")
+    p_portfolio.add_argument("--min-drop", type=float, default=2.0, help="Caída mínima del sentimiento (puntos)")
+    p_portfolio.add_argument("--backfill", action="store_true",
+                             help="Cargar antes la última instantánea de cada cliente en la matriz")
+    p_portfolio.add_argument("--json", action="store_true", help="Salida JSON")
+
+    p_scan = subparsers.add_parser("scan", help="Escáner de alertas sobre el correo nuevo")
+    p_scan.add_argument("--token", required=True, help="Credenciales OAuth de Gmail (JSON authorized_user)")
+    p_scan.add_argument("--every", type=float, default=0,
+                        help="Repetir cada N minutos (por defecto, una sola pasada para cron)")
+    p_scan.add_argument("--pending-hours", type=float, default=ALERT_PENDING_HOURS,
+                        help="Horas sin responder a un cliente que generan alerta")
+
+    args = parser.parse_args(argv)
+    config = EngineConfig.from_env(args.secrets) if args.secrets else EngineConfig.from_env()
+
+    if args.command == "analyze":
+        if bool(args.desde) != bool(args.hasta):
+            parser.error("--desde y --hasta van juntos")
+        return cmd_analyze(args, config)
+    if args.command == "risk":
+        return cmd_risk(args, config)
+    if args.command == "portfolio":
+        return cmd_portfolio(args, config)
+    if args.command == "scan":
+        return cmd_scan(args, config)
+    return batch.run_from_args(args, config)
@@ -0,0 +1,96 @@
+"""
+Configuración del motor, inyectada de forma explícita.
+
+La app la construye desde st.secrets y la CLI desde .streamlit/secrets.toml y
+variables de entorno; el motor nunca lee secretos por su cuenta.
+"""
+import os
+
+from advisor.alerts import ALERTS_DB
+from advisor.ledger import LEDGER_DB
+from advisor.registry import LEGACY_HISTORY_FILE, REGISTRY_DB
+from advisor.snapshots import SNAPSHOT_DB
+from advisor.summaries import HISTORY_DB
+from advisor.store import PRECOMPUTE_DIR
+from advisor.workqueue import QUEUE_DB
+
+DEFAULT_SECRETS_PATH = os.path.join(".streamlit", "secrets.toml")
+DEFAULT_MODEL = "gpt-4o"
+DEFAULT_CACHE_DIR = ".advisor_cache"
+DEFAULT_PORTFOLIO_DIR = "portfolio_matrix"   # advisor.portfolio.PORTFOLIO_DIR (sin importar NumPy aquí)
+
+# Variables de entorno que sobreescriben las claves de secrets.toml
+ENV_OVERRIDES = {
+    "OPENAI_API_KEY": "OPENAI_KEY",
+    "ADVISOR_OPENAI_MODEL": "OPENAI_MODEL",
+    "ADVISOR_HISTORY_FILE": "HISTORY_FILE",
+    "ADVISOR_REGISTRY_DB": "REGISTRY_DB",
+    "ADVISOR_SNAPSHOT_DB": "SNAPSHOT_DB",
+    "ADVISOR_SUMMARY_DB": "SUMMARY_DB",
+    "ADVISOR_PORTFOLIO_DIR": "PORTFOLIO_DIR",
+    "ADVISOR_ALERTS_DB": "ALERTS_DB",
+    "ADVISOR_QUEUE_DB": "QUEUE_DB",
+    "ADVISOR_PRECOMPUTE_DIR": "PRECOMPUTE_DIR",
+    "ADVISOR_PRECOMPUTE_MAX_AGE_HOURS": "PRECOMPUTE_MAX_AGE_HOURS",
+    "ADVISOR_CACHE_DIR": "CACHE_DIR",
+    "ADVISOR_LEDGER_DB": "LEDGER_DB",
+}
+
+
+class EngineConfig:
+    """Parámetros y credenciales del motor de análisis."""
+
+    def __init__(self, openai_api_key=None, model=DEFAULT_MODEL, history_file=LEGACY_HISTORY_FILE,
+                 precompute_dir=PRECOMPUTE_DIR, precompute_max_age_hours=18.0, cache_dir=DEFAULT_CACHE_DIR,
+                 ledger_path=LEDGER_DB, registry_path=REGISTRY_DB, snapshot_path=SNAPSHOT_DB,
+                 summary_path=HISTORY_DB, portfolio_path=DEFAULT_PORTFOLIO_DIR,
+                 alerts_path=ALERTS_DB, queue_path=QUEUE_DB):
+        self.openai_api_key = openai_api_key
+        self.model = model
+        self.history_file = history_file  # client_history.json antiguo: solo se lee para importarlo al registro
+        self.registry_path = registry_path
+        self.snapshot_path = snapshot_path
+        self.summary_path = summary_path
+        self.portfolio_path = portfolio_path
+        self.alerts_path = alerts_path
+        self.queue_path = queue_path
+        self.precompute_dir = precompute_dir
+        self.precompute_max_age_hours = precompute_max_age_hours
+        self.cache_dir = cache_dir
+        self.ledger_path = ledger_path
+
+    @classmethod
+    def from_mapping(cls, secrets):
+        """
+        Crea la configuración desde st.secrets o un dict con las mismas claves
+        que secrets.toml (OPENAI_KEY, OPENAI_MODEL, PRECOMPUTE_MAX_AGE_HOURS...).
+        """
+        return cls(
+            openai_api_key=secrets.get("OPENAI_KEY"),
+            model=secrets.get("OPENAI_MODEL", DEFAULT_MODEL),
+            history_file=secrets.get("HISTORY_FILE", LEGACY_HISTORY_FILE),
+            precompute_dir=secrets.get("PRECOMPUTE_DIR", PRECOMPUTE_DIR),
+            precompute_max_age_hours=float(secrets.get("PRECOMPUTE_MAX_AGE_HOURS", 18)),
+            cache_dir=secrets.get("CACHE_DIR", DEFAULT_CACHE_DIR),
+            ledger_path=secrets.get("LEDGER_DB", LEDGER_DB),
+            registry_path=secrets.get("REGISTRY_DB", REGISTRY_DB),
+            snapshot_path=secrets.get("SNAPSHOT_DB", SNAPSHOT_DB),
+            summary_path=secrets.get("SUMMARY_DB", HISTORY_DB),
+            portfolio_path=secrets.get("PORTFOLIO_DIR", DEFAULT_PORTFOLIO_DIR),
+            alerts_path=secrets.get("ALERTS_DB", ALERTS_DB),
+            queue_path=secrets.get("QUEUE_DB", QUEUE_DB),
+        )
+
+    @classmethod
+    def from_env(cls, secrets_path=DEFAULT_SECRETS_PATH, environ=None):
+        """secrets.toml (si existe) con las variables de entorno por encima."""
+        environ = os.environ if environ is None else environ
+        mapping = {}
+        if secrets_path and os.path.exists(secrets_path):
+            import tomllib
+            with open(secrets_path, "rb") as f:
+                mapping.update(tomllib.load(f))
+        for env_name, key in ENV_OVERRIDES.items():
+            if environ.get(env_name):
+                mapping[key] = environ[env_name]
+        return cls.from_mapping(mapping)
@@ -0,0 +1,807 @@
+"""
+Motor de análisis sin interfaz.
+
+AdvisorEngine agrupa Gmail, OpenAI e informes con la configuración y la caché
+inyectadas. Lo usan la app de Streamlit (como cliente fino), los workers en
+segundo plano, el precálculo nocturno y la CLI (python -m advisor).
+"""
+import contextvars
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date
+
+from advisor import ai, gmail, reports, summaries, telemetry
+from advisor.alerts import ALERT_PENDING_HOURS
+from advisor.ledger import Ledger, attribution
+from advisor.ranking import RankingIndex
+from advisor.registry import normalize
+from advisor.cache import MISS, NullCache, make_key
+from advisor.evidence import EvidenceFrame
+from advisor.snapshots import SnapshotStore, diff_snapshots, snapshot_scope
+from advisor.store import PrecomputeStore
+from advisor.summaries import HISTORY_YEARS, SummaryStore
+
+ANALYSIS_TTL = 3600
+THREAD_TTL = 3600
+BRIEF_TTL = 1800
+MEMBER_FETCH_TTL = 600      # Emails de un miembro reutilizables entre vistas de grupo
+GROUP_FETCH_WORKERS = 4
+HISTORY_TTL = 86400         # El análisis final del historial (los resúmenes no caducan)
+HISTORY_WORKERS = 4
+SCAN_SCORE_BATCH = 20       # Emails nuevos de clientes por llamada a la IA en el escáner de alertas
+SCAN_BODY_CHARS = 1500
+
+
+def _no_progress(fraction=None, message=None):
+    pass
+
+
+def member_sentiment(evidence, analysis):
+    """
+    Serie de sentimiento de cada miembro de un grupo.
+
+    El sentimiento se empareja con la evidencia por posición, igual que en el
+    gráfico del dashboard.
+
+    Returns:
+        dict: {miembro: [(fecha, score), ...]} en orden cronológico
+    """
+    series = {}
+    sentiment = (analysis or {}).get('analisis_sentimiento') or []
+    for record, member, item in zip(evidence, evidence.members(), sentiment):
+        try:
+            score = float(item.get('sentimiento_score'))
+        except (TypeError, ValueError, AttributeError):
+            continue
+        series.setdefault(member, []).append((record['Fecha'], score))
+    return series
+
+
+class AdvisorEngine:
+    """Fachada headless del análisis de clientes."""
+
+    def __init__(self, config, cache=None, store=None, ledger=None, snapshots=None, summaries=None):
+        """
+        Args:
+            config: EngineConfig con credenciales y parámetros
+            cache: Objeto con get/set (MemoryCache, DiskCache, NullCache...)
+            store: PrecomputeStore; por defecto el de config.precompute_dir
+            ledger: Libro de consumo de la IA; por defecto el de config.ledger_path
+            snapshots: SnapshotStore; por defecto el de config.snapshot_path
+            summaries: SummaryStore del historial completo; por defecto el de config.summary_path
+        """
+        self.config = config
+        self.cache = cache if cache is not None else NullCache()
+        self.store = store if store is not None else PrecomputeStore(config.precompute_dir)
+        self.ledger = ledger if ledger is not None else Ledger(config.ledger_path)
+        self.snapshots = snapshots if snapshots is not None else SnapshotStore(config.snapshot_path)
+        self.summaries = summaries if summaries is not None else SummaryStore(config.summary_path)
+
+    # --- CACHÉ ---
+    def _cached(self, namespace, ttl, compute, *parts, is_valid=None):
+        """
+        Devuelve compute() desde la caché; solo guarda resultados válidos.
+
+        Cada consulta es un span ``ai.<namespace>`` con el atributo cache_hit
+        y una fila en el libro de consumo (también los aciertos de caché).
+        """
+        with telemetry.span(f"ai.{namespace}", cache_hit=False) as span:
+            key = make_key(namespace, self.config.model, *parts)
+            value = self.cache.get(key)
+            if value is not MISS:
+                span.set_attribute("cache_hit", True)
+                with self.ledger.track(namespace, self.config.model, cache_hit=True):
+                    return value
+            with self.ledger.track(namespace, self.config.model) as call:
+                value = compute()
+                valid = is_valid is None or is_valid(value)
+                call.error = not valid
+            if valid:
+                self.cache.set(key, value, ttl)
+            return value
+
+    # --- GMAIL ---
+    def fetch_emails(self, creds, target_email, num_emails=None, fecha_desde=None, fecha_hasta=None, progress_callback=None,
+                     addresses=None):
+        """
+        Descarga los emails del cliente (todas sus direcciones en una consulta).
+
+        Returns: (EvidenceFrame, mensaje_error)
+        """
+        with telemetry.span("gmail.fetch", addresses=len(addresses or ()) + 1) as span:
+            evidence, err = gmail.get_emails(
+                creds,
+                target_email,
+                num_emails=num_emails,
+                fecha_desde=fecha_desde,
+                fecha_hasta=fecha_hasta,
+                progress_callback=progress_callback,
+                addresses=addresses
+            )
+            span.set_attributes(
+                emails=len(evidence) if evidence is not None else 0,
+                bytes=evidence.memory_bytes() if evidence is not None else 0,
+                failed=bool(err and not evidence)
+            )
+            return evidence, err
+
+    def probe_mailbox(self, creds, target_email, num_emails=None, fecha_desde=None, fecha_hasta=None,
+                      addresses=None):
+        """Huella actual del buzón para la búsqueda (una llamada a messages.list). Returns: (huella, error)"""
+        with telemetry.span("gmail.probe"):
+            return gmail.probe_mailbox(creds, target_email, num_emails, fecha_desde, fecha_hasta, addresses)
+
+    # --- IA ---
+    def analyze(self, text_data, num_emails):
+        """
+        Análisis completo de la conversación. Returns: (resultado_json, mensaje_error)
+
+        ``text_data`` es el texto para la IA (evidence.prompt_text()).
+        """
+        return self._cached(
+            "analysis", ANALYSIS_TTL,
+            lambda: ai.analyze_with_ai(text_data, num_emails, self.config.openai_api_key, model=self.config.model),
+            text_data, num_emails,
+            is_valid=lambda out: out[1] is None
+        )
+
+    def analyze_thread(self, thread_text):
+        """Timeline e inteligencia de un hilo (Markdown)."""
+        return self._cached(
+            "thread", THREAD_TTL,
+            lambda: ai.analyze_thread_structure(thread_text, self.config.openai_api_key, model=self.config.model),
+            thread_text,
+            is_valid=lambda out: not out.startswith("Error al generar inteligencia")
+        )
+
+    def meeting_brief(self, text_data, num_emails, target_email):
+        """Pre-Meeting Brief. Returns: (brief_json, mensaje_error)"""
+        return self._cached(
+            "brief", BRIEF_TTL,
+            lambda: ai.generate_meeting_brief(text_data, num_emails, target_email, self.config.openai_api_key, model=self.config.model),
+            text_data, num_emails, target_email,
+            is_valid=lambda out: out[1] is None
+        )
+
+    def thread_intelligence(self, creds, message_id):
+        """
+        Localiza el hilo de un mensaje y lo analiza.
+
+        Returns:
+            tuple: (markdown, mensaje_error)
+        """
+        with telemetry.span("engine.thread_intelligence"):
+            service = gmail.build('gmail', 'v1', credentials=creds)
+            with telemetry.span("gmail.get", format="minimal"):
+                meta = service.users().messages().get(userId='me', id=message_id, format='minimal').execute()
+            thread_content = gmail.get_thread_content(creds, meta.get('threadId'))
+            if not thread_content:
+                return None, "No se pudo leer el hilo."
+            return self.analyze_thread(thread_content), None
+
+    # --- INFORMES ---
+    def brief_pdf_bytes(self, brief_data, target_email):
+        """Renderiza el Brief en PDF y devuelve los bytes (sin ficheros temporales)."""
+        with telemetry.span("pdf.render") as span:
+            buffer = io.BytesIO()
+            reports.generate_brief_pdf(brief_data, target_email, buffer)
+            span.set_attribute("bytes", buffer.tell())
+            return buffer.getvalue()
+
+    # --- BÚSQUEDA ---
+    def build_ranking(self, evidence):
+        """Índice de relevancia (BM25 + embeddings hash) de la evidencia."""
+        with telemetry.span("search.ranking", emails=len(evidence)):
+            return RankingIndex(evidence)
+
+    def ranking_from_stored(self, stored):
+        """Índice guardado con un resultado precalculado (o uno nuevo si es antiguo)."""
+        if stored.get('ranking'):
+            try:
+                return RankingIndex.from_dict(stored['ranking'])
+            except (KeyError, ValueError):
+                pass
+        return self.build_ranking(EvidenceFrame.from_records(stored['evidence']))
+
+    # --- PIPELINES ---
+    def load_precomputed(self, target_email, num_emails, addresses=None):
+        """
+        Resultado del precálculo nocturno si existe, no ha caducado y vio las
+        mismas direcciones del cliente (un alias añadido después lo invalida).
+        """
+        return self.store.load(
+            target_email, num_emails, max_age_hours=self.config.precompute_max_age_hours,
+            scope=snapshot_scope(num_emails, addresses=addresses)
+        )
+
+    @telemetry.traced("engine.analyze_client")
+    def analyze_client(self, creds, target_email, num_emails=None, fecha_desde=None, fecha_hasta=None,
+                       prefetched=None, use_precomputed=True, fallback=True, progress=None, addresses=None,
+                       use_snapshots=True):
+        """
+        Pipeline completo: Gmail + análisis IA (+ modo básico si OpenAI falla).
+
+        Si la última instantánea del cliente vio el mismo buzón (misma huella de
+        la búsqueda), se devuelve sin descargar los emails ni llamar a la IA.
+
+        Args:
+            creds: Credenciales de Google OAuth
+            target_email: Email del cliente
+            num_emails / fecha_desde / fecha_hasta: Igual que get_emails
+            prefetched: (evidencia, error) ya descargados, evita ir a Gmail
+            use_precomputed: Servir el precálculo nocturno si existe (solo modo cantidad)
+            fallback: Generar el análisis básico local si la IA falla
+            progress: Función (fracción, mensaje) para informar del avance
+            addresses: Otras direcciones del cliente (ver get_emails)
+            use_snapshots: Reutilizar y guardar instantáneas del análisis (SnapshotStore)
+
+        Returns:
+            dict: {'analysis', 'evidence' (EvidenceFrame), 'error', 'ai_error',
+                   'precomputed_at', 'ranking', 'timings',
+                   'snapshot' ({'version', 'created_at', 'reused'} o None),
+                   'diff' (cambios respecto a la versión anterior, o None)}
+        """
+        progress = progress or _no_progress
+        timings = {}
+        start = time.perf_counter()
+
+        # === RESULTADO PRECALCULADO ===
+        if use_precomputed and num_emails and not (fecha_desde and fecha_hasta):
+            stored = self.load_precomputed(target_email, num_emails, addresses)
+            if stored:
+                telemetry.current_span().set_attribute("precomputed", True)
+                return {
+                    'analysis': stored['analysis'],
+                    'evidence': EvidenceFrame.from_records(stored['evidence']),
+                    'error': None,
+                    'ai_error': None,
+                    'precomputed_at': stored['created_at'],
+                    'ranking': self.ranking_from_stored(stored),
+                    'timings': {'total_s': round(time.perf_counter() - start, 3)},
+                    'snapshot': None,
+                    'diff': None
+                }
+
+        # === INSTANTÁNEA: ¿HA CAMBIADO EL BUZÓN? ===
+        scope = snapshot_scope(num_emails, fecha_desde, fecha_hasta, addresses)
+        latest = self.snapshots.latest(target_email, scope) if use_snapshots else None
+        if latest and not prefetched:
+            progress(0.02, "🔎 Comprobando si hay emails nuevos...")
+            state, _ = self.probe_mailbox(creds, target_email, num_emails, fecha_desde, fecha_hasta, addresses)
+            timings['probe_s'] = round(time.perf_counter() - start, 3)
+            if state and state == latest['mailbox_state']:
+                return self.snapshot_result(latest, start, timings)
+
+        # === GMAIL ===
+        if prefetched:
+            evidence, err = prefetched
+            if latest and evidence is not None and evidence.mailbox_state == latest['mailbox_state']:
+                return self.snapshot_result(latest, start, timings)
+        else:
+            progress(0.02, "📥 Conectando con Gmail...")
+
+            def on_fetch_progress(done, total):
+                progress(0.05 + 0.55 * done / max(total, 1), f"📥 Descargando emails ({done}/{total})...")
+
+            evidence, err = self.fetch_emails(
+                creds, target_email, num_emails, fecha_desde, fecha_hasta, progress_callback=on_fetch_progress,
+                addresses=addresses
+            )
+        timings['fetch_s'] = round(time.perf_counter() - start, 3)
+
+        result = {
+            'analysis': None, 'evidence': evidence, 'error': err,
+            'ai_error': None, 'precomputed_at': None, 'ranking': None, 'timings': timings,
+            'snapshot': None, 'diff': None
+        }
+        if err or not evidence:
+            return result
+
+        # === ANÁLISIS ===
+        progress(0.65, f"🤖 Analizando {len(evidence)} emails con {self.config.model}...")
+        t = time.perf_counter()
+        with attribution(client=target_email):
+            analysis, ai_err = self.analyze(evidence.prompt_text(), len(evidence))
+        timings['analysis_s'] = round(time.perf_counter() - t, 3)
+        progress(0.95, "Preparando resultados...")
+
+        if ai_err and fallback:
+            # === ACTIVAR MODO FALLBACK ===
+            analysis = ai.generate_fallback_analysis(evidence, target_email)
+
+        # === ÍNDICE DE RELEVANCIA ===
+        t = time.perf_counter()
+        ranking = self.build_ranking(evidence)
+        timings['ranking_s'] = round(time.perf_counter() - t, 3)
+
+        # === NUEVA VERSIÓN (solo análisis de la IA, no el básico) ===
+        if use_snapshots and not ai_err and analysis:
+            snapshot = self.snapshots.save(
+                target_email, scope, analysis, evidence, ranking=ranking,
+                mailbox_state=evidence.mailbox_state, history_id=evidence.history_id
+            )
+            result.update(
+                snapshot={'version': snapshot['version'], 'created_at': snapshot['created_at'], 'reused': False},
+                diff=diff_snapshots(latest, snapshot) if latest else None
+            )
+
+        timings['total_s'] = round(time.perf_counter() - start, 3)
+        result.update(analysis=analysis, ai_error=ai_err, ranking=ranking)
+        return result
+
+    def snapshot_result(self, snapshot, start, timings):
+        """Resultado de analyze_client servido desde una instantánea (sin Gmail ni IA)."""
+        telemetry.current_span().set_attribute("snapshot", snapshot['version'])
+        evidence = EvidenceFrame.from_records(snapshot['evidence'])
+        evidence.mailbox_state = snapshot['mailbox_state']
+        evidence.history_id = int(snapshot['history_id']) if snapshot['history_id'] else None
+        timings['total_s'] = round(time.perf_counter() - start, 3)
+        return {
+            'analysis': snapshot['analysis'],
+            'evidence': evidence,
+            'error': None,
+            'ai_error': None,
+            'precomputed_at': None,
+            'ranking': self.ranking_from_stored(snapshot),
+            'timings': timings,
+            'snapshot': {'version': snapshot['version'], 'created_at': snapshot['created_at'], 'reused': True},
+            'diff': self.snapshots.diff(snapshot)
+        }
+
+    def fetch_member(self, creds, member, addresses=None, num_emails=None, fecha_desde=None, fecha_hasta=None,
+                     use_precomputed=True):
+        """
+        Emails de un miembro de un grupo, reutilizando lo que ya se tenga: el
+        precálculo nocturno o una descarga reciente de otra vista de grupo.
+
+        Returns:
+            tuple: (EvidenceFrame, mensaje_error, origen) con origen
+            'precomputed', 'cache' o 'gmail'
+        """
+        if use_precomputed and num_emails and not (fecha_desde and fecha_hasta):
+            stored = self.load_precomputed(member, num_emails, addresses)
+            if stored:
+                return EvidenceFrame.from_records(stored['evidence']), None, 'precomputed'
+
+        key = make_key("gmail", member, sorted(addresses or ()), num_emails, fecha_desde, fecha_hasta)
+        cached = self.cache.get(key)
+        if cached is not MISS:
+            return cached, None, 'cache'
+
+        evidence, err = self.fetch_emails(
+            creds, member, num_emails=num_emails, fecha_desde=fecha_desde, fecha_hasta=fecha_hasta, addresses=addresses
+        )
+        if evidence is not None and len(evidence) and not err:
+            self.cache.set(key, evidence, MEMBER_FETCH_TTL)
+        return evidence, err, 'gmail'
+
+    @telemetry.traced("engine.analyze_group")
+    def analyze_group(self, creds, group_name, members, num_emails=None, fecha_desde=None, fecha_hasta=None,
+                      use_precomputed=True, fallback=True, progress=None):
+        """
+        Análisis de un grupo (hogar): una sola evidencia con el correo de
+        todos los miembros y un único análisis IA.
+
+        Args:
+            group_name: Nombre del grupo (se usa como "cliente" en el análisis)
+            members: Lista de (email del miembro, sus direcciones)
+            num_emails / fecha_desde / fecha_hasta: Por miembro, igual que get_emails
+            use_precomputed: Reutilizar la evidencia del precálculo nocturno de cada miembro
+            fallback: Generar el análisis básico local si la IA falla
+            progress: Función (fracción, mensaje) para informar del avance
+
+        Returns:
+            dict: lo mismo que analyze_client + 'members': {email: {'emails',
+                  'error', 'source', 'sentiment'}}
+        """
+        progress = progress or _no_progress
+        timings = {}
+        start = time.perf_counter()
+
+        # === GMAIL (miembros en paralelo) ===
+        progress(0.02, f"📥 Descargando el correo de {len(members)} miembros...")
+        frames = {email: None for email, _ in members}
+        members_info = dict(frames)  # Mismo orden que el grupo, no el de llegada
+        with ThreadPoolExecutor(max_workers=min(GROUP_FETCH_WORKERS, len(members) or 1)) as pool:
+            futures = {
+                pool.submit(
+                    contextvars.copy_context().run, self.fetch_member, creds, email, addresses,
+                    num_emails, fecha_desde, fecha_hasta, use_precomputed
+                ): email
+                for email, addresses in members
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                email = futures[future]
+                evidence, err, source = future.result()
+                frames[email] = evidence
+                members_info[email] = {
+                    'emails': len(evidence) if evidence is not None else 0,
+                    'error': err, 'source': source, 'sentiment': []
+                }
+                progress(0.05 + 0.55 * done / len(futures), f"📥 {done}/{len(futures)} miembros descargados")
+        timings['fetch_s'] = round(time.perf_counter() - start, 3)
+
+        evidence = EvidenceFrame.merge(frames)
+        errors = [f"{email}: {info['error']}" for email, info in members_info.items() if info['error']]
+        result = {
+            'analysis': None, 'evidence': evidence, 'error': None, 'ai_error': None,
+            'precomputed_at': None, 'ranking': None, 'timings': timings, 'members': members_info,
+            'snapshot': None, 'diff': None
+        }
+        if not len(evidence):
+            result['error'] = "\n".join(errors) or f"📭 No se encontraron emails de {group_name}."
+            return result
+        if errors:
+            result['warning'] = "⚠️ Miembros sin datos: " + "; ".join(errors)
+
+        # === ANÁLISIS ÚNICO ===
+        progress(0.65, f"🤖 Analizando {len(evidence)} emails del grupo con {self.config.model}...")
+        t = time.perf_counter()
+        with attribution(client=group_name):
+            analysis, ai_err = self.analyze(evidence.prompt_text(), len(evidence))
+        timings['analysis_s'] = round(time.perf_counter() - t, 3)
+        progress(0.95, "Preparando resultados...")
+
+        if ai_err and fallback:
+            analysis = ai.generate_fallback_analysis(evidence, group_name)
+
+        for member, series in member_sentiment(evidence, analysis).items():
+            members_info[member]['sentiment'] = series
+
+        t = time.perf_counter()
+        ranking = self.build_ranking(evidence)
+        timings['ranking_s'] = round(time.perf_counter() - t, 3)
+
+        timings['total_s'] = round(time.perf_counter() - start, 3)
+        result.update(analysis=analysis, ai_error=ai_err, ranking=ranking)
+        return result
+
+    # --- HISTORIAL COMPLETO ---
+    def summarize_period(self, client, period, text_data, from_summaries):
+        """Resumen IA de un periodo, con su fila en el libro de consumo. Returns: (json, error)"""
+        with telemetry.span("ai.history_period", period=period), attribution(client=client):
+            with self.ledger.track("history_period", self.config.model) as call:
+                summary, err = ai.summarize_period(
+                    text_data, summaries.period_label(period), from_summaries,
+                    self.config.openai_api_key, model=self.config.model
+                )
+                call.error = err is not None
+        return summary, err
+
+    def summarize_month(self, creds, client, month, addresses, stored, closed):
+        """
+        Resumen de un mes. Si la búsqueda de Gmail del mes devuelve lo mismo
+        que cuando se resumió, se reutiliza sin descargar nada.
+
+        Returns:
+            tuple: (fila del SummaryStore, mensaje_error, resúmenes nuevos)
+        """
+        start, end = summaries.month_bounds(month)
+        state, err = gmail.probe_mailbox(creds, client, fecha_desde=start, fecha_hasta=end, addresses=addresses)
+        if err:
+            return None, err, 0
+        if stored and stored['source_state'] == state:
+            if closed and not stored['closed']:
+                # El mes terminó sin cambios desde el último resumen: ya es definitivo
+                stored = self.summaries.put(client, month, 'month', stored['summary'], stored['emails'], state, True)
+            return stored, None, 0
+        if state == gmail.mailbox_state([]):
+            return self.summaries.put(client, month, 'month', None, 0, state, closed), None, 0
+
+        evidence, err = self.fetch_emails(creds, client, fecha_desde=start, fecha_hasta=end, addresses=addresses)
+        if evidence is None:
+            return None, err, 0
+        summary, err = self.summarize_period(client, month, evidence.brief_text(), from_summaries=False)
+        if err:
+            return None, err, 0
+        return self.summaries.put(client, month, 'month', summary, len(evidence), state, closed), None, 1
+
+    def rollup_period(self, client, period, level, children, stored):
+        """
+        Resumen de un trimestre o año cerrado a partir de los de sus hijos
+        (solo se recalcula si algún hijo cambió).
+
+        Returns:
+            tuple: (fila del SummaryStore, mensaje_error, resúmenes nuevos)
+        """
+        state = summaries.children_state(children)
+        if stored and stored['source_state'] == state:
+            return stored, None, 0
+        emails = sum(child['emails'] for child in children)
+        if not emails:
+            return self.summaries.put(client, period, level, None, 0, state, True), None, 0
+        summary, err = self.summarize_period(client, period, summaries.summary_text(children), from_summaries=True)
+        if err:
+            return None, err, 0
+        return self.summaries.put(client, period, level, summary, emails, state, True), None, 1
+
+    @telemetry.traced("engine.full_history")
+    def full_history(self, creds, target_email, years=HISTORY_YEARS, addresses=None, progress=None, today=None):
+        """
+        Análisis de toda la relación con el cliente a partir de resúmenes
+        jerárquicos (ver advisor.summaries).
+
+        Args:
+            creds: Credenciales de Google OAuth
+            target_email: Email principal del cliente
+            years: Años naturales a cubrir, incluido el actual
+            addresses: Otras direcciones del cliente (ver get_emails)
+            progress: Función (fracción, mensaje) para informar del avance
+            today: Fecha de referencia (por defecto, hoy)
+
+        Returns:
+            dict: {'history' (análisis IA), 'periods' (resúmenes usados, en orden),
+                   'months', 'emails', 'new_summaries', 'error', 'warning', 'timings'}
+        """
+        progress = progress or _no_progress
+        timings = {}
+        start = time.perf_counter()
+        today = today or date.today()
+        current = summaries.month_key(today)
+
+        months = summaries.months_between(date(today.year - years + 1, 1, 1), today)
+        quarters = list(dict.fromkeys(summaries.quarter_key(m) for m in months))
+        year_keys = list(dict.fromkeys(m[:4] for m in months))
+        stored = self.summaries.get_many(target_email, months + quarters + year_keys)
+
+        result = {
+            'history': None, 'periods': [], 'months': len(months), 'emails': 0, 'new_summaries': 0,
+            'error': None, 'warning': None, 'timings': timings
+        }
+        errors = []
+
+        # === MESES (los cerrados ya resumidos no se tocan) ===
+        rows = {m: stored[m] for m in months if stored.get(m) and stored[m]['closed']}
+        pending = [m for m in months if m not in rows]
+        progress(0.05, f"📚 {len(rows)} meses ya resumidos, {len(pending)} por revisar en Gmail...")
+        with ThreadPoolExecutor(max_workers=HISTORY_WORKERS) as pool:
+            futures = {
+                pool.submit(
+                    contextvars.copy_context().run, self.summarize_month, creds, target_email, month, addresses,
+                    stored.get(month), month < current
+                ): month
+                for month in pending
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                month = futures[future]
+                row, err, new = future.result()
+                result['new_summaries'] += new
+                if row:
+                    rows[month] = row
+                else:
+                    errors.append(f"{summaries.period_label(month)}: {err}")
+                progress(0.05 + 0.6 * done / len(pending), f"📚 Resumiendo meses ({done}/{len(pending)})...")
+        timings['months_s'] = round(time.perf_counter() - start, 3)
+
+        # === TRIMESTRES Y AÑOS CERRADOS ===
+        # Un periodo sin resumen propio (en curso, o con algún hijo que falló) aporta los de sus hijos
+        progress(0.7, "🧩 Agrupando trimestres y años cerrados...")
+        t = time.perf_counter()
+
+        def rollup(period, level, children):
+            row, err, new = self.rollup_period(target_email, period, level, children, stored.get(period))
+            result['new_summaries'] += new
+            if err:
+                errors.append(f"{summaries.period_label(period)}: {err}")
+            return row
+
+        for year in year_keys:
+            nodes = []
+            for quarter in (q for q in quarters if q.startswith(year)):
+                quarter_months = summaries.quarter_months(quarter)
+                node = None
+                if quarter_months[-1] < current and all(m in rows for m in quarter_months):
+                    node = rollup(quarter, 'quarter', [rows[m] for m in quarter_months])
+                nodes.append([node] if node else [rows[m] for m in quarter_months if m in rows])
+            year_row = None
+            if year < current[:4] and all(len(n) == 1 and n[0]['level'] == 'quarter' for n in nodes):
+                year_row = rollup(year, 'year', [n[0] for n in nodes])
+            result['periods'].extend([year_row] if year_row else [row for n in nodes for row in n])
+        timings['rollup_s'] = round(time.perf_counter() - t, 3)
+
+        result['emails'] = sum(row['emails'] for row in result['periods'])
+        if errors:
+            result['warning'] = f"⚠️ {len(errors)} periodos no se pudieron resumir: " + "; ".join(errors[:3])
+        if not result['emails']:
+            result['error'] = errors[0].split(": ", 1)[1] if errors and not rows else (
+                f"📭 No se encontraron emails con {target_email} en los últimos {years} años."
+            )
+            timings['total_s'] = round(time.perf_counter() - start, 3)
+            return result
+
+        # === ANÁLISIS FINAL (una llamada con los resúmenes compuestos) ===
+        progress(0.8, f"🤖 Analizando {len(result['periods'])} periodos con {self.config.model}...")
+        text_data = summaries.summary_text(result['periods'])
+        t = time.perf_counter()
+        with attribution(client=target_email):
+            history, err = self._cached(
+                "history", HISTORY_TTL,
+                lambda: ai.analyze_full_history(text_data, target_email, self.config.openai_api_key, model=self.config.model),
+                text_data, target_email,
+                is_valid=lambda out: out[1] is None
+            )
+        timings['analysis_s'] = round(time.perf_counter() - t, 3)
+        timings['total_s'] = round(time.perf_counter() - start, 3)
+        result.update(history=history, error=err)
+        return result
+
+    @telemetry.traced("engine.client_brief")
+    def client_brief(self, creds, target_email, evidence=None, num_emails=15, use_precomputed=True, progress=None,
+                     addresses=None):
+        """
+        Pre-Meeting Brief de un cliente, reutilizando la evidencia si ya existe.
+
+        Returns:
+            dict: {'brief', 'evidence_count', 'fetch_error', 'error', 'empty', 'timings'}
+        """
+        progress = progress or _no_progress
+        start = time.perf_counter()
+        result = {'brief': None, 'evidence_count': 0, 'fetch_error': None, 'error': None, 'empty': False, 'timings': {}}
+
+        if use_precomputed and num_emails:
+            stored = self.load_precomputed(target_email, num_emails, addresses)
+            if stored and stored.get('brief'):
+                result.update(brief=stored['brief'], evidence_count=len(stored['evidence']))
+                result['timings']['total_s'] = round(time.perf_counter() - start, 3)
+                return result
+
+        if evidence is None:
+            progress(0.05, "📥 Obteniendo emails...")
+            evidence, err = self.fetch_emails(creds, target_email, num_emails=num_emails, addresses=addresses)
+            if err:
+                result['fetch_error'] = err
+                return result
+            if not evidence:
+                result['empty'] = True
+                return result
+
+        progress(0.4, "📄 Generando Pre-Meeting Brief con IA...")
+        with telemetry.span("ai.prompt", emails=len(evidence)):
+            brief_text = ai.build_brief_text(evidence)
+        with attribution(client=target_email):
+            brief, brief_err = self.meeting_brief(brief_text, len(evidence), target_email)
+        result.update(brief=brief, evidence_count=len(evidence), error=brief_err)
+        result['timings']['total_s'] = round(time.perf_counter() - start, 3)
+        return result
+
+    # --- ESCÁNER DE ALERTAS ---
+    def score_new_emails(self, messages):
+        """Sentimiento y urgencia de emails nuevos de clientes, por tandas. Returns: ({id: puntuación}, error)"""
+        scores = {}
+        for i in range(0, len(messages), SCAN_SCORE_BATCH):
+            batch = messages[i:i + SCAN_SCORE_BATCH]
+            text_data = "\n\n".join(
+                f"--- EMAIL ---\nID: {m['id']}\nCLIENTE: {m['client']}\nASUNTO: {m['subject']}\n"
+                f"CUERPO: {m['body'][:SCAN_BODY_CHARS]}"
+                for m in batch
+            )
+            with telemetry.span("ai.alert_scan", emails=len(batch)):
+                with self.ledger.track("alert_scan", self.config.model) as call:
+                    batch_scores, err = ai.score_new_emails(
+                        text_data, self.config.openai_api_key, model=self.config.model
+                    )
+                    call.error = err is not None
+            if err:
+                return None, err
+            scores.update(batch_scores)
+        return scores, None
+
+    @telemetry.traced("engine.scan_alerts")
+    def scan_alerts(self, creds, registry, alerts, progress=None, now=None, pending_hours=ALERT_PENDING_HOURS):
+        """
+        Una pasada del escáner de alertas: solo el correo añadido al buzón
+        desde la pasada anterior (ver advisor.alerts).
+
+        Args:
+            creds: Credenciales de Google OAuth
+            registry: ClientRegistry (direcciones, alias y sentimiento habitual)
+            alerts: AlertStore con el cursor y las alertas
+            progress: Función (fracción, mensaje) para informar del avance
+            now: Marca de tiempo de la pasada (por defecto, ahora)
+            pending_hours: Horas sin responder al cliente que generan alerta
+
+        Returns:
+            dict: {'account', 'messages' (nuevos en el buzón), 'client_messages',
+                   'scored', 'alerts' (nuevas), 'history_id', 'error', 'warning', 'timings'}
+        """
+        progress = progress or _no_progress
+        now = now or time.time()
+        start = time.perf_counter()
+        result = {'account': None, 'messages': 0, 'client_messages': 0, 'scored': 0, 'alerts': [], 'history_id': None,
+                  'error': None, 'warning': None, 'timings': {}}
+        timings = result['timings']
+
+        clients = registry.clients(with_aliases=True)
+        owners = {}
+        for client in clients:
+            for address in [client['email']] + [a for a in client['aliases'] if '@' in a]:
+                owners.setdefault(normalize(address), client['email'])
+        baselines = {c['email']: c['avg_sentiment'] for c in clients if c['avg_sentiment'] is not None}
+
+        # === CORREO NUEVO (users.history.list desde el cursor) ===
+        progress(0.05, "🔔 Buscando correo nuevo...")
+        t = time.perf_counter()
+        try:
+            service = gmail.build('gmail', 'v1', credentials=creds)
+            account, current = gmail.mailbox_profile(service)
+            result['account'] = account
+            cursor = alerts.cursor(account)
+            if cursor is None:
+                # Primera pasada: desde el análisis más antiguo que dejó historyId en el registro
+                seen = [int(c['history_id']) for c in clients if c.get('history_id')]
+                cursor = min(seen) if seen else None
+            expired = cursor is None
+            messages, latest, err = [], None, None
+            if cursor is not None:
+                messages, latest, expired, err = gmail.list_history(service, cursor)
+            if expired:
+                latest, messages = current, []
+                result['warning'] = ("No hay un punto de partida reciente en Gmail (el historial dura una semana): "
+                                     "se vigila el correo que llegue a partir de ahora.")
+        except Exception as e:
+            err = f"❌ Error al conectar con Gmail: {str(e)[:200]}"
+        timings['history_s'] = round(time.perf_counter() - t, 3)
+        if err:
+            result['error'] = err
+            return result
+
+        new_ids = [m['id'] for m in messages]
+        known = alerts.known(new_ids)
+        pending = [mid for mid in new_ids if mid not in known]
+        result['messages'] = len(pending)
+
+        # === MENSAJES DE CLIENTES (cabeceras de todos; cuerpo solo de los del cliente) ===
+        t = time.perf_counter()
+        found = []
+        for idx, message_id in enumerate(pending):
+            progress(0.1 + 0.5 * idx / max(len(pending), 1), f"📥 Revisando {idx + 1} de {len(pending)} emails nuevos...")
+            msg = gmail.get_message(service, message_id)
+            if msg is None:
+                continue
+            sender = next((owners[a] for a in msg['from'] if a in owners), None)
+            recipient = next((owners[a] for a in msg['to'] if a in owners), None)
+            if sender is None and recipient is None:
+                continue
+            if sender is not None:
+                msg = gmail.get_message(service, message_id, full=True) or msg
+            found.append({
+                'id': message_id,
+                'client': sender or recipient,
+                'origin': "CLIENTE" if sender is not None else "BANCO",
+                'sent_at': msg['date'].timestamp() if msg['date'] else now,
+                'subject': msg['subject'],
+                'body': msg['body'],
+                'score': None,
+                'urgency': None,
+            })
+        found.sort(key=lambda m: m['sent_at'])
+        result['client_messages'] = len(found)
+        timings['fetch_s'] = round(time.perf_counter() - t, 3)
+
+        # === PUNTUACIÓN (solo los emails nuevos del cliente) ===
+        from_clients = [m for m in found if m['origin'] == "CLIENTE"]
+        if from_clients and self.config.openai_api_key:
+            progress(0.65, f"🤖 Puntuando {len(from_clients)} emails de clientes...")
+            t = time.perf_counter()
+            scores, err = self.score_new_emails(from_clients)
+            timings['scoring_s'] = round(time.perf_counter() - t, 3)
+            if err:
+                # No se avanza el cursor: la próxima pasada los vuelve a intentar
+                result['error'] = err
+                return result
+            for m in from_clients:
+                scored = scores.get(m['id']) or {}
+                m['score'] = scored.get('sentimiento_score')
+                m['urgency'] = scored.get('urgencia')
+            result['scored'] = sum(1 for m in from_clients if m['score'] is not None)
+        elif from_clients:
+            result['warning'] = "Sin API Key de OpenAI: solo se vigilan los emails sin responder."
+
+        # === ALERTAS ===
+        progress(0.9, "🔔 Actualizando alertas...")
+        result['alerts'] = alerts.ingest(found, baselines, now=now) + alerts.check_unanswered(now, pending_hours)
+        alerts.set_cursor(account, latest)
+        result['history_id'] = latest
+        timings['total_s'] = round(time.perf_counter() - start, 3)
+        return result
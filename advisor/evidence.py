@@ -0,0 +1,245 @@
+"""
+Evidencia de un análisis en formato columnar.
+
+EvidenceFrame guarda los emails de un cliente en un DataFrame de pandas:
+fecha como datetime64, origen categórico y asuntos internados (los hilos
+repiten "Re: ..." una y otra vez). Sustituye a la lista de dicts y al texto
+concatenado que se guardaba aparte: el texto para la IA (prompt_text) y el
+del Brief (brief_text) se generan al vuelo desde las columnas.
+
+Para no romper a quien ya consume la evidencia, se comporta como una lista
+de dicts con las claves de siempre ('Nº', 'Fecha', 'Origen', 'Cuerpo'...):
+len(), índices, slices e iteración funcionan igual.
+
+Con poca memoria, spill() vuelca el DataFrame a disco y lo suelta; el primer
+acceso posterior lo recarga sin que quien lo usa tenga que enterarse.
+
+La evidencia de un grupo familiar (merge) lleva además la columna 'member':
+el miembro del grupo al que pertenece cada email ('Miembro' en los dicts).
+"""
+import sys
+from datetime import datetime
+
+import pandas as pd
+
+PROMPT_BODY_CHARS = 3000   # Igual que el recorte que hacía get_emails
+BRIEF_BODY_CHARS = 500
+SUBJECT_SHORT_CHARS = 60
+ORIGINS = ["CLIENTE", "BANCO"]
+DATE_FORMAT = '%Y-%m-%d %H:%M'
+UNKNOWN_DATE = "Fecha desconocida"
+
+_COLUMNS = ['num', 'id', 'date', 'date_text', 'origin', 'subject', 'body', 'attachments']
+
+
+def prompt_chars(num, msg_id, fecha, origin, subject, body):
+    """Longitud del bloque de un email en prompt_text, sin construirlo."""
+    header = len(f"\n--- EMAIL {num} ---\nID: \nFECHA: \nORIGEN: \nASUNTO: \nCONTENIDO: \n")
+    return header + len(msg_id) + len(fecha) + len(origin) + len(subject) + min(len(body), PROMPT_BODY_CHARS)
+
+
+def short_subject(subject):
+    return subject[:SUBJECT_SHORT_CHARS] + "..." if len(subject) > SUBJECT_SHORT_CHARS else subject
+
+
+class EvidenceFrame:
+    """Emails de un análisis en columnas, con interfaz de lista de dicts."""
+
+    def __init__(self, df=None):
+        self._df = df if df is not None else self._frame([])
+        self._size = len(self._df)
+        self._spill_path = None
+        self._memory_bytes = None  # Los datos no cambian: se mide una vez
+        self.history_id = None  # historyId de Gmail más alto de estos emails (si vienen de Gmail)
+        self.mailbox_state = None  # Huella de la búsqueda de Gmail que los devolvió (gmail.mailbox_state)
+
+    @property
+    def df(self):
+        if self._df is None:
+            self._df = pd.read_pickle(self._spill_path)
+        return self._df
+
+    @property
+    def spilled(self):
+        return self._df is None
+
+    def spill(self, path):
+        """Vuelca la evidencia a disco y libera el DataFrame (se recarga al usarla)."""
+        if self._df is None:
+            return
+        self._df.to_pickle(path)
+        self._spill_path = path
+        self._df = None
+
+    # --- CONSTRUCCIÓN ---
+    @staticmethod
+    def _frame(rows):
+        """
+        DataFrame tipado a partir de filas (num, id, fecha, texto_fecha, origen, asunto, cuerpo, adjuntos).
+
+        ``fecha`` es un datetime (o None); ``texto_fecha`` solo se usa cuando
+        la fecha no se pudo parsear.
+        """
+        columns = list(zip(*rows)) if rows else [()] * len(_COLUMNS)
+        data = dict(zip(_COLUMNS, columns))
+        return pd.DataFrame({
+            'num': pd.array(data['num'], dtype="int32"),
+            'id': pd.array(data['id'], dtype=object),
+            'date': pd.to_datetime(pd.Series(data['date'], dtype=object), errors="coerce"),
+            'date_text': pd.array(data['date_text'], dtype=object),
+            'origin': pd.Categorical(data['origin'], categories=ORIGINS),
+            'subject': pd.array([sys.intern(s) for s in data['subject']], dtype=object),
+            'body': pd.array(data['body'], dtype=object),
+            'attachments': pd.array(data['attachments'], dtype="int16"),
+        })
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Construye la evidencia desde las filas que produce get_emails."""
+        normalized = []
+        for num, msg_id, date, date_text, origin, subject, body, attachments in rows:
+            if date is not None and date.tzinfo is not None:
+                date = date.replace(tzinfo=None)  # Hora local del remitente, como antes
+            normalized.append((num, msg_id, date, None if date else date_text, origin, subject, body, attachments))
+        return cls(cls._frame(normalized))
+
+    @classmethod
+    def from_records(cls, records):
+        """Evidencia desde la lista de dicts clásica (precálculos guardados, sesiones antiguas)."""
+        if isinstance(records, cls):
+            return records
+        records = list(records or [])
+        rows = []
+        for e in records:
+            text = e.get('Fecha', '')
+            try:
+                date = datetime.strptime(text, DATE_FORMAT)
+            except (TypeError, ValueError):
+                date = None
+            rows.append((
+                e.get('Nº', 0), e.get('Id_Completo', ''), date, text, e.get('Origen', 'BANCO'),
+                e.get('Asunto_Completo', ''), e.get('Cuerpo', ''), int(e.get('Adjuntos', 0) or 0)
+            ))
+        evidence = cls.from_rows(rows)
+        if records and 'Miembro' in records[0]:
+            evidence.df['member'] = pd.Categorical([e.get('Miembro') for e in records])
+        return evidence
+
+    @classmethod
+    def merge(cls, frames):
+        """
+        Evidencia única de un grupo a partir de la de cada miembro.
+
+        Un email entre dos miembros aparece en la descarga de ambos: se queda
+        una sola vez, como CLIENTE si lo envió algún miembro y atribuido a ese
+        miembro. El resultado va en orden cronológico y se renumera.
+
+        Args:
+            frames: dict {email del miembro: EvidenceFrame}
+        """
+        parts = [frame.df.assign(member=member) for member, frame in frames.items() if frame is not None and len(frame)]
+        if not parts:
+            return cls()
+        df = pd.concat(parts, ignore_index=True)
+        df['origin'] = pd.Categorical(df['origin'], categories=ORIGINS)
+        df['_client_first'] = (df['origin'] != "CLIENTE").astype("int8")
+        df = (df.sort_values(['_client_first'], kind="stable")
+                .drop_duplicates('id', keep='first')
+                .sort_values(['date', 'num'], kind="stable", na_position='first')
+                .drop(columns=['_client_first'])
+                .reset_index(drop=True))
+        df['num'] = pd.array(range(1, len(df) + 1), dtype="int32")
+        df['member'] = pd.Categorical(df['member'], categories=list(frames))
+        return cls(df)
+
+    # --- INTERFAZ DE LISTA ---
+    def __len__(self):
+        return self._size
+
+    @property
+    def is_group(self):
+        return 'member' in self.df.columns
+
+    def __iter__(self):
+        df = self.df
+        columns = [df[c] for c in _COLUMNS]
+        if self.is_group:
+            columns.append(df['member'])
+        return map(self._record, *columns)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return EvidenceFrame(self.df.iloc[key].reset_index(drop=True))
+        row = self.df.iloc[key]
+        return self._record(*(row[c] for c in _COLUMNS), *([row['member']] if self.is_group else []))
+
+    def __repr__(self):
+        return f"<EvidenceFrame {len(self)} emails>"
+
+    @staticmethod
+    def _record(num, msg_id, date, date_text, origin, subject, body, attachments, member=None):
+        """Dict con las claves clásicas de la evidencia (+ 'Miembro' en los grupos)."""
+        if pd.isna(date):
+            fecha, fecha_corta = date_text or UNKNOWN_DATE, "N/A"
+        else:
+            fecha, fecha_corta = date.strftime(DATE_FORMAT), date.strftime('%d %b')
+        record = {
+            "Nº": int(num),
+            "Id_Completo": msg_id,
+            "Id": msg_id[:8],
+            "Fecha": fecha,
+            "Fecha_Corta": fecha_corta,
+            "Origen": origin,
+            "Asunto": short_subject(subject),
+            "Asunto_Completo": subject,
+            "Cuerpo": body,
+            "Adjuntos": int(attachments)
+        }
+        if member is not None:
+            record["Miembro"] = member
+        return record
+
+    def to_records(self):
+        """Lista de dicts serializable en JSON (PrecomputeStore, --json de la CLI)."""
+        return list(self)
+
+    # --- TEXTOS PARA LA IA ---
+    def prompt_text(self):
+        """
+        Texto completo para el análisis, en el orden en que llegó de Gmail
+        (más reciente primero), idéntico al que concatenaba get_emails.
+        """
+        parts = []
+        for e in reversed(self.to_records()):
+            member = f"MIEMBRO: {e['Miembro']}\n" if 'Miembro' in e else ""
+            parts.append(
+                f"\n--- EMAIL {e['Nº']} ---\nID: {e['Id_Completo']}\nFECHA: {e['Fecha']}\n"
+                f"ORIGEN: {e['Origen']}\n{member}ASUNTO: {e['Asunto_Completo']}\nCONTENIDO: {e['Cuerpo'][:PROMPT_BODY_CHARS]}\n"
+            )
+        return "".join(parts)
+
+    def brief_text(self):
+        """Texto compacto (500 caracteres por email) que se envía al generar el Brief."""
+        return "\n".join(
+            f"EMAIL {e['Nº']}: {e['Fecha']} | {e['Origen']} | {e['Asunto_Completo']} | {e['Cuerpo'][:BRIEF_BODY_CHARS]}"
+            for e in self
+        )
+
+    # --- COLUMNAS ---
+    def members(self):
+        """Miembro de cada email (None fuera de un grupo)."""
+        if not self.is_group:
+            return [None] * len(self)
+        return [None if pd.isna(m) else m for m in self.df['member']]
+
+    def dates(self):
+        """Fechas como datetime (None si no se pudo parsear)."""
+        return [None if pd.isna(d) else d.to_pydatetime() for d in self.df['date']]
+
+    def memory_bytes(self):
+        """Memoria aproximada del contenedor (incluye el texto de los cuerpos; 0 si está en disco)."""
+        if self._df is None:
+            return 0
+        if self._memory_bytes is None:
+            self._memory_bytes = int(self._df.memory_usage(deep=True).sum())
+        return self._memory_bytes
@@ -0,0 +1,459 @@
+"""
+Motor de Gmail: descarga y normalización de emails.
+
+No depende de Streamlit, de modo que puede usarse desde la app, desde los
+workers en segundo plano o desde el precálculo nocturno (advisor.batch).
+"""
+import base64
+import hashlib
+from email.utils import getaddresses, parsedate_to_datetime
+
+from advisor import telemetry
+
+SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
+
+
+def build(*args, **kwargs):
+    """googleapiclient.discovery.build, importado en el primer uso (la pantalla de login no lo necesita)."""
+    from googleapiclient.discovery import build as _build
+    return _build(*args, **kwargs)
+
+
+def load_credentials(token_path):
+    """
+    Carga credenciales OAuth guardadas (formato authorized_user de Google).
+    
+    Se usa en los procesos sin interfaz, que no pueden pasar por el login web.
+    """
+    from google.oauth2.credentials import Credentials
+    return Credentials.from_authorized_user_file(token_path, SCOPES)
+
+
+def parse_email_body(payload):
+    body = ""
+    if 'parts' in payload:
+        for part in payload['parts']:
+            if part['mimeType'] == 'text/plain':
+                if 'data' in part['body']:
+                    body = base64.urlsafe_b64decode(part['body']['data']).decode('utf-8', errors='ignore')
+                    break
+            elif 'parts' in part:
+                body = parse_email_body(part)
+                if body: break
+    elif 'body' in payload and 'data' in payload['body']:
+        body = base64.urlsafe_b64decode(payload['body']['data']).decode('utf-8', errors='ignore')
+    return body
+
+
+def client_addresses(target_email, addresses=None):
+    """Direcciones del cliente, normalizadas y sin repetir (la principal primero)."""
+    result = []
+    for address in [target_email] + list(addresses or []):
+        address = (address or "").strip().lower()
+        if address and address not in result:
+            result.append(address)
+    return result
+
+
+def build_client_query(addresses):
+    """
+    Consulta de Gmail con los emails enviados o recibidos por cualquiera de
+    las direcciones del cliente ({...} es un OR en Gmail).
+    """
+    if len(addresses) == 1:
+        return f"from:{addresses[0]} OR to:{addresses[0]}"
+    terms = " ".join(f"from:{a} to:{a}" for a in addresses)
+    return "{" + terms + "}"
+
+
+def is_from_client(sender, addresses):
+    """True si el remitente (cabecera From) es alguna de las direcciones del cliente."""
+    return any(address.lower() in addresses for _, address in getaddresses([sender]) if address)
+
+
+def count_attachments(payload):
+    """Número de partes con nombre de fichero (adjuntos) del mensaje."""
+    count = 1 if payload.get('filename') else 0
+    for part in payload.get('parts', []):
+        count += count_attachments(part)
+    return count
+
+MAX_EMAILS_ALLOWED = 500  # Límite absoluto de emails por consulta
+
+
+def build_search(addresses, num_emails=None, fecha_desde=None, fecha_hasta=None):
+    """
+    Consulta y número máximo de resultados de una búsqueda de emails del cliente.
+    
+    Returns:
+        tuple: (query, max_results, mensaje_error)
+    """
+    query = build_client_query(addresses)
+    
+    # Determinar modo y ajustar query
+    if fecha_desde and fecha_hasta:
+        # MODO FECHA
+        try:
+            fecha_desde_str = fecha_desde.strftime('%Y/%m/%d')
+            fecha_hasta_str = fecha_hasta.strftime('%Y/%m/%d')
+        except Exception as e:
+            return None, None, f"❌ Error en el formato de fechas: {str(e)}"
+        return f"{query} after:{fecha_desde_str} before:{fecha_hasta_str}", MAX_EMAILS_ALLOWED, None
+    
+    # MODO CANTIDAD
+    if not num_emails:
+        num_emails = 15  # Default seguro
+    
+    # Validar límite
+    if num_emails > MAX_EMAILS_ALLOWED:
+        return None, None, f"❌ El límite máximo es {MAX_EMAILS_ALLOWED} emails. Solicitaste {num_emails}."
+    return query, num_emails, None
+
+
+def list_messages(service, query, max_results):
+    """
+    Ids de los mensajes que devuelve la búsqueda (solo la lista, sin descargarlos).
+    
+    Returns:
+        tuple: (lista de {'id', 'threadId'}, mensaje_error)
+    """
+    try:
+        with telemetry.span("gmail.list", max_results=max_results) as list_span:
+            results = service.users().messages().list(
+                userId='me',
+                q=query,
+                maxResults=max_results
+            ).execute()
+            list_span.set_attribute("messages", len(results.get('messages', [])))
+    except Exception as api_error:
+        error_msg = str(api_error)
+        
+        # Errores comunes con mensajes amigables
+        if "invalid_grant" in error_msg.lower():
+            return None, "🔐 Tu sesión ha expirado. Por favor, cierra sesión y vuelve a autenticarte."
+        elif "insufficient permission" in error_msg.lower():
+            return None, "🔒 No tienes permisos suficientes en Gmail. Verifica tu configuración de OAuth."
+        elif "quota" in error_msg.lower():
+            return None, "⏳ Has alcanzado el límite de consultas de Gmail. Intenta de nuevo en unos minutos."
+        else:
+            return None, f"❌ Error al conectar con Gmail: {error_msg[:200]}"
+    return results.get('messages', []), None
+
+
+def mailbox_state(messages):
+    """
+    Huella de los mensajes que devuelve una búsqueda: cambia si llega, se
+    borra o entra en el rango algún email. No depende del orden.
+    """
+    ids = sorted({msg['id'] for msg in messages})
+    return hashlib.sha1(",".join(ids).encode()).hexdigest()[:16]
+
+
+def probe_mailbox(creds, target_email, num_emails=None, fecha_desde=None, fecha_hasta=None, addresses=None):
+    """
+    Estado actual del buzón para una búsqueda, con una sola llamada a
+    messages.list (sin descargar ningún email).
+    
+    Returns:
+        tuple: (huella, mensaje_error). La huella es la misma que
+        get_emails() deja en evidence.mailbox_state.
+    """
+    addresses = client_addresses(target_email, addresses)
+    query, max_results, error = build_search(addresses, num_emails, fecha_desde, fecha_hasta)
+    if error:
+        return None, error
+    try:
+        service = build('gmail', 'v1', credentials=creds)
+    except Exception as e:
+        return None, f"❌ Error al conectar con Gmail: {str(e)[:200]}"
+    messages, error = list_messages(service, query, max_results)
+    if error:
+        return None, error
+    return mailbox_state(messages), None
+
+
+def get_emails(creds, target_email, num_emails=None, fecha_desde=None, fecha_hasta=None, progress_callback=None,
+               addresses=None):
+    """
+    Obtiene y procesa emails de Gmail con manejo robusto de errores.
+    
+    Args:
+        creds: Credenciales de Google OAuth
+        target_email: Email del cliente a buscar
+        num_emails: Número de emails a obtener (modo cantidad)
+        fecha_desde: Fecha inicio (modo rango)
+        fecha_hasta: Fecha fin (modo rango)
+        progress_callback: Función opcional (procesados, total) llamada antes de cada email
+        addresses: Otras direcciones del mismo cliente (empresa, family office,
+                   asistente); se descargan en la misma consulta
+    
+    Returns:
+        tuple: (EvidenceFrame, mensaje_error). El texto para la IA se genera
+        después con evidence.prompt_text().
+    """
+    
+    from advisor.evidence import EvidenceFrame, prompt_chars
+
+    # === VALIDACIONES PREVIAS ===
+    if not creds:
+        return None, "❌ Credenciales no válidas. Por favor, vuelve a iniciar sesión."
+    
+    if not target_email or '@' not in target_email:
+        return None, "❌ El email del cliente no es válido."
+    
+    addresses = client_addresses(target_email, addresses)
+    
+    # === LÍMITES DE SEGURIDAD ===
+    MAX_CHARS_TOTAL = 100000  # Límite de caracteres para IA
+    
+    try:
+        # Construcción del servicio con timeout
+        service = build('gmail', 'v1', credentials=creds)
+        
+        # === CONSTRUIR QUERY ===
+        query, max_results, error = build_search(addresses, num_emails, fecha_desde, fecha_hasta)
+        if error:
+            return None, error
+        
+        # === LLAMADA A GMAIL API ===
+        messages, error = list_messages(service, query, max_results)
+        if error:
+            return None, error
+        
+        # === VERIFICAR RESULTADOS ===
+        if not messages:
+            if fecha_desde and fecha_hasta:
+                return None, f"📭 No se encontraron emails entre el {fecha_desde.strftime('%d/%m/%Y')} y el {fecha_hasta.strftime('%d/%m/%Y')}."
+            else:
+                return None, f"📭 No se encontraron emails con {', '.join(addresses)}."
+        
+        # === PROCESAR EMAILS ===
+        rows = []
+        seen_ids = set()
+        history_id = 0
+        current_chars = 0
+        emails_procesados = 0
+        emails_con_error = 0
+        
+        for idx, msg in enumerate(messages):
+            # Límite de caracteres alcanzado
+            if current_chars >= MAX_CHARS_TOTAL:
+                break
+            
+            # Un mensaje entre dos direcciones del cliente aparece una sola vez
+            if msg['id'] in seen_ids:
+                continue
+            seen_ids.add(msg['id'])
+            
+            # Informar del progreso (fuera del try: una cancelación debe propagarse)
+            if progress_callback:
+                progress_callback(idx, len(messages))
+            
+            try:
+                # Obtener detalles del email
+                with telemetry.span("gmail.get"):
+                    msg_detail = service.users().messages().get(
+                        userId='me', 
+                        id=msg['id'], 
+                        format='full'
+                    ).execute()
+                
+                headers = msg_detail['payload']['headers']
+                
+                # Extraer metadata
+                subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), "Sin Asunto")
+                date_str = next((h['value'] for h in headers if h['name'].lower() == 'date'), "")
+                sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), "")
+                
+                # Parsear fecha
+                try:
+                    date_obj = parsedate_to_datetime(date_str)
+                    date_formatted = date_obj.strftime('%Y-%m-%d %H:%M')
+                except:
+                    date_obj = None
+                    date_formatted = date_str[:16] if date_str else "Fecha desconocida"
+                
+                # Determinar origen
+                origin = "CLIENTE" if is_from_client(sender, addresses) else "BANCO"
+                
+                # Extraer cuerpo
+                with telemetry.span("gmail.decode"):
+                    body = parse_email_body(msg_detail['payload'])
+                if not body:
+                    body = msg_detail.get('snippet', '[Sin contenido]')
+                
+                # Tamaño que tendrá en el texto para la IA (se genera después, desde la evidencia)
+                current_chars += prompt_chars(idx + 1, msg['id'], date_formatted, origin, subject, body)
+                
+                # Guardar evidencia
+                rows.append((
+                    idx + 1, msg['id'], date_obj, date_formatted, origin, subject, body,
+                    count_attachments(msg_detail['payload'])
+                ))
+                
+                history_id = max(history_id, int(msg_detail.get('historyId') or 0))
+                emails_procesados += 1
+                
+            except Exception as email_error:
+                emails_con_error += 1
+                # Continuar con el siguiente email en lugar de fallar
+                continue
+        
+        # === VALIDAR RESULTADOS ===
+        if not rows:
+            return None, "❌ No se pudieron procesar los emails. Puede que estén vacíos o corruptos."
+        
+        # Invertir para tener orden cronológico
+        rows.reverse()
+        evidence = EvidenceFrame.from_rows(rows)
+        evidence.history_id = history_id or None
+        evidence.mailbox_state = mailbox_state(messages)
+        
+        # Mensaje de advertencia si hubo errores parciales
+        warning_msg = None
+        if emails_con_error > 0:
+            warning_msg = f"⚠️ Se procesaron {emails_procesados} emails correctamente. {emails_con_error} tuvieron errores y se omitieron."
+        
+        return evidence, warning_msg
+    
+    except Exception as e:
+        # CAPTURA DE ERRORES INESPERADOS
+        import traceback
+        error_detail = traceback.format_exc()
+        
+        return None, f"❌ Error técnico inesperado al obtener emails. Detalles: {str(e)[:300]}"
+
+
+def get_profile_email(creds):
+    """Dirección de la cuenta de Gmail autenticada (None si no se puede obtener)."""
+    try:
+        service = build('gmail', 'v1', credentials=creds)
+        return service.users().getProfile(userId='me').execute().get('emailAddress')
+    except Exception:
+        return None
+
+
+# --- SINCRONIZACIÓN INCREMENTAL (ESCÁNER DE ALERTAS) ---
+
+def mailbox_profile(service):
+    """(dirección de la cuenta, historyId actual): el buzón y el punto de partida de la siguiente sincronización."""
+    profile = service.users().getProfile(userId='me').execute()
+    return profile.get('emailAddress', '').lower(), int(profile['historyId'])
+
+
+def list_history(service, start_history_id):
+    """
+    Mensajes añadidos al buzón desde ``start_history_id`` (users.history.list).
+    
+    Solo se listan ids: el coste es proporcional al correo nuevo, no al buzón.
+    
+    Returns:
+        tuple: (lista de {'id', 'threadId'} sin repetir ni borradores,
+                historyId más reciente, caducado, mensaje_error). Gmail
+                guarda el historial alrededor de una semana: si el punto de
+                partida es más antiguo, caducado es True y no hay lista.
+    """
+    messages = []
+    seen = set()
+    latest = int(start_history_id)
+    page_token = None
+    try:
+        while True:
+            with telemetry.span("gmail.history"):
+                response = service.users().history().list(
+                    userId='me', startHistoryId=str(start_history_id), historyTypes=['messageAdded'],
+                    pageToken=page_token
+                ).execute()
+            for record in response.get('history', []):
+                for added in record.get('messagesAdded', []):
+                    msg = added['message']
+                    if msg['id'] in seen or 'DRAFT' in msg.get('labelIds', []):
+                        continue
+                    seen.add(msg['id'])
+                    messages.append({'id': msg['id'], 'threadId': msg.get('threadId')})
+            latest = max(latest, int(response.get('historyId') or 0))
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return messages, latest, False, None
+    except Exception as e:
+        if getattr(getattr(e, 'resp', None), 'status', None) == 404:
+            return None, None, True, None
+        error_str = str(e)
+        if "403" in error_str:
+            return None, None, False, "🔒 Sin permisos para acceder a Gmail. Verifica la autorización."
+        if "401" in error_str:
+            return None, None, False, "🔑 Sesión expirada. Por favor, cierra sesión y vuelve a conectarte."
+        return None, None, False, f"❌ Error al consultar el historial de Gmail: {error_str[:200]}"
+
+
+def get_message(service, message_id, full=False):
+    """
+    Un mensaje nuevo para el escáner: cabeceras y, si ``full``, el cuerpo.
+    
+    Returns:
+        dict: {'id', 'history_id', 'date' (datetime o None), 'from', 'to'
+               (direcciones en minúscula), 'subject', 'body'} o None si el
+               mensaje ya no existe
+    """
+    try:
+        with telemetry.span("gmail.get"):
+            if full:
+                msg = service.users().messages().get(userId='me', id=message_id, format='full').execute()
+            else:
+                msg = service.users().messages().get(
+                    userId='me', id=message_id, format='metadata',
+                    metadataHeaders=['From', 'To', 'Cc', 'Subject', 'Date']
+                ).execute()
+    except Exception:
+        return None
+    
+    headers = {}
+    for h in msg['payload'].get('headers', []):
+        headers.setdefault(h['name'].lower(), h['value'])
+    try:
+        date_obj = parsedate_to_datetime(headers.get('date', ''))
+    except (TypeError, ValueError):
+        date_obj = None
+    recipients = [headers.get('to', ''), headers.get('cc', '')]
+    body = ""
+    if full:
+        body = parse_email_body(msg['payload']) or msg.get('snippet', '')
+    return {
+        'id': msg['id'],
+        'history_id': int(msg.get('historyId') or 0),
+        'date': date_obj,
+        'from': [a.lower() for _, a in getaddresses([headers.get('from', '')]) if a],
+        'to': [a.lower() for _, a in getaddresses(recipients) if a],
+        'subject': headers.get('subject', "Sin Asunto"),
+        'body': body or msg.get('snippet', ''),
+    }
+
+
+# --- ANÁLISIS DE HILOS (THREAD INTELLIGENCE) ---
+
+def get_thread_content(creds, thread_id):
+    """Obtiene el contenido completo de un hilo específico de Gmail"""
+    try:
+        service = build('gmail', 'v1', credentials=creds)
+        # Traemos el hilo completo
+        with telemetry.span("gmail.thread_get"):
+            thread = service.users().threads().get(userId='me', id=thread_id, format='full').execute()
+        messages = thread.get('messages', [])
+        
+        full_thread_text = ""
+        
+        for msg in messages:
+            # Extraer fecha
+            headers = msg['payload']['headers']
+            date = next((h['value'] for h in headers if h['name'].lower() == 'date'), "N/A")
+            sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), "Desconocido")
+            
+            # Extraer cuerpo (reutilizando tu parser existente)
+            body = parse_email_body(msg['payload'])
+            if not body: body = msg.get('snippet', '')
+            
+            full_thread_text += f"\n--- MENSAJE DEL {date} ---\nDE: {sender}\nCONTENIDO:\n{body[:2000]}\n"
+            
+        return full_thread_text
+    except Exception as e:
+        return None
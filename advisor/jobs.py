@@ -0,0 +1,175 @@
+"""
+Ejecutor de tareas en segundo plano.
+
+Las operaciones largas (descarga de Gmail, llamadas a OpenAI, PDF) se ejecutan
+en un pool de hilos compartido por todo el proceso. La sesión de Streamlit solo
+guarda el ID de la tarea en ``st.session_state``; así un rerun del script (por
+tocar cualquier widget) no descarta el trabajo en curso, solo vuelve a
+consultar su estado.
+"""
+import contextvars
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from advisor import telemetry
+
+# Estados posibles de una tarea
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_ERROR = "error"
+JOB_CANCELLED = "cancelled"
+
+FINISHED_STATES = (JOB_DONE, JOB_ERROR, JOB_CANCELLED)
+
+
+class JobCancelled(BaseException):
+    """
+    Se lanza dentro de una tarea cuando el usuario la cancela.
+
+    Hereda de BaseException (como asyncio.CancelledError) para que los
+    ``except Exception`` del motor de Gmail no la conviertan en un error.
+    """
+
+
+class Job:
+    """Estado observable de una tarea en segundo plano."""
+
+    def __init__(self, kind, label="", owner=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.label = label
+        self.owner = owner
+        self.status = JOB_PENDING
+        self.progress = 0.0
+        self.message = "En cola..."
+        self.result = None
+        self.error = None
+        self.error_details = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+        self._cancel_event = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    @property
+    def elapsed(self):
+        """Segundos transcurridos desde que empezó (o hasta que terminó)."""
+        if not self.started_at:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def cancel(self):
+        """Solicita la cancelación. La tarea se detiene en su siguiente punto de control."""
+        self._cancel_event.set()
+        # Si aún no había empezado, el pool la descarta y no llegará a ejecutarse
+        if self.future is not None and self.future.cancel():
+            self.status = JOB_CANCELLED
+            self.finished_at = time.time()
+
+    def check_cancelled(self):
+        """Punto de control: lanza JobCancelled si se pidió cancelar."""
+        if self.cancelled:
+            raise JobCancelled()
+
+    def update(self, progress=None, message=None):
+        """
+        Actualiza el progreso visible de la tarea.
+
+        Args:
+            progress: Fracción completada entre 0 y 1
+            message: Texto corto para la UI
+        """
+        self.check_cancelled()
+        with self._lock:
+            if progress is not None:
+                self.progress = max(0.0, min(1.0, float(progress)))
+            if message is not None:
+                self.message = message
+
+
+class JobManager:
+    """
+    Pool de hilos con registro de tareas por ID.
+
+    Una única instancia vive en el proceso (vía ``st.cache_resource``) y la
+    comparten todas las sesiones; cada sesión solo conoce sus propios IDs.
+    """
+
+    def __init__(self, max_workers=4, keep_seconds=3600):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="advisor-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.keep_seconds = keep_seconds
+
+    def submit(self, fn, *args, kind="task", label="", owner=None, **kwargs):
+        """
+        Encola ``fn(job, *args, **kwargs)`` y devuelve la tarea creada.
+
+        La función recibe la propia tarea como primer argumento para informar
+        del progreso con ``job.update()`` y comprobar cancelaciones. Se ejecuta
+        en una copia del contexto actual (contextvars), así las trazas y demás
+        variables de contexto acompañan a la tarea hasta el hilo del pool.
+        """
+        job = Job(kind, label=label, owner=owner)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        context = contextvars.copy_context()
+        job.future = self._executor.submit(context.run, self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        if job.cancelled:
+            job.status = JOB_CANCELLED
+            job.finished_at = time.time()
+            return
+        job.status = JOB_RUNNING
+        job.started_at = time.time()
+        try:
+            with telemetry.span(f"job.{job.kind}", job_id=job.id):
+                job.result = fn(job, *args, **kwargs)
+            job.progress = 1.0
+            job.status = JOB_DONE
+        except JobCancelled:
+            job.status = JOB_CANCELLED
+            job.message = "Cancelado"
+        except Exception as e:
+            job.status = JOB_ERROR
+            job.error = str(e)
+            job.error_details = traceback.format_exc()
+        finally:
+            job.finished_at = time.time()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job and not job.finished:
+            job.cancel()
+        return job
+
+    def active_jobs(self):
+        with self._lock:
+            return [j for j in self._jobs.values() if not j.finished]
+
+    def _prune(self):
+        """Olvida tareas terminadas hace más de ``keep_seconds`` (con el lock tomado)."""
+        limit = time.time() - self.keep_seconds
+        stale = [jid for jid, j in self._jobs.items() if j.finished and (j.finished_at or 0) < limit]
+        for jid in stale:
+            del self._jobs[jid]
@@ -0,0 +1,247 @@
+"""
+Libro de consumo de la IA (tokens, coste y latencia de cada llamada).
+
+Cada consulta al motor de IA (análisis, inteligencia de hilos, brief) deja
+una fila en SQLite con la funcionalidad, el cliente, el usuario, el modelo,
+los tokens de ``response.usage``, la latencia y si se sirvió desde caché o si
+el texto se truncó por el límite de 80k caracteres.
+
+El cliente y el usuario se atribuyen con un ContextVar: la app abre
+``attribution(client=..., user=...)`` al lanzar una tarea y JobManager copia
+el contexto al hilo del pool, así el motor no necesita recibirlos.
+"""
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+LEDGER_DB = "llm_ledger.sqlite3"
+
+# Tarifa pública en USD por millón de tokens (entrada, salida). Actualizar si cambia.
+PRICES_PER_MILLION = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+}
+
+_attribution = contextvars.ContextVar("advisor_ledger_attribution", default={})
+_active_call = contextvars.ContextVar("advisor_ledger_call", default=None)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_calls (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    day TEXT NOT NULL,
+    feature TEXT NOT NULL,
+    client TEXT,
+    user TEXT,
+    model TEXT,
+    prompt_tokens INTEGER DEFAULT 0,
+    completion_tokens INTEGER DEFAULT 0,
+    cost_usd REAL DEFAULT 0,
+    latency_ms REAL DEFAULT 0,
+    cache_hit INTEGER DEFAULT 0,
+    truncated INTEGER DEFAULT 0,
+    error INTEGER DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_llm_calls_day ON llm_calls(day);
+CREATE INDEX IF NOT EXISTS idx_llm_calls_client ON llm_calls(client);
+"""
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    """Coste estimado en USD (0 si el modelo no está en la tarifa)."""
+    price = PRICES_PER_MILLION.get(model)
+    if price is None:
+        # gpt-4o-2024-08-06 y similares: usar la tarifa del modelo base
+        price = next((p for name, p in PRICES_PER_MILLION.items() if model and model.startswith(name + "-")), (0.0, 0.0))
+    return (prompt_tokens * price[0] + completion_tokens * price[1]) / 1_000_000
+
+
+@contextmanager
+def attribution(client=None, user=None):
+    """Atribuye las llamadas del bloque a un cliente y/o usuario (se combina con la actual)."""
+    current = dict(_attribution.get())
+    if client:
+        current['client'] = client.strip().lower()
+    if user:
+        current['user'] = user.strip().lower()
+    token = _attribution.set(current)
+    try:
+        yield current
+    finally:
+        _attribution.reset(token)
+
+
+def current_attribution():
+    return dict(_attribution.get())
+
+
+class LLMCall:
+    """Fila en construcción mientras dura una llamada."""
+
+    def __init__(self, feature, model, cache_hit=False):
+        self.feature = feature
+        self.model = model
+        self.cache_hit = cache_hit
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.truncated = False
+        self.error = False
+        self.started = time.perf_counter()
+
+    def add_usage(self, usage, model=None):
+        self.prompt_tokens += getattr(usage, "prompt_tokens", 0) or 0
+        self.completion_tokens += getattr(usage, "completion_tokens", 0) or 0
+        if model:
+            self.model = model
+
+
+def note_usage(response):
+    """Suma el ``response.usage`` de OpenAI a la llamada en curso (si la hay)."""
+    call = _active_call.get()
+    usage = getattr(response, "usage", None)
+    if call is not None and usage is not None:
+        call.add_usage(usage, getattr(response, "model", None))
+
+
+def note_truncated():
+    """Marca la llamada en curso como truncada por el límite de caracteres."""
+    call = _active_call.get()
+    if call is not None:
+        call.truncated = True
+
+
+class Ledger:
+    """Libro persistente en SQLite, seguro entre hilos y procesos (WAL)."""
+
+    def __init__(self, path=LEDGER_DB):
+        self.path = path
+        self._init_lock = threading.Lock()
+        self._ready = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        if not self._ready:
+            with self._init_lock:
+                if not self._ready:
+                    directory = os.path.dirname(self.path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.executescript(SCHEMA)
+                    self._ready = True
+        return conn
+
+    @contextmanager
+    def track(self, feature, model, cache_hit=False):
+        """
+        Registra una llamada: ``with ledger.track("analysis", model) as call:``
+
+        Las funciones de advisor.ai informan de tokens y truncado con
+        note_usage()/note_truncated() mientras el bloque está activo.
+        """
+        call = LLMCall(feature, model, cache_hit=cache_hit)
+        token = _active_call.set(call)
+        try:
+            yield call
+        except Exception:
+            call.error = True
+            raise
+        finally:
+            _active_call.reset(token)
+            self.record(call)
+
+    def record(self, call):
+        """Escribe la fila. Un fallo del libro nunca interrumpe el análisis."""
+        who = _attribution.get()
+        now = time.time()
+        row = (
+            now,
+            datetime.fromtimestamp(now).strftime('%Y-%m-%d'),
+            call.feature,
+            who.get('client'),
+            who.get('user'),
+            call.model,
+            call.prompt_tokens,
+            call.completion_tokens,
+            estimate_cost(call.model, call.prompt_tokens, call.completion_tokens),
+            (time.perf_counter() - call.started) * 1000,
+            int(call.cache_hit),
+            int(call.truncated),
+            int(call.error),
+        )
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute(
+                        "INSERT INTO llm_calls (ts, day, feature, client, user, model, prompt_tokens, "
+                        "completion_tokens, cost_usd, latency_ms, cache_hit, truncated, error) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        row
+                    )
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            pass
+
+    # --- CONSULTAS ---
+    def _query(self, sql, params=()):
+        try:
+            conn = self._connect()
+            try:
+                return [dict(r) for r in conn.execute(sql, params).fetchall()]
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return []
+
+    @staticmethod
+    def _since(days):
+        return (datetime.now() - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+
+    def daily_totals(self, days=14):
+        """Totales por día: llamadas, tokens, coste, % de aciertos de caché y truncados."""
+        return self._query(
+            """
+            SELECT day,
+                   COUNT(*) AS calls,
+                   SUM(prompt_tokens + completion_tokens) AS tokens,
+                   ROUND(SUM(cost_usd), 4) AS cost_usd,
+                   ROUND(100.0 * SUM(cache_hit) / COUNT(*), 1) AS cache_hit_pct,
+                   SUM(truncated) AS truncated,
+                   ROUND(AVG(CASE WHEN cache_hit = 0 THEN latency_ms END), 0) AS avg_latency_ms
+            FROM llm_calls WHERE day >= ?
+            GROUP BY day ORDER BY day DESC
+            """,
+            (self._since(days),)
+        )
+
+    def top_consumers(self, by="client", days=30, limit=5):
+        """
+        Mayores consumidores por cliente, usuario o funcionalidad.
+
+        Args:
+            by: 'client', 'user' o 'feature'
+        """
+        if by not in ("client", "user", "feature"):
+            raise ValueError(f"Agrupación no válida: {by}")
+        return self._query(
+            f"""
+            SELECT COALESCE({by}, '(sin atribuir)') AS name,
+                   COUNT(*) AS calls,
+                   SUM(prompt_tokens + completion_tokens) AS tokens,
+                   ROUND(SUM(cost_usd), 4) AS cost_usd,
+                   SUM(truncated) AS truncated,
+                   ROUND(AVG(CASE WHEN cache_hit = 0 THEN latency_ms END), 0) AS avg_latency_ms
+            FROM llm_calls WHERE day >= ?
+            GROUP BY name ORDER BY cost_usd DESC, tokens DESC LIMIT ?
+            """,
+            (self._since(days), limit)
+        )
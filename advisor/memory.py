@@ -0,0 +1,254 @@
+"""
+Presupuesto de memoria de las sesiones.
+
+Cada sesión de Streamlit guarda sus objetos pesados (evidencia del análisis,
+inteligencia de hilos) en un SessionMemory en lugar de directamente en
+st.session_state. Un MemoryBudget compartido por el proceso mide lo que
+ocupa cada sesión y, al pasar de los límites, vuelca a disco lo usado hace
+más tiempo:
+
+- Límite por sesión: se vuelcan las entradas menos usadas de esa sesión.
+- Límite del proceso: se vuelcan las entradas menos usadas de cualquier
+  sesión (normalmente, las de RMs que dejaron la pestaña abierta).
+
+Los objetos con spill(path) (EvidenceFrame) se vuelcan a sí mismos y se
+recargan solos; el resto se serializa con pickle y se lee al pedirlo.
+Nada se pierde: volcar solo cambia memoria por una lectura de disco. Los
+índices que se derivan de la evidencia pueden guardarse como descartables
+(droppable): en vez de escribirse a disco se olvidan, y quien los pide los
+reconstruye.
+"""
+import hashlib
+import os
+import pickle
+import shutil
+import sys
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+
+DEFAULT_SESSION_LIMIT_MB = 150
+DEFAULT_PROCESS_LIMIT_MB = 1024
+SPILL_DIR = ".advisor_spill"
+
+MB = 1024 * 1024
+
+
+def deep_size(obj, _seen=None):
+    """Tamaño aproximado en bytes de ``obj`` y lo que contiene."""
+    seen = _seen if _seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    if hasattr(obj, 'memory_bytes'):
+        return obj.memory_bytes()
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(item, seen) for item in obj)
+    return size
+
+
+class _Entry:
+    """Valor guardado (o su fichero en disco) y su contabilidad."""
+
+    def __init__(self, value, size, droppable=False):
+        self.value = value
+        self.size = size
+        self.droppable = droppable
+        self.path = None
+        self.last_used = time.monotonic()
+
+    @property
+    def self_spilling(self):
+        return hasattr(self.value, 'spill')
+
+    @property
+    def resident(self):
+        if self.self_spilling:
+            return not self.value.spilled
+        return self.path is None
+
+
+class SessionMemory:
+    """Objetos pesados de una sesión, con orden LRU y volcado a disco."""
+
+    def __init__(self, budget, session_id):
+        self.budget = budget
+        self.session_id = session_id
+        self.entries = OrderedDict()
+        self.spills = 0
+        self.lock = threading.RLock()
+
+    @property
+    def spill_dir(self):
+        return os.path.join(self.budget.spill_dir, self.session_id)
+
+    def _spill_path(self, key, suffix):
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.spill_dir, f"{digest}.{suffix}")
+
+    # --- ACCESO ---
+    def put(self, key, value, droppable=False):
+        """
+        Guarda ``value`` como el más recientemente usado y aplica los límites.
+
+        Args:
+            droppable: Al pasar del límite se descarta en lugar de volcarse
+                       (get devuelve el default y quien lo pide lo reconstruye)
+        """
+        with self.lock:
+            self.pop(key)
+            self.entries[key] = _Entry(value, deep_size(value), droppable=droppable)
+        self.budget.enforce(self)
+
+    def get(self, key, default=None):
+        """Valor de ``key`` (lo lee de disco si se volcó)."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            self.entries.move_to_end(key)
+            entry.last_used = time.monotonic()
+            if entry.path is not None:
+                with open(entry.path, "rb") as f:
+                    entry.value = pickle.load(f)
+                os.remove(entry.path)
+                entry.path = None
+            value = entry.value
+        if entry.self_spilling or entry.size == 0:
+            entry.size = deep_size(value)
+        self.budget.enforce(self)
+        return value
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def pop(self, key, default=None):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+        if entry is None:
+            return default
+        if entry.path is not None and os.path.exists(entry.path):
+            os.remove(entry.path)
+        return entry.value
+
+    # --- CONTABILIDAD ---
+    def resident_bytes(self):
+        """Bytes en memoria (las entradas que se vuelcan solas se miden de nuevo)."""
+        total = 0
+        for entry in list(self.entries.values()):
+            if entry.self_spilling:
+                entry.size = entry.value.memory_bytes()
+            if entry.resident:
+                total += entry.size
+        return total
+
+    def spill_candidates(self):
+        """(último uso, clave) de las entradas residentes, de la menos a la más usada."""
+        resident = [(e.last_used, k) for k, e in self.entries.items() if e.resident]
+        return resident[:-1]  # Lo último que tocó el usuario se queda en memoria
+
+    def spill_lru(self):
+        """
+        Vuelca la entrada residente menos usada de la sesión.
+
+        Returns:
+            int: bytes liberados (0 si no queda nada que volcar)
+        """
+        candidates = self.spill_candidates()
+        return self.spill(candidates[0][1]) if candidates else 0
+
+    def spill(self, key):
+        """Vuelca ``key`` a disco (o la descarta si es droppable). Returns: bytes liberados"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or not entry.resident:
+                return 0
+            freed = entry.size
+            if entry.droppable:
+                del self.entries[key]
+                self.spills += 1
+                return freed
+            os.makedirs(self.spill_dir, exist_ok=True)
+            if entry.self_spilling:
+                entry.value.spill(self._spill_path(key, "frame"))
+            else:
+                path = self._spill_path(key, "pkl")
+                with open(path, "wb") as f:
+                    pickle.dump(entry.value, f, protocol=pickle.HIGHEST_PROTOCOL)
+                entry.path = path
+                entry.value = None
+            self.spills += 1
+            return freed
+
+    def usage(self):
+        """Resumen para el panel de la barra lateral."""
+        resident = self.resident_bytes()
+        return {
+            'session_id': self.session_id,
+            'entries': len(self.entries),
+            'resident_bytes': resident,
+            'spilled_entries': sum(1 for e in self.entries.values() if not e.resident),
+            'spills': self.spills,
+        }
+
+
+class MemoryBudget:
+    """Contabilidad de memoria de todas las sesiones del proceso."""
+
+    def __init__(self, session_limit_mb=DEFAULT_SESSION_LIMIT_MB, process_limit_mb=DEFAULT_PROCESS_LIMIT_MB,
+                 spill_dir=SPILL_DIR):
+        self.session_limit = int(float(session_limit_mb) * MB)
+        self.process_limit = int(float(process_limit_mb) * MB)
+        self.spill_dir = spill_dir
+        self.sessions = weakref.WeakValueDictionary()
+        self.lock = threading.Lock()
+
+    def new_session(self):
+        """
+        SessionMemory de una sesión nueva. Cuando la sesión desaparece (y con
+        ella su st.session_state) se borran también sus ficheros volcados.
+        """
+        memory = SessionMemory(self, uuid.uuid4().hex)
+        with self.lock:
+            self.sessions[memory.session_id] = memory
+        weakref.finalize(memory, shutil.rmtree, memory.spill_dir, True)
+        return memory
+
+    def process_bytes(self):
+        return sum(memory.resident_bytes() for memory in list(self.sessions.values()))
+
+    def enforce(self, memory=None):
+        """Aplica el límite de ``memory`` y el del proceso, volcando por orden LRU."""
+        if memory is not None:
+            while memory.resident_bytes() > self.session_limit and memory.spill_lru():
+                pass
+
+        with self.lock:
+            while self.process_bytes() > self.process_limit:
+                candidates = [
+                    (last_used, key, session)
+                    for session in list(self.sessions.values())
+                    for last_used, key in session.spill_candidates()
+                ]
+                if not candidates:
+                    break
+                _, key, session = min(candidates, key=lambda c: c[0])
+                if not session.spill(key):
+                    break
+
+    def usage(self):
+        """Uso del proceso: total, límites y número de sesiones vivas."""
+        sessions = [memory.usage() for memory in list(self.sessions.values())]
+        return {
+            'process_bytes': sum(s['resident_bytes'] for s in sessions),
+            'process_limit': self.process_limit,
+            'session_limit': self.session_limit,
+            'sessions': len(sessions),
+            'spilled_entries': sum(s['spilled_entries'] for s in sessions),
+        }
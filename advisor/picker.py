@@ -0,0 +1,189 @@
+"""
+Índice de la Cartera de Clientes para el selector del sidebar.
+
+Con miles de clientes no se puede mandar la lista entera al navegador en cada
+rerun: el sidebar pide al índice solo la página de coincidencias que va a
+pintar. El índice vive en el servidor y se reconstruye solo cuando cambia el
+registro (altas, alias o un análisis nuevo).
+
+Cada cliente se encuentra por:
+
+- Prefijo de su email, de las palabras de la parte local ("ana.perez@..." ->
+  "ana", "perez"), del dominio o de sus alias (vocabulario ordenado + bisect,
+  como advisor.search). Varias palabras se combinan con AND.
+- Aproximación por trigramas de caracteres si el prefijo no encuentra
+  bastantes (erratas: "gonzales" encuentra "gonzalez").
+
+Entre los que coinciden, primero los urgentes y los usados hace poco.
+"""
+import bisect
+import math
+import re
+import threading
+import time
+
+from advisor.search import fold, tokenize
+
+PAGE_SIZE = 8
+FUZZY_MIN_SIMILARITY = 0.5   # Fracción de trigramas de la consulta que debe tener el cliente
+RECENCY_HALF_LIFE_DAYS = 14
+URGENCY_BOOST = {'Alta': 0.6, 'Media': 0.2}
+
+_SPLIT_RE = re.compile(r"[@._+\-]+")
+
+
+def trigrams(text):
+    padded = f"#{text}#"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ClientMatch:
+    """Cliente encontrado, con lo necesario para pintar su opción."""
+
+    __slots__ = ('email', 'aliases', 'urgency', 'last_used_at', 'score')
+
+    def __init__(self, client, score):
+        self.email = client['email']
+        self.aliases = client['aliases']
+        self.urgency = client.get('urgency')
+        self.last_used_at = client.get('last_used_at')
+        self.score = score
+
+    def label(self):
+        icon = "🔴 " if self.urgency == 'Alta' else ""
+        alias = f" · {self.aliases[0]}" if self.aliases else ""
+        return f"{icon}{self.email}{alias}"
+
+
+class ClientIndex:
+    """Índice de prefijos y trigramas sobre emails y alias de la cartera."""
+
+    def __init__(self, clients, now=None):
+        """
+        Args:
+            clients: Fichas del registro (dicts con 'email', 'aliases', 'urgency', 'last_used_at')
+            now: Referencia para la antigüedad (por defecto, ahora)
+        """
+        self.clients = clients
+        now = now or time.time()
+
+        keys = []
+        self.trigrams = {}
+        self.priority = []
+        self.exact = {}
+        for idx, client in enumerate(clients):
+            names = [client['email']] + list(client['aliases'])
+            words = set()
+            for name in names:
+                folded = fold(name)
+                self.exact.setdefault(folded, idx)
+                words.add(folded)
+                words.update(w for w in _SPLIT_RE.split(folded) if w)
+                words.update(tokenize(folded))
+            keys.extend((word, idx) for word in words)
+
+            # Trigramas de las palabras de la parte local y de los alias (el dominio no distingue)
+            local = fold(client['email']).split('@')[0]
+            fuzzy_words = {local, *_SPLIT_RE.split(local)}
+            for alias in client['aliases']:
+                fuzzy_words.update(tokenize(alias))
+            for gram in set().union(*(trigrams(w) for w in fuzzy_words if w)):
+                self.trigrams.setdefault(gram, []).append(idx)
+
+            self.priority.append(self._priority(client, now))
+
+        keys.sort()
+        self.keys = [k for k, _ in keys]
+        self.key_clients = [i for _, i in keys]
+
+    @staticmethod
+    def _priority(client, now):
+        """Urgencia del último análisis + uso reciente (decae a la mitad cada 14 días)."""
+        score = URGENCY_BOOST.get(client.get('urgency'), 0.0)
+        last_used = client.get('last_used_at')
+        if last_used:
+            age_days = max(0.0, (now - last_used) / 86400)
+            score += 0.5 * math.pow(0.5, age_days / RECENCY_HALF_LIFE_DAYS)
+        return score
+
+    def __len__(self):
+        return len(self.clients)
+
+    # --- BÚSQUEDA ---
+    def _prefix(self, word):
+        """Clientes con alguna palabra que empieza por ``word``."""
+        start = bisect.bisect_left(self.keys, word)
+        end = bisect.bisect_left(self.keys, word + "\uffff")
+        return set(self.key_clients[start:end])
+
+    def _fuzzy(self, text):
+        """{cliente: similitud} por trigramas (solo los que pasan FUZZY_MIN_SIMILARITY)."""
+        grams = trigrams(text)
+        counts = {}
+        for gram in grams:
+            for idx in self.trigrams.get(gram, ()):
+                counts[idx] = counts.get(idx, 0) + 1
+        return {
+            idx: count / len(grams)
+            for idx, count in counts.items()
+            if count / len(grams) >= FUZZY_MIN_SIMILARITY
+        }
+
+    def scores(self, query):
+        """{cliente: puntuación} de los que coinciden con ``query`` (todos si está vacía)."""
+        folded = fold(query or "").strip()
+        if not folded:
+            return dict(enumerate(self.priority))
+
+        words = [w for w in _SPLIT_RE.split(folded.replace(" ", ".")) if w]
+        matched = None
+        for word in sorted(words, key=len, reverse=True):
+            hits = self._prefix(word)
+            matched = hits if matched is None else matched & hits
+            if not matched:
+                break
+        scores = {idx: 2.0 + self.priority[idx] for idx in matched or ()}
+
+        exact = self.exact.get(folded)
+        if exact is not None:
+            scores[exact] = 3.0 + self.priority[exact]
+
+        if len(scores) < PAGE_SIZE:
+            for idx, similarity in self._fuzzy(folded.replace(" ", "")).items():
+                if idx not in scores:
+                    scores[idx] = similarity + self.priority[idx]
+        return scores
+
+    def search(self, query, page=0, page_size=PAGE_SIZE):
+        """
+        Una página de coincidencias, de la mejor a la peor.
+
+        Returns:
+            tuple: (lista de ClientMatch, total de coincidencias)
+        """
+        scores = self.scores(query)
+        start = page * page_size
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], self.clients[item[0]]['email']))
+        page_items = ranked[start:start + page_size]
+        return [ClientMatch(self.clients[idx], score) for idx, score in page_items], len(ranked)
+
+
+class ClientPicker:
+    """ClientIndex del registro, reconstruido solo cuando el registro cambia."""
+
+    def __init__(self, registry):
+        self.registry = registry
+        self._index = None
+        self._stamp = None
+        self._lock = threading.Lock()
+
+    def index(self):
+        stamp = self.registry.stamp()
+        with self._lock:
+            if self._index is None or stamp != self._stamp:
+                self._index = ClientIndex(self.registry.clients(with_aliases=True))
+                self._stamp = stamp
+            return self._index
+
+    def search(self, query, page=0, page_size=PAGE_SIZE):
+        return self.index().search(query, page=page, page_size=page_size)
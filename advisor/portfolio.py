@@ -0,0 +1,279 @@
+"""
+Matriz de sentimiento de toda la cartera, en arrays de NumPy mapeados en disco.
+
+Para saber qué clientes han empeorado este mes había que abrir y volver a
+analizar cada uno. Ahora cada análisis deja, en la fila del cliente (asignada
+por el registro, ClientRegistry.portfolio_row), la suma de scores, los emails
+puntuados y el volumen de cada día. El mapa de calor y el ranking de la
+cartera abren las matrices con np.load(mmap_mode='r'): abrirlas no lee nada y
+solo se tocan las columnas de la ventana pedida, sea cual sea la cartera.
+
+- Días en anillo: hay PORTFOLIO_DAYS columnas; la de un día es
+  día % PORTFOLIO_DAYS y days.npy guarda qué día contiene cada una, así que un
+  día nuevo reutiliza la columna del más antiguo sin mover datos.
+- Cada análisis sustituye los días que cubre su evidencia (del email más
+  antiguo al más reciente): volver a analizar no cuenta dos veces los emails.
+- Las filas crecen duplicando la capacidad. Las escrituras se serializan con
+  un bloqueo de fichero entre procesos (la app y el precálculo nocturno).
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:   # Windows: solo se serializan los hilos del proceso
+    fcntl = None
+
+from advisor.analytics import DAY_S, client_series
+
+PORTFOLIO_DIR = "portfolio_matrix"
+PORTFOLIO_DAYS = 731     # Dos años de días en el anillo
+INITIAL_ROWS = 256
+
+# Matrices (filas × días) y su tipo: suma de scores, emails puntuados, emails
+ARRAYS = {'sentiment': np.float32, 'scored': np.uint16, 'volume': np.uint16}
+_UINT16_MAX = np.iinfo(np.uint16).max
+
+
+def today():
+    """Día actual en días desde epoch (la misma escala que advisor.analytics)."""
+    return int(time.time() // DAY_S)
+
+
+def daily_totals(columns):
+    """
+    Totales por día de la evidencia de un cliente.
+
+    Args:
+        columns: EvidenceColumns (advisor.query)
+
+    Returns:
+        tuple: (días, suma de scores, emails puntuados, emails) como arrays,
+        solo de los días con algún email
+    """
+    t, x, _ = client_series(columns)
+    if not len(t):
+        empty = np.zeros(0)
+        return empty.astype(np.int64), empty, empty, empty
+    days, inverse = np.unique(np.floor(t).astype(np.int64), return_inverse=True)
+    valid = ~np.isnan(x)
+    sums = np.bincount(inverse, weights=np.where(valid, x, 0.0), minlength=len(days))
+    scored = np.bincount(inverse, weights=valid, minlength=len(days))
+    volume = np.bincount(inverse, minlength=len(days)).astype(np.float64)
+    return days, sums, scored, volume
+
+
+class PortfolioMatrix:
+    """Sentimiento y volumen diario por cliente, en .npy mapeados en memoria."""
+
+    def __init__(self, path=PORTFOLIO_DIR, registry=None, days=PORTFOLIO_DAYS):
+        """
+        Args:
+            path: Directorio de las matrices
+            registry: ClientRegistry que asigna la fila de cada cliente
+            days: Días del anillo (solo se usa al crear las matrices)
+        """
+        self.path = path
+        self.registry = registry
+        self.days = days
+        self._lock = threading.Lock()
+
+    def _file(self, name):
+        return os.path.join(self.path, f"{name}.npy")
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            with open(os.path.join(self.path, "write.lock"), "a") as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _open(self, mode='r'):
+        """{nombre: array mapeado} con 'days'; None si la matriz no existe todavía."""
+        if not os.path.exists(self._file('days')):
+            return None
+        arrays = {name: np.load(self._file(name), mmap_mode=mode) for name in ARRAYS}
+        arrays['days'] = np.load(self._file('days'), mmap_mode=mode)
+        return arrays
+
+    def _ensure(self, rows):
+        """Abre las matrices para escribir con al menos ``rows`` filas (se llama con el bloqueo)."""
+        arrays = self._open('r+')
+        if arrays is None:
+            capacity = INITIAL_ROWS
+            while capacity < rows:
+                capacity *= 2
+            for name, dtype in ARRAYS.items():
+                np.lib.format.open_memmap(self._file(name), mode='w+', dtype=dtype,
+                                          shape=(capacity, self.days)).flush()
+            days = np.lib.format.open_memmap(self._file('days') + ".tmp", mode='w+', dtype=np.int64,
+                                             shape=(self.days,))
+            days[:] = -1
+            days.flush()
+            del days
+            os.replace(self._file('days') + ".tmp", self._file('days'))   # days.npy marca la matriz como lista
+            return self._open('r+')
+
+        capacity = arrays['sentiment'].shape[0]
+        if capacity >= rows:
+            return arrays
+        while capacity < rows:
+            capacity *= 2
+        # Copia a ficheros más grandes y sustitución atómica; quien lea a la vez ve el fichero anterior
+        for name, dtype in ARRAYS.items():
+            old = arrays.pop(name)
+            tmp = self._file(name) + ".tmp"
+            grown = np.lib.format.open_memmap(tmp, mode='w+', dtype=dtype, shape=(capacity, old.shape[1]))
+            grown[:old.shape[0]] = old
+            grown.flush()
+            del grown, old
+            os.replace(tmp, self._file(name))
+        return self._open('r+')
+
+    # --- ESCRITURA ---
+    def record(self, client, columns, row=None):
+        """
+        Guarda los totales diarios de un análisis en la fila del cliente.
+
+        Los días entre el email más antiguo y el más reciente de la evidencia
+        se sustituyen (los que no tienen emails quedan a cero).
+
+        Args:
+            client: Email del cliente (o un alias)
+            columns: EvidenceColumns del análisis
+            row: Fila de la matriz (por defecto, la que asigna el registro)
+
+        Returns:
+            int: días con emails guardados
+        """
+        days, sums, scored, volume = daily_totals(columns)
+        if not len(days):
+            return 0
+        if row is None:
+            row = self.registry.portfolio_row(client)
+
+        with self._locked():
+            arrays = self._ensure(row + 1)
+            stamp = arrays['days']
+            width = len(stamp)
+
+            span = np.arange(max(days[0], days[-1] - width + 1), days[-1] + 1)
+            slots = span % width
+            current = stamp[slots]
+            # Un día ocupado por otro más reciente ya no cabe en el anillo
+            fits = current <= span
+            span, slots, current = span[fits], slots[fits], current[fits]
+            # Las columnas que pasan a un día nuevo se vacían para toda la cartera
+            fresh = current < span
+            if fresh.any():
+                for name in ARRAYS:
+                    arrays[name][:, slots[fresh]] = 0
+                stamp[slots[fresh]] = span[fresh]
+
+            keep = np.isin(days, span)
+            day_slots = days[keep] % width
+            for name in ARRAYS:
+                arrays[name][row, slots] = 0
+            arrays['sentiment'][row, day_slots] = sums[keep]
+            arrays['scored'][row, day_slots] = np.minimum(scored[keep], _UINT16_MAX)
+            arrays['volume'][row, day_slots] = np.minimum(volume[keep], _UINT16_MAX)
+            for array in arrays.values():
+                array.flush()
+        return int(keep.sum())
+
+    # --- LECTURA ---
+    def window(self, rows, length, end=None):
+        """
+        Totales diarios de unas filas en una ventana de días.
+
+        Args:
+            rows: Filas de la matriz (array de enteros)
+            length: Días de la ventana
+            end: Último día (días desde epoch; por defecto, hoy)
+
+        Returns:
+            tuple: (días de la ventana, {nombre: matriz len(rows) × length})
+        """
+        end = today() if end is None else int(end)
+        span = np.arange(end - length + 1, end + 1)
+        rows = np.asarray(rows, dtype=np.int64)
+        arrays = self._open('r')
+        out = {name: np.zeros((len(rows), length)) for name in ARRAYS}
+        if arrays is None or not len(rows):
+            return span, out
+
+        width = len(arrays['days'])
+        slots = span % width
+        present = np.asarray(arrays['days'][slots]) == span
+        # Filas que aún no existen (o un fichero a medio crecer): se quedan a cero
+        stored = min(arrays[name].shape[0] for name in ARRAYS)
+        inside = rows < stored
+        cols = slots[present]
+        for name in ARRAYS:
+            out[name][np.ix_(inside, present)] = arrays[name][rows[inside][:, None], cols[None, :]]
+        return span, out
+
+    def report(self, clients, weeks=12, recent_days=30, baseline_days=90, end=None):
+        """
+        Mapa de calor semanal y variación reciente de toda la cartera.
+
+        Args:
+            clients: {email: fila} (ClientRegistry.portfolio_rows)
+            weeks: Semanas del mapa de calor
+            recent_days: Días del periodo reciente ("este mes")
+            baseline_days: Días anteriores con los que se compara
+            end: Último día (por defecto, hoy)
+
+        Returns:
+            dict: {'clients', 'week_starts' (días desde epoch), 'heat'
+                   (clientes × semanas, NaN sin datos), 'weekly_volume',
+                   'recent', 'baseline', 'change', 'recent_volume'}
+        """
+        emails = list(clients)
+        rows = np.array([clients[e] for e in emails], dtype=np.int64)
+        length = max(weeks * 7, recent_days + baseline_days)
+        span, totals = self.window(rows, length, end=end)
+
+        def mean(sums, scored):
+            with np.errstate(invalid='ignore', divide='ignore'):
+                return np.where(scored > 0, sums / scored, np.nan)
+
+        n = len(emails)
+        tail = slice(length - weeks * 7, length)
+        by_week = {name: totals[name][:, tail].reshape(n, weeks, 7).sum(axis=2) for name in ARRAYS}
+        recent = slice(length - recent_days, length)
+        baseline = slice(length - recent_days - baseline_days, length - recent_days)
+        recent_mean = mean(totals['sentiment'][:, recent].sum(axis=1), totals['scored'][:, recent].sum(axis=1))
+        baseline_mean = mean(totals['sentiment'][:, baseline].sum(axis=1), totals['scored'][:, baseline].sum(axis=1))
+        return {
+            'clients': emails,
+            'week_starts': span[tail][::7],
+            'heat': mean(by_week['sentiment'], by_week['scored']),
+            'weekly_volume': by_week['volume'],
+            'recent': recent_mean,
+            'baseline': baseline_mean,
+            'change': recent_mean - baseline_mean,
+            'recent_volume': totals['volume'][:, recent].sum(axis=1),
+        }
+
+
+def deteriorated(report, limit=20, min_drop=0.0):
+    """
+    Clientes cuyo sentimiento reciente más ha caído respecto al periodo anterior.
+
+    Returns:
+        list: posiciones en report['clients'], de la mayor caída a la menor
+    """
+    change = report['change']
+    candidates = np.flatnonzero(np.isfinite(change) & (change <= -min_drop))
+    return candidates[np.argsort(change[candidates], kind='stable')[:limit]].tolist()
@@ -0,0 +1,76 @@
+"""
+Precarga especulativa de emails.
+
+Cuando el RM selecciona un cliente de la cartera se lanza en segundo plano la
+misma descarga que haría "Analizar" (y opcionalmente el análisis IA para dejar
+la caché caliente). Cada sesión tiene un presupuesto máximo de precargas y
+solo mantiene una viva: cambiar de cliente cancela la anterior.
+"""
+
+DEFAULT_BUDGET = 10  # Precargas máximas por sesión
+
+
+def make_fetch_key(target_email, mode, email_count=None, fecha_desde=None, fecha_hasta=None, addresses=None):
+    """Clave que identifica una descarga concreta de Gmail (cliente, sus direcciones + parámetros)."""
+    return (
+        (target_email or "").strip().lower(),
+        mode,
+        email_count,
+        str(fecha_desde) if fecha_desde else None,
+        str(fecha_hasta) if fecha_hasta else None,
+        tuple(sorted(a.strip().lower() for a in addresses or ())),
+    )
+
+
+class PrefetchSession:
+    """Precarga activa y presupuesto consumido por una sesión de Streamlit."""
+
+    def __init__(self, budget=DEFAULT_BUDGET):
+        self.budget = budget
+        self.used = 0
+        self.key = None
+        self.job_id = None
+
+    @property
+    def remaining(self):
+        return max(0, self.budget - self.used)
+
+    def request(self, manager, key, fn, *args, **kwargs):
+        """
+        Asegura que hay una precarga para ``key``.
+
+        Si ya existe la reutiliza; si había otra para un cliente distinto la
+        cancela. No lanza nada cuando el presupuesto de la sesión se agotó.
+
+        Returns:
+            Job o None
+        """
+        if key == self.key:
+            return manager.get(self.job_id)
+
+        self.cancel(manager)
+
+        if self.used >= self.budget:
+            return None
+
+        self.used += 1
+        job = manager.submit(fn, *args, kind="prefetch", label=f"Precarga {key[0]}", **kwargs)
+        self.key = key
+        self.job_id = job.id
+        return job
+
+    def job_for(self, manager, key):
+        """Devuelve la precarga de ``key`` si existe y no fue cancelada."""
+        if key != self.key or not self.job_id:
+            return None
+        job = manager.get(self.job_id)
+        if job is None or job.cancelled:
+            return None
+        return job
+
+    def cancel(self, manager):
+        """Cancela la precarga actual (si la hay)."""
+        if self.job_id:
+            manager.cancel(self.job_id)
+        self.key = None
+        self.job_id = None
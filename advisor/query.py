@@ -0,0 +1,231 @@
+"""
+Lenguaje de consulta de la barra de filtros del Explorador.
+
+Ejemplo:
+    from:cliente asunto:"fondo" after:2026-01-01 score:<-3 has:adjunto comisiones
+
+Campos:
+    from:cliente | from:banco        Origen del email (también de:)
+    asunto:"texto"                   Texto contenido en el asunto (también subject:)
+    after:AAAA-MM-DD                 Desde esa fecha, incluida (también desde:)
+    before:AAAA-MM-DD                Antes de esa fecha (también hasta:)
+    score:<-3 | score:>=5 | score:0  Umbral de sentimiento del análisis
+    has:adjunto                      Con ficheros adjuntos
+    -campo:valor                     Negación de cualquier cláusula
+    -palabra | -"frase"              Excluye los emails que contienen el texto
+
+Lo que no es un campo es texto libre y se resuelve con el índice invertido
+(advisor.search); el texto negado también, restando sus posiciones. La consulta se compila una vez en un único predicado sobre
+columnas ya tipadas (EvidenceColumns): las fechas se parsean al construir las
+columnas, no en cada rerun.
+"""
+import operator
+import re
+from datetime import datetime
+
+from advisor.memory import deep_size
+from advisor.search import fold
+
+_CLAUSE_RE = re.compile(r'(-?)(\w+):("[^"]*"|\S+)|-?"[^"]*"|\S+')
+_SCORE_RE = re.compile(r"^(<=|>=|<|>|=)?(-?\d+(?:\.\d+)?)$")
+
+_COMPARATORS = {
+    '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge, '=': operator.eq
+}
+_ORIGINS = {
+    'cliente': 'CLIENTE', 'client': 'CLIENTE',
+    'banco': 'BANCO', 'bank': 'BANCO', 'yo': 'BANCO', 'me': 'BANCO'
+}
+_FIELD_ALIASES = {
+    'from': 'from', 'de': 'from', 'origen': 'from',
+    'asunto': 'subject', 'subject': 'subject',
+    'after': 'after', 'desde': 'after',
+    'before': 'before', 'hasta': 'before',
+    'score': 'score', 'sentimiento': 'score',
+    'has': 'has', 'tiene': 'has'
+}
+_ATTACHMENT_WORDS = {'adjunto', 'adjuntos', 'attachment', 'attachments'}
+_DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%Y-%m')
+
+
+def parse_date(value):
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+class EvidenceColumns:
+    """
+    Columnas tipadas de la evidencia, construidas una vez por análisis.
+
+    El sentimiento se empareja por posición, igual que en el gráfico.
+    """
+
+    def __init__(self, evidence, analysis=None):
+        from advisor.evidence import EvidenceFrame
+
+        self.size = len(evidence)
+        if isinstance(evidence, EvidenceFrame):
+            # Ya vienen tipadas: sin construir un dict por email
+            df = evidence.df
+            self.origin = df['origin'].astype(object).tolist()
+            self.subject = [fold(s) for s in df['subject']]
+            self.attachments = df['attachments'].tolist()
+            self.date = evidence.dates()
+        else:
+            self.origin = [e.get('Origen') for e in evidence]
+            self.subject = [fold(e.get('Asunto_Completo', '')) for e in evidence]
+            self.attachments = [e.get('Adjuntos', 0) for e in evidence]
+            self.date = []
+            for e in evidence:
+                try:
+                    self.date.append(datetime.strptime(e['Fecha'], '%Y-%m-%d %H:%M'))
+                except (KeyError, ValueError):
+                    self.date.append(None)  # "Fecha desconocida": no pasa ningún filtro de fecha
+
+        sentiment = (analysis or {}).get('analisis_sentimiento') or []
+        self.score = [None] * self.size
+        for pos, item in enumerate(sentiment[:self.size]):
+            try:
+                self.score[pos] = float(item.get('sentimiento_score'))
+            except (TypeError, ValueError):
+                pass
+        self._memory_bytes = None
+
+    def memory_bytes(self):
+        """Bytes de las columnas (se mide una vez: no cambian)."""
+        if self._memory_bytes is None:
+            self._memory_bytes = deep_size((self.origin, self.subject, self.attachments, self.date, self.score))
+        return self._memory_bytes
+
+
+class CompiledQuery:
+    """Consulta compilada: predicado por posición + texto libre (y negado) para el índice."""
+
+    def __init__(self, tests, text, excluded=None):
+        self.tests = tests  # funciones pos -> bool
+        self.text = text
+        self.excluded = excluded or []  # Texto negado (-palabra), un término por elemento
+
+    @property
+    def is_empty(self):
+        return not self.tests and not self.text and not self.excluded
+
+    def filter(self, columns, index=None, positions=None, prefix_last=False, match_text=True):
+        """
+        Posiciones que cumplen la consulta, en una sola pasada.
+
+        Args:
+            columns: EvidenceColumns de la evidencia
+            index: InvertedIndex para el texto libre y el negado (None = ignorar el texto)
+            positions: Orden/subconjunto de partida (por defecto, cronológico)
+            prefix_last: El último término libre cuenta como prefijo
+            match_text: False si ``positions`` ya viene de buscar el texto libre
+                        (ranking); el índice solo resta el texto negado
+
+        Returns:
+            list: posiciones en el orden de ``positions``
+        """
+        tests = list(self.tests)
+        if index is not None:
+            excluded_hits = set()
+            for term in self.excluded:
+                excluded_hits |= index.search(term) or set()
+            if excluded_hits:
+                tests.insert(0, lambda pos: pos not in excluded_hits)
+            text_hits = index.search(self.text, prefix_last=prefix_last) if (self.text and match_text) else None
+            if text_hits is not None:
+                tests.insert(0, text_hits.__contains__)
+        if positions is None:
+            positions = range(columns.size)
+        if not tests:
+            return list(positions)
+        return [pos for pos in positions if all(test(pos) for test in tests)]
+
+
+def compile_query(query, columns):
+    """
+    Compila la consulta sobre las columnas.
+
+    Returns:
+        tuple: (CompiledQuery, mensaje_error). Las cláusulas inválidas se
+        ignoran y se explican en el mensaje.
+    """
+    tests = []
+    free_text = []
+    excluded = []
+    errors = []
+
+    for match in _CLAUSE_RE.finditer(query or ""):
+        negate, name, value = match.group(1), match.group(2), match.group(3)
+        field = _FIELD_ALIASES.get(name.lower()) if name else None
+        if not field:
+            token = match.group(0)
+            if token.startswith('-') and len(token) > 1:
+                excluded.append(token[1:].strip('"'))  # -palabra: se resta con el índice
+            else:
+                free_text.append(token.strip('"'))
+            continue
+        value = value.strip('"')
+        test, err = _compile_clause(field, value, columns)
+        if err:
+            errors.append(err)
+            continue
+        if negate:
+            test = (lambda t: lambda pos: not t(pos))(test)
+        tests.append(test)
+
+    error = None
+    if errors:
+        error = "⚠️ Filtros ignorados: " + "; ".join(errors)
+    return CompiledQuery(tests, " ".join(free_text), excluded), error
+
+
+def _compile_clause(field, value, columns):
+    """Función pos -> bool de una cláusula. Returns: (función, mensaje_error)"""
+    if field == 'from':
+        origin = _ORIGINS.get(value.lower())
+        if not origin:
+            return None, f"from:{value} (usa cliente o banco)"
+        col = columns.origin
+        return lambda pos: col[pos] == origin, None
+
+    if field == 'subject':
+        needle = fold(value)
+        col = columns.subject
+        return lambda pos: needle in col[pos], None
+
+    if field in ('after', 'before'):
+        limit = parse_date(value)
+        if not limit:
+            return None, f"{field}:{value} (fecha AAAA-MM-DD)"
+        if field == 'after':
+            return date_after(columns, limit), None
+        col = columns.date
+        return lambda pos: col[pos] is not None and col[pos] < limit, None
+
+    if field == 'score':
+        parsed = _SCORE_RE.match(value)
+        if not parsed:
+            return None, f"score:{value} (ej. score:<-3)"
+        compare = _COMPARATORS[parsed.group(1) or '=']
+        threshold = float(parsed.group(2))
+        col = columns.score
+        return lambda pos: col[pos] is not None and compare(col[pos], threshold), None
+
+    if field == 'has':
+        if value.lower() not in _ATTACHMENT_WORDS:
+            return None, f"has:{value} (solo has:adjunto)"
+        col = columns.attachments
+        return lambda pos: col[pos] > 0, None
+
+    return None, f"{field}:{value}"
+
+
+def date_after(columns, since):
+    """Función pos -> bool de los emails con fecha >= ``since``."""
+    col = columns.date
+    return lambda pos: col[pos] is not None and col[pos] >= since
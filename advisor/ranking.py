@@ -0,0 +1,287 @@
+"""
+Búsqueda por relevancia sobre el historial de un cliente (sin servicios externos).
+
+Cada email se parte en pasajes (el asunto y ventanas solapadas del cuerpo) y
+cada pasaje se puntúa con:
+
+- BM25 sobre los tokens normalizados de advisor.search (sin tildes).
+- Opcionalmente, similitud coseno entre "embeddings" por hashing de
+  trigramas de caracteres: no entiende sinónimos, pero acerca variantes
+  ("comision", "comisiones", "comisionar") y tolera erratas.
+
+La puntuación de un email es la de su mejor pasaje, que es el que se
+resalta en el Explorador. El índice se construye una vez por análisis y se
+guarda junto al resultado en el PrecomputeStore (to_dict/from_dict). No
+guarda el texto de los pasajes, solo dónde empiezan: ocupa una fracción de
+la evidencia que indexa.
+"""
+import base64
+import math
+import sys
+import zlib
+
+import numpy as np
+
+from advisor.search import highlight, tokenize
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+PASSAGE_WORDS = 60      # Palabras por pasaje
+PASSAGE_STRIDE = 40     # Solape de 20 palabras entre pasajes consecutivos
+EMBEDDING_DIMS = 256
+SEMANTIC_MIN_SIMILARITY = 0.35  # Por debajo, la similitud sola no cuenta como coincidencia
+
+# Palabras vacías habituales en las búsquedas de los RMs (ES + EN)
+STOPWORDS = frozenset(
+    "a al and about con de del donde el en es la las lo los o or para por que "
+    "se sobre the to un una y where what when".split()
+)
+
+
+def split_passages(email):
+    """
+    Asunto + ventanas de PASSAGE_WORDS palabras del cuerpo.
+
+    Returns:
+        list: (inicio, texto) por pasaje; inicio es la palabra del cuerpo
+        donde empieza (-1 para el asunto), lo que guarda el índice
+    """
+    passages = [(-1, email.get('Asunto_Completo', ''))]
+    words = (email.get('Cuerpo') or '').split()
+    for start in range(0, max(len(words) - PASSAGE_WORDS + PASSAGE_STRIDE, 1), PASSAGE_STRIDE):
+        chunk = " ".join(words[start:start + PASSAGE_WORDS])
+        if chunk:
+            passages.append((start, chunk))
+    return passages
+
+
+def passage_text(email, start):
+    """Texto de un pasaje a partir del email y su inicio (el índice no guarda textos)."""
+    if start < 0:
+        return email.get('Asunto_Completo', '')
+    return " ".join((email.get('Cuerpo') or '').split()[start:start + PASSAGE_WORDS])
+
+
+def _pack(array):
+    return base64.b64encode(np.ascontiguousarray(array).tobytes()).decode("ascii")
+
+
+def _unpack(text, dtype):
+    return np.frombuffer(base64.b64decode(text), dtype=dtype).copy()
+
+
+def query_terms(query):
+    return [t for t in tokenize(query) if t not in STOPWORDS]
+
+
+def token_slots(token, dims=EMBEDDING_DIMS):
+    """Posiciones y signos de los trigramas de caracteres de un token (crc32: estable entre procesos)."""
+    padded = f"#{token}#"
+    slots = []
+    for i in range(len(padded) - 2):
+        h = zlib.crc32(padded[i:i + 3].encode("utf-8"))
+        slots.append((h % dims, 1.0 if h & 0x80000000 else -1.0))
+    return slots
+
+
+def embed(tokens, dims=EMBEDDING_DIMS):
+    """Vector normalizado de trigramas de caracteres por hashing."""
+    vector = np.zeros(dims, dtype=np.float32)
+    for token in tokens:
+        for slot, sign in token_slots(token, dims):
+            vector[slot] += sign
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class RankingIndex:
+    """
+    BM25 por pasaje + similitud por embeddings hash sobre la evidencia de un análisis.
+
+    Los pasajes son (email, palabra de inicio) y las frecuencias van en una
+    matriz dispersa término × pasaje (CSR): el texto se recompone de la
+    evidencia solo para resaltar el pasaje que se enseña. El embedding de un
+    pasaje es la suma de los de sus tokens, así que tampoco se guarda: la
+    similitud con la consulta sale de las frecuencias y de la norma del pasaje.
+    """
+
+    def __init__(self, evidence=None):
+        self.passage_pos = np.zeros(0, dtype=np.int32)     # Email de cada pasaje
+        self.passage_start = np.zeros(0, dtype=np.int32)   # Palabra de inicio (-1 = asunto)
+        self.lengths = np.zeros(0, dtype=np.int32)         # Tokens por pasaje
+        self.norms = np.zeros(0, dtype=np.float32)         # Norma del embedding de cada pasaje
+        self.vocabulary = {}                               # token -> fila de la matriz
+        self.indptr = np.zeros(1, dtype=np.int32)          # Postings del término t: indptr[t]:indptr[t + 1]
+        self.postings = np.zeros(0, dtype=np.int32)        # Pasaje
+        self.frequencies = np.zeros(0, dtype=np.uint16)    # Apariciones del término en el pasaje
+        self._hash_vocabulary()
+        if evidence is not None:
+            self._build(evidence)
+
+    def _hash_vocabulary(self, slots=None):
+        """Trigramas de cada término del vocabulario (CSR), para la similitud."""
+        tokens = sorted(self.vocabulary, key=self.vocabulary.get)
+        slots = slots if slots is not None else [token_slots(token) for token in tokens]
+        counts = [len(s) for s in slots]
+        self.slot_ptr = np.concatenate(([0], np.cumsum(counts, dtype=np.int64))).astype(np.int32)
+        flat = [pair for s in slots for pair in s]
+        self.slot_index = np.array([slot for slot, _ in flat], dtype=np.int16)
+        self.slot_sign = np.array([sign for _, sign in flat], dtype=np.int8)
+
+    def _build(self, evidence):
+        positions, starts, lengths, norms = [], [], [], []
+        terms, passages, counts = [], [], []
+        slots = []   # Trigramas de cada término, en orden de vocabulario
+        for pos, email in enumerate(evidence):
+            for start, text in split_passages(email):
+                tokens = tokenize(text)
+                if not tokens:
+                    continue
+                freqs = {}
+                for token in tokens:
+                    freqs[token] = freqs.get(token, 0) + 1
+                passage = len(positions)
+                vector = np.zeros(EMBEDDING_DIMS, dtype=np.float32)
+                for token, count in freqs.items():
+                    term = self.vocabulary.get(token)
+                    if term is None:
+                        term = self.vocabulary[token] = len(self.vocabulary)
+                        slots.append(token_slots(token))
+                    for slot, sign in slots[term]:
+                        vector[slot] += sign * count
+                    terms.append(term)
+                    passages.append(passage)
+                    counts.append(count)
+                positions.append(pos)
+                starts.append(start)
+                lengths.append(len(tokens))
+                norms.append(np.linalg.norm(vector))
+        if not positions:
+            return
+
+        self.passage_pos = np.array(positions, dtype=np.int32)
+        self.passage_start = np.array(starts, dtype=np.int32)
+        self.lengths = np.array(lengths, dtype=np.int32)
+        self.norms = np.array(norms, dtype=np.float32)
+        terms = np.array(terms, dtype=np.int32)
+        order = np.argsort(terms, kind='stable')
+        self.indptr = np.concatenate(([0], np.cumsum(np.bincount(terms, minlength=len(self.vocabulary))))).astype(np.int32)
+        self.postings = np.array(passages, dtype=np.int32)[order]
+        self.frequencies = np.minimum(np.array(counts)[order], np.iinfo(np.uint16).max).astype(np.uint16)
+        self._hash_vocabulary(slots)
+
+    def __len__(self):
+        return len(self.passage_pos)
+
+    def memory_bytes(self):
+        """Bytes de los arrays y del vocabulario (para el presupuesto de memoria de la sesión)."""
+        arrays = (self.passage_pos, self.passage_start, self.lengths, self.norms, self.indptr, self.postings,
+                  self.frequencies, self.slot_ptr, self.slot_index, self.slot_sign)
+        vocabulary = sys.getsizeof(self.vocabulary) + sum(sys.getsizeof(t) + 28 for t in self.vocabulary)   # + el int
+        return sys.getsizeof(self) + sum(a.nbytes for a in arrays) + vocabulary
+
+    @property
+    def avg_length(self):
+        return float(self.lengths.mean()) if len(self.lengths) else 0.0
+
+    def _bm25(self, terms):
+        """Puntuación BM25 de cada pasaje para los términos de la consulta."""
+        n = len(self)
+        avg = self.avg_length or 1.0
+        scores = np.zeros(n, dtype=np.float32)
+        for term in set(terms):
+            row = self.vocabulary.get(term)
+            if row is None:
+                continue
+            postings = self.postings[self.indptr[row]:self.indptr[row + 1]]
+            tf = self.frequencies[self.indptr[row]:self.indptr[row + 1]].astype(np.float32)
+            df = len(postings)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[postings] / avg)
+            scores[postings] += idf * tf * (BM25_K1 + 1) / norm
+        return scores
+
+    def _similarity(self, terms):
+        """Coseno entre el embedding de la consulta y el de cada pasaje."""
+        query_vector = embed(terms)
+        # Producto de cada término con la consulta y, ponderado por su frecuencia, suma por pasaje
+        term_dot = np.add.reduceat(self.slot_sign * query_vector[self.slot_index], self.slot_ptr[:-1])
+        term_of = np.repeat(np.arange(len(self.vocabulary)), np.diff(self.indptr))
+        dots = np.bincount(self.postings, weights=self.frequencies * term_dot[term_of], minlength=len(self))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.norms > 0, dots / self.norms, 0.0).astype(np.float32)
+
+    def search(self, query, limit=50, semantic_weight=0.3):
+        """
+        Emails ordenados por relevancia.
+
+        Args:
+            query: Texto libre ("comisiones del fondo", "fees or comisiones"...)
+            limit: Máximo de emails devueltos
+            semantic_weight: Peso de la similitud por embeddings (0 = solo BM25)
+
+        Returns:
+            list: dicts {'pos', 'score', 'start' (pasaje: passage_text), 'bm25',
+                  'similarity'} por email
+        """
+        terms = query_terms(query)
+        if not terms or not len(self):
+            return []
+
+        bm25 = self._bm25(terms)
+        top = float(bm25.max())
+        combined = (1 - semantic_weight) * (bm25 / top if top else bm25)
+        similarity = np.zeros_like(bm25)
+        if semantic_weight:
+            similarity = self._similarity(terms)
+            combined = combined + semantic_weight * np.clip(similarity, 0, None)
+
+        # Mejor pasaje de cada email: orden por email y puntuación descendente, primero de cada email
+        matches = np.flatnonzero((bm25 > 0) | (similarity >= SEMANTIC_MIN_SIMILARITY))
+        order = matches[np.lexsort((-combined[matches], self.passage_pos[matches]))]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = self.passage_pos[order][1:] != self.passage_pos[order][:-1]
+
+        hits = [{
+            'pos': int(self.passage_pos[i]),
+            'score': round(float(combined[i]), 4),
+            'start': int(self.passage_start[i]),
+            'bm25': round(float(bm25[i]), 3),
+            'similarity': round(float(similarity[i]), 3)
+        } for i in order[first]]
+        hits.sort(key=lambda h: h['score'], reverse=True)
+        return hits[:limit]
+
+    def highlight_passage(self, passage, query, template="<mark style='background:#fff9c4'>{}</mark>"):
+        """Pasaje con los términos de la consulta resaltados (prefijos incluidos)."""
+        return highlight(passage, " ".join(f"{t}*" for t in query_terms(query)), template=template)
+
+    # --- PERSISTENCIA ---
+    def to_dict(self):
+        """Forma serializable en JSON para guardar con el PrecomputeStore."""
+        return {
+            'format': 2,
+            'vocabulary': sorted(self.vocabulary, key=self.vocabulary.get),
+            'passage_pos': _pack(self.passage_pos),
+            'passage_start': _pack(self.passage_start),
+            'lengths': _pack(self.lengths),
+            'norms': _pack(self.norms),
+            'indptr': _pack(self.indptr),
+            'postings': _pack(self.postings),
+            'frequencies': _pack(self.frequencies),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Índice guardado con to_dict (KeyError con el formato antiguo, que guardaba los textos)."""
+        index = cls()
+        index.vocabulary = {token: i for i, token in enumerate(data['vocabulary'])}
+        index.passage_pos = _unpack(data['passage_pos'], np.int32)
+        index.passage_start = _unpack(data['passage_start'], np.int32)
+        index.lengths = _unpack(data['lengths'], np.int32)
+        index.norms = _unpack(data['norms'], np.float32)
+        index.indptr = _unpack(data['indptr'], np.int32)
+        index.postings = _unpack(data['postings'], np.int32)
+        index.frequencies = _unpack(data['frequencies'], np.uint16)
+        index._hash_vocabulary()
+        return index
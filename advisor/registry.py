@@ -0,0 +1,416 @@
+"""
+Registro de clientes (Cartera de Clientes) en SQLite.
+
+Sustituye a client_history.json, que se releía entero en cada render del
+sidebar y se reescribía sin bloqueo (dos sesiones a la vez podían perder
+clientes o dejar el fichero a medias). Cada cliente es una fila indexada por
+su email con lo último que se sabe de él:
+
+- last_used_at: cuándo se seleccionó o analizó por última vez (orden del sidebar)
+- last_analyzed_at, history_id: último análisis y el historyId de Gmail que vio
+- urgency, avg_sentiment, emails_analyzed: resumen de ese análisis
+
+Los alias (otra dirección o un nombre) apuntan a un cliente y se resuelven con
+la misma búsqueda por clave. Los grupos (un hogar: cónyuges, holding,
+fiduciario...) reúnen varios clientes para analizarlos juntos. Cada cliente
+analizado tiene además su fila en la matriz de la cartera (advisor.portfolio),
+que no se reutiliza aunque se borre el cliente. La base está en modo WAL: varias sesiones y el
+precálculo nocturno pueden leer y escribir a la vez. La primera vez que se
+abre importa el client_history.json antiguo si existe.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+REGISTRY_DB = "client_registry.sqlite3"
+LEGACY_HISTORY_FILE = "client_history.json"
+
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS clients (
+    email TEXT PRIMARY KEY,
+    added_at REAL NOT NULL,
+    last_used_at REAL NOT NULL,
+    last_analyzed_at REAL,
+    history_id TEXT,
+    urgency TEXT,
+    avg_sentiment REAL,
+    emails_analyzed INTEGER
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_clients_last_used ON clients(last_used_at);
+CREATE TABLE IF NOT EXISTS aliases (
+    alias TEXT PRIMARY KEY,
+    email TEXT NOT NULL REFERENCES clients(email) ON DELETE CASCADE
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_aliases_email ON aliases(email);
+CREATE TABLE IF NOT EXISTS client_groups (
+    name TEXT PRIMARY KEY COLLATE NOCASE,
+    created_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS group_members (
+    group_name TEXT NOT NULL COLLATE NOCASE REFERENCES client_groups(name) ON DELETE CASCADE,
+    email TEXT NOT NULL REFERENCES clients(email) ON DELETE CASCADE,
+    role TEXT,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (group_name, email)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_group_members_email ON group_members(email);
+CREATE TABLE IF NOT EXISTS portfolio_rows (
+    email TEXT PRIMARY KEY,
+    matrix_row INTEGER NOT NULL UNIQUE
+) WITHOUT ROWID;
+"""
+
+_COLUMNS = "email, added_at, last_used_at, last_analyzed_at, history_id, urgency, avg_sentiment, emails_analyzed"
+
+
+def normalize(value):
+    return (value or "").strip().lower()
+
+
+def summarize_analysis(analysis):
+    """Urgencia y sentimiento medio de un análisis (None si no hay datos)."""
+    analysis = analysis or {}
+    scores = []
+    for item in analysis.get('analisis_sentimiento') or []:
+        try:
+            scores.append(float(item.get('sentimiento_score')))
+        except (TypeError, ValueError, AttributeError):
+            continue
+    avg = round(sum(scores) / len(scores), 2) if scores else None
+    return analysis.get('urgencia'), avg
+
+
+class ClientRegistry:
+    """Cartera de clientes persistente, segura entre hilos y procesos (WAL)."""
+
+    def __init__(self, path=REGISTRY_DB, legacy_path=LEGACY_HISTORY_FILE):
+        """
+        Args:
+            path: Fichero SQLite del registro
+            legacy_path: client_history.json a importar la primera vez (None = no importar)
+        """
+        self.path = path
+        self.legacy_path = legacy_path
+        self._init_lock = threading.Lock()
+        self._ready = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys=ON")
+        if not self._ready:
+            with self._init_lock:
+                if not self._ready:
+                    directory = os.path.dirname(self.path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.executescript(SCHEMA)
+                    self._migrate(conn)
+                    self._ready = True
+        return conn
+
+    def _migrate(self, conn):
+        """Importa client_history.json una sola vez (el primer proceso que llega lo hace)."""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+                conn.rollback()
+                return
+            legacy = []
+            if self.legacy_path and os.path.exists(self.legacy_path):
+                try:
+                    with open(self.legacy_path, "r", encoding="utf-8") as f:
+                        legacy = json.load(f)
+                except (OSError, ValueError):
+                    legacy = []
+            # El JSON guardaba el más reciente primero: se conserva ese orden
+            now = time.time()
+            conn.executemany(
+                "INSERT OR IGNORE INTO clients (email, added_at, last_used_at) VALUES (?, ?, ?)",
+                [(normalize(email), now - i, now - i) for i, email in enumerate(legacy) if normalize(email)]
+            )
+            conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def _execute(self, sql, params=()):
+        with closing(self._connect()) as conn:
+            with conn:
+                return conn.execute(sql, params).rowcount
+
+    def _query(self, sql, params=()):
+        with closing(self._connect()) as conn:
+            return [dict(r) for r in conn.execute(sql, params).fetchall()]
+
+    # --- ESCRITURA ---
+    def touch(self, email):
+        """Da de alta el cliente (si no existe) y lo marca como el más reciente."""
+        email = normalize(email)
+        if not email:
+            return
+        now = time.time()
+        self._execute(
+            "INSERT INTO clients (email, added_at, last_used_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(email) DO UPDATE SET last_used_at = excluded.last_used_at",
+            (email, now, now)
+        )
+
+    def record_analysis(self, email, analysis, emails_analyzed=None, history_id=None, analyzed_at=None):
+        """
+        Guarda el resumen del último análisis del cliente.
+
+        Args:
+            email: Email del cliente (o un alias)
+            analysis: Resultado de analyze_with_ai (None en modo básico)
+            emails_analyzed: Número de emails de la evidencia
+            history_id: historyId de Gmail más alto visto en la evidencia
+            analyzed_at: Marca de tiempo del análisis (por defecto, ahora)
+        """
+        email = self.resolve(email) or normalize(email)
+        if not email:
+            return
+        urgency, avg_sentiment = summarize_analysis(analysis)
+        now = time.time()
+        analyzed_at = analyzed_at or now
+        self._execute(
+            "INSERT INTO clients (email, added_at, last_used_at, last_analyzed_at, history_id, urgency, "
+            "avg_sentiment, emails_analyzed) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(email) DO UPDATE SET "
+            "last_used_at = MAX(last_used_at, excluded.last_used_at), "
+            "last_analyzed_at = excluded.last_analyzed_at, "
+            "history_id = COALESCE(excluded.history_id, history_id), "
+            "urgency = COALESCE(excluded.urgency, urgency), "
+            "avg_sentiment = COALESCE(excluded.avg_sentiment, avg_sentiment), "
+            "emails_analyzed = COALESCE(excluded.emails_analyzed, emails_analyzed)",
+            (email, now, now, analyzed_at, str(history_id) if history_id else None, urgency, avg_sentiment,
+             emails_analyzed)
+        )
+
+    def portfolio_row(self, email):
+        """Fila del cliente en la matriz de la cartera (advisor.portfolio); se asigna la primera vez."""
+        email = self.resolve(email) or normalize(email)
+        with closing(self._connect()) as conn:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")  # Dos procesos no pueden llevarse la misma fila
+                row = conn.execute("SELECT matrix_row FROM portfolio_rows WHERE email = ?", (email,)).fetchone()
+                if row:
+                    return row[0]
+                matrix_row = conn.execute("SELECT COALESCE(MAX(matrix_row), -1) + 1 FROM portfolio_rows").fetchone()[0]
+                conn.execute("INSERT INTO portfolio_rows (email, matrix_row) VALUES (?, ?)", (email, matrix_row))
+                return matrix_row
+
+    def add_alias(self, email, alias):
+        """
+        Asocia un alias (otra dirección o un nombre) a un cliente.
+
+        Si el alias ya era un cliente de la cartera (la misma persona analizada
+        con otra dirección), se fusiona: su ficha desaparece y sus alias pasan
+        al cliente, que se queda con el resumen del análisis más reciente de
+        los dos. Su fila de la matriz de la cartera pasa al cliente si este no
+        tenía; si los dos tenían, el cliente se queda con la del análisis más
+        reciente (la otra queda huérfana, como la de un cliente borrado).
+
+        Returns:
+            tuple: (ok, mensaje_error)
+        """
+        email, alias = normalize(email), normalize(alias)
+        if not email or not alias or alias == email:
+            return False, "⚠️ Alias no válido"
+        now = time.time()
+        with closing(self._connect()) as conn:
+            try:
+                with conn:
+                    conn.execute(
+                        "INSERT INTO clients (email, added_at, last_used_at) VALUES (?, ?, ?) "
+                        "ON CONFLICT(email) DO UPDATE SET last_used_at = excluded.last_used_at",
+                        (email, now, now)
+                    )
+                    merged = conn.execute(f"SELECT {_COLUMNS} FROM clients WHERE email = ?", (alias,)).fetchone()
+                    if merged is not None:
+                        self._merge_client(conn, email, merged)
+                    conn.execute("UPDATE aliases SET email = ? WHERE email = ?", (email, alias))
+                    conn.execute("UPDATE OR IGNORE group_members SET email = ? WHERE email = ?", (email, alias))
+                    conn.execute("DELETE FROM clients WHERE email = ?", (alias,))
+                    conn.execute("INSERT INTO aliases (alias, email) VALUES (?, ?)", (alias, email))
+            except sqlite3.IntegrityError:
+                return False, f"⚠️ El alias '{alias}' ya está asignado"
+        return True, None
+
+    @staticmethod
+    def _merge_client(conn, email, merged):
+        """Pasa a ``email`` el resumen y la fila de la matriz del cliente ``merged`` (dentro de add_alias)."""
+        current = conn.execute("SELECT last_analyzed_at FROM clients WHERE email = ?", (email,)).fetchone()
+        newer = merged['last_analyzed_at'] is not None and \
+            (current['last_analyzed_at'] is None or merged['last_analyzed_at'] > current['last_analyzed_at'])
+        if newer:
+            # El análisis del cliente fusionado es el último: su resumen va entero
+            conn.execute(
+                "UPDATE clients SET added_at = MIN(added_at, ?), last_used_at = MAX(last_used_at, ?), "
+                "last_analyzed_at = ?, history_id = ?, urgency = ?, avg_sentiment = ?, emails_analyzed = ? "
+                "WHERE email = ?",
+                (merged['added_at'], merged['last_used_at'], merged['last_analyzed_at'], merged['history_id'],
+                 merged['urgency'], merged['avg_sentiment'], merged['emails_analyzed'], email)
+            )
+        else:
+            conn.execute(
+                "UPDATE clients SET added_at = MIN(added_at, ?), last_used_at = MAX(last_used_at, ?), "
+                "last_analyzed_at = COALESCE(last_analyzed_at, ?), history_id = COALESCE(history_id, ?), "
+                "urgency = COALESCE(urgency, ?), avg_sentiment = COALESCE(avg_sentiment, ?), "
+                "emails_analyzed = COALESCE(emails_analyzed, ?) WHERE email = ?",
+                (merged['added_at'], merged['last_used_at'], merged['last_analyzed_at'], merged['history_id'],
+                 merged['urgency'], merged['avg_sentiment'], merged['emails_analyzed'], email)
+            )
+
+        rows = dict(conn.execute(
+            "SELECT email, matrix_row FROM portfolio_rows WHERE email IN (?, ?)", (email, merged['email'])
+        ).fetchall())
+        if merged['email'] not in rows:
+            return
+        if email not in rows:
+            conn.execute("UPDATE portfolio_rows SET email = ? WHERE email = ?", (email, merged['email']))
+        elif newer:
+            # Intercambio de filas (matrix_row es UNIQUE: pasa por -1)
+            conn.execute("UPDATE portfolio_rows SET matrix_row = -1 WHERE email = ?", (email,))
+            conn.execute("UPDATE portfolio_rows SET matrix_row = ? WHERE email = ?", (rows[email], merged['email']))
+            conn.execute("UPDATE portfolio_rows SET matrix_row = ? WHERE email = ?", (rows[merged['email']], email))
+
+    def save_group(self, name, members):
+        """
+        Crea o redefine un grupo de clientes.
+
+        Args:
+            name: Nombre del grupo (p. ej. "Familia García")
+            members: Lista de (email o alias, rol) en el orden en que se muestran
+
+        Returns:
+            tuple: (ok, mensaje_error)
+        """
+        name = (name or "").strip()
+        if not name:
+            return False, "⚠️ El grupo necesita un nombre"
+        resolved = []
+        for member, role in members:
+            email = self.resolve(member) or normalize(member)
+            if '@' not in email:
+                return False, f"⚠️ '{member}' no es un email ni un alias conocido"
+            if email not in (e for e, _ in resolved):
+                resolved.append((email, (role or "").strip() or None))
+        if len(resolved) < 2:
+            return False, "⚠️ Un grupo necesita al menos dos miembros"
+
+        now = time.time()
+        with closing(self._connect()) as conn:
+            with conn:
+                conn.executemany(
+                    "INSERT INTO clients (email, added_at, last_used_at) VALUES (?, ?, ?) ON CONFLICT(email) DO NOTHING",
+                    [(email, now, now) for email, _ in resolved]
+                )
+                conn.execute("INSERT OR IGNORE INTO client_groups (name, created_at) VALUES (?, ?)", (name, now))
+                conn.execute("DELETE FROM group_members WHERE group_name = ?", (name,))
+                conn.executemany(
+                    "INSERT INTO group_members (group_name, email, role, position) VALUES (?, ?, ?, ?)",
+                    [(name, email, role, pos) for pos, (email, role) in enumerate(resolved)]
+                )
+        return True, None
+
+    def delete_group(self, name):
+        self._execute("DELETE FROM client_groups WHERE name = ?", ((name or "").strip(),))
+
+    def remove(self, email):
+        """Borra el cliente y sus alias."""
+        self._execute("DELETE FROM clients WHERE email = ?", (normalize(email),))
+
+    # --- CONSULTAS ---
+    def resolve(self, name):
+        """Email del cliente al que corresponde ``name`` (email o alias), o None."""
+        name = normalize(name)
+        rows = self._query(
+            "SELECT email FROM clients WHERE email = ? "
+            "UNION ALL SELECT email FROM aliases WHERE alias = ? LIMIT 1",
+            (name, name)
+        )
+        return rows[0]['email'] if rows else None
+
+    def addresses(self, name):
+        """
+        Direcciones de email del cliente: la principal y los alias que son
+        direcciones (los nombres no se pueden buscar en Gmail).
+        """
+        email = self.resolve(name) or normalize(name)
+        rows = self._query("SELECT alias FROM aliases WHERE email = ? ORDER BY alias", (email,))
+        return [email] + [r['alias'] for r in rows if '@' in r['alias']]
+
+    def groups(self):
+        """Nombres de los grupos, en orden alfabético."""
+        return [r['name'] for r in self._query("SELECT name FROM client_groups ORDER BY name")]
+
+    def group(self, name):
+        """Miembros del grupo: lista de {'email', 'role'} (vacía si no existe)."""
+        return self._query(
+            "SELECT email, role FROM group_members WHERE group_name = ? ORDER BY position", ((name or "").strip(),)
+        )
+
+    def groups_of(self, email):
+        """Grupos a los que pertenece un cliente."""
+        return [r['group_name'] for r in self._query(
+            "SELECT group_name FROM group_members WHERE email = ? ORDER BY group_name", (self.resolve(email) or normalize(email),)
+        )]
+
+    def get(self, name):
+        """Ficha del cliente (dict con sus columnas y 'aliases'), o None."""
+        email = self.resolve(name)
+        if not email:
+            return None
+        rows = self._query(f"SELECT {_COLUMNS} FROM clients WHERE email = ?", (email,))
+        if not rows:
+            return None
+        client = rows[0]
+        client['aliases'] = [r['alias'] for r in self._query(
+            "SELECT alias FROM aliases WHERE email = ? ORDER BY alias", (email,)
+        )]
+        return client
+
+    def recent(self, limit=None):
+        """Emails de la cartera, el usado más recientemente primero."""
+        sql = "SELECT email FROM clients ORDER BY last_used_at DESC"
+        params = ()
+        if limit:
+            sql += " LIMIT ?"
+            params = (limit,)
+        return [r['email'] for r in self._query(sql, params)]
+
+    def clients(self, with_aliases=False):
+        """Fichas de toda la cartera, la usada más recientemente primero."""
+        clients = self._query(f"SELECT {_COLUMNS} FROM clients ORDER BY last_used_at DESC")
+        if with_aliases:
+            aliases = {}
+            for row in self._query("SELECT alias, email FROM aliases ORDER BY alias"):
+                aliases.setdefault(row['email'], []).append(row['alias'])
+            for client in clients:
+                client['aliases'] = aliases.get(client['email'], [])
+        return clients
+
+    def portfolio_rows(self):
+        """{email: fila de la matriz de la cartera} de los clientes que la tienen."""
+        return {r['email']: r['matrix_row'] for r in self._query(
+            "SELECT p.email, p.matrix_row FROM portfolio_rows AS p JOIN clients AS c ON c.email = p.email"
+        )}
+
+    def stamp(self):
+        """Huella barata del contenido: cambia con cada alta, alias, uso o análisis."""
+        row = self._query(
+            "SELECT COUNT(*) AS n, MAX(last_used_at) AS used, MAX(last_analyzed_at) AS analyzed, "
+            "(SELECT COUNT(*) FROM aliases) AS aliases FROM clients"
+        )[0]
+        return (row['n'], row['used'], row['analyzed'], row['aliases'])
+
+    def __len__(self):
+        return self._query("SELECT COUNT(*) AS n FROM clients")[0]['n']
@@ -0,0 +1,341 @@
+"""
+Informes exportables: resumen en texto plano y PDF del Pre-Meeting Brief.
+"""
+
+
+def generate_analysis_summary_text(analysis_data, evidence_data, target_email):
+    """
+    Genera un resumen de texto plano del análisis para exportar.
+    
+    Args:
+        analysis_data: Resultado del análisis de IA
+        evidence_data: Lista de emails procesados
+        target_email: Email del cliente
+    
+    Returns:
+        str: Texto formateado listo para copiar/exportar
+    """
+    from datetime import datetime
+    
+    text = f"""
+╔═══════════════════════════════════════════════════════════════╗
+║          WEALTH SOLUTIONS ADVISOR - ANÁLISIS DE CLIENTE        ║
+╚═══════════════════════════════════════════════════════════════╝
+
+📧 CLIENTE: {target_email}
+📅 FECHA ANÁLISIS: {datetime.now().strftime('%d/%m/%Y %H:%M')}
+📊 EMAILS ANALIZADOS: {len(evidence_data)}
+
+───────────────────────────────────────────────────────────────
+
+📖 RESUMEN EJECUTIVO:
+{analysis_data.get('resumen_exhaustivo', 'N/A')}
+
+───────────────────────────────────────────────────────────────
+
+🎯 PERFIL DEL CLIENTE:
+{analysis_data.get('perfil_cliente', 'N/A')}
+
+───────────────────────────────────────────────────────────────
+
+⚡ URGENCIA: {analysis_data.get('urgencia', 'N/A')}
+
+───────────────────────────────────────────────────────────────
+
+💡 ACCIÓN RECOMENDADA:
+{analysis_data.get('accion_recomendada', 'N/A')}
+
+───────────────────────────────────────────────────────────────
+
+💎 INSIGHTS CLAVE:
+"""
+    
+    insights = analysis_data.get('insights_clave', [])
+    for idx, insight in enumerate(insights, 1):
+        text += f"{idx}. {insight}\n"
+    
+    text += "\n───────────────────────────────────────────────────────────────\n\n"
+    text += "📊 EVOLUCIÓN DE SENTIMIENTO:\n\n"
+    
+    sentimientos = analysis_data.get('analisis_sentimiento', [])
+    for sent in sentimientos[:10]:  # Primeros 10 emails
+        email_num = sent.get('email_num', 'N/A')
+        score = sent.get('sentimiento_score', 0)
+        explicacion = sent.get('explicacion', 'N/A')
+        
+        # Barra visual simple
+        bar = "█" * max(0, int((score + 10) / 2))
+        text += f"Email #{email_num}: [{score:+3d}/10] {bar}\n"
+        text += f"           {explicacion}\n\n"
+    
+    text += "───────────────────────────────────────────────────────────────\n\n"
+    text += "✉️ BORRADOR DE RESPUESTA SUGERIDO:\n\n"
+    text += analysis_data.get('borrador_respuesta', 'N/A')
+    text += "\n\n═══════════════════════════════════════════════════════════════\n"
+    text += "         Generado por Wealth Solutions Advisor v1.0\n"
+    text += "═══════════════════════════════════════════════════════════════\n"
+    
+    return text
+
+
+def generate_brief_pdf(brief_data, target_email, output_path="brief.pdf"):
+    """
+    Genera un PDF profesional del Pre-Meeting Brief.
+    
+    Args:
+        brief_data: Datos del brief generado por la IA
+        target_email: Email del cliente
+        output_path: Ruta donde guardar el PDF (o un objeto tipo fichero, p.ej. BytesIO)
+    
+    Returns:
+        Ruta (u objeto) donde se escribió el PDF
+    """
+    from reportlab.lib.pagesizes import letter, A4
+    from reportlab.lib.units import inch
+    from reportlab.lib import colors
+    from reportlab.platypus import (
+        SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, 
+        PageBreak, KeepTogether
+    )
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.enums import TA_LEFT, TA_CENTER, TA_JUSTIFY
+    from reportlab.pdfgen import canvas
+    from datetime import datetime
+    
+    # Crear el documento
+    doc = SimpleDocTemplate(
+        output_path,
+        pagesize=A4,
+        rightMargin=50,
+        leftMargin=50,
+        topMargin=80,
+        bottomMargin=50
+    )
+    
+    # Estilos
+    styles = getSampleStyleSheet()
+    
+    # Estilo personalizado para títulos
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=24,
+        textColor=colors.HexColor('#1a2b4b'),
+        spaceAfter=30,
+        alignment=TA_CENTER,
+        fontName='Helvetica-Bold'
+    )
+    
+    # Estilo para subtítulos
+    subtitle_style = ParagraphStyle(
+        'CustomSubtitle',
+        parent=styles['Heading2'],
+        fontSize=16,
+        textColor=colors.HexColor('#004e98'),
+        spaceAfter=12,
+        spaceBefore=20,
+        fontName='Helvetica-Bold'
+    )
+    
+    # Estilo para texto normal
+    normal_style = ParagraphStyle(
+        'CustomNormal',
+        parent=styles['Normal'],
+        fontSize=11,
+        textColor=colors.HexColor('#2c3e50'),
+        spaceAfter=10,
+        alignment=TA_JUSTIFY,
+        leading=16
+    )
+    
+    # Estilo para badges
+    badge_style = ParagraphStyle(
+        'Badge',
+        parent=styles['Normal'],
+        fontSize=10,
+        textColor=colors.white,
+        alignment=TA_CENTER,
+        fontName='Helvetica-Bold'
+    )
+    
+    # Container para elementos del PDF
+    elements = []
+    
+    # === HEADER ===
+    header_data = [
+        [Paragraph("🏦 WEALTH SOLUTIONS ADVISOR", title_style)],
+        [Paragraph("PRE-MEETING BRIEF", subtitle_style)],
+    ]
+    header_table = Table(header_data, colWidths=[6.5*inch])
+    header_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#f5f7fa')),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('TOPPADDING', (0, 0), (-1, -1), 15),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 15),
+    ]))
+    elements.append(header_table)
+    elements.append(Spacer(1, 20))
+    
+    # === METADATA ===
+    metadata_data = [
+        [Paragraph("<b>Cliente:</b>", normal_style), Paragraph(target_email, normal_style)],
+        [Paragraph("<b>Fecha:</b>", normal_style), Paragraph(datetime.now().strftime('%d/%m/%Y %H:%M'), normal_style)],
+        [Paragraph("<b>Tipo:</b>", normal_style), Paragraph("Pre-Meeting Brief Ejecutivo", normal_style)],
+    ]
+    metadata_table = Table(metadata_data, colWidths=[1.5*inch, 5*inch])
+    metadata_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#e3f2fd')),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#90caf9')),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('TOPPADDING', (0, 0), (-1, -1), 8),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+        ('LEFTPADDING', (0, 0), (-1, -1), 10),
+    ]))
+    elements.append(metadata_table)
+    elements.append(Spacer(1, 25))
+    
+    # === CONTEXTO RÁPIDO ===
+    elements.append(Paragraph("📋 CONTEXTO RÁPIDO", subtitle_style))
+    contexto_box = Table(
+        [[Paragraph(brief_data.get('contexto_rapido', 'N/A'), normal_style)]],
+        colWidths=[6.5*inch]
+    )
+    contexto_box.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#e8f5e9')),
+        ('BOX', (0, 0), (-1, -1), 2, colors.HexColor('#4caf50')),
+        ('TOPPADDING', (0, 0), (-1, -1), 15),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 15),
+        ('LEFTPADDING', (0, 0), (-1, -1), 15),
+        ('RIGHTPADDING', (0, 0), (-1, -1), 15),
+    ]))
+    elements.append(contexto_box)
+    elements.append(Spacer(1, 20))
+    
+    # === TEMAS DE REUNIÓN ===
+    elements.append(Paragraph("📌 AGENDA DE REUNIÓN", subtitle_style))
+    
+    temas = brief_data.get('temas_reunion', [])
+    for idx, tema in enumerate(temas[:5], 1):
+        prioridad = tema.get('prioridad', 'INFORMATIVO')
+        
+        # Color según prioridad
+        if prioridad == 'URGENTE':
+            color_bg = colors.HexColor('#ffebee')
+            color_border = colors.HexColor('#d32f2f')
+        elif prioridad == 'IMPORTANTE':
+            color_bg = colors.HexColor('#fff3e0')
+            color_border = colors.HexColor('#f57c00')
+        else:
+            color_bg = colors.HexColor('#e3f2fd')
+            color_border = colors.HexColor('#1976d2')
+        
+        tema_content = [
+            [Paragraph(f"<b>{idx}. {tema.get('tema', 'N/A')}</b> [{prioridad}]", normal_style)],
+            [Paragraph(tema.get('detalle', 'N/A'), normal_style)],
+            [Paragraph(f"<i>💡 {tema.get('contexto', 'N/A')}</i>", normal_style)],
+        ]
+        tema_table = Table(tema_content, colWidths=[6.5*inch])
+        tema_table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (-1, -1), color_bg),
+            ('BOX', (0, 0), (-1, -1), 2, color_border),
+            ('TOPPADDING', (0, 0), (-1, -1), 10),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
+            ('LEFTPADDING', (0, 0), (-1, -1), 12),
+            ('RIGHTPADDING', (0, 0), (-1, -1), 12),
+        ]))
+        elements.append(tema_table)
+        elements.append(Spacer(1, 10))
+    
+    elements.append(Spacer(1, 15))
+    
+    # === PENDIENTES (2 columnas) ===
+    elements.append(Paragraph("⚠️ PENDIENTES", subtitle_style))
+    
+    # Preparar pendientes del cliente
+    pendientes_cliente_list = brief_data.get('pendientes_cliente', [])
+    cliente_text = "<br/>".join([f"• {p}" for p in pendientes_cliente_list[:5]]) if pendientes_cliente_list else "✅ Ninguno"
+    
+    # Preparar pendientes del banco
+    pendientes_banco_list = brief_data.get('pendientes_banco', [])
+    banco_text = "<br/>".join([f"• {p}" for p in pendientes_banco_list[:5]]) if pendientes_banco_list else "✅ Ninguno"
+    
+    pendientes_data = [
+        [Paragraph("<b>👤 Cliente</b>", normal_style), Paragraph("<b>🏦 Banco</b>", normal_style)],
+        [Paragraph(cliente_text, normal_style), Paragraph(banco_text, normal_style)],
+    ]
+    pendientes_table = Table(pendientes_data, colWidths=[3.25*inch, 3.25*inch])
+    pendientes_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (0, 0), colors.HexColor('#ffebee')),
+        ('BACKGROUND', (1, 0), (1, 0), colors.HexColor('#e3f2fd')),
+        ('BACKGROUND', (0, 1), (0, 1), colors.HexColor('#fff5f5')),
+        ('BACKGROUND', (1, 1), (1, 1), colors.HexColor('#f5f9ff')),
+        ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#cfd8dc')),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ('TOPPADDING', (0, 0), (-1, -1), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
+        ('LEFTPADDING', (0, 0), (-1, -1), 10),
+        ('RIGHTPADDING', (0, 0), (-1, -1), 10),
+    ]))
+    elements.append(pendientes_table)
+    elements.append(Spacer(1, 20))
+    
+    # === TALKING POINTS ===
+    elements.append(Paragraph("🎤 TALKING POINTS SUGERIDOS", subtitle_style))
+    
+    talking_points = brief_data.get('talking_points', [])
+    for idx, point in enumerate(talking_points[:3], 1):
+        point_table = Table(
+            [[Paragraph(f'<b>{idx}.</b> "{point}"', normal_style)]],
+            colWidths=[6.5*inch]
+        )
+        point_table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#f3e5f5')),
+            ('BOX', (0, 0), (-1, -1), 1, colors.HexColor('#9c27b0')),
+            ('TOPPADDING', (0, 0), (-1, -1), 10),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
+            ('LEFTPADDING', (0, 0), (-1, -1), 12),
+        ]))
+        elements.append(point_table)
+        elements.append(Spacer(1, 8))
+    
+    elements.append(Spacer(1, 15))
+    
+    # === TIMELINE ===
+    elements.append(Paragraph("⏰ TIMELINE RECIENTE", subtitle_style))
+    
+    timeline_data = [["Fecha", "Quién", "Qué Pasó"]]
+    for item in brief_data.get('timeline_reciente', [])[:5]:
+        timeline_data.append([
+            item.get('fecha', 'N/A'),
+            item.get('quien', 'N/A'),
+            item.get('que_paso', 'N/A')[:80] + "..." if len(item.get('que_paso', '')) > 80 else item.get('que_paso', 'N/A')
+        ])
+    
+    timeline_table = Table(timeline_data, colWidths=[0.8*inch, 0.8*inch, 4.9*inch])
+    timeline_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#004e98')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f5f5f5')]),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ('TOPPADDING', (0, 0), (-1, -1), 8),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+        ('LEFTPADDING', (0, 0), (-1, -1), 8),
+    ]))
+    elements.append(timeline_table)
+    
+    # === FOOTER ===
+    elements.append(Spacer(1, 30))
+    footer_text = Paragraph(
+        "<i>Generado por Wealth Solutions Advisor | Documento confidencial</i>",
+        ParagraphStyle('Footer', parent=styles['Normal'], fontSize=9, textColor=colors.grey, alignment=TA_CENTER)
+    )
+    elements.append(footer_text)
+    
+    # Construir el PDF
+    doc.build(elements)
+    
+    return output_path
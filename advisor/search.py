@@ -0,0 +1,147 @@
+"""
+Índice invertido para la búsqueda del Explorador.
+
+Se construye una vez por análisis (en la tarea en segundo plano) y resuelve
+cada consulta intersectando listas de posiciones, en lugar de pasar a
+minúsculas y recorrer el asunto y el cuerpo de cada email en cada rerun.
+
+Los textos se normalizan sin tildes ni mayúsculas ("Inversión" -> "inversion"),
+así "comision" encuentra "comisión" y al revés.
+
+Sintaxis de consulta:
+    fondo comisiones        -> AND (ambos términos)
+    fondo OR comisiones     -> OR
+    comis*                  -> prefijo
+    a b OR c                -> (a AND b) OR c
+"""
+import bisect
+import re
+import unicodedata
+
+from advisor.memory import deep_size
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Vía rápida para el español; el resto de diacríticos pasa por NFKD
+_FOLD_TABLE = str.maketrans("áéíóúüñàèìòùâêîôûäëïöç", "aeiouunaeiouaeiouaeioc")
+
+
+def fold(text):
+    """Minúsculas y sin diacríticos (la ñ también se pliega a n)."""
+    text = text.lower().translate(_FOLD_TABLE)
+    if text.isascii():
+        return text
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    """Tokens normalizados de un texto."""
+    return _TOKEN_RE.findall(fold(text or ""))
+
+
+def parse_query(query, prefix_last=False):
+    """
+    Convierte la consulta en grupos OR de términos AND.
+
+    Args:
+        query: Texto escrito por el usuario
+        prefix_last: Tratar el último término como prefijo (búsqueda mientras se escribe)
+
+    Returns:
+        list: [[(término, es_prefijo), ...], ...]
+    """
+    groups = [[]]
+    raw_terms = query.split()
+    for pos, raw in enumerate(raw_terms):
+        if raw == "OR":
+            if groups[-1]:
+                groups.append([])
+            continue
+        is_prefix = raw.endswith("*") or (prefix_last and pos == len(raw_terms) - 1)
+        for token in tokenize(raw):
+            groups[-1].append((token, is_prefix))
+    return [g for g in groups if g]
+
+
+class InvertedIndex:
+    """Índice token -> posiciones de la lista de evidencia."""
+
+    def __init__(self, evidence):
+        self.size = len(evidence)
+        self.postings = {}
+        for pos, email in enumerate(evidence):
+            text = f"{email.get('Asunto_Completo', '')} {email.get('Cuerpo', '')}"
+            for token in set(tokenize(text)):
+                self.postings.setdefault(token, set()).add(pos)
+        self.vocabulary = sorted(self.postings)
+        self._prefix_cache = {}
+        self._memory_bytes = None
+
+    def memory_bytes(self):
+        """Bytes del índice sin la caché de prefijos (se mide una vez: no cambia)."""
+        if self._memory_bytes is None:
+            self._memory_bytes = deep_size((self.postings, self.vocabulary))
+        return self._memory_bytes
+
+    def _prefix_postings(self, prefix):
+        """Unión de las posiciones de todos los tokens que empiezan por ``prefix``."""
+        cached = self._prefix_cache.get(prefix)
+        if cached is not None:
+            return cached
+        start = bisect.bisect_left(self.vocabulary, prefix)
+        matched = set()
+        for token in self.vocabulary[start:]:
+            if not token.startswith(prefix):
+                break
+            matched |= self.postings[token]
+        self._prefix_cache[prefix] = matched
+        return matched
+
+    def _term_postings(self, term, is_prefix):
+        if is_prefix:
+            return self._prefix_postings(term)
+        return self.postings.get(term, set())
+
+    def search(self, query, prefix_last=False):
+        """
+        Posiciones de la evidencia que cumplen la consulta.
+
+        Returns:
+            set o None si la consulta no tiene términos (no filtra nada)
+        """
+        groups = parse_query(query, prefix_last=prefix_last)
+        if not groups:
+            return None
+
+        result = set()
+        for group in groups:
+            # Intersección empezando por la lista más corta
+            lists = sorted((self._term_postings(t, p) for t, p in group), key=len)
+            hits = set(lists[0])
+            for postings in lists[1:]:
+                if not hits:
+                    break
+                hits &= postings
+            result |= hits
+        return result
+
+
+def highlight(text, query, prefix_last=False, template="<mark style='background:#fff9c4'>{}</mark>"):
+    """
+    Resalta en ``text`` las palabras que coinciden con la consulta
+    (comparando sin tildes, igual que el índice).
+    """
+    terms = [term for group in parse_query(query, prefix_last=prefix_last) for term in group]
+    if not terms:
+        return text
+    exact = {t for t, p in terms if not p}
+    prefixes = tuple(t for t, p in terms if p)
+
+    def mark(match):
+        word = fold(match.group(0))
+        if word in exact or (prefixes and word.startswith(prefixes)):
+            return template.format(match.group(0))
+        return match.group(0)
+
+    return _TOKEN_RE.sub(mark, text)
@@ -0,0 +1,251 @@
+"""
+Instantáneas versionadas de los análisis de clientes, en SQLite.
+
+El resultado de un análisis vivía solo en la sesión de Streamlit: al volver a
+un cliente al día siguiente se descargaban otra vez todos los emails y se
+pagaba otra llamada a la IA aunque no hubiera llegado nada nuevo. Cada
+análisis correcto se guarda como una versión más del cliente, identificada
+por:
+
+- client + scope: el cliente y la búsqueda (últimos N emails, rango de fechas
+  y direcciones extra), porque cada búsqueda tiene su propio análisis
+- mailbox_state: huella de los ids que devuelve esa búsqueda en Gmail
+  (gmail.mailbox_state); si coincide con la actual, el buzón no ha cambiado y
+  la instantánea se sirve tal cual
+
+Entre dos versiones se calcula un diff (emails nuevos, cambio de urgencia,
+variación del sentimiento medio, insights nuevos) sin llamar a la IA. Se
+guardan las últimas SNAPSHOT_KEEP versiones de cada cliente y búsqueda; el
+contenido va comprimido (la evidencia ocupa decenas de KB por análisis).
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import closing
+
+from advisor.registry import normalize, summarize_analysis
+
+SNAPSHOT_DB = "analysis_snapshots.sqlite3"
+SNAPSHOT_KEEP = 10   # Versiones por cliente y búsqueda
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    client TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    mailbox_state TEXT,
+    history_id TEXT,
+    created_at REAL NOT NULL,
+    emails INTEGER NOT NULL,
+    urgency TEXT,
+    avg_sentiment REAL,
+    payload BLOB NOT NULL,
+    UNIQUE (client, scope, version)
+);
+"""
+
+_META_COLUMNS = "id, client, scope, version, mailbox_state, history_id, created_at, emails, urgency, avg_sentiment"
+
+
+def snapshot_scope(num_emails=None, fecha_desde=None, fecha_hasta=None, addresses=None):
+    """
+    Clave de la búsqueda de un análisis: "n15", "2026-01-01..2026-02-01", con
+    las direcciones extra del cliente detrás si las hay.
+    """
+    if fecha_desde and fecha_hasta:
+        scope = f"{fecha_desde:%Y-%m-%d}..{fecha_hasta:%Y-%m-%d}"
+    else:
+        scope = f"n{num_emails or 15}"
+    extra = sorted({normalize(a) for a in addresses or () if normalize(a)})
+    if extra:
+        scope += "|" + ",".join(extra)
+    return scope
+
+
+def _insights(analysis):
+    return [str(i).strip() for i in (analysis or {}).get('insights_clave') or [] if str(i).strip()]
+
+
+def diff_snapshots(previous, current):
+    """
+    Qué ha cambiado entre dos instantáneas del mismo cliente y búsqueda.
+
+    Args:
+        previous: Instantánea anterior (dict de SnapshotStore)
+        current: Instantánea actual
+
+    Returns:
+        dict: {'from_version', 'to_version', 'previous_at',
+               'new_emails' (lista de {'id', 'Fecha', 'Origen', 'Asunto'}),
+               'dropped_emails' (cuántos ya no entran en la búsqueda),
+               'urgency' ((antes, ahora) o None si no cambió),
+               'avg_sentiment' ((antes, ahora)), 'sentiment_delta',
+               'new_insights'}
+    """
+    old_ids = {e['Id_Completo'] for e in previous['evidence']}
+    new_emails = [
+        {'id': e['Id_Completo'], 'Fecha': e['Fecha'], 'Origen': e['Origen'], 'Asunto': e['Asunto']}
+        for e in current['evidence'] if e['Id_Completo'] not in old_ids
+    ]
+    current_ids = {e['Id_Completo'] for e in current['evidence']}
+
+    old_urgency, old_avg = summarize_analysis(previous['analysis'])
+    new_urgency, new_avg = summarize_analysis(current['analysis'])
+    delta = round(new_avg - old_avg, 2) if old_avg is not None and new_avg is not None else None
+
+    seen = {i.lower() for i in _insights(previous['analysis'])}
+    return {
+        'from_version': previous['version'],
+        'to_version': current['version'],
+        'previous_at': previous['created_at'],
+        'new_emails': new_emails,
+        'dropped_emails': len(old_ids - current_ids),
+        'urgency': (old_urgency, new_urgency) if old_urgency != new_urgency else None,
+        'avg_sentiment': (old_avg, new_avg),
+        'sentiment_delta': delta,
+        'new_insights': [i for i in _insights(current['analysis']) if i.lower() not in seen],
+    }
+
+
+class SnapshotStore:
+    """Histórico de análisis por cliente y búsqueda, seguro entre hilos y procesos (WAL)."""
+
+    def __init__(self, path=SNAPSHOT_DB, keep=SNAPSHOT_KEEP):
+        """
+        Args:
+            path: Fichero SQLite de las instantáneas
+            keep: Versiones que se conservan de cada cliente y búsqueda
+        """
+        self.path = path
+        self.keep = keep
+        self._init_lock = threading.Lock()
+        self._ready = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        if not self._ready:
+            with self._init_lock:
+                if not self._ready:
+                    directory = os.path.dirname(self.path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.executescript(SCHEMA)
+                    self._ready = True
+        return conn
+
+    @staticmethod
+    def _row(row, with_payload=True):
+        snapshot = {k: row[k] for k in _META_COLUMNS.split(", ")}
+        if with_payload:
+            snapshot.update(json.loads(zlib.decompress(row['payload'])))
+        return snapshot
+
+    # --- ESCRITURA ---
+    def save(self, client, scope, analysis, evidence, ranking=None, mailbox_state=None, history_id=None):
+        """
+        Guarda un análisis como la siguiente versión del cliente.
+
+        Args:
+            client: Email principal del cliente
+            scope: Búsqueda (snapshot_scope)
+            analysis: Resultado de la IA
+            evidence: EvidenceFrame o lista de registros
+            ranking: RankingIndex (se guarda con to_dict) o None
+            mailbox_state: Huella del buzón que vio el análisis
+            history_id: historyId de Gmail más alto de la evidencia
+
+        Returns:
+            dict: la instantánea guardada
+        """
+        client = normalize(client)
+        records = evidence.to_records() if hasattr(evidence, 'to_records') else list(evidence)
+        payload = {
+            'analysis': analysis,
+            'evidence': records,
+            'ranking': ranking.to_dict() if ranking is not None else None,
+        }
+        blob = zlib.compress(json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8"))
+        urgency, avg = summarize_analysis(analysis)
+        now = time.time()
+
+        with closing(self._connect()) as conn:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")  # La versión siguiente no puede repetirse entre procesos
+                version = conn.execute(
+                    "SELECT COALESCE(MAX(version), 0) + 1 FROM snapshots WHERE client = ? AND scope = ?",
+                    (client, scope)
+                ).fetchone()[0]
+                cursor = conn.execute(
+                    "INSERT INTO snapshots (client, scope, version, mailbox_state, history_id, created_at, "
+                    "emails, urgency, avg_sentiment, payload) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (client, scope, version, mailbox_state, str(history_id) if history_id else None, now,
+                     len(records), urgency, avg, blob)
+                )
+                conn.execute(
+                    "DELETE FROM snapshots WHERE client = ? AND scope = ? AND version <= ?",
+                    (client, scope, version - self.keep)
+                )
+        return {
+            'id': cursor.lastrowid, 'client': client, 'scope': scope, 'version': version,
+            'mailbox_state': mailbox_state, 'history_id': str(history_id) if history_id else None,
+            'created_at': now, 'emails': len(records), 'urgency': urgency, 'avg_sentiment': avg,
+            **payload
+        }
+
+    def delete(self, client):
+        """Borra todas las versiones de un cliente."""
+        with closing(self._connect()) as conn:
+            with conn:
+                conn.execute("DELETE FROM snapshots WHERE client = ?", (normalize(client),))
+
+    # --- LECTURA ---
+    def latest(self, client, scope):
+        """Última instantánea del cliente para esa búsqueda (None si no hay)."""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                f"SELECT {_META_COLUMNS}, payload FROM snapshots WHERE client = ? AND scope = ? "
+                "ORDER BY version DESC LIMIT 1",
+                (normalize(client), scope)
+            ).fetchone()
+        return self._row(row) if row else None
+
+    def previous(self, snapshot):
+        """Versión anterior a ``snapshot`` (None si es la primera que se conserva)."""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                f"SELECT {_META_COLUMNS}, payload FROM snapshots WHERE client = ? AND scope = ? AND version < ? "
+                "ORDER BY version DESC LIMIT 1",
+                (snapshot['client'], snapshot['scope'], snapshot['version'])
+            ).fetchone()
+        return self._row(row) if row else None
+
+    def versions(self, client, scope=None):
+        """Versiones guardadas del cliente, la más reciente primero (sin el contenido)."""
+        sql = f"SELECT {_META_COLUMNS} FROM snapshots WHERE client = ?"
+        params = [normalize(client)]
+        if scope is not None:
+            sql += " AND scope = ?"
+            params.append(scope)
+        with closing(self._connect()) as conn:
+            rows = conn.execute(sql + " ORDER BY created_at DESC, version DESC", params).fetchall()
+        return [self._row(row, with_payload=False) for row in rows]
+
+    def latest_per_client(self):
+        """Última instantánea de cada cliente (de cualquier búsqueda), para analizar la cartera."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                f"SELECT {_META_COLUMNS}, payload FROM snapshots AS s WHERE id = ("
+                "SELECT id FROM snapshots WHERE client = s.client ORDER BY created_at DESC, id DESC LIMIT 1)"
+            ).fetchall()
+        return [self._row(row) for row in rows]
+
+    def diff(self, snapshot):
+        """Cambios de ``snapshot`` respecto a la versión anterior (None si no hay anterior)."""
+        previous = self.previous(snapshot)
+        return diff_snapshots(previous, snapshot) if previous else None
@@ -0,0 +1,76 @@
+"""
+Almacén en disco de análisis precalculados.
+
+El precálculo nocturno (advisor.batch) guarda aquí un JSON por cliente y
+número de emails; la app lo consulta antes de ir a Gmail y OpenAI.
+"""
+import json
+import os
+import re
+import tempfile
+import time
+
+PRECOMPUTE_DIR = "precompute"
+
+
+def atomic_write_json(path, data):
+    """Escribe JSON de forma atómica (fichero temporal + rename) para no dejar ficheros a medias."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, default=str)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class PrecomputeStore:
+    """Resultados precalculados, un fichero por (cliente, número de emails)."""
+
+    def __init__(self, directory=PRECOMPUTE_DIR):
+        self.directory = directory
+
+    def path_for(self, target_email, num_emails):
+        safe = re.sub(r'[^a-z0-9@._-]', '_', target_email.strip().lower())
+        return os.path.join(self.directory, f"{safe}__n{num_emails}.json")
+
+    def save(self, target_email, num_emails, payload):
+        """
+        Guarda el resultado de un cliente.
+
+        Args:
+            target_email: Email del cliente
+            num_emails: Número de emails analizados (parte de la clave)
+            payload: dict con 'analysis', 'evidence', 'brief', 'ranking', 'scope' y 'timings'
+        """
+        record = dict(payload, target_email=target_email, num_emails=num_emails, created_at=time.time())
+        atomic_write_json(self.path_for(target_email, num_emails), record)
+        return record
+
+    def load(self, target_email, num_emails, max_age_hours=None, scope=None):
+        """
+        Devuelve el resultado guardado o None si no existe o está caducado.
+
+        Args:
+            max_age_hours: Antigüedad máxima aceptada (None = sin límite)
+            scope: Búsqueda que tiene que haber visto el resultado
+                   (snapshots.snapshot_scope, con las direcciones del cliente);
+                   None = cualquiera
+        """
+        path = self.path_for(target_email, num_emails)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if max_age_hours is not None and time.time() - record.get('created_at', 0) > max_age_hours * 3600:
+            return None
+        if scope is not None and record.get('scope') != scope:
+            return None   # Otras direcciones (p. ej. un alias añadido después del precálculo)
+        return record
@@ -0,0 +1,195 @@
+"""
+Resúmenes jerárquicos del historial completo de un cliente.
+
+Un análisis normal está limitado a 500 emails y al recorte de caracteres de la
+IA, así que una relación de varios años no cabe. Aquí el historial se resume
+por piezas que se guardan en SQLite:
+
+- Mes ("2025-03"): un resumen de sus emails. Un mes cerrado no cambia, así que
+  se calcula una vez y no se vuelve a pedir; el mes en curso se vuelve a
+  resumir solo si su huella en Gmail (gmail.mailbox_state) ha cambiado.
+- Trimestre ("2025-T1") y año ("2025"): resumen de los resúmenes de sus hijos,
+  solo para periodos cerrados. Se guardan con la huella de los hijos y se
+  recalculan únicamente si alguno cambia (por ejemplo, al ampliar el rango).
+
+El análisis del "historial completo" compone los años cerrados, los trimestres
+cerrados del año en curso y los meses del trimestre en curso en una sola
+llamada pequeña a la IA.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from datetime import date
+
+from advisor.registry import normalize
+
+HISTORY_DB = "history_summaries.sqlite3"
+HISTORY_YEARS = 3   # Años naturales que se analizan por defecto (incluido el actual)
+
+MONTH_NAMES = ["enero", "febrero", "marzo", "abril", "mayo", "junio", "julio",
+               "agosto", "septiembre", "octubre", "noviembre", "diciembre"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS summaries (
+    client TEXT NOT NULL,
+    period TEXT NOT NULL,
+    level TEXT NOT NULL,
+    source_state TEXT,
+    closed INTEGER NOT NULL DEFAULT 0,
+    emails INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    summary TEXT,
+    PRIMARY KEY (client, period)
+) WITHOUT ROWID;
+"""
+
+
+# --- PERIODOS ---
+def month_key(day):
+    return f"{day.year}-{day.month:02d}"
+
+
+def quarter_key(month):
+    year, m = month.split("-")
+    return f"{year}-T{(int(m) - 1) // 3 + 1}"
+
+
+def quarter_months(quarter):
+    year, q = quarter.split("-T")
+    first = (int(q) - 1) * 3 + 1
+    return [f"{year}-{m:02d}" for m in range(first, first + 3)]
+
+
+def month_bounds(month):
+    """(primer día del mes, primer día del mes siguiente), para la búsqueda de Gmail."""
+    year, m = (int(x) for x in month.split("-"))
+    start = date(year, m, 1)
+    end = date(year + 1, 1, 1) if m == 12 else date(year, m + 1, 1)
+    return start, end
+
+
+def months_between(since, today):
+    """Meses desde ``since`` hasta el de ``today`` incluidos, del más antiguo al más reciente."""
+    months = []
+    year, m = since.year, since.month
+    while (year, m) <= (today.year, today.month):
+        months.append(f"{year}-{m:02d}")
+        year, m = (year + 1, 1) if m == 12 else (year, m + 1)
+    return months
+
+
+def period_label(period):
+    """Nombre legible: "marzo 2025", "T1 2025" o "2025"."""
+    if "-T" in period:
+        year, q = period.split("-T")
+        return f"T{q} {year}"
+    if "-" in period:
+        year, m = period.split("-")
+        return f"{MONTH_NAMES[int(m) - 1]} {year}"
+    return period
+
+
+def children_state(rows):
+    """Huella de los resúmenes hijos de un periodo (cambia si cambia alguno)."""
+    parts = [f"{r['period']}:{r['source_state']}:{r['emails']}" for r in rows]
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()[:16]
+
+
+def summary_text(rows):
+    """Texto compacto de varios resúmenes para la IA (los periodos sin emails se omiten)."""
+    blocks = []
+    for row in rows:
+        s = row['summary']
+        if not row['emails'] or not s:
+            continue
+        lines = [f"=== {period_label(row['period']).upper()} ({row['emails']} emails) ==="]
+        lines.append(f"RESUMEN: {s.get('resumen', '')}")
+        if s.get('temas'):
+            lines.append("TEMAS: " + "; ".join(str(t) for t in s['temas']))
+        if s.get('sentimiento_medio') is not None:
+            lines.append(f"SENTIMIENTO MEDIO: {s['sentimiento_medio']}")
+        if s.get('urgencia'):
+            lines.append(f"URGENCIA: {s['urgencia']}")
+        for hito in s.get('hitos') or []:
+            if isinstance(hito, dict):
+                lines.append(f"- {hito.get('fecha', '')}: {hito.get('hecho', '')}")
+        if s.get('pendientes'):
+            lines.append("PENDIENTES: " + "; ".join(str(p) for p in s['pendientes']))
+        blocks.append("\n".join(lines))
+    return "\n\n".join(blocks)
+
+
+class SummaryStore:
+    """Resúmenes por cliente y periodo, seguros entre hilos y procesos (WAL)."""
+
+    def __init__(self, path=HISTORY_DB):
+        self.path = path
+        self._init_lock = threading.Lock()
+        self._ready = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        if not self._ready:
+            with self._init_lock:
+                if not self._ready:
+                    directory = os.path.dirname(self.path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.executescript(SCHEMA)
+                    self._ready = True
+        return conn
+
+    @staticmethod
+    def _row(row):
+        item = dict(row)
+        item['closed'] = bool(item['closed'])
+        item['summary'] = json.loads(item['summary']) if item['summary'] else None
+        return item
+
+    def get_many(self, client, periods):
+        """{periodo: resumen} de los periodos pedidos que ya están guardados."""
+        periods = list(periods)
+        if not periods:
+            return {}
+        found = {}
+        with closing(self._connect()) as conn:
+            # SQLite limita el número de parámetros: por tandas
+            for i in range(0, len(periods), 500):
+                chunk = periods[i:i + 500]
+                rows = conn.execute(
+                    f"SELECT * FROM summaries WHERE client = ? AND period IN ({','.join('?' * len(chunk))})",
+                    [normalize(client)] + chunk
+                ).fetchall()
+                found.update((row['period'], self._row(row)) for row in rows)
+        return found
+
+    def get(self, client, period):
+        return self.get_many(client, [period]).get(period)
+
+    def put(self, client, period, level, summary, emails, source_state, closed):
+        """Guarda (o sustituye) el resumen de un periodo y lo devuelve como fila."""
+        row = {
+            'client': normalize(client), 'period': period, 'level': level, 'source_state': source_state,
+            'closed': bool(closed), 'emails': int(emails), 'created_at': time.time(), 'summary': summary
+        }
+        with closing(self._connect()) as conn:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO summaries (client, period, level, source_state, closed, emails, "
+                    "created_at, summary) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (row['client'], period, level, source_state, int(bool(closed)), row['emails'], row['created_at'],
+                     json.dumps(summary, ensure_ascii=False) if summary is not None else None)
+                )
+        return row
+
+    def forget(self, client):
+        """Borra todos los resúmenes de un cliente (se recalculan en el siguiente análisis)."""
+        with closing(self._connect()) as conn:
+            with conn:
+                conn.execute("DELETE FROM summaries WHERE client = ?", (normalize(client),))
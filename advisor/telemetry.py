@@ -0,0 +1,270 @@
+"""
+Trazas de rendimiento por etapa.
+
+Cada etapa del análisis (lista de Gmail, GET de cada mensaje, decodificación
+MIME, prompt, llamada a OpenAI, validación, gráfico, PDF...) se mide con un
+span anidado. El span activo viaja en un ContextVar, así los hijos se cuelgan
+solos del padre aunque estén en otro módulo; JobManager copia el contexto al
+lanzar una tarea para que las trazas sigan en el hilo del pool.
+
+Los spans terminados se guardan en memoria (para el panel "Rendimiento") y,
+si existe la variable ADVISOR_TRACE_FILE, se añaden a ese fichero como JSON
+lines con la forma de un span OTLP/JSON de OpenTelemetry.
+"""
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+TRACE_FILE_ENV = "ADVISOR_TRACE_FILE"
+SERVICE_NAME = "wealth-solutions-advisor"
+MAX_SPANS = 5000  # Spans terminados que se conservan en memoria
+
+# Códigos de estado de OpenTelemetry
+STATUS_UNSET = "STATUS_CODE_UNSET"
+STATUS_OK = "STATUS_CODE_OK"
+STATUS_ERROR = "STATUS_CODE_ERROR"
+
+_current_span = contextvars.ContextVar("advisor_current_span", default=None)
+
+
+def _otel_value(value):
+    """Convierte un atributo al formato AnyValue de OTLP/JSON."""
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class Span:
+    """Una etapa medida. Se usa como context manager o con end() manual."""
+
+    def __init__(self, tracer, name, parent=None, attributes=None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        self.status = STATUS_UNSET
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self._start_perf = time.perf_counter()
+        self._duration_ms = None
+        self._token = None
+
+    @property
+    def duration_ms(self):
+        if self._duration_ms is not None:
+            return self._duration_ms
+        return (time.perf_counter() - self._start_perf) * 1000
+
+    def set_attribute(self, key, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_attributes(self, **attributes):
+        for key, value in attributes.items():
+            self.set_attribute(key, value)
+
+    def end(self, **attributes):
+        """Cierra el span (idempotente) y lo entrega al tracer."""
+        if self.end_ns is not None:
+            return
+        self.set_attributes(**attributes)
+        self._duration_ms = (time.perf_counter() - self._start_perf) * 1000
+        self.end_ns = self.start_ns + int(self._duration_ms * 1e6)
+        self.tracer._record(self)
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            if issubclass(exc_type, Exception):
+                self.status = STATUS_ERROR
+                self.set_attribute("exception.type", exc_type.__name__)
+                self.set_attribute("exception.message", str(exc)[:300])
+            else:
+                # Cancelaciones (JobCancelled) y similares no son errores
+                self.set_attribute("cancelled", True)
+        self.end()
+        return False
+
+    def to_otel(self):
+        """Span en formato OTLP/JSON (una línea del fichero de trazas)."""
+        record = {
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": "SPAN_KIND_INTERNAL",
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or time.time_ns()),
+            "attributes": [{"key": k, "value": _otel_value(v)} for k, v in self.attributes.items()],
+            "status": {"code": self.status},
+        }
+        if self.parent_id:
+            record["parentSpanId"] = self.parent_id
+        return record
+
+
+class Tracer:
+    """Registro de spans terminados, seguro entre hilos."""
+
+    def __init__(self, max_spans=MAX_SPANS, export_path=None):
+        self.export_path = export_path
+        self._spans = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+
+    def span(self, name, **attributes):
+        """Abre un span hijo del span activo: ``with tracer.span("gmail.list"):``"""
+        return Span(self, name, parent=_current_span.get(), attributes=attributes)
+
+    def start_span(self, name, **attributes):
+        """
+        Span hoja con cierre manual (``span.end()``), para medir un tramo
+        de código sin reindentarlo. No pasa a ser el span activo.
+        """
+        return Span(self, name, parent=_current_span.get(), attributes=attributes)
+
+    def _record(self, span):
+        with self._lock:
+            self._spans.append(span)
+            if self.export_path:
+                try:
+                    with open(self.export_path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(span.to_otel(), ensure_ascii=False) + "\n")
+                except OSError:
+                    pass  # La telemetría nunca debe romper el análisis
+
+    def spans(self):
+        with self._lock:
+            return list(self._spans)
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+    def stage_stats(self):
+        """
+        Estadísticas por etapa (nombre del span).
+
+        Returns:
+            list: dicts {'stage', 'count', 'p50_ms', 'p95_ms', 'max_ms', 'tokens'}
+                  ordenados por p95 descendente
+        """
+        by_stage = {}
+        for span in self.spans():
+            by_stage.setdefault(span.name, []).append(span)
+
+        stats = []
+        for name, spans in by_stage.items():
+            durations = sorted(s.duration_ms for s in spans)
+            stats.append({
+                'stage': name,
+                'count': len(durations),
+                'p50_ms': round(percentile(durations, 50), 1),
+                'p95_ms': round(percentile(durations, 95), 1),
+                'max_ms': round(durations[-1], 1),
+                'tokens': sum(s.attributes.get("gen_ai.usage.input_tokens", 0)
+                              + s.attributes.get("gen_ai.usage.output_tokens", 0) for s in spans)
+            })
+        return sorted(stats, key=lambda s: s['p95_ms'], reverse=True)
+
+    def last_trace(self, root_name=None):
+        """
+        Spans de la última traza completa (opcionalmente de una raíz concreta).
+
+        Returns:
+            list: tuplas (profundidad, span) en orden de inicio
+        """
+        spans = self.spans()
+        roots = [s for s in spans if s.parent_id is None and (root_name is None or s.name == root_name)]
+        if not roots:
+            return []
+        trace_id = roots[-1].trace_id
+        members = [s for s in spans if s.trace_id == trace_id]
+        children = {}
+        for s in members:
+            children.setdefault(s.parent_id, []).append(s)
+
+        ordered = []
+
+        def walk(parent_id, depth):
+            for s in sorted(children.get(parent_id, []), key=lambda x: x.start_ns):
+                ordered.append((depth, s))
+                walk(s.span_id, depth + 1)
+
+        walk(None, 0)
+        return ordered
+
+    def export_jsonl(self, spans=None):
+        """Texto JSON lines (un span OTLP por línea) para descargar o enviar a un collector."""
+        spans = self.spans() if spans is None else spans
+        return "".join(json.dumps(s.to_otel(), ensure_ascii=False) + "\n" for s in spans)
+
+
+def percentile(sorted_values, pct):
+    """Percentil con interpolación lineal sobre una lista ya ordenada."""
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * pct / 100
+    low = int(k)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (k - low)
+
+
+# Tracer del proceso: lo comparten la app, los workers y la CLI
+tracer = Tracer(export_path=os.environ.get(TRACE_FILE_ENV) or None)
+
+
+def span(name, **attributes):
+    """Atajo de ``tracer.span``."""
+    return tracer.span(name, **attributes)
+
+
+def start_span(name, **attributes):
+    """Atajo de ``tracer.start_span``."""
+    return tracer.start_span(name, **attributes)
+
+
+def traced(name, **attributes):
+    """Decorador: ejecuta la función dentro de un span ``name``."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name, **attributes):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_span():
+    return _current_span.get()
+
+
+def record_usage(response, target=None):
+    """
+    Anota en el span el consumo de tokens de una respuesta de OpenAI.
+
+    Usa los nombres de la convención semántica gen_ai de OpenTelemetry.
+    """
+    target = target or current_span()
+    usage = getattr(response, "usage", None)
+    if target is None or usage is None:
+        return
+    target.set_attributes(**{
+        "gen_ai.usage.input_tokens": getattr(usage, "prompt_tokens", None),
+        "gen_ai.usage.output_tokens": getattr(usage, "completion_tokens", None),
+        "gen_ai.response.model": getattr(response, "model", None),
+    })
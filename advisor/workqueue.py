@@ -0,0 +1,378 @@
+"""
+Cola de trabajo persistente y con prioridad para el procesamiento masivo, en SQLite.
+
+El precálculo nocturno recorría la cartera en el orden del sidebar y guardaba
+el avance en un JSON: los clientes que más lo necesitaban podían quedarse al
+final y solo un proceso podía trabajar a la vez. Ahora cada cliente es un
+elemento de la cola con su prioridad:
+
+- Urgencia del último análisis (URGENCY_PRIORITY)
+- Días sin contacto (el último email visto por el escáner de alertas o, si
+  no hay, el último análisis), hasta CONTACT_DAYS_CAP días
+- Alertas abiertas del cliente (advisor.alerts)
+
+Los workers piden elementos con lease(): el elemento queda reservado
+LEASE_SECONDS y hay que renovarlo (heartbeat) mientras se trabaja. Si el
+proceso se cae, la reserva caduca y otro lo retoma; un proceso nuevo en la
+misma máquina recupera al momento las reservas de procesos que ya no existen.
+Los fallos se reintentan hasta MAX_ATTEMPTS veces, con espera creciente.
+stats() da la profundidad de la cola y el ritmo (para la app y el informe).
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+from advisor.registry import normalize
+
+QUEUE_DB = "work_queue.sqlite3"
+LEASE_SECONDS = 600
+MAX_ATTEMPTS = 2
+RETRY_DELAY_S = 60          # Espera antes del reintento (se multiplica por el número de intentos)
+THROUGHPUT_WINDOW_S = 900   # Ventana del ritmo (clientes/minuto)
+
+URGENCY_PRIORITY = {'Alta': 3.0, 'Media': 1.5, 'Baja': 0.5}
+UNKNOWN_URGENCY_PRIORITY = 1.0
+CONTACT_DAYS_CAP = 30       # Días sin contacto a partir de los cuales no sube más
+CONTACT_WEIGHT = 2.0
+ALERT_WEIGHT = 2.0          # Por alerta abierta
+ALERT_CAP = 2               # Alertas que cuentan como máximo
+
+PENDING, LEASED, DONE, FAILED, SKIPPED = "pending", "leased", "done", "failed", "skipped"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS work_items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    queue TEXT NOT NULL,
+    client TEXT NOT NULL,
+    params TEXT NOT NULL,
+    priority REAL NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    lease_owner TEXT,
+    lease_expires REAL,
+    enqueued_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    error TEXT,
+    timings TEXT,
+    UNIQUE (queue, client)
+);
+CREATE INDEX IF NOT EXISTS idx_work_ready ON work_items(queue, status, priority);
+"""
+
+
+def worker_id():
+    """Identificador del proceso que reserva elementos: "máquina:pid"."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True   # Existe (de otro usuario) o no se puede saber: se deja caducar
+    return True
+
+
+def client_priority(urgency=None, days_since_contact=None, open_alerts=0):
+    """
+    Prioridad de un cliente en la cola (mayor = antes).
+
+    Args:
+        urgency: Urgencia del último análisis ('Alta', 'Media', 'Baja' o None)
+        days_since_contact: Días desde el último email o análisis (None = desconocido, cuenta como el máximo)
+        open_alerts: Alertas abiertas del cliente
+    """
+    score = URGENCY_PRIORITY.get(urgency, UNKNOWN_URGENCY_PRIORITY)
+    days = CONTACT_DAYS_CAP if days_since_contact is None else min(max(days_since_contact, 0), CONTACT_DAYS_CAP)
+    score += CONTACT_WEIGHT * days / CONTACT_DAYS_CAP
+    score += ALERT_WEIGHT * min(open_alerts, ALERT_CAP)
+    return round(score, 3)
+
+
+def portfolio_priorities(clients, alerts=None, now=None):
+    """
+    Prioridad de cada cliente del registro.
+
+    Args:
+        clients: Fichas de ClientRegistry.clients()
+        alerts: AlertStore (actividad y alertas abiertas) o None
+        now: Referencia para los días sin contacto (por defecto, ahora)
+
+    Returns:
+        dict: {email: prioridad}
+    """
+    now = now or time.time()
+    activity = alerts.activity() if alerts is not None else {}
+    open_counts = alerts.open_counts() if alerts is not None else {}
+    priorities = {}
+    for client in clients:
+        email = client['email']
+        seen = activity.get(email) or {}
+        last_contact = max(
+            (t for t in (seen.get('last_client_at'), seen.get('last_bank_at'), client.get('last_analyzed_at')) if t),
+            default=None
+        )
+        days = (now - last_contact) / 86400 if last_contact else None
+        priorities[email] = client_priority(client.get('urgency'), days, open_counts.get(email, 0))
+    return priorities
+
+
+class WorkQueue:
+    """Colas de trabajo con prioridad y reservas con caducidad, seguras entre procesos (WAL)."""
+
+    def __init__(self, path=QUEUE_DB):
+        self.path = path
+        self._init_lock = threading.Lock()
+        self._ready = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        if not self._ready:
+            with self._init_lock:
+                if not self._ready:
+                    directory = os.path.dirname(self.path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.executescript(SCHEMA)
+                    self._ready = True
+        return conn
+
+    @staticmethod
+    def _item(row):
+        item = dict(row)
+        item['params'] = json.loads(item['params'])
+        item['timings'] = json.loads(item['timings']) if item['timings'] else {}
+        return item
+
+    # --- EJECUCIONES ---
+    def unfinished(self, queue, params=None):
+        """Elementos pendientes o reservados de la cola (de una ejecución con esos parámetros)."""
+        rows = self.items(queue, statuses=(PENDING, LEASED))
+        if params is not None:
+            rows = [r for r in rows if r['params'] == params]
+        return len(rows)
+
+    @staticmethod
+    def _insert(conn, queue, priorities, params, skipped, now):
+        blob = json.dumps(params, sort_keys=True)
+        return conn.executemany(
+            "INSERT OR IGNORE INTO work_items (queue, client, params, priority, status, available_at, enqueued_at, "
+            "finished_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(queue, normalize(c), blob, p, PENDING, now, now, None) for c, p in priorities.items()]
+            + [(queue, normalize(c), blob, 0.0, SKIPPED, now, now, now) for c in skipped]
+        ).rowcount
+
+    def start_run(self, queue, priorities, params, skipped=()):
+        """
+        Sustituye la cola por una ejecución nueva.
+
+        No se sustituye mientras algún proceso tenga una reserva vigente: sus
+        resultados se perderían de la cola aunque ya estén guardados.
+
+        Args:
+            queue: Nombre de la cola ("precompute")
+            priorities: {cliente: prioridad} de los elementos a procesar
+            params: Parámetros comunes de la ejecución (JSON)
+            skipped: Clientes que no hace falta procesar (constan como skipped)
+
+        Returns:
+            tuple: (elementos encolados, mensaje_error)
+        """
+        now = time.time()
+        with closing(self._connect()) as conn:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")  # Nadie puede reservar entre la comprobación y el borrado
+                busy = conn.execute(
+                    "SELECT COUNT(*) FROM work_items WHERE queue = ? AND status = ? AND lease_expires >= ?",
+                    (queue, LEASED, now)
+                ).fetchone()[0]
+                if busy:
+                    return 0, f"⚠️ Hay {busy} clientes en curso en otro proceso: espera a que termine la ejecución actual"
+                conn.execute("DELETE FROM work_items WHERE queue = ?", (queue,))
+                self._insert(conn, queue, priorities, params, skipped, now)
+        return len(priorities), None
+
+    def add(self, queue, priorities, params, skipped=()):
+        """
+        Añade a la ejecución en curso los clientes que aún no están en la cola.
+
+        Returns:
+            int: elementos nuevos (pendientes o skipped)
+        """
+        with closing(self._connect()) as conn:
+            with conn:
+                return self._insert(conn, queue, priorities, params, skipped, time.time())
+
+    # --- RESERVAS ---
+    @staticmethod
+    def _exhaust(conn, queue, now):
+        """Da por fallidos los elementos con la reserva caducada que ya agotaron sus intentos."""
+        conn.execute(
+            "UPDATE work_items SET status = ?, finished_at = ?, lease_owner = NULL, lease_expires = NULL, "
+            "error = COALESCE(error, ?) WHERE queue = ? AND status = ? AND lease_expires < ? AND attempts >= ?",
+            (FAILED, now, "Reserva caducada: el worker no terminó", queue, LEASED, now, MAX_ATTEMPTS)
+        )
+
+    def lease(self, queue, owner=None, lease_seconds=LEASE_SECONDS):
+        """
+        Reserva el elemento disponible de más prioridad (o uno con la reserva
+        caducada, si le quedan intentos: un cliente que cuelga o tumba al worker
+        acaba como failed).
+
+        Returns:
+            dict: el elemento (con 'params' y 'attempts' ya incrementado) o None
+        """
+        owner = owner or worker_id()
+        now = time.time()
+        with closing(self._connect()) as conn:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")  # Dos workers no pueden llevarse el mismo elemento
+                self._exhaust(conn, queue, now)
+                row = conn.execute(
+                    "SELECT id FROM work_items WHERE queue = ? AND ("
+                    "(status = ? AND available_at <= ?) OR (status = ? AND lease_expires < ?)) "
+                    "ORDER BY priority DESC, id LIMIT 1",
+                    (queue, PENDING, now, LEASED, now)
+                ).fetchone()
+                if row is None:
+                    return None
+                conn.execute(
+                    "UPDATE work_items SET status = ?, lease_owner = ?, lease_expires = ?, attempts = attempts + 1, "
+                    "started_at = ? WHERE id = ?",
+                    (LEASED, owner, now + lease_seconds, now, row['id'])
+                )
+                return self._item(conn.execute("SELECT * FROM work_items WHERE id = ?", (row['id'],)).fetchone())
+
+    def heartbeat(self, item_id, owner=None, lease_seconds=LEASE_SECONDS):
+        """Renueva la reserva. Returns: False si ya no es de ``owner`` (caducó y otro la tomó)."""
+        with closing(self._connect()) as conn:
+            with conn:
+                return conn.execute(
+                    "UPDATE work_items SET lease_expires = ? WHERE id = ? AND status = ? AND lease_owner = ?",
+                    (time.time() + lease_seconds, item_id, LEASED, owner or worker_id())
+                ).rowcount == 1
+
+    def complete(self, item_id, owner=None, timings=None):
+        """Marca el elemento como hecho. Returns: False si la reserva ya no era de ``owner``."""
+        with closing(self._connect()) as conn:
+            with conn:
+                return conn.execute(
+                    "UPDATE work_items SET status = ?, finished_at = ?, lease_owner = NULL, lease_expires = NULL, "
+                    "error = NULL, timings = ? WHERE id = ? AND status = ? AND lease_owner = ?",
+                    (DONE, time.time(), json.dumps(timings or {}), item_id, LEASED, owner or worker_id())
+                ).rowcount == 1
+
+    def fail(self, item_id, error, owner=None, timings=None):
+        """
+        Registra un fallo: vuelve a la cola tras una espera o, agotados los
+        intentos, queda como failed.
+
+        Returns:
+            str: estado resultante (pending o failed); None si la reserva ya no era de ``owner``
+        """
+        now = time.time()
+        with closing(self._connect()) as conn:
+            with conn:
+                row = conn.execute(
+                    "SELECT attempts FROM work_items WHERE id = ? AND status = ? AND lease_owner = ?",
+                    (item_id, LEASED, owner or worker_id())
+                ).fetchone()
+                if row is None:
+                    return None
+                status = PENDING if row['attempts'] < MAX_ATTEMPTS else FAILED
+                conn.execute(
+                    "UPDATE work_items SET status = ?, available_at = ?, finished_at = ?, lease_owner = NULL, "
+                    "lease_expires = NULL, error = ?, timings = ? WHERE id = ?",
+                    (status, now + RETRY_DELAY_S * row['attempts'], now if status == FAILED else None,
+                     str(error)[:500], json.dumps(timings or {}), item_id)
+                )
+        return status
+
+    def recover(self, queue):
+        """
+        Da por caducadas al momento las reservas de procesos de esta máquina
+        que ya no existen (una ejecución que se cayó): lease() las retoma o,
+        sin intentos, las da por fallidas.
+
+        Returns:
+            int: reservas liberadas
+        """
+        host = socket.gethostname()
+        released = 0
+        with closing(self._connect()) as conn:
+            with conn:
+                rows = conn.execute(
+                    "SELECT id, lease_owner FROM work_items WHERE queue = ? AND status = ?", (queue, LEASED)
+                ).fetchall()
+                for row in rows:
+                    owner_host, _, pid = (row['lease_owner'] or "").rpartition(":")
+                    if owner_host == host and pid.isdigit() and not _pid_alive(int(pid)):
+                        released += conn.execute(
+                            "UPDATE work_items SET lease_expires = 0 WHERE id = ?", (row['id'],)
+                        ).rowcount
+        return released
+
+    def next_available(self, queue):
+        """Cuándo estará disponible el próximo pendiente que espera un reintento (None si no hay)."""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT MIN(available_at) AS t FROM work_items WHERE queue = ? AND status = ?", (queue, PENDING)
+            ).fetchone()
+        return row['t']
+
+    # --- LECTURA ---
+    def items(self, queue, statuses=None):
+        """Elementos de la cola, los de más prioridad primero."""
+        sql = "SELECT * FROM work_items WHERE queue = ?"
+        params = [queue]
+        if statuses:
+            sql += f" AND status IN ({','.join('?' * len(statuses))})"
+            params += list(statuses)
+        with closing(self._connect()) as conn:
+            rows = conn.execute(sql + " ORDER BY priority DESC, id", params).fetchall()
+        return [self._item(row) for row in rows]
+
+    def stats(self, queue, now=None):
+        """
+        Profundidad y ritmo de la cola.
+
+        Returns:
+            dict: {'pending', 'leased', 'done', 'failed', 'skipped', 'total',
+                   'throughput_per_min' (últimos 15 min), 'avg_seconds' (por
+                   elemento hecho), 'eta_seconds', 'oldest_pending_s',
+                   'started_at', 'last_finished_at'}
+        """
+        now = now or time.time()
+        with closing(self._connect()) as conn:
+            counts = {row['status']: row['n'] for row in conn.execute(
+                "SELECT status, COUNT(*) AS n FROM work_items WHERE queue = ? GROUP BY status", (queue,)
+            )}
+            row = conn.execute(
+                "SELECT MIN(enqueued_at) AS started_at, MAX(finished_at) AS last_finished_at, "
+                "SUM(CASE WHEN status = ? AND finished_at >= ? THEN 1 ELSE 0 END) AS recent, "
+                "AVG(CASE WHEN status = ? THEN finished_at - started_at END) AS avg_seconds, "
+                "MIN(CASE WHEN status = ? THEN enqueued_at END) AS oldest_pending "
+                "FROM work_items WHERE queue = ?",
+                (DONE, now - THROUGHPUT_WINDOW_S, DONE, PENDING, queue)
+            ).fetchone()
+        stats = {status: counts.get(status, 0) for status in (PENDING, LEASED, DONE, FAILED, SKIPPED)}
+        stats['total'] = sum(counts.values())
+        throughput = (row['recent'] or 0) / (THROUGHPUT_WINDOW_S / 60)
+        stats['throughput_per_min'] = round(throughput, 2)
+        stats['avg_seconds'] = round(row['avg_seconds'], 1) if row['avg_seconds'] is not None else None
+        remaining = stats[PENDING] + stats[LEASED]
+        stats['eta_seconds'] = round(remaining / throughput * 60) if throughput and remaining else None
+        stats['oldest_pending_s'] = round(now - row['oldest_pending']) if row['oldest_pending'] else None
+        stats['started_at'] = row['started_at']
+        stats['last_finished_at'] = row['last_finished_at']
+        return stats
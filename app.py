@@ -1,32 +1,27 @@
 import streamlit as st
-import pandas as pd
 import json
 import os # <--- NUEVO: Para gestionar el archivo de historial
-import plotly.express as px
-import plotly.graph_objects as go
-from datetime import datetime, timedelta
-from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
-from openai import OpenAI
-import base64
-from email.utils import parsedate_to_datetime
 import hmac
-import os
-import json
-import streamlit as st
+import time
+from streamlit.errors import StreamlitAPIException
+from datetime import datetime, timedelta
+# Solo módulos ligeros: pandas, plotly, OpenAI y los clientes de Google se
+# importan en el primer uso, así la pantalla de contraseña y la de OAuth
+# cargan sin ellos (ver benchmarks/startup_time.py)
+from advisor.auth import CredentialManager
+from advisor.cache import MemoryCache
+from advisor.config import EngineConfig
+from advisor.gmail import SCOPES, get_profile_email
+from advisor.ledger import attribution
+from advisor.memory import MB, MemoryBudget, SPILL_DIR
+from advisor import search, telemetry
+from advisor.jobs import JobManager, JOB_CANCELLED, JOB_DONE, JOB_ERROR
+from advisor.picker import ClientPicker, PAGE_SIZE as CLIENT_PAGE_SIZE
+from advisor.prefetch import PrefetchSession, make_fetch_key
+from advisor.registry import ClientRegistry
+from advisor.summaries import HISTORY_YEARS, period_label
+from advisor.workqueue import WorkQueue
 
-# --- CÓDIGO NUEVO PARA CREAR EL ARCHIVO JSON DESDE SECRETS ---
-if not os.path.exists("client_secret.json"):
-    try:
-        # Recuperamos el secreto que acabamos de guardar
-        google_creds = st.secrets["GOOGLE_CREDENTIALS"]
-        
-        # Lo escribimos en un archivo temporal para que la librería de Google lo encuentre
-        with open("client_secret.json", "w") as f:
-            f.write(google_creds)
-    except:
-        st.error("No se encontró el secreto GOOGLE_CREDENTIALS en la configuración.")
-# -------------------------------------------------------------
 # =============================================================================
 # COMPONENTES REUTILIZABLES DE UI
 # =============================================================================
@@ -145,341 +140,6 @@ def show_empty_state(icon, title, subtitle, suggestions=None):
 </div>
 """, unsafe_allow_html=True)
 
-def generate_analysis_summary_text(analysis_data, evidence_data, target_email):
-    """
-    Genera un resumen de texto plano del análisis para exportar.
-    
-    Args:
-        analysis_data: Resultado del análisis de IA
-        evidence_data: Lista de emails procesados
-        target_email: Email del cliente
-    
-    Returns:
-        str: Texto formateado listo para copiar/exportar
-    """
-    from datetime import datetime
-    
-    text = f"""
-╔═══════════════════════════════════════════════════════════════╗
-║          WEALTH SOLUTIONS ADVISOR - ANÁLISIS DE CLIENTE        ║
-╚═══════════════════════════════════════════════════════════════╝
-
-📧 CLIENTE: {target_email}
-📅 FECHA ANÁLISIS: {datetime.now().strftime('%d/%m/%Y %H:%M')}
-📊 EMAILS ANALIZADOS: {len(evidence_data)}
-
-───────────────────────────────────────────────────────────────
-
-📖 RESUMEN EJECUTIVO:
-{analysis_data.get('resumen_exhaustivo', 'N/A')}
-
-───────────────────────────────────────────────────────────────
-
-🎯 PERFIL DEL CLIENTE:
-{analysis_data.get('perfil_cliente', 'N/A')}
-
-───────────────────────────────────────────────────────────────
-
-⚡ URGENCIA: {analysis_data.get('urgencia', 'N/A')}
-
-───────────────────────────────────────────────────────────────
-
-💡 ACCIÓN RECOMENDADA:
-{analysis_data.get('accion_recomendada', 'N/A')}
-
-───────────────────────────────────────────────────────────────
-
-💎 INSIGHTS CLAVE:
-"""
-    
-    insights = analysis_data.get('insights_clave', [])
-    for idx, insight in enumerate(insights, 1):
-        text += f"{idx}. {insight}\n"
-    
-    text += "\n───────────────────────────────────────────────────────────────\n\n"
-    text += "📊 EVOLUCIÓN DE SENTIMIENTO:\n\n"
-    
-    sentimientos = analysis_data.get('analisis_sentimiento', [])
-    for sent in sentimientos[:10]:  # Primeros 10 emails
-        email_num = sent.get('email_num', 'N/A')
-        score = sent.get('sentimiento_score', 0)
-        explicacion = sent.get('explicacion', 'N/A')
-        
-        # Barra visual simple
-        bar = "█" * max(0, int((score + 10) / 2))
-        text += f"Email #{email_num}: [{score:+3d}/10] {bar}\n"
-        text += f"           {explicacion}\n\n"
-    
-    text += "───────────────────────────────────────────────────────────────\n\n"
-    text += "✉️ BORRADOR DE RESPUESTA SUGERIDO:\n\n"
-    text += analysis_data.get('borrador_respuesta', 'N/A')
-    text += "\n\n═══════════════════════════════════════════════════════════════\n"
-    text += "         Generado por Wealth Solutions Advisor v1.0\n"
-    text += "═══════════════════════════════════════════════════════════════\n"
-    
-    return text
-def generate_brief_pdf(brief_data, target_email, output_path="brief.pdf"):
-    """
-    Genera un PDF profesional del Pre-Meeting Brief.
-    
-    Args:
-        brief_data: Datos del brief generado por la IA
-        target_email: Email del cliente
-        output_path: Ruta donde guardar el PDF
-    
-    Returns:
-        str: Ruta del archivo generado
-    """
-    from reportlab.lib.pagesizes import letter, A4
-    from reportlab.lib.units import inch
-    from reportlab.lib import colors
-    from reportlab.platypus import (
-        SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, 
-        PageBreak, KeepTogether
-    )
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.lib.enums import TA_LEFT, TA_CENTER, TA_JUSTIFY
-    from reportlab.pdfgen import canvas
-    from datetime import datetime
-    
-    # Crear el documento
-    doc = SimpleDocTemplate(
-        output_path,
-        pagesize=A4,
-        rightMargin=50,
-        leftMargin=50,
-        topMargin=80,
-        bottomMargin=50
-    )
-    
-    # Estilos
-    styles = getSampleStyleSheet()
-    
-    # Estilo personalizado para títulos
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=24,
-        textColor=colors.HexColor('#1a2b4b'),
-        spaceAfter=30,
-        alignment=TA_CENTER,
-        fontName='Helvetica-Bold'
-    )
-    
-    # Estilo para subtítulos
-    subtitle_style = ParagraphStyle(
-        'CustomSubtitle',
-        parent=styles['Heading2'],
-        fontSize=16,
-        textColor=colors.HexColor('#004e98'),
-        spaceAfter=12,
-        spaceBefore=20,
-        fontName='Helvetica-Bold'
-    )
-    
-    # Estilo para texto normal
-    normal_style = ParagraphStyle(
-        'CustomNormal',
-        parent=styles['Normal'],
-        fontSize=11,
-        textColor=colors.HexColor('#2c3e50'),
-        spaceAfter=10,
-        alignment=TA_JUSTIFY,
-        leading=16
-    )
-    
-    # Estilo para badges
-    badge_style = ParagraphStyle(
-        'Badge',
-        parent=styles['Normal'],
-        fontSize=10,
-        textColor=colors.white,
-        alignment=TA_CENTER,
-        fontName='Helvetica-Bold'
-    )
-    
-    # Container para elementos del PDF
-    elements = []
-    
-    # === HEADER ===
-    header_data = [
-        [Paragraph("🏦 WEALTH SOLUTIONS ADVISOR", title_style)],
-        [Paragraph("PRE-MEETING BRIEF", subtitle_style)],
-    ]
-    header_table = Table(header_data, colWidths=[6.5*inch])
-    header_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#f5f7fa')),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('TOPPADDING', (0, 0), (-1, -1), 15),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 15),
-    ]))
-    elements.append(header_table)
-    elements.append(Spacer(1, 20))
-    
-    # === METADATA ===
-    metadata_data = [
-        [Paragraph("<b>Cliente:</b>", normal_style), Paragraph(target_email, normal_style)],
-        [Paragraph("<b>Fecha:</b>", normal_style), Paragraph(datetime.now().strftime('%d/%m/%Y %H:%M'), normal_style)],
-        [Paragraph("<b>Tipo:</b>", normal_style), Paragraph("Pre-Meeting Brief Ejecutivo", normal_style)],
-    ]
-    metadata_table = Table(metadata_data, colWidths=[1.5*inch, 5*inch])
-    metadata_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#e3f2fd')),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#90caf9')),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('TOPPADDING', (0, 0), (-1, -1), 8),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-        ('LEFTPADDING', (0, 0), (-1, -1), 10),
-    ]))
-    elements.append(metadata_table)
-    elements.append(Spacer(1, 25))
-    
-    # === CONTEXTO RÁPIDO ===
-    elements.append(Paragraph("📋 CONTEXTO RÁPIDO", subtitle_style))
-    contexto_box = Table(
-        [[Paragraph(brief_data.get('contexto_rapido', 'N/A'), normal_style)]],
-        colWidths=[6.5*inch]
-    )
-    contexto_box.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#e8f5e9')),
-        ('BOX', (0, 0), (-1, -1), 2, colors.HexColor('#4caf50')),
-        ('TOPPADDING', (0, 0), (-1, -1), 15),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 15),
-        ('LEFTPADDING', (0, 0), (-1, -1), 15),
-        ('RIGHTPADDING', (0, 0), (-1, -1), 15),
-    ]))
-    elements.append(contexto_box)
-    elements.append(Spacer(1, 20))
-    
-    # === TEMAS DE REUNIÓN ===
-    elements.append(Paragraph("📌 AGENDA DE REUNIÓN", subtitle_style))
-    
-    temas = brief_data.get('temas_reunion', [])
-    for idx, tema in enumerate(temas[:5], 1):
-        prioridad = tema.get('prioridad', 'INFORMATIVO')
-        
-        # Color según prioridad
-        if prioridad == 'URGENTE':
-            color_bg = colors.HexColor('#ffebee')
-            color_border = colors.HexColor('#d32f2f')
-        elif prioridad == 'IMPORTANTE':
-            color_bg = colors.HexColor('#fff3e0')
-            color_border = colors.HexColor('#f57c00')
-        else:
-            color_bg = colors.HexColor('#e3f2fd')
-            color_border = colors.HexColor('#1976d2')
-        
-        tema_content = [
-            [Paragraph(f"<b>{idx}. {tema.get('tema', 'N/A')}</b> [{prioridad}]", normal_style)],
-            [Paragraph(tema.get('detalle', 'N/A'), normal_style)],
-            [Paragraph(f"<i>💡 {tema.get('contexto', 'N/A')}</i>", normal_style)],
-        ]
-        tema_table = Table(tema_content, colWidths=[6.5*inch])
-        tema_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, -1), color_bg),
-            ('BOX', (0, 0), (-1, -1), 2, color_border),
-            ('TOPPADDING', (0, 0), (-1, -1), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
-            ('LEFTPADDING', (0, 0), (-1, -1), 12),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 12),
-        ]))
-        elements.append(tema_table)
-        elements.append(Spacer(1, 10))
-    
-    elements.append(Spacer(1, 15))
-    
-    # === PENDIENTES (2 columnas) ===
-    elements.append(Paragraph("⚠️ PENDIENTES", subtitle_style))
-    
-    # Preparar pendientes del cliente
-    pendientes_cliente_list = brief_data.get('pendientes_cliente', [])
-    cliente_text = "<br/>".join([f"• {p}" for p in pendientes_cliente_list[:5]]) if pendientes_cliente_list else "✅ Ninguno"
-    
-    # Preparar pendientes del banco
-    pendientes_banco_list = brief_data.get('pendientes_banco', [])
-    banco_text = "<br/>".join([f"• {p}" for p in pendientes_banco_list[:5]]) if pendientes_banco_list else "✅ Ninguno"
-    
-    pendientes_data = [
-        [Paragraph("<b>👤 Cliente</b>", normal_style), Paragraph("<b>🏦 Banco</b>", normal_style)],
-        [Paragraph(cliente_text, normal_style), Paragraph(banco_text, normal_style)],
-    ]
-    pendientes_table = Table(pendientes_data, colWidths=[3.25*inch, 3.25*inch])
-    pendientes_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (0, 0), colors.HexColor('#ffebee')),
-        ('BACKGROUND', (1, 0), (1, 0), colors.HexColor('#e3f2fd')),
-        ('BACKGROUND', (0, 1), (0, 1), colors.HexColor('#fff5f5')),
-        ('BACKGROUND', (1, 1), (1, 1), colors.HexColor('#f5f9ff')),
-        ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#cfd8dc')),
-        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-        ('TOPPADDING', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
-        ('LEFTPADDING', (0, 0), (-1, -1), 10),
-        ('RIGHTPADDING', (0, 0), (-1, -1), 10),
-    ]))
-    elements.append(pendientes_table)
-    elements.append(Spacer(1, 20))
-    
-    # === TALKING POINTS ===
-    elements.append(Paragraph("🎤 TALKING POINTS SUGERIDOS", subtitle_style))
-    
-    talking_points = brief_data.get('talking_points', [])
-    for idx, point in enumerate(talking_points[:3], 1):
-        point_table = Table(
-            [[Paragraph(f'<b>{idx}.</b> "{point}"', normal_style)]],
-            colWidths=[6.5*inch]
-        )
-        point_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#f3e5f5')),
-            ('BOX', (0, 0), (-1, -1), 1, colors.HexColor('#9c27b0')),
-            ('TOPPADDING', (0, 0), (-1, -1), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
-            ('LEFTPADDING', (0, 0), (-1, -1), 12),
-        ]))
-        elements.append(point_table)
-        elements.append(Spacer(1, 8))
-    
-    elements.append(Spacer(1, 15))
-    
-    # === TIMELINE ===
-    elements.append(Paragraph("⏰ TIMELINE RECIENTE", subtitle_style))
-    
-    timeline_data = [["Fecha", "Quién", "Qué Pasó"]]
-    for item in brief_data.get('timeline_reciente', [])[:5]:
-        timeline_data.append([
-            item.get('fecha', 'N/A'),
-            item.get('quien', 'N/A'),
-            item.get('que_paso', 'N/A')[:80] + "..." if len(item.get('que_paso', '')) > 80 else item.get('que_paso', 'N/A')
-        ])
-    
-    timeline_table = Table(timeline_data, colWidths=[0.8*inch, 0.8*inch, 4.9*inch])
-    timeline_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#004e98')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 10),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f5f5f5')]),
-        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-        ('TOPPADDING', (0, 0), (-1, -1), 8),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-        ('LEFTPADDING', (0, 0), (-1, -1), 8),
-    ]))
-    elements.append(timeline_table)
-    
-    # === FOOTER ===
-    elements.append(Spacer(1, 30))
-    footer_text = Paragraph(
-        "<i>Generado por Wealth Solutions Advisor | Documento confidencial</i>",
-        ParagraphStyle('Footer', parent=styles['Normal'], fontSize=9, textColor=colors.grey, alignment=TA_CENTER)
-    )
-    elements.append(footer_text)
-    
-    # Construir el PDF
-    doc.build(elements)
-    
-    return output_path
-
 # --- CONFIGURACIÓN ---
 st.set_page_config(
     page_title="Wealth Solutions Advisor",
@@ -777,38 +437,46 @@ st.markdown("""
 
 # --- CREDENCIALES ---
 try:
-    OPENAI_API_KEY = st.secrets["OPENAI_KEY"]
+    ENGINE_CONFIG = EngineConfig.from_mapping(st.secrets)
 except Exception:
+    ENGINE_CONFIG = None
+
+if not ENGINE_CONFIG or not ENGINE_CONFIG.openai_api_key:
     st.error("⚠️ Error: No se encontró OPENAI_KEY en secrets.toml")
     st.stop()
 
 CLIENT_SECRETS_FILE = "client_secret.json"
-SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
 REDIRECT_URI = "https://wealth-solutions-advisor.streamlit.app/"
-HISTORY_FILE = "client_history.json" # Archivo donde guardaremos los emails
 
-# --- GESTIÓN DE HISTORIAL (NUEVO) ---
-def load_history():
-    """Carga la lista de clientes previos"""
-    if os.path.exists(HISTORY_FILE):
-        with open(HISTORY_FILE, "r") as f:
+# --- FUNCIONES AUTH ---
+def load_client_config():
+    """
+    Configuración OAuth de Google desde el secreto GOOGLE_CREDENTIALS (JSON o
+    tabla TOML). En local sirve también un client_secret.json; ya no se
+    escribe a disco en cada arranque.
+    """
+    try:
+        google_creds = st.secrets["GOOGLE_CREDENTIALS"]
+        if isinstance(google_creds, str):
+            return json.loads(google_creds)
+        return {k: dict(v) if hasattr(v, 'items') else v for k, v in google_creds.items()}
+    except (KeyError, FileNotFoundError, ValueError):
+        pass
+    if os.path.exists(CLIENT_SECRETS_FILE):
+        with open(CLIENT_SECRETS_FILE, encoding="utf-8") as f:
             return json.load(f)
-    return []
-
-def save_to_history(email):
-    """Guarda un nuevo email en el historial sin duplicados"""
-    history = load_history()
-    if email not in history:
-        history.insert(0, email) # Añadir al principio
-        with open(HISTORY_FILE, "w") as f:
-            json.dump(history, f)
+    return None
 
-# --- FUNCIONES AUTH ---
 def create_auth_flow():
+    from google_auth_oauthlib.flow import Flow  # Solo la pantalla de OAuth lo necesita
+    client_config = load_client_config()
+    if not client_config:
+        st.error("No se encontró el secreto GOOGLE_CREDENTIALS en la configuración.")
+        return None
     try:
-        return Flow.from_client_secrets_file(CLIENT_SECRETS_FILE, scopes=SCOPES, redirect_uri=REDIRECT_URI)
+        return Flow.from_client_config(client_config, scopes=SCOPES, redirect_uri=REDIRECT_URI)
     except Exception as e:
-        st.error(f"Error client_secret.json: {e}")
+        st.error(f"Error en GOOGLE_CREDENTIALS: {e}")
         return None
 
 def authorize_google():
@@ -828,552 +496,1756 @@ def exchange_code(code):
         st.error(f"Error auth: {e}")
     return None
 
-# --- MOTOR GMAIL ---
-def parse_email_body(payload):
-    body = ""
-    if 'parts' in payload:
-        for part in payload['parts']:
-            if part['mimeType'] == 'text/plain':
-                if 'data' in part['body']:
-                    body = base64.urlsafe_b64decode(part['body']['data']).decode('utf-8', errors='ignore')
-                    break
-            elif 'parts' in part:
-                body = parse_email_body(part)
-                if body: break
-    elif 'body' in payload and 'data' in payload['body']:
-        body = base64.urlsafe_b64decode(payload['body']['data']).decode('utf-8', errors='ignore')
-    return body
-
-def get_emails(creds, target_email, num_emails=None, fecha_desde=None, fecha_hasta=None):
+
+def get_credential_manager():
+    """
+    Gestor de las credenciales de la sesión (lo crea al entrar y programa la
+    renovación del token antes de que caduque).
+    """
+    auth = st.session_state.get('auth')
+    if auth is None or auth.credentials is not st.session_state.creds:
+        if auth is not None:
+            auth.stop()
+        auth = CredentialManager(st.session_state.creds)
+        auth.start()
+        st.session_state.auth = auth
+    return auth
+
+
+def session_credentials():
+    """
+    Credenciales para lanzar una tarea, renovadas si caducan en pocos minutos.
+    Si la sesión de Google ya no se puede renovar, vuelve a la pantalla de login.
+    """
+    creds, err = get_credential_manager().fresh()
+    if err:
+        logout_google(err)
+    return creds
+
+
+def logout_google(message=None):
+    """Olvida las credenciales de Google de la sesión y relanza la app."""
+    auth = st.session_state.pop('auth', None)
+    if auth is not None:
+        auth.stop()
+    st.session_state.creds = None
+    if message:
+        st.session_state.auth_notice = message
+    st.rerun()
+
+# --- MOTOR DE ANÁLISIS ---
+# Toda la lógica de negocio vive en el paquete advisor (sin Streamlit); la app
+# solo le inyecta la configuración de st.secrets y una caché de proceso.
+
+@st.cache_resource
+def get_engine():
+    """Motor compartido por todas las sesiones del proceso."""
+    from advisor.engine import AdvisorEngine  # Arrastra OpenAI, pandas y Gmail: solo tras el login
+    return AdvisorEngine(ENGINE_CONFIG, cache=MemoryCache(max_entries=256))
+
+# =============================================================================
+# TAREAS EN SEGUNDO PLANO
+# =============================================================================
+
+@st.cache_resource
+def get_job_manager():
+    """Pool de tareas compartido por todas las sesiones del proceso."""
+    return JobManager(max_workers=4)
+
+
+@st.cache_resource
+def get_client_registry():
+    """Cartera de clientes compartida por todas las sesiones (SQLite en modo WAL)."""
+    return ClientRegistry(ENGINE_CONFIG.registry_path, legacy_path=ENGINE_CONFIG.history_file)
+
+
+@st.cache_resource
+def get_portfolio_matrix():
+    """Matriz de sentimiento de la cartera (arrays mapeados en disco, advisor.portfolio)."""
+    from advisor.portfolio import PortfolioMatrix
+    
+    return PortfolioMatrix(ENGINE_CONFIG.portfolio_path, get_client_registry())
+
+
+@st.cache_resource
+def get_alert_store():
+    """Alertas del escáner incremental (advisor.alerts), compartidas por todas las sesiones."""
+    from advisor.alerts import AlertStore
+    
+    return AlertStore(ENGINE_CONFIG.alerts_path)
+
+
+@st.cache_resource
+def get_work_queue():
+    """Cola de trabajo del precálculo de la cartera (advisor.workqueue)."""
+    return WorkQueue(ENGINE_CONFIG.queue_path)
+
+
+@st.cache_resource
+def get_client_picker():
+    """Índice de búsqueda de la cartera (se reconstruye solo si el registro cambia)."""
+    return ClientPicker(get_client_registry())
+
+
+def add_client_alias(email):
+    """Callback del botón de la ficha: añade la dirección o alias escrito."""
+    ok, err = get_client_registry().add_alias(email, st.session_state.get('new_client_alias', ''))
+    st.session_state.client_alias_error = err
+    if ok:
+        st.session_state.new_client_alias = ""
+
+
+def render_client_addresses(email):
+    """Direcciones y alias del cliente: todas se descargan en una sola consulta."""
+    client = get_client_registry().get(email) or {'aliases': []}
+    addresses = [a for a in client['aliases'] if '@' in a]
+    names = [a for a in client['aliases'] if '@' not in a]
+    title = f"✉️ Direcciones ({len(addresses) + 1})" if addresses else "✉️ Direcciones y alias"
+    with st.expander(title, expanded=False):
+        st.caption("Principal: " + email)
+        for address in addresses:
+            st.caption("También: " + address)
+        if names:
+            st.caption("Alias: " + ", ".join(names))
+        st.text_input(
+            "Añadir dirección o alias",
+            key="new_client_alias",
+            placeholder="asistente@familyoffice.com",
+            label_visibility="collapsed"
+        )
+        st.button("➕ Añadir", key="add_client_alias", use_container_width=True,
+                  on_click=add_client_alias, args=(email,))
+        if st.session_state.get('client_alias_error'):
+            st.caption(st.session_state.client_alias_error)
+
+
+def save_client_group():
+    """Callback del formulario de grupos: guarda el grupo escrito."""
+    members = []
+    for line in st.session_state.get('new_group_members', '').splitlines():
+        email, _, role = line.partition(',')
+        if email.strip():
+            members.append((email.strip(), role.strip()))
+    ok, err = get_client_registry().save_group(st.session_state.get('new_group_name', ''), members)
+    st.session_state.client_group_error = err
+    if ok:
+        st.session_state.selected_group = st.session_state.new_group_name.strip()
+        st.session_state.new_group_name = ""
+        st.session_state.new_group_members = ""
+
+
+def render_group_panel():
+    """Grupos familiares: un solo análisis con el correo de todos los miembros."""
+    registry = get_client_registry()
+    groups = registry.groups()
+    with st.expander(f"👪 Grupos familiares ({len(groups)})", expanded=False):
+        if groups:
+            if st.session_state.get('selected_group') not in groups:
+                st.session_state.selected_group = groups[0]
+            group = st.selectbox("Grupo", groups, key="selected_group", label_visibility="collapsed")
+            members = registry.group(group)
+            for member in members:
+                st.caption(f"{member['email']}" + (f" · {member['role']}" if member['role'] else ""))
+            if st.button("🚀 Analizar grupo", key="analyze_group", use_container_width=True):
+                st.session_state.pending_group = group
+        
+        st.markdown("**Nuevo grupo**")
+        st.text_input("Nombre", key="new_group_name", placeholder="Familia García")
+        st.text_area(
+            "Miembros (uno por línea: email, rol)",
+            key="new_group_members",
+            placeholder="ana@garcia.com, titular\nluis@garcia.com, cónyuge\nfo@holdinggarcia.com, holding"
+        )
+        st.button("💾 Guardar grupo", key="save_group", use_container_width=True, on_click=save_client_group)
+        if st.session_state.get('client_group_error'):
+            st.caption(st.session_state.client_group_error)
+
+
+def start_alert_scan(force=False):
+    """
+    Lanza el escáner de alertas en segundo plano: al entrar (una vez por sesión
+    y si la última pasada sobre el buzón tiene más de ALERT_SCAN_MINUTES) o
+    desde el botón del panel.
+    """
+    if st.session_state.get('alert_scan_job'):
+        return
+    account = st.session_state.get('user_email')
+    if not force:
+        if st.session_state.get('alert_scan_checked') or not account:
+            return
+        st.session_state.alert_scan_checked = True
+        last_scan = get_alert_store().last_scan(account)
+        if last_scan and time.time() - last_scan < ALERT_SCAN_MINUTES * 60:
+            return
+    job = get_job_manager().submit(
+        run_alert_scan_job,
+        get_engine(),
+        session_credentials(),
+        get_client_registry(),
+        get_alert_store(),
+        kind="alerts",
+        label="Escáner de alertas"
+    )
+    st.session_state.alert_scan_job = job.id
+
+
+def render_alerts_panel():
+    """Alertas abiertas de la cartera y estado del escáner (fragmento del sidebar)."""
+    from advisor.alerts import ALERT_LABELS
+    
+    store = get_alert_store()
+    job = None
+    if st.session_state.get('alert_scan_job'):
+        job = get_job_manager().get(st.session_state.alert_scan_job)
+        if job is None or job.finished:
+            st.session_state.alert_scan_job = None
+            if job is not None:
+                st.session_state.alert_scan_result = job.result if job.status == JOB_DONE else {
+                    'error': "❌ El escáner de alertas se detuvo antes de terminar.", 'warning': None
+                }
+            # Rerun completo: deja de refrescarse y pinta las alertas nuevas
+            st.rerun()
+    
+    open_alerts = store.open_alerts()
+    with st.expander(f"🔔 Alertas ({len(open_alerts)})", expanded=bool(open_alerts)):
+        for alert in open_alerts:
+            col_text, col_ack = st.columns([5, 1])
+            col_text.markdown(f"**{ALERT_LABELS.get(alert['kind'], alert['kind'])}** · {alert['client']}")
+            col_text.caption(f"{alert['detail']} · {datetime.fromtimestamp(alert['created_at']):%d/%m %H:%M}")
+            col_ack.button("✓", key=f"ack_alert_{alert['id']}", help="Marcar como vista",
+                           on_click=store.acknowledge, kwargs={'alert_id': alert['id']})
+        if not open_alerts:
+            st.caption("Sin alertas abiertas.")
+        
+        outcome = st.session_state.get('alert_scan_result')
+        if job is not None:
+            st.caption(f"🔄 {job.message or 'Buscando correo nuevo...'}")
+        elif outcome and outcome.get('error'):
+            st.caption(outcome['error'])
+        else:
+            last_scan = store.last_scan(st.session_state.get('user_email') or "")
+            if last_scan:
+                st.caption(f"Última revisión del correo: {datetime.fromtimestamp(last_scan):%d/%m %H:%M}")
+            if outcome and outcome.get('warning'):
+                st.caption(f"⚠️ {outcome['warning']}")
+        if st.button("🔄 Buscar correo nuevo", key="scan_alerts", use_container_width=True, disabled=job is not None):
+            start_alert_scan(force=True)
+            st.rerun()
+
+
+def move_client_page(step):
+    """Callback de los botones Anterior / Siguiente de la Cartera."""
+    st.session_state.client_page = max(0, st.session_state.get('client_page', 0) + step)
+
+
+def render_client_picker():
     """
-    Obtiene y procesa emails de Gmail con manejo robusto de errores.
+    Selector de la Cartera de Clientes: solo viaja al navegador la página de
+    coincidencias de la búsqueda (las urgentes y recientes primero).
+    
+    Returns:
+        str: email elegido o "Nuevo Búsqueda"
+    """
+    search_text = st.text_input(
+        "Buscar cliente:",
+        key="client_search",
+        placeholder="Email, nombre o alias",
+        help="Busca por el principio de cualquier palabra del email o de un alias; tolera erratas"
+    )
+    if st.session_state.get('client_search_sig') != search_text:
+        st.session_state.client_search_sig = search_text
+        st.session_state.client_page = 0
+    
+    picker = get_client_picker()
+    page = st.session_state.get('client_page', 0)
+    matches, total = picker.search(search_text, page=page)
+    pages = max(1, -(-total // CLIENT_PAGE_SIZE))
+    if page >= pages:
+        page = st.session_state.client_page = pages - 1
+        matches, total = picker.search(search_text, page=page)
+    
+    # El cliente elegido se mantiene aunque no esté en la página visible
+    picked = st.session_state.get('picked_client')
+    labels = {m.email: m.label() for m in matches}
+    options = ["Nuevo Búsqueda"] + list(labels)
+    if picked and picked not in labels:
+        options.insert(1, picked)
+    selected = st.selectbox(
+        "Seleccionar cliente:",
+        options,
+        index=options.index(picked) if picked in options else 0,
+        format_func=lambda email: labels.get(email, email)
+    )
+    st.session_state.picked_client = None if selected == "Nuevo Búsqueda" else selected
+    
+    if total > CLIENT_PAGE_SIZE:
+        c_prev, c_info, c_next = st.columns([1, 2, 1])
+        c_prev.button("◀", key="client_prev", use_container_width=True,
+                      disabled=page == 0, on_click=move_client_page, args=(-1,))
+        c_info.caption(f"{page * CLIENT_PAGE_SIZE + 1}–{min(total, (page + 1) * CLIENT_PAGE_SIZE)} de {total}")
+        c_next.button("▶", key="client_next", use_container_width=True,
+                      disabled=page >= pages - 1, on_click=move_client_page, args=(1,))
+    elif search_text and not total:
+        st.caption("Sin coincidencias en la cartera")
+    return selected
+
+
+@st.cache_resource
+def get_memory_budget():
+    """Contabilidad de memoria compartida por todas las sesiones del proceso."""
+    return MemoryBudget(
+        session_limit_mb=st.secrets.get("SESSION_MEMORY_MB", 150),
+        process_limit_mb=st.secrets.get("PROCESS_MEMORY_MB", 1024),
+        spill_dir=st.secrets.get("SPILL_DIR", SPILL_DIR)
+    )
+
+
+def mode_params(mode, email_count=None, fecha_desde=None, fecha_hasta=None):
+    """Traduce el modo del sidebar a los parámetros de get_emails."""
+    if mode == "📊 Por número de emails":
+        return {'num_emails': email_count, 'fecha_desde': None, 'fecha_hasta': None}
+    return {'num_emails': None, 'fecha_desde': fecha_desde, 'fecha_hasta': fecha_hasta}
+
+
+def wait_for_prefetch(job, prefetch_job):
+    """
+    Espera a que termine una precarga y devuelve su (ev, err).
+    
+    Returns:
+        tuple o None si la precarga se canceló o falló (hay que descargar de nuevo)
+    """
+    while not prefetch_job.finished:
+        job.check_cancelled()
+        job.update(message=f"♻️ Completando precarga ({prefetch_job.message})")
+        time.sleep(0.2)
+    
+    if prefetch_job.status != JOB_DONE:
+        return None
+    return prefetch_job.result['emails']
+
+
+def run_prefetch_job(job, engine, creds, target_email, mode, email_count=None, fecha_desde=None, fecha_hasta=None, warm_ai=False,
+                     addresses=None):
+    """
+    Precarga especulativa: descarga los emails del cliente seleccionado y,
+    si se pide, deja caliente la caché de análisis del motor.
+    
+    Returns:
+        dict: {'emails': (ev, err), 'ai_warmed': bool}
+    """
+    def on_fetch_progress(done, total):
+        job.update(0.7 * done / max(total, 1), f"📥 {done}/{total} emails")
+    
+    ev, err = engine.fetch_emails(
+        creds, target_email, progress_callback=on_fetch_progress, addresses=addresses,
+        **mode_params(mode, email_count, fecha_desde, fecha_hasta)
+    )
+    
+    ai_warmed = False
+    if warm_ai and ev and not err:
+        job.update(0.75, "🤖 Precalculando análisis IA")
+        engine.analyze(ev.prompt_text(), len(ev))
+        ai_warmed = True
+    
+    job.update(1.0, "Listo")
+    return {'emails': (ev, err), 'ai_warmed': ai_warmed}
+
+
+def run_analysis_job(job, engine, creds, target_email, mode, email_count=None, fecha_desde=None, fecha_hasta=None, prefetch_job=None,
+                     addresses=None):
+    """
+    Ejecuta engine.analyze_client fuera del hilo del script de Streamlit.
+    
+    No debe llamar a funciones de UI (st.*): el resultado se recoge desde la
+    sesión con collect_finished_jobs(). Si recibe una precarga del mismo
+    cliente y parámetros, reutiliza sus emails en lugar de descargarlos.
+    
+    Returns:
+        dict: {'results': dict para analysis_results o None, 'target_email',
+               'error': aviso de Gmail o None, 'ai_error': motivo del modo básico o None}
+    """
+    prefetched = wait_for_prefetch(job, prefetch_job) if prefetch_job else None
+    
+    outcome = engine.analyze_client(
+        creds,
+        target_email,
+        prefetched=prefetched,
+        progress=job.update,
+        addresses=addresses,
+        **mode_params(mode, email_count, fecha_desde, fecha_hasta)
+    )
+    
+    return analysis_job_result(job, outcome, target_email, mode, email_count, fecha_desde, fecha_hasta)
+
+
+def run_group_job(job, engine, creds, group_name, members, mode, email_count=None, fecha_desde=None, fecha_hasta=None):
+    """
+    Análisis de un grupo familiar: descarga a la vez el correo de todos los
+    miembros (reutilizando el precálculo o descargas recientes) y hace un solo
+    análisis sobre la evidencia unida.
     
     Args:
-        creds: Credenciales de Google OAuth
-        target_email: Email del cliente a buscar
-        num_emails: Número de emails a obtener (modo cantidad)
-        fecha_desde: Fecha inicio (modo rango)
-        fecha_hasta: Fecha fin (modo rango)
+        members: Lista de (email del miembro, sus direcciones)
     
     Returns:
-        tuple: (texto_completo, lista_evidencia, mensaje_error)
+        dict: igual que run_analysis_job; los resultados llevan 'group' y 'members'
     """
+    outcome = engine.analyze_group(
+        creds,
+        group_name,
+        members,
+        progress=job.update,
+        **mode_params(mode, email_count, fecha_desde, fecha_hasta)
+    )
+    result = analysis_job_result(
+        job, outcome, members[0][0], mode, email_count, fecha_desde, fecha_hasta, group=group_name
+    )
+    result['warning'] = outcome.get('warning')
+    if result['results']:
+        result['results']['members'] = outcome['members']
+    return result
+
+
+def analysis_job_result(job, outcome, target_email, mode, email_count, fecha_desde, fecha_hasta, group=None):
+    """Resultado de una tarea de análisis (cliente o grupo) listo para la sesión."""
+    from advisor import query
+    from advisor.analytics import client_report
+    
+    if outcome['error'] or not outcome['evidence']:
+        return {'results': None, 'target_email': group or target_email, 'error': outcome['error'], 'ai_error': None}
     
-    # === VALIDACIONES PREVIAS ===
-    if not creds:
-        return None, None, "❌ Credenciales no válidas. Por favor, vuelve a iniciar sesión."
+    job.update(0.97, "🔎 Indexando emails para el Explorador...")
+    with telemetry.span("search.index", emails=len(outcome['evidence'])):
+        search_index = search.InvertedIndex(outcome['evidence'])
+        query_columns = query.EvidenceColumns(outcome['evidence'], outcome['analysis'])
+    with telemetry.span("analytics.client", emails=len(outcome['evidence'])):
+        relationship = client_report(group or target_email, query_columns)
     
-    if not target_email or '@' not in target_email:
-        return None, None, "❌ El email del cliente no es válido."
+    return {
+        'results': {
+            'analysis': outcome['analysis'],
+            'evidence': outcome['evidence'],
+            'target_email': target_email,
+            'analysis_mode': mode,
+            'email_count': email_count,
+            'fecha_desde': fecha_desde,
+            'fecha_hasta': fecha_hasta,
+            'precomputed_at': outcome['precomputed_at'],
+            'search_index': search_index,
+            'query_columns': query_columns,
+            'relationship': relationship,
+            'ranking': outcome['ranking'],
+            'group': group,
+            'snapshot': outcome.get('snapshot'),
+            'diff': outcome.get('diff')
+        },
+        'target_email': group or target_email,
+        'error': None,
+        'ai_error': outcome['ai_error']
+    }
+
+
+def run_alert_scan_job(job, engine, creds, registry, alerts):
+    """Una pasada del escáner de alertas en segundo plano (solo el correo nuevo)."""
+    return engine.scan_alerts(creds, registry, alerts, progress=job.update)
+
+
+def run_history_job(job, engine, creds, target_email, years=HISTORY_YEARS, addresses=None):
+    """
+    Análisis del historial completo del cliente en segundo plano.
+    
+    Returns:
+        dict: {'results': dict para history_results o None, 'target_email',
+               'error': motivo si no hay análisis, 'warning': periodos que fallaron}
+    """
+    outcome = engine.full_history(creds, target_email, years=years, addresses=addresses, progress=job.update)
+    if outcome['error'] or not outcome['history']:
+        return {'results': None, 'target_email': target_email, 'error': outcome['error'], 'warning': outcome['warning']}
+    return {
+        'results': {
+            'history': outcome['history'],
+            'periods': outcome['periods'],
+            'target_email': target_email,
+            'years': years,
+            'months': outcome['months'],
+            'emails': outcome['emails'],
+            'new_summaries': outcome['new_summaries'],
+            'timings': outcome['timings']
+        },
+        'target_email': target_email,
+        'error': None,
+        'warning': outcome['warning']
+    }
+
+
+def run_brief_job(job, engine, creds, target_email, evidence=None, num_emails=15, addresses=None):
+    """
+    Genera el Pre-Meeting Brief y su PDF en segundo plano.
+    
+    Reutiliza la evidencia del análisis en pantalla si se recibe; si no, el
+    motor sirve el precálculo nocturno o hace un análisis rápido de num_emails.
+    
+    Returns:
+        dict: {'pdf_bytes', 'pdf_filename'} o {'error': argumentos para show_error_box}
+              o {'empty': True} si no hay emails
+    """
+    import traceback
     
-    # === LÍMITES DE SEGURIDAD ===
-    MAX_EMAILS_ALLOWED = 500  # Límite absoluto
-    MAX_CHARS_TOTAL = 100000  # Límite de caracteres para IA
+    outcome = engine.client_brief(
+        creds, target_email, evidence=evidence, num_emails=num_emails, progress=job.update, addresses=addresses
+    )
+    job.check_cancelled()
+    
+    if outcome['fetch_error']:
+        return {'error': {
+            'title': "Error al obtener emails",
+            'message': outcome['fetch_error'],
+            'suggestions': [
+                "Verifica que el email esté bien escrito",
+                "Asegúrate de tener permisos en Gmail"
+            ]
+        }}
+    
+    if outcome['empty']:
+        return {'empty': True, 'target_email': target_email}
+    
+    if outcome['error']:
+        return {'error': {
+            'title': "Error al generar el brief",
+            'message': outcome['error'],
+            'suggestions': [
+                "Verifica tu conexión con OpenAI",
+                "Intenta con menos emails"
+            ]
+        }}
     
+    # === GENERAR PDF ===
+    job.update(0.85, "🖨️ Generando PDF del Brief...")
     try:
-        # Construcción del servicio con timeout
-        service = build('gmail', 'v1', credentials=creds)
+        pdf_filename = f"brief_{target_email.replace('@', '_')}_{datetime.now().strftime('%Y%m%d_%H%M')}.pdf"
+        pdf_bytes = engine.brief_pdf_bytes(outcome['brief'], target_email)
+    except Exception as e:
+        return {'error': {
+            'title': "Error al generar el PDF",
+            'message': f"No se pudo crear el documento: {str(e)}",
+            'details': traceback.format_exc(),
+            'suggestions': [
+                "Verifica que reportlab esté instalado",
+                "Reinicia Streamlit",
+                "Intenta de nuevo"
+            ]
+        }}
+    
+    return {'pdf_bytes': pdf_bytes, 'pdf_filename': pdf_filename, 'target_email': target_email}
+
+
+def collect_finished_jobs():
+    """
+    Pasa a la sesión el resultado de las tareas terminadas.
+    
+    Se ejecuta en cada rerun completo: las tareas en curso se quedan en
+    st.session_state.active_jobs y las terminadas generan avisos en job_notices.
+    """
+    manager = get_job_manager()
+    
+    for slot, job_id in list(st.session_state.active_jobs.items()):
+        job = manager.get(job_id)
         
-        # === CONSTRUIR QUERY ===
-        query = f"from:{target_email} OR to:{target_email}"
+        if job is None:
+            # El proceso se reinició o la tarea caducó
+            del st.session_state.active_jobs[slot]
+            continue
         
-        # Determinar modo y ajustar query
-        if fecha_desde and fecha_hasta:
-            # MODO FECHA
-            try:
-                fecha_desde_str = fecha_desde.strftime('%Y/%m/%d')
-                fecha_hasta_str = fecha_hasta.strftime('%Y/%m/%d')
-                query += f" after:{fecha_desde_str} before:{fecha_hasta_str}"
-                max_results = MAX_EMAILS_ALLOWED
-            except Exception as e:
-                return None, None, f"❌ Error en el formato de fechas: {str(e)}"
-        else:
-            # MODO CANTIDAD
-            if not num_emails:
-                num_emails = 15  # Default seguro
-            
-            # Validar límite
-            if num_emails > MAX_EMAILS_ALLOWED:
-                return None, None, f"❌ El límite máximo es {MAX_EMAILS_ALLOWED} emails. Solicitaste {num_emails}."
-            
-            max_results = num_emails
+        if not job.finished:
+            continue
         
-        # === LLAMADA A GMAIL API ===
-        try:
-            results = service.users().messages().list(
-                userId='me',
-                q=query,
-                maxResults=max_results
-            ).execute()
-        except Exception as api_error:
-            error_msg = str(api_error)
-            
-            # Errores comunes con mensajes amigables
-            if "invalid_grant" in error_msg.lower():
-                return None, None, "🔐 Tu sesión ha expirado. Por favor, cierra sesión y vuelve a autenticarte."
-            elif "insufficient permission" in error_msg.lower():
-                return None, None, "🔒 No tienes permisos suficientes en Gmail. Verifica tu configuración de OAuth."
-            elif "quota" in error_msg.lower():
-                return None, None, "⏳ Has alcanzado el límite de consultas de Gmail. Intenta de nuevo en unos minutos."
-            else:
-                return None, None, f"❌ Error al conectar con Gmail: {error_msg[:200]}"
+        del st.session_state.active_jobs[slot]
+        notices = st.session_state.job_notices
         
-        # === VERIFICAR RESULTADOS ===
-        messages = results.get('messages', [])
+        if job.status == JOB_CANCELLED:
+            notices.append({'type': 'info', 'title': "Tarea cancelada", 'message': job.label})
         
-        if not messages:
-            if fecha_desde and fecha_hasta:
-                return None, None, f"📭 No se encontraron emails entre el {fecha_desde.strftime('%d/%m/%Y')} y el {fecha_hasta.strftime('%d/%m/%Y')}."
-            else:
-                return None, None, f"📭 No se encontraron emails con {target_email}."
-        
-        # === PROCESAR EMAILS ===
-        full_text = ""
-        evidence = []
-        current_chars = 0
-        emails_procesados = 0
-        emails_con_error = 0
-        
-        for idx, msg in enumerate(messages):
-            # Límite de caracteres alcanzado
-            if current_chars >= MAX_CHARS_TOTAL:
-                break
+        elif job.status == JOB_ERROR:
+            # CAPTURA DE ERRORES INESPERADOS
+            notices.append({
+                'type': 'error',
+                'title': "Error técnico inesperado",
+                'message': "Ha ocurrido un error que no pudimos anticipar. Por favor, contacta a soporte.",
+                'details': job.error
+            })
+        
+        elif slot == 'analysis':
+            outcome = job.result
             
-            try:
-                # Obtener detalles del email
-                msg_detail = service.users().messages().get(
-                    userId='me', 
-                    id=msg['id'], 
-                    format='full'
-                ).execute()
-                
-                headers = msg_detail['payload']['headers']
-                
-                # Extraer metadata
-                subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), "Sin Asunto")
-                date_str = next((h['value'] for h in headers if h['name'].lower() == 'date'), "")
-                sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), "")
-                
-                # Parsear fecha
-                try:
-                    date_obj = parsedate_to_datetime(date_str)
-                    date_formatted = date_obj.strftime('%Y-%m-%d %H:%M')
-                    date_short = date_obj.strftime('%d %b')
-                except:
-                    date_formatted = date_str[:16] if date_str else "Fecha desconocida"
-                    date_short = "N/A"
-                
-                # Determinar origen
-                origin = "CLIENTE" if target_email.lower() in sender.lower() else "BANCO"
-                
-                # Extraer cuerpo
-                body = parse_email_body(msg_detail['payload'])
-                if not body:
-                    body = msg_detail.get('snippet', '[Sin contenido]')
+            if outcome['error']:
+                # === MANEJO DE ERRORES GMAIL ===
+                notices.append({
+                    'type': 'error',
+                    'title': "Error al obtener emails",
+                    'message': outcome['error'],
+                    'suggestions': [
+                        "Verifica que el email esté bien escrito",
+                        "Asegúrate de tener permisos en Gmail",
+                        "Si el problema persiste, cierra sesión y vuelve a autenticarte"
+                    ]
+                })
+            elif not outcome['results']:
+                # === SI NO HAY EMAILS ===
+                notices.append({
+                    'type': 'empty',
+                    'title': "No se encontraron emails",
+                    'message': f"No hay conversaciones con <strong>{outcome['target_email']}</strong> en el período seleccionado",
+                    'suggestions': [
+                        "Verifica que el email sea correcto",
+                        "Amplía el rango de fechas",
+                        'Prueba con "Por número de emails" en el sidebar'
+                    ]
+                })
+            else:
+                # === ÉXITO ===
+                st.session_state.analysis_results = outcome['results']
+                # La evidencia se vuelca sola a disco si la sesión o el proceso pasan de su límite
+                st.session_state.memory.put('evidence', outcome['results']['evidence'])
+                columns = outcome['results']['query_columns']
+                store_derived_indexes(outcome['results'])
+                num_ev = len(outcome['results']['evidence'])
+                if not outcome['results'].get('group'):
+                    get_client_registry().record_analysis(
+                        outcome['target_email'],
+                        outcome['results']['analysis'],
+                        emails_analyzed=num_ev,
+                        history_id=getattr(outcome['results']['evidence'], 'history_id', None),
+                        analyzed_at=outcome['results'].get('precomputed_at')
+                    )
+                    with telemetry.span("portfolio.record", emails=num_ev):
+                        get_portfolio_matrix().record(outcome['target_email'], columns)
                 
-                # Limitar longitud del cuerpo
-                body_cut = body[:3000]
+                if outcome.get('warning'):
+                    notices.append({'type': 'warning', 'title': "Grupo incompleto", 'message': outcome['warning'], 'tips': []})
                 
-                # Construir texto para IA
-                email_text = f"\n--- EMAIL {idx+1} ---\nID: {msg['id']}\nFECHA: {date_formatted}\nORIGEN: {origin}\nASUNTO: {subject}\nCONTENIDO: {body_cut}\n"
-                full_text += email_text
-                current_chars += len(email_text)
+                if outcome['ai_error']:
+                    notices.append({
+                        'type': 'warning',
+                        'title': "Modo Básico Activado",
+                        'message': f"<strong>Motivo:</strong> {outcome['ai_error']}",
+                        'tips': [
+                            f"Los {num_ev} emails se cargaron correctamente",
+                            'Usa el "Explorador Avanzado" para revisarlos manualmente',
+                            "El análisis de sentimiento se generará cuando OpenAI esté disponible"
+                        ]
+                    })
                 
-                # Guardar evidencia
-                evidence.append({
-                    "Nº": idx + 1,
-                    "Id_Completo": msg['id'],
-                    "Id": msg['id'][:8],
-                    "Fecha": date_formatted,
-                    "Fecha_Corta": date_short,
-                    "Origen": origin,
-                    "Asunto": subject[:60] + "..." if len(subject) > 60 else subject,
-                    "Asunto_Completo": subject,
-                    "Cuerpo": body
+                snapshot = outcome['results'].get('snapshot')
+                if outcome['results'].get('precomputed_at'):
+                    precomputed_time = datetime.fromtimestamp(outcome['results']['precomputed_at']).strftime('%d/%m %H:%M')
+                    notices.append({
+                        'type': 'success',
+                        'title': "Análisis cargado del precálculo nocturno",
+                        'message': f"Resultado calculado el {precomputed_time}. Los resultados ya están disponibles más abajo"
+                    })
+                elif snapshot and snapshot['reused']:
+                    snapshot_time = datetime.fromtimestamp(snapshot['created_at']).strftime('%d/%m %H:%M')
+                    notices.append({
+                        'type': 'success',
+                        'title': "Sin emails nuevos desde el último análisis",
+                        'message': f"Se ha recuperado el análisis del {snapshot_time} (versión {snapshot['version']}) sin volver a consultar a la IA"
+                    })
+                else:
+                    notices.append({
+                        'type': 'success',
+                        'title': "Análisis completado correctamente",
+                        'message': "Los resultados ya están disponibles más abajo"
+                    })
+        
+        elif slot == 'brief':
+            outcome = job.result
+            
+            if outcome.get('error'):
+                notices.append(dict(outcome['error'], type='error'))
+            elif outcome.get('empty'):
+                notices.append({
+                    'type': 'empty',
+                    'title': "No se encontraron emails",
+                    'message': f"No hay conversaciones con <strong>{outcome['target_email']}</strong>",
+                    'suggestions': ["Verifica que el email sea correcto"]
                 })
-                
-                emails_procesados += 1
-                
-            except Exception as email_error:
-                emails_con_error += 1
-                # Continuar con el siguiente email en lugar de fallar
-                continue
+            else:
+                st.session_state.brief_result = outcome
         
-        # === VALIDAR RESULTADOS ===
-        if not evidence:
-            return None, None, "❌ No se pudieron procesar los emails. Puede que estén vacíos o corruptos."
+        elif slot == 'history':
+            outcome = job.result
+            
+            if outcome['error']:
+                notices.append({
+                    'type': 'error',
+                    'title': "No se pudo analizar el historial completo",
+                    'message': outcome['error'],
+                    'suggestions': ["Verifica que el email sea correcto", "Prueba con menos años de historial"]
+                })
+            else:
+                st.session_state.history_results = outcome['results']
+                if outcome['warning']:
+                    notices.append({'type': 'warning', 'title': "Historial incompleto", 'message': outcome['warning'], 'tips': []})
+                new = outcome['results']['new_summaries']
+                notices.append({
+                    'type': 'success',
+                    'title': "Historial completo analizado",
+                    'message': f"{outcome['results']['emails']} emails en {outcome['results']['months']} meses"
+                               + (f" ({new} resúmenes nuevos)" if new else " (todos los resúmenes ya estaban guardados)")
+                })
+
+
+def render_job_notice(notice):
+    """Muestra un aviso generado por una tarea terminada."""
+    if notice['type'] == 'error':
+        show_error_box(notice['title'], notice['message'], details=notice.get('details'), suggestions=notice.get('suggestions'))
+    elif notice['type'] == 'warning':
+        show_warning_box(notice['title'], notice['message'], tips=notice.get('tips'))
+    elif notice['type'] == 'empty':
+        show_empty_state("📭", notice['title'], notice['message'], suggestions=notice.get('suggestions'))
+    elif notice['type'] == 'success':
+        show_success_box(notice['title'], notice['message'])
+    else:
+        show_info_box(notice['title'], notice['message'], icon="⏹️")
+
+
+def render_job_status():
+    """
+    Panel de progreso de las tareas activas de la sesión.
+    
+    Se ejecuta como fragmento con refresco periódico: solo esta zona se
+    redibuja mientras la tarea avanza. Cuando alguna termina, fuerza un rerun
+    completo para que collect_finished_jobs() publique el resultado.
+    """
+    manager = get_job_manager()
+    
+    for slot, job_id in list(st.session_state.active_jobs.items()):
+        job = manager.get(job_id)
         
-        # Invertir para tener orden cronológico
-        evidence.reverse()
+        if job is None or job.finished:
+            st.rerun()
         
-        # Mensaje de advertencia si hubo errores parciales
-        warning_msg = None
-        if emails_con_error > 0:
-            warning_msg = f"⚠️ Se procesaron {emails_procesados} emails correctamente. {emails_con_error} tuvieron errores y se omitieron."
+        if slot == 'analysis':
+            bg, border, title_color, text_color, icon = "#e3f2fd 0%, #bbdefb 100%", "#2196f3", "#0d47a1", "#1565c0", "📥"
+        else:
+            bg, border, title_color, text_color, icon = "#f3e5f5 0%, #e1bee7 100%", "#7b1fa2", "#4a148c", "#6a1b9a", "📄"
         
-        return full_text, evidence, warning_msg
-    
-    except Exception as e:
-        # CAPTURA DE ERRORES INESPERADOS
-        import traceback
-        error_detail = traceback.format_exc()
+        st.markdown(f"""
+<div style='background: linear-gradient(135deg, {bg}); padding: 20px; border-radius: 12px; border-left: 4px solid {border}; text-align: center;'>
+    <div style='font-size: 32px; margin-bottom: 10px;'>{icon}</div>
+    <h4 style='color: {title_color}; margin: 0 0 8px 0;'>{job.label}</h4>
+    <p style='color: {text_color}; margin: 0; font-size: 14px;'>
+        {job.message}<br>
+        <em style='font-size: 12px; opacity: 0.8;'>{job.elapsed:.0f}s · Puedes seguir navegando mientras tanto</em>
+    </p>
+</div>
+""", unsafe_allow_html=True)
         
-        return None, None, f"❌ Error técnico inesperado al obtener emails. Detalles: {str(e)[:300]}"
+        col_prog, col_cancel = st.columns([5, 1])
+        with col_prog:
+            st.progress(job.progress)
+        with col_cancel:
+            if st.button("⏹️ Cancelar", key=f"cancel_job_{job.id}", use_container_width=True):
+                manager.cancel(job.id)
+
 
-# --- IA ---
-@st.cache_data(show_spinner=False, ttl=3600)
-def analyze_with_ai(text_data, num_emails):
+# =============================================================================
+# RENDIMIENTO Y CONSUMO
+# =============================================================================
+
+def session_attribution(client=None):
+    """Atribuye las llamadas a la IA al cliente indicado y al usuario de la sesión."""
+    return attribution(client=client, user=st.session_state.get('user_email'))
+
+
+def summarize_trace(trace):
     """
-    Analiza emails con OpenAI GPT-4 con manejo robusto de errores.
-    
-    Args:
-        text_data: Texto concatenado de todos los emails
-        num_emails: Cantidad de emails analizados
+    Agrupa los spans repetidos de una traza (p.ej. un gmail.get por email).
     
     Returns:
-        tuple: (resultado_json, mensaje_error)
+        list: (profundidad, nombre, veces, ms_totales, tokens)
     """
-    
-    # === VALIDACIONES PREVIAS ===
-    if not text_data or not text_data.strip():
-        return None, "❌ No hay contenido de emails para analizar."
-    
-    if num_emails <= 0:
-        return None, "❌ El número de emails debe ser mayor a 0."
-    
-    # Validar que la API key existe
-    if not OPENAI_API_KEY or OPENAI_API_KEY == "":
-        return None, "🔑 Falta configurar OPENAI_KEY en secrets.toml"
-    
-    # === LÍMITE DE TOKENS ===
-    # GPT-4o tiene límite de contexto. Vamos a truncar si es necesario
-    MAX_CHARS_FOR_AI = 80000  # Margen de seguridad
-    
-    if len(text_data) > MAX_CHARS_FOR_AI:
-        text_data = text_data[:MAX_CHARS_FOR_AI]
-        text_data += "\n\n[NOTA: Contenido truncado por límite de tokens]"
-    
-    # === CONSTRUCCIÓN DEL PROMPT ===
-    prompt = f"""
-    Actúa como un Senior Private Banker. Analiza el historial de {num_emails} correos.
-    
-    OBJETIVO 1: NARRATIVA. Genera un campo 'resumen_exhaustivo' (6-8 líneas) contando la historia de la conversación.
-    OBJETIVO 2: SENTIMIENTO. Analiza CADA UNO de los {num_emails} correos y asigna un score (-10 a +10).
-    
-    JSON Estricto:
-    {{
-        "resumen_exhaustivo": "Texto narrativo...",
-        "urgencia": "Alta|Media|Baja",
-        "perfil_cliente": "Estado actual...",
-        "accion_recomendada": "Acción comercial...",
-        "borrador_respuesta": "Email...",
-        "analisis_sentimiento": [
-            {{ "email_num": 1, "sentimiento_score": 5, "explicacion": "..." }},
-            ... (UN OBJETO POR CADA EMAIL) ...
-            {{ "email_num": {num_emails}, "sentimiento_score": -2, "explicacion": "..." }}
-        ],
-        "insights_clave": ["Insight 1", "Insight 2"]
-    }}
+    rows = []
+    for depth, span in trace:
+        tokens = span.attributes.get("gen_ai.usage.input_tokens", 0) + span.attributes.get("gen_ai.usage.output_tokens", 0)
+        if rows and rows[-1][0] == depth and rows[-1][1] == span.name:
+            _, name, count, total_ms, total_tokens = rows[-1]
+            rows[-1] = (depth, name, count + 1, total_ms + span.duration_ms, total_tokens + tokens)
+        else:
+            rows.append((depth, span.name, 1, span.duration_ms, tokens))
+    return rows
+
+
+def render_performance_panel():
+    """Panel lateral con los percentiles por etapa y la última traza."""
+    import pandas as pd
+    
+    with st.expander("⏱️ Rendimiento", expanded=False):
+        stats = telemetry.tracer.stage_stats()
+        if not stats:
+            st.caption("Sin mediciones todavía: lanza un análisis.")
+            return
+        
+        st.caption("Tiempos por etapa (todas las sesiones del servidor)")
+        df_stats = pd.DataFrame(stats).rename(columns={
+            'stage': 'Etapa', 'count': 'N', 'p50_ms': 'p50 ms', 'p95_ms': 'p95 ms', 'max_ms': 'máx ms', 'tokens': 'Tokens'
+        })
+        st.dataframe(df_stats, hide_index=True, use_container_width=True)
+        
+        trace = telemetry.tracer.last_trace()
+        if trace:
+            st.markdown("**Última traza**")
+            lines = []
+            for depth, name, count, total_ms, tokens in summarize_trace(trace):
+                label = f"{name} ×{count}" if count > 1 else name
+                extra = f" · {tokens} tokens" if tokens else ""
+                lines.append(f"{'  ' * depth}{label}: {total_ms:,.0f} ms{extra}")
+            st.code("\n".join(lines), language=None)
+        
+        col_export, col_clear = st.columns(2)
+        with col_export:
+            st.download_button(
+                "📥 JSONL",
+                data=telemetry.tracer.export_jsonl(),
+                file_name=f"trazas_{datetime.now().strftime('%Y%m%d_%H%M')}.jsonl",
+                mime="application/x-ndjson",
+                use_container_width=True
+            )
+        with col_clear:
+            if st.button("🧹 Limpiar", key="clear_traces", use_container_width=True):
+                telemetry.tracer.clear()
+                st.rerun()
+
+
+def render_usage_panel():
+    """Panel lateral con el consumo de la IA: totales diarios y mayores consumidores."""
+    import pandas as pd
+    
+    with st.expander("💳 Consumo IA", expanded=False):
+        ledger = get_engine().ledger
+        daily = ledger.daily_totals(days=14)
+        if not daily:
+            st.caption("Todavía no hay llamadas registradas.")
+            return
+        
+        today = daily[0]
+        col_cost, col_tokens = st.columns(2)
+        col_cost.metric(f"Coste {today['day'][5:]}", f"${today['cost_usd'] or 0:.2f}")
+        col_tokens.metric("Tokens", f"{today['tokens'] or 0:,}")
+        
+        st.caption("Últimos 14 días")
+        st.dataframe(pd.DataFrame(daily).rename(columns={
+            'day': 'Día', 'calls': 'Llamadas', 'tokens': 'Tokens', 'cost_usd': 'USD',
+            'cache_hit_pct': '% caché', 'truncated': 'Truncados', 'avg_latency_ms': 'Lat. ms'
+        }), hide_index=True, use_container_width=True)
+        
+        group_labels = {'client': "Cliente", 'feature': "Funcionalidad", 'user': "Usuario"}
+        group = st.radio("Top 30 días por", list(group_labels), format_func=group_labels.get, horizontal=True, key="usage_group")
+        top = ledger.top_consumers(by=group, days=30)
+        st.dataframe(pd.DataFrame(top).rename(columns={
+            'name': group_labels[group], 'calls': 'Llamadas', 'tokens': 'Tokens', 'cost_usd': 'USD',
+            'truncated': 'Truncados', 'avg_latency_ms': 'Lat. ms'
+        }), hide_index=True, use_container_width=True)
+
+
+def render_memory_panel():
+    """Panel lateral con la memoria de la sesión y del proceso."""
+    with st.expander("🧠 Memoria", expanded=False):
+        session = st.session_state.memory.usage()
+        process = get_memory_budget().usage()
+        
+        col_session, col_process = st.columns(2)
+        col_session.metric("Sesión", f"{session['resident_bytes'] / MB:.1f} MB")
+        col_process.metric("Proceso", f"{process['process_bytes'] / MB:.1f} MB")
+        st.progress(
+            min(1.0, process['process_bytes'] / max(process['process_limit'], 1)),
+            text=f"Límite del proceso: {process['process_limit'] / MB:.0f} MB · sesión: {process['session_limit'] / MB:.0f} MB"
+        )
+        st.caption(
+            f"{session['entries']} objetos en esta sesión ({session['spilled_entries']} en disco) · "
+            f"{process['sessions']} sesiones activas, {process['spilled_entries']} objetos en disco"
+        )
+
+
+def render_queue_panel():
+    """Panel lateral con la profundidad y el ritmo de la cola del precálculo."""
+    from advisor.batch import QUEUE_NAME
+    
+    with st.expander("📦 Cola de precálculo", expanded=False):
+        if not os.path.exists(ENGINE_CONFIG.queue_path):
+            st.caption("Todavía no se ha lanzado el precálculo (python -m advisor batch).")
+            return
+        stats = get_work_queue().stats(QUEUE_NAME)
+        if not stats['total']:
+            st.caption("La cola está vacía.")
+            return
+        
+        col_pending, col_running = st.columns(2)
+        col_pending.metric("Pendientes", stats['pending'])
+        col_running.metric("En curso", stats['leased'])
+        col_done, col_failed = st.columns(2)
+        col_done.metric("Hechos", stats['done'], help=f"{stats['skipped']} ya estaban al día")
+        col_failed.metric("Con error", stats['failed'])
+        st.progress(
+            (stats['done'] + stats['failed'] + stats['skipped']) / stats['total'],
+            text=f"{stats['throughput_per_min']:.1f} clientes/min (últimos 15 min)"
+        )
+        parts = []
+        if stats['avg_seconds'] is not None:
+            parts.append(f"{stats['avg_seconds']:.0f}s por cliente")
+        if stats['eta_seconds'] is not None:
+            parts.append(f"fin estimado en {stats['eta_seconds'] / 60:.0f} min")
+        elif stats['last_finished_at'] and not stats['pending'] and not stats['leased']:
+            parts.append(f"terminado {datetime.fromtimestamp(stats['last_finished_at']):%d/%m %H:%M}")
+        if stats['started_at']:
+            parts.append(f"lanzado {datetime.fromtimestamp(stats['started_at']):%d/%m %H:%M}")
+        st.caption(" · ".join(parts))
+
+def render_token_status():
+    """Caducidad del token de Google bajo el indicador de conexión."""
+    status = get_credential_manager().status()
+    left = status['expires_in_s']
+    if left is None:
+        return
+    text = f"🔑 Token válido {max(0, int(left // 60))} min más"
+    if status['refreshes']:
+        text += f" · renovado {status['refreshes']}× (último {status['last_refresh']:%H:%M})"
+    st.caption(text)
+
+# =============================================================================
+# DASHBOARD: FRAGMENTOS
+# =============================================================================
+# Cada zona interactiva del dashboard es un st.fragment: tocar un filtro del
+# Explorador, un botón de hilo o el borrador solo vuelve a ejecutar (y enviar)
+# su propia zona, no las KPIs, el gráfico ni el resto de vistas.
+
+def rerun_fragment():
     """
+    Vuelve a ejecutar solo el fragmento actual.
     
+    Si el fragmento se está pintando dentro de un rerun completo (primera carga,
+    AppTest) Streamlit no admite scope="fragment": se relanza el script.
+    """
     try:
-        # === LLAMADA A OPENAI CON TIMEOUT ===
-        client = OpenAI(
-            api_key=OPENAI_API_KEY,
-            timeout=60.0  # Timeout de 60 segundos
-        )
-        
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            response_format={"type": "json_object"},
-            messages=[
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": text_data}
-            ],
-            temperature=0.2,
-            max_tokens=4000  # Límite explícito
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+
+# Índices derivados de la evidencia: van al SessionMemory (no a analysis_results)
+# para que cuenten en el presupuesto. Los baratos se descartan y se reconstruyen
+# al pedirlos; el de relevancia se vuelca a disco.
+DERIVED_INDEXES = {'search_index': True, 'query_columns': True, 'ranking': False}   # clave -> se descarta
+
+
+def store_derived_indexes(results):
+    """Pasa los índices de un análisis nuevo de ``results`` al SessionMemory."""
+    memory = st.session_state.memory
+    for key, droppable in DERIVED_INDEXES.items():
+        value = results.pop(key, None)
+        if value is None:
+            memory.pop(key)   # Que no se quede el del análisis anterior
+        else:
+            memory.put(key, value, droppable=droppable)
+
+
+def get_derived_index(key, build):
+    """Índice ``key`` del análisis en pantalla; si se descartó (o falta), lo reconstruye con ``build``."""
+    memory = st.session_state.memory
+    index = memory.get(key)
+    if index is None:
+        index = build()
+        memory.put(key, index, droppable=DERIVED_INDEXES[key])
+    return index
+
+
+def get_search_index():
+    """Índice invertido del análisis en pantalla (se crea al vuelo si falta)."""
+    results = st.session_state.analysis_results
+    return get_derived_index('search_index', lambda: search.InvertedIndex(results['evidence']))
+
+
+def get_query_columns():
+    """Columnas tipadas para el lenguaje de consulta (se crean al vuelo si faltan)."""
+    from advisor import query
+    
+    results = st.session_state.analysis_results
+    return get_derived_index('query_columns', lambda: query.EvidenceColumns(results['evidence'], results.get('analysis')))
+
+
+def get_relationship():
+    """Analítica de la relación (advisor.analytics), calculada al vuelo si falta."""
+    from advisor.analytics import client_report
+    
+    results = st.session_state.analysis_results
+    if results.get('relationship') is None:
+        key = results.get('group') or results['target_email']
+        results['relationship'] = client_report(key, get_query_columns())
+    return results['relationship']
+
+
+def get_ranking_index():
+    """Índice de relevancia del análisis en pantalla (se crea al vuelo si falta)."""
+    from advisor.ranking import RankingIndex
+    
+    results = st.session_state.analysis_results
+    
+    def build():
+        with telemetry.span("search.ranking", emails=len(results['evidence'])):
+            return RankingIndex(results['evidence'])
+    
+    return get_derived_index('ranking', build)
+
+
+def clear_explorer_filters():
+    """Callback del botón Limpiar: borra las keys de los filtros del Explorador."""
+    for key in ['f_origen_key', 'f_texto_key', 'f_fecha_key', 'f_orden_key', 'explorer_page']:
+        if key in st.session_state:
+            del st.session_state[key]
+
+
+EXPLORER_PAGE_SIZES = [10, 25, 50]
+ALERT_SCAN_MINUTES = 15       # Al entrar no se vuelve a escanear si la última pasada es más reciente
+PORTFOLIO_WEEKS = 12          # Semanas del mapa de calor de la cartera
+PORTFOLIO_HEATMAP_ROWS = 40   # Clientes en el mapa de calor (los que más empeoran primero)
+PORTFOLIO_DROP = 2.0          # Caída del sentimiento (puntos) para contar un cliente como "empeora"
+
+
+def move_explorer_page(step):
+    """Callback de los botones Anterior / Siguiente del Explorador."""
+    st.session_state.explorer_page = max(0, st.session_state.get('explorer_page', 0) + step)
+
+
+def explorer_page_window(total, filters_signature):
+    """
+    Ventana de tarjetas visible: solo se construyen las de la página actual.
+
+    Vuelve a la primera página cuando cambian los filtros.
+
+    Returns:
+        tuple: (inicio, fin) dentro de la lista filtrada
+    """
+    if st.session_state.get('explorer_filters_sig') != filters_signature:
+        st.session_state.explorer_filters_sig = filters_signature
+        st.session_state.explorer_page = 0
+
+    page_size = st.session_state.get('explorer_page_size_key', EXPLORER_PAGE_SIZES[0])
+    pages = max(1, -(-total // page_size))
+    page = min(st.session_state.get('explorer_page', 0), pages - 1)
+    st.session_state.explorer_page = page
+    start, end = page * page_size, min(total, (page + 1) * page_size)
+
+    p_col1, p_col2, p_col3, p_col4 = st.columns([1, 3, 1, 1])
+    with p_col1:
+        st.button("◀ Anterior", key="explorer_prev", use_container_width=True,
+                  disabled=page == 0, on_click=move_explorer_page, args=(-1,))
+    with p_col2:
+        st.markdown(
+            f"<div style='text-align: center; padding-top: 8px; color: #5a6c7d;'>"
+            f"Página <b>{page + 1}</b> de <b>{pages}</b> · emails {start + 1}–{end} de {total}</div>",
+            unsafe_allow_html=True
         )
-        
-        # === PARSEAR RESPUESTA ===
-        try:
-            result = json.loads(response.choices[0].message.content)
-        except json.JSONDecodeError as json_err:
-            return None, f"❌ La IA devolvió un formato inválido. Error: {str(json_err)}"
-        
-        # === VALIDAR ESTRUCTURA DEL JSON ===
-        required_fields = [
-            'resumen_exhaustivo',
-            'urgencia',
-            'perfil_cliente',
-            'accion_recomendada',
-            'borrador_respuesta',
-            'analisis_sentimiento',
-            'insights_clave'
-        ]
-        
-        missing_fields = [field for field in required_fields if field not in result]
-        
-        if missing_fields:
-            # Si faltan campos críticos, crear valores por defecto
-            if 'resumen_exhaustivo' not in result:
-                result['resumen_exhaustivo'] = "⚠️ No se pudo generar el resumen completo."
-            if 'urgencia' not in result:
-                result['urgencia'] = "Media"
-            if 'perfil_cliente' not in result:
-                result['perfil_cliente'] = "Cliente con actividad reciente."
-            if 'accion_recomendada' not in result:
-                result['accion_recomendada'] = "Revisar la conversación y responder según contexto."
-            if 'borrador_respuesta' not in result:
-                result['borrador_respuesta'] = "Estimado/a cliente,\n\nGracias por tu mensaje. Estamos revisando tu solicitud.\n\nSaludos cordiales."
-            if 'analisis_sentimiento' not in result:
-                result['analisis_sentimiento'] = []
-            if 'insights_clave' not in result:
-                result['insights_clave'] = ["Revisar el historial de emails manualmente para más detalles."]
-        
-        # === VALIDAR ANÁLISIS DE SENTIMIENTO ===
-        sentimientos = result.get('analisis_sentimiento', [])
-        
-        # Si la IA no generó sentimientos, crear estructura básica
-        if not sentimientos or len(sentimientos) == 0:
-            result['analisis_sentimiento'] = [
-                {
-                    "email_num": i + 1,
-                    "sentimiento_score": 0,
-                    "explicacion": "Análisis no disponible"
-                }
-                for i in range(num_emails)
-            ]
-        
-        # Si hay menos sentimientos que emails, rellenar
-        elif len(sentimientos) < num_emails:
-            for i in range(len(sentimientos), num_emails):
-                result['analisis_sentimiento'].append({
-                    "email_num": i + 1,
-                    "sentimiento_score": 0,
-                    "explicacion": "Análisis no disponible"
-                })
-        
-        # Validar que los scores estén en rango válido
-        for sent in result['analisis_sentimiento']:
-            score = sent.get('sentimiento_score', 0)
-            if not isinstance(score, (int, float)) or score < -10 or score > 10:
-                sent['sentimiento_score'] = 0
-        
-        return result, None
+    with p_col3:
+        st.button("Siguiente ▶", key="explorer_next", use_container_width=True,
+                  disabled=page >= pages - 1, on_click=move_explorer_page, args=(1,))
+    with p_col4:
+        st.selectbox("Por página", EXPLORER_PAGE_SIZES, key="explorer_page_size_key", label_visibility="collapsed")
+    return start, end
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def build_sentiment_figure(points, trend=None, change_at=None):
+    """
+    Figura de evolución del sentimiento.
     
-    except Exception as e:
-        error_msg = str(e)
+    Args:
+        points: Tupla de (fecha, score, asunto, explicación, origen, id); al ser
+                hashable, la figura se reutiliza en los reruns completos.
+        trend: Tupla de (fecha, media móvil) o None
+        change_at: Fecha del punto de cambio o None
+    """
+    import pandas as pd
+    import plotly.graph_objects as go
+    
+    df_chart = pd.DataFrame(points, columns=['Fecha', 'Score', 'Asunto', 'Explicacion', 'Origen', 'ID'])
+    
+    # Crear figura
+    fig = go.Figure()
+
+    # 1. Zonas de fondo (Semáforo Visual)
+    # Zona Éxito (Verde)
+    fig.add_hrect(y0=5, y1=11, line_width=0, fillcolor="rgba(46, 204, 113, 0.1)", layer="below")
+    # Zona Peligro (Rojo)
+    fig.add_hrect(y0=-11, y1=-5, line_width=0, fillcolor="rgba(231, 76, 60, 0.1)", layer="below")
+
+    # 2. Línea y Puntos
+    fig.add_trace(go.Scatter(
+        x=df_chart['Fecha'], 
+        y=df_chart['Score'], 
+        mode='lines+markers', 
+        name='Sentimiento',
+        # Línea curva suave y elegante
+        line=dict(color='#1a2b4b', width=3, shape='spline', smoothing=1.3),
+        # Marcadores dinámicos: Color según score, Tamaño según intensidad
+        marker=dict(
+            size=[max(8, abs(s)*1.5) for s in df_chart['Score']], # Más grande si es más intenso
+            color=df_chart['Score'], 
+            colorscale='RdYlGn', # Rojo -> Amarillo -> Verde
+            line=dict(width=2, color='white'), 
+            showscale=False,
+            cmin=-10, cmax=10
+        ),
+        # Tooltip Informativo HTML
+        customdata=df_chart[['Asunto', 'Explicacion', 'Origen', 'ID']],
+        hovertemplate="""
+        <b>%{customdata[2]}</b> (ID: %{customdata[3]})<br>
+        📅 %{x}<br>
+        ----------------<br>
+        <b>%{customdata[0]}</b><br>
+        <i>%{customdata[1]}</i><br>
+        ----------------<br>
+        🎯 Score: <b>%{y}</b>
+        <extra></extra>
+        """
+    ))
+
+    # 3. Media móvil ponderada y punto de cambio (advisor.analytics)
+    if trend:
+        fig.add_trace(go.Scatter(
+            x=[d for d, _ in trend], y=[v for _, v in trend],
+            mode='lines', name='Media móvil',
+            line=dict(color='#d4af37', width=2, dash='dot'),
+            hovertemplate="📊 Media móvil: <b>%{y:.1f}</b><extra></extra>"
+        ))
+    if change_at:
+        # Sin annotation_text: add_vline no sabe colocarla en ejes de fecha
+        fig.add_vline(x=change_at, line_dash="dot", line_color="#e74c3c", opacity=0.7)
+        fig.add_annotation(x=change_at, y=10, text="Cambio", showarrow=False,
+                           font=dict(color="#e74c3c", size=11), xanchor="left")
+    
+    # 4. Línea Neutral
+    fig.add_hline(y=0, line_dash="dash", line_color="gray", opacity=0.5, annotation_text="Neutral (0)", annotation_position="bottom right")
+    
+    # 5. Diseño Limpio
+    fig.update_layout(
+        height=500, 
+        plot_bgcolor='rgba(255,255,255,0)', 
+        paper_bgcolor='white', 
+        yaxis=dict(
+            range=[-11, 11], 
+            title="Negativo ↔ Positivo", 
+            showgrid=True, 
+            gridcolor='rgba(0,0,0,0.05)'
+        ),
+        xaxis=dict(
+            showgrid=False
+        ),
+        hovermode='closest', # Importante para ver el punto exacto
+        margin=dict(t=20, b=20, l=20, r=20)
+    )
+    return fig
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def build_member_sentiment_figure(series):
+    """
+    Una línea de sentimiento por miembro del grupo.
+    
+    Args:
+        series: Tupla de (miembro, ((fecha, score), ...)); hashable para cachear la figura
+    """
+    import plotly.graph_objects as go
+    
+    fig = go.Figure()
+    for member, points in series:
+        fig.add_trace(go.Scatter(
+            x=[p[0] for p in points],
+            y=[p[1] for p in points],
+            mode='lines+markers',
+            name=member,
+            hovertemplate="%{x}<br>Score: %{y}<extra>" + member + "</extra>"
+        ))
+    fig.update_layout(
+        template="plotly_white",
+        height=320,
+        yaxis=dict(range=[-11, 11], title="Score", gridcolor='rgba(0,0,0,0.05)'),
+        xaxis=dict(showgrid=False),
+        legend=dict(orientation="h", y=-0.2),
+        margin=dict(t=20, b=20, l=20, r=20)
+    )
+    return fig
+
+
+def render_member_panel(members):
+    """Sentimiento y origen de los datos de cada miembro de un grupo."""
+    series = tuple(
+        (email, tuple(info['sentiment']))
+        for email, info in members.items() if info['sentiment']
+    )
+    if series:
+        st.plotly_chart(build_member_sentiment_figure(series), use_container_width=True)
+    
+    sources = {'precomputed': "precálculo nocturno", 'cache': "descarga reciente", 'gmail': "Gmail"}
+    cols = st.columns(max(1, len(members)))
+    for col, (email, info) in zip(cols, members.items()):
+        scores = [score for _, score in info['sentiment']]
+        avg = f"{sum(scores) / len(scores):+.1f}" if scores else "–"
+        col.metric(email, avg, help="Sentimiento medio de sus emails")
+        col.caption(f"{info['emails']} emails · {sources.get(info['source'], info['source'])}"
+                    + (" · ⚠️ error" if info['error'] else ""))
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def build_portfolio_figure(clients, weeks, heat):
+    """
+    Mapa de calor cliente × semana del sentimiento medio.
+    
+    Args:
+        clients, weeks: Etiquetas de filas y columnas (tuplas)
+        heat: Tupla de filas con el sentimiento de cada semana (None sin emails)
+    """
+    import plotly.graph_objects as go
+    
+    fig = go.Figure(go.Heatmap(
+        z=heat, x=list(weeks), y=list(clients),
+        colorscale='RdYlGn', zmin=-10, zmax=10, xgap=2, ygap=2,
+        colorbar=dict(title="Score", thickness=12),
+        hovertemplate="%{y}<br>Semana del %{x}<br>Sentimiento: <b>%{z:.1f}</b><extra></extra>"
+    ))
+    fig.update_layout(
+        template="plotly_white",
+        height=max(240, 22 * len(clients) + 80),
+        yaxis=dict(autorange="reversed"),
+        margin=dict(t=20, b=20, l=20, r=20)
+    )
+    return fig
+
+
+def render_portfolio_view():
+    """Mapa de calor y ranking de toda la cartera desde la matriz mapeada en disco."""
+    import numpy as np
+    from advisor.portfolio import deteriorated
+    
+    st.markdown("""
+<div style='margin-bottom: 24px;'>
+    <h3 style='color: #1a1d29; font-size: 18px; margin: 0; font-weight: 600;'>🗺️ Vista de Cartera</h3>
+    <p style='color: #718096; font-size: 14px; margin: 8px 0 0 0;'>Sentimiento semanal de todos los clientes analizados</p>
+</div>
+""", unsafe_allow_html=True)
+    
+    with telemetry.span("portfolio.report"):
+        report = get_portfolio_matrix().report(get_client_registry().portfolio_rows(), weeks=PORTFOLIO_WEEKS)
+    
+    if not report['clients']:
+        st.info("La cartera se va llenando con cada análisis: todavía no hay ninguno guardado.")
+    else:
+        change = report['change']
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Clientes", len(report['clients']))
+        col2.metric("Con emails (30 días)", int(np.isfinite(report['recent']).sum()))
+        recent = report['recent'][np.isfinite(report['recent'])]
+        col3.metric("Sentimiento medio (30 días)", f"{recent.mean():.1f}" if len(recent) else "–")
+        col4.metric("Empeoran este mes", int((change <= -PORTFOLIO_DROP).sum()),
+                    help=f"Clientes cuyo sentimiento de los últimos 30 días cae {PORTFOLIO_DROP:.0f} puntos "
+                         "o más respecto a los 90 días anteriores.")
+        
+        # Filas del mapa: primero los que más empeoran, después el resto con actividad
+        with_data = np.flatnonzero(np.isfinite(report['heat']).any(axis=1))
+        order = with_data[np.argsort(np.nan_to_num(change[with_data], nan=np.inf), kind='stable')]
+        rows = order[:PORTFOLIO_HEATMAP_ROWS]
+        if len(rows):
+            heat = tuple(
+                tuple(None if np.isnan(v) else round(float(v), 1) for v in report['heat'][pos])
+                for pos in rows
+            )
+            weeks = tuple(format_day(day, '%d/%m') for day in report['week_starts'])
+            st.plotly_chart(
+                build_portfolio_figure(tuple(report['clients'][pos] for pos in rows), weeks, heat),
+                use_container_width=True
+            )
+            if len(order) > len(rows):
+                st.caption(f"Mostrando {len(rows)} de {len(order)} clientes con emails en las últimas {PORTFOLIO_WEEKS} semanas")
+        
+        ranking = deteriorated(report, limit=20, min_drop=PORTFOLIO_DROP)
+        st.markdown("**📉 Empeoran este mes**")
+        if ranking:
+            st.dataframe([{
+                'Cliente': report['clients'][pos],
+                'Últimos 30 días': round(float(report['recent'][pos]), 1),
+                '90 días anteriores': round(float(report['baseline'][pos]), 1),
+                'Variación': round(float(change[pos]), 1),
+                'Emails (30 días)': int(report['recent_volume'][pos]),
+            } for pos in ranking], use_container_width=True, hide_index=True)
+        else:
+            st.caption("Ningún cliente ha empeorado de forma clara en los últimos 30 días.")
+    
+    if st.button("✖️ Cerrar vista de cartera", key="close_portfolio"):
+        st.session_state.show_portfolio = False
+        st.rerun()
+    
+    st.markdown("""
+        <div style='border-top: 2px solid #e0e6ed; margin: 30px 0;'></div>
+        """, unsafe_allow_html=True)
+
+
+def render_snapshot_diff(diff):
+    """Cambios respecto al análisis anterior del cliente (calculados sin la IA)."""
+    previous_time = datetime.fromtimestamp(diff['previous_at']).strftime('%d/%m %H:%M')
+    new_emails = diff['new_emails']
+    with st.expander(f"🆕 Cambios desde el análisis del {previous_time} (v{diff['from_version']} → v{diff['to_version']})",
+                     expanded=bool(new_emails or diff['urgency'])):
+        c1, c2, c3 = st.columns(3)
+        c1.metric("Emails nuevos", len(new_emails),
+                  help=f"{diff['dropped_emails']} emails antiguos ya no entran en la búsqueda" if diff['dropped_emails'] else None)
+        if diff['urgency']:
+            c2.metric("Urgencia", diff['urgency'][1] or "–", f"antes {diff['urgency'][0] or '–'}", delta_color="off")
+        else:
+            c2.metric("Urgencia", "Sin cambios")
+        old_avg, new_avg = diff['avg_sentiment']
+        c3.metric("Sentimiento medio", f"{new_avg:+.1f}" if new_avg is not None else "–",
+                  f"{diff['sentiment_delta']:+.1f}" if diff['sentiment_delta'] is not None else None)
         
-        # === MANEJO DE ERRORES ESPECÍFICOS ===
-        if "rate_limit" in error_msg.lower():
-            return None, "⏳ Has alcanzado el límite de consultas de OpenAI. Intenta de nuevo en unos minutos."
+        for email in new_emails[:10]:
+            origin = "👤" if email['Origen'] == 'CLIENTE' else "🏦"
+            st.markdown(f"{origin} `{email['Fecha']}` {email['Asunto']}")
+        if len(new_emails) > 10:
+            st.caption(f"... y {len(new_emails) - 10} emails nuevos más")
         
-        elif "invalid_api_key" in error_msg.lower() or "authentication" in error_msg.lower():
-            return None, "🔑 La API Key de OpenAI no es válida. Verifica tu configuración en secrets.toml"
+        if diff['new_insights']:
+            st.markdown("**Insights nuevos**")
+            for insight in diff['new_insights']:
+                st.markdown(f"- {insight}")
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def build_history_figure(points):
+    """
+    Sentimiento medio de cada periodo del historial.
+    
+    Args:
+        points: Tupla de (periodo, score, emails); hashable para cachear la figura
+    """
+    import plotly.graph_objects as go
+    
+    fig = go.Figure(go.Scatter(
+        x=[p[0] for p in points],
+        y=[p[1] for p in points],
+        mode='lines+markers',
+        marker=dict(size=[8 + min(p[2], 100) / 5 for p in points], color='#2b6cb0'),
+        customdata=[p[2] for p in points],
+        hovertemplate="%{x}<br>Sentimiento: %{y}<br>%{customdata} emails<extra></extra>"
+    ))
+    fig.update_layout(
+        template="plotly_white",
+        height=280,
+        yaxis=dict(range=[-11, 11], title="Score", gridcolor='rgba(0,0,0,0.05)'),
+        xaxis=dict(showgrid=False, type='category'),
+        margin=dict(t=20, b=20, l=20, r=20)
+    )
+    return fig
+
+
+def render_history_results(results):
+    """Análisis del historial completo: relación, etapas y resúmenes de cada periodo."""
+    history = results['history']
+    st.markdown(f"""
+<div style='margin-bottom: 16px;'>
+    <h3 style='color: #1a1d29; font-size: 20px; margin: 0; font-weight: 600;'>📜 Historial completo · {results['target_email']}</h3>
+    <p style='color: #718096; font-size: 14px; margin: 8px 0 0 0;'>{results['emails']} emails en {results['months']} meses ({results['years']} años), compuestos desde {len(results['periods'])} resúmenes</p>
+</div>
+""", unsafe_allow_html=True)
+    
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Urgencia", history.get('urgencia', 'N/A'))
+    c2.metric("Tendencia", history.get('tendencia_sentimiento', 'N/A'))
+    c3.metric("Resúmenes nuevos", results['new_summaries'], help="Periodos que se han tenido que resumir en este análisis")
+    
+    st.markdown(history.get('resumen_relacion', ''))
+    if history.get('perfil_cliente'):
+        st.markdown(f"**Perfil actual:** {history['perfil_cliente']}")
+    if history.get('accion_recomendada'):
+        st.info(f"🎯 {history['accion_recomendada']}")
+    
+    points = tuple(
+        (period_label(row['period']), row['summary'].get('sentimiento_medio'), row['emails'])
+        for row in results['periods']
+        if row['summary'] and row['summary'].get('sentimiento_medio') is not None
+    )
+    if points:
+        st.plotly_chart(build_history_figure(points), use_container_width=True)
+    
+    col_r, col_o = st.columns(2)
+    with col_r:
+        st.markdown("**⚠️ Riesgos**")
+        for item in history.get('riesgos') or ["Sin riesgos destacados"]:
+            st.markdown(f"- {item}")
+    with col_o:
+        st.markdown("**💡 Oportunidades**")
+        for item in history.get('oportunidades') or ["Sin oportunidades destacadas"]:
+            st.markdown(f"- {item}")
+    
+    if history.get('etapas'):
+        st.markdown("**🧭 Etapas de la relación**")
+        for etapa in history['etapas']:
+            if isinstance(etapa, dict):
+                st.markdown(f"- **{etapa.get('periodo', '')}** · {etapa.get('descripcion', '')}")
+    
+    with st.expander(f"📚 Resúmenes por periodo ({len(results['periods'])})"):
+        for row in results['periods']:
+            if not row['summary']:
+                continue
+            st.markdown(f"**{period_label(row['period']).capitalize()}** · {row['emails']} emails")
+            st.caption(row['summary'].get('resumen', ''))
+    
+    if st.button("✖️ Cerrar historial", key="close_history"):
+        st.session_state.history_results = None
+        st.rerun()
+    
+    st.markdown("""
+        <div style='border-top: 2px solid #e0e6ed; margin: 30px 0;'></div>
+        """, unsafe_allow_html=True)
+
+
+def render_sentiment_chart(data, evidence):
+    """Gráfico de sentimiento (no tiene widgets propios: se cachea la figura)."""
+    sent_data = data.get('analisis_sentimiento', [])
+    limit = min(len(sent_data), len(evidence))
+    
+    if limit > 0:
+        chart_span = telemetry.start_span("ui.chart", points=limit)
+        points = tuple(
+            (e['Fecha'], s['sentimiento_score'], e['Asunto'], s.get('explicacion', ''), e['Origen'], e['Id'])
+            for e, s in zip(evidence[:limit], sent_data[:limit])
+        )
+        metrics, dates, rolling = get_relationship()
+        trend = tuple((d, v) for d, v in zip(dates, rolling) if v is not None)
+        change_at = format_day(metrics['change_at'], '%Y-%m-%d %H:%M') if metrics['change_at'] is not None else None
+        st.plotly_chart(build_sentiment_figure(points, trend, change_at), use_container_width=True)
+        chart_span.end()
+        
+        # Nota para el usuario sobre la interactividad
+        st.caption("💡 *Nota: Los puntos más grandes indican emociones más intensas. El fondo verde indica zona de confort, el rojo zona de riesgo.*")
+
+
+def format_day(day, fmt='%d/%m/%Y'):
+    """Fecha legible de un instante en días desde epoch (advisor.analytics)."""
+    return datetime.fromtimestamp(day * 86400).strftime(fmt)
+
+
+def render_relationship_metrics():
+    """Métricas de la dinámica de la relación bajo el gráfico de sentimiento."""
+    metrics = get_relationship()[0]
+    if not metrics['scored']:
+        return
+    
+    def fmt(value, pattern):
+        return pattern.format(value) if value is not None else "–"
+    
+    col1, col2, col3, col4, col5 = st.columns(5)
+    delta = None
+    if metrics['recent'] is not None and metrics['mean'] is not None:
+        delta = round(metrics['recent'] - metrics['mean'], 1)
+    col1.metric("Sentimiento reciente", fmt(metrics['recent'], "{:.1f}"), delta=delta,
+                help="Media ponderada en el tiempo: un email de hace 30 días pesa la mitad que uno de hoy.")
+    col2.metric("Tendencia (30 días)", fmt(metrics['slope'], "{:+.1f}"),
+                help="Pendiente de la recta de regresión del sentimiento, en puntos cada 30 días.")
+    col3.metric("Volatilidad", fmt(metrics['volatility'], "{:.1f}"),
+                help="Desviación típica de los saltos de sentimiento entre emails consecutivos.")
+    col4.metric("Respuesta mediana", fmt(metrics['response_median_h'], "{:.0f} h"),
+                help=f"Del email del cliente a la respuesta del banco ({metrics['replies']} respuestas; "
+                     f"p90 {fmt(metrics['response_p90_h'], '{:.0f} h')}).")
+    col5.metric("Riesgo", f"{metrics['risk_score']:.0f}/100",
+                help="Combina sentimiento reciente, tendencia, volatilidad, caídas bruscas y espera. "
+                     + (f"Pesa: {', '.join(metrics['reasons'])}." if metrics['reasons'] else ""))
+    
+    if metrics['pending_hours'] is not None:
+        st.warning(f"⏳ El cliente espera respuesta desde hace {metrics['pending_hours']:.0f} h.")
+    if metrics['change_at'] is not None:
+        direction = "cayó" if metrics['change_shift'] < 0 else "subió"
+        st.caption(f"📍 Cambio de tendencia el {format_day(metrics['change_at'])}: el sentimiento medio "
+                   f"{direction} {abs(metrics['change_shift']):.1f} puntos.")
+
+
+@st.fragment
+@telemetry.traced("ui.draft_editor")
+def render_draft_editor(draft, target_email):
+    """Editor del borrador de respuesta."""
+    # Las ediciones del RM se conservan (también al cambiar de vista) hasta que
+    # llega un borrador nuevo
+    if st.session_state.get('draft_source') != draft:
+        st.session_state.draft_source = draft
+        st.session_state.draft_saved = draft
+        st.session_state.pop('draft_text', None)
+    if 'draft_text' not in st.session_state:
+        st.session_state.draft_text = st.session_state.draft_saved
+    
+    def keep_draft():
+        st.session_state.draft_saved = st.session_state.draft_text
+    
+    st.text_area(
+        "Contenido del mensaje:",
+        height=400,
+        label_visibility="collapsed",
+        key="draft_text",
+        on_change=keep_draft
+    )
+    
+    st.markdown("<br>", unsafe_allow_html=True)
+    
+    col_btn1, col_btn2, col_btn3 = st.columns([2, 2, 1])
+    with col_btn1:
+        gmail_compose_url = f"https://mail.google.com/mail/?view=cm&fs=1&to={target_email}&su=Seguimiento"
+        st.link_button("📧 Abrir en Gmail", gmail_compose_url, use_container_width=True, type="primary")
+    with col_btn2:
+        st.button("📋 Copiar texto", use_container_width=True, key="copy_draft")
+    with col_btn3:
+        st.button("🔄", use_container_width=True, help="Regenerar borrador", key="regenerate_draft")
+
+
+@st.fragment
+@telemetry.traced("ui.thread_panel")
+def render_thread_panel(email, target_email):
+    """Botones y resultado de la inteligencia de hilo de un email."""
+    # --- ZONA DE ACCIONES (ESTADO PERSISTENTE) ---
+    c_btn1, c_btn2 = st.columns([1, 2])
+    memory = st.session_state.memory
+    analysis_key = f"thread_analysis_{email['Id']}"
+    
+    with c_btn1:
+        gmail_url = f"https://mail.google.com/mail/u/0/#inbox/{email['Id_Completo']}"
+        st.link_button("🔗 Abrir en Gmail", gmail_url, use_container_width=True)
+    
+    with c_btn2:
+        # 1. BOTÓN DE ANÁLISIS (MEJORADO)
+        button_label = "✅ Análisis cargado" if analysis_key in memory else "🧶 Analizar Hilo Completo"
+        button_type = "secondary" if analysis_key in memory else "primary"
+        
+        if st.button(button_label, key=f"btn_{email['Id']}", use_container_width=True, type=button_type):
+            # Mostrar placeholder mientras carga
+            placeholder = st.empty()
+            with placeholder.container():
+                st.markdown("""
+<div style='background: linear-gradient(135deg, #f3e5f5 0%, #e1bee7 100%); padding: 30px; border-radius: 12px; text-align: center; border-left: 4px solid #7b1fa2; box-shadow: 0 4px 12px rgba(123,31,162,0.1);'>
+    <div style='font-size: 48px; margin-bottom: 15px; animation: pulse 1.5s ease-in-out infinite;'>🧶</div>
+    <h4 style='color: #4a148c; margin: 0 0 10px 0;'>Analizando hilo completo...</h4>
+    <p style='color: #6a1b9a; font-size: 14px; margin: 0;'>Procesando conversación completa con IA</p>
+    <div style='width: 50%; height: 4px; background: rgba(123,31,162,0.2); border-radius: 2px; margin: 15px auto 0; overflow: hidden;'>
+        <div style='width: 100%; height: 100%; background: #7b1fa2; animation: loading 1.5s ease-in-out infinite;'></div>
+    </div>
+</div>
+
+<style>
+@keyframes pulse {
+    0%, 100% { opacity: 1; transform: scale(1); }
+    50% { opacity: 0.7; transform: scale(1.1); }
+}
+@keyframes loading {
+    0% { transform: translateX(-100%); }
+    100% { transform: translateX(100%); }
+}
+</style>
+""", unsafe_allow_html=True)
+            
+            try:
+                with session_attribution(target_email):
+                    analysis, thread_err = get_engine().thread_intelligence(session_credentials(), email['Id_Completo'])
+                
+                if not thread_err:
+                    # 💾 GUARDADO EN LA MEMORIA DE LA SESIÓN (con límite y volcado a disco)
+                    memory.put(analysis_key, analysis)
+                    placeholder.empty()  # Limpiar el loading
+                    rerun_fragment()  # Refrescar solo este panel
+                else:
+                    placeholder.empty()
+                    st.error("No se pudo leer el hilo.")
+            except Exception as e:
+                placeholder.empty()
+                st.error(f"Error técnico: {e}")
+
+    # 2. VISUALIZADOR (Lee del estado)
+    if analysis_key in memory:
+        st.markdown("<br>", unsafe_allow_html=True)
         
-        elif "timeout" in error_msg.lower():
-            return None, "⏱️ La consulta tardó demasiado. Intenta con menos emails o un período más corto."
+        # Header con botón de cerrar
+        col_header1, col_header2 = st.columns([4, 1])
+        with col_header1:
+            st.markdown("""
+            <div style='background: linear-gradient(135deg, #fff3e0 0%, #ffe0b2 100%); padding: 15px 20px; border-radius: 10px 10px 0 0; border-left: 5px solid #ef6c00;'>
+                <h4 style='color: #ef6c00; margin: 0; display: flex; align-items: center;'>
+                    <span style='font-size: 24px; margin-right: 10px;'>🧶</span>
+                    Inteligencia de Hilo
+                </h4>
+            </div>
+            """, unsafe_allow_html=True)
+        with col_header2:
+            st.button("✕", key=f"close_{email['Id']}", help="Cerrar análisis",
+                      on_click=lambda: memory.pop(analysis_key))
         
-        elif "context_length_exceeded" in error_msg.lower():
-            return None, f"📏 El contenido es demasiado largo para procesar ({len(text_data)} caracteres). Reduce el número de emails."
+        # Contenido del análisis en markdown nativo (mejor renderizado)
+        st.markdown(f"""
+        <div style='background-color: white; border: 2px solid #ffe0b2; border-top: none; padding: 25px; border-radius: 0 0 10px 10px; box-shadow: 0 4px 12px rgba(0,0,0,0.08);'>
+        """, unsafe_allow_html=True)
         
-        elif "insufficient_quota" in error_msg.lower():
-            return None, "💳 Tu cuenta de OpenAI no tiene créditos suficientes. Recarga tu saldo."
+        # Renderizar el markdown de la IA directamente
+        st.markdown(memory.get(analysis_key, ""))
         
-        else:
-            # Error genérico con detalles
-            return None, f"❌ Error al comunicarse con OpenAI: {error_msg[:300]}"
+        st.markdown("</div>", unsafe_allow_html=True)
 
 
-def generate_fallback_analysis(evidence, target_email):
-    """
-    Genera un análisis básico local cuando OpenAI falla.
-    Permite al usuario seguir trabajando con los emails.
-    """
-    num_emails = len(evidence)
-    
-    # Contar origen de emails
-    from_client = sum(1 for e in evidence if e['Origen'] == 'CLIENTE')
-    from_bank = num_emails - from_client
+@st.fragment
+@telemetry.traced("ui.explorer")
+def render_explorer(evidence, target_email):
+    """Explorador avanzado: filtros y tarjetas de emails."""
+    from advisor import query
+    from advisor.ranking import passage_text
     
-    # Detectar último origen
-    last_origin = evidence[-1]['Origen'] if evidence else 'DESCONOCIDO'
-    
-    # Análisis básico sin IA
-    return {
-        'resumen_exhaustivo': f"Se analizaron {num_emails} emails con {target_email}. El cliente envió {from_client} mensajes y el banco {from_bank}. El último mensaje fue del {last_origin}. ⚠️ Análisis automático no disponible - revisa los emails manualmente.",
-        'urgencia': 'Media',
-        'perfil_cliente': f"Cliente con {num_emails} interacciones recientes. {'Espera respuesta del banco.' if last_origin == 'CLIENTE' else 'Última respuesta enviada por el banco.'}",
-        'accion_recomendada': 'Revisar el historial de emails manualmente en el Explorador Avanzado.',
-        'borrador_respuesta': f"Estimado/a cliente,\n\nHemos recibido tu mensaje y estamos revisando tu solicitud.\n\nTe responderemos a la brevedad.\n\nSaludos cordiales,\nEquipo de Banca Privada",
-        'analisis_sentimiento': [
-            {
-                'email_num': i + 1,
-                'sentimiento_score': 0,
-                'explicacion': 'Análisis automático no disponible'
-            }
-            for i in range(num_emails)
-        ],
-        'insights_clave': [
-            '⚠️ El análisis de IA no está disponible temporalmente',
-            f'Total de {num_emails} emails en la conversación',
-            'Revisa los emails manualmente en la pestaña "Explorador Avanzado"'
-        ]
-    }
+    # === PANEL DE FILTROS (MEJORADO) ===
+    st.markdown("""
+    <div style='background: white; padding: 20px 25px; border-radius: 12px; box-shadow: 0 2px 8px rgba(0,0,0,0.06); margin-bottom: 25px; border-left: 5px solid #004e98;'>
+        <h4 style='margin: 0 0 15px 0; color: #1a2b4b; font-size: 18px; display: flex; align-items: center;'>
+            🔍 <span style='margin-left: 10px;'>Filtros de Búsqueda</span>
+        </h4>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    # Inicializar valores por defecto si no existen
+    if 'f_origen_key' not in st.session_state:
+        st.session_state.f_origen_key = "Todos"
+    if 'f_texto_key' not in st.session_state:
+        st.session_state.f_texto_key = ""
+    if 'f_fecha_key' not in st.session_state:
+        st.session_state.f_fecha_key = "Todas"
+    if 'f_orden_key' not in st.session_state:
+        st.session_state.f_orden_key = "Cronológico"
+    
+    # Filtros en una sola línea compacta
+    f_col1, f_col2, f_col3, f_col5, f_col4 = st.columns([2, 2, 2, 2, 1])
+    with f_col1:
+        f_origen = st.selectbox(
+            "Origen", 
+            ["Todos", "CLIENTE", "BANCO"], 
+            index=["Todos", "CLIENTE", "BANCO"].index(st.session_state.f_origen_key),
+            key="f_origen_key"
+        )
+    with f_col2:
+        f_texto = st.text_input(
+            "Buscar", 
+            value=st.session_state.f_texto_key,
+            placeholder='Ej: inversión from:cliente score:<-3', 
+            key="f_texto_key",
+            help=(
+                'Palabras clave y filtros combinables: from:cliente | from:banco, asunto:"fondo", '
+                'after:2026-01-01, before:2026-03-31, score:<-3 | score:>=5, has:adjunto. '
+                'Un "-" delante niega el filtro (-has:adjunto) o excluye los emails con esa palabra (-comisiones).'
+            )
+        )
+    with f_col3:
+        f_fecha = st.selectbox(
+            "Fecha", 
+            ["Todas", "7 días", "30 días"],
+            index=["Todas", "7 días", "30 días"].index(st.session_state.f_fecha_key),
+            key="f_fecha_key"
+        )
+    with f_col5:
+        f_orden = st.selectbox(
+            "Orden",
+            ["Cronológico", "Relevancia"],
+            index=["Cronológico", "Relevancia"].index(st.session_state.f_orden_key),
+            key="f_orden_key",
+            help="Relevancia: BM25 por pasaje + parecido de palabras; encuentra variantes y erratas"
+        )
+    with f_col4:
+        st.markdown("<br>", unsafe_allow_html=True)  # Alinear verticalmente
+        # Reset en el callback: se ejecuta antes de volver a pintar los filtros
+        st.button("🔄 Limpiar", key="clear_filters", use_container_width=True, on_click=clear_explorer_filters)
+    
+    st.markdown("---")
+
+    # === LÓGICA DE FILTRADO ===
+    # Barra de búsqueda + desplegables compilados en un único predicado sobre columnas tipadas
+    columns = get_query_columns()
+    query_text = f_texto if f_origen == "Todos" else f"{f_texto} from:{f_origen.lower()}"
+    compiled, query_err = query.compile_query(query_text, columns)
+    if query_err:
+        st.warning(query_err)
+    if f_fecha != "Todas":
+        days = 7 if "7" in f_fecha else 30
+        compiled.tests.append(query.date_after(columns, datetime.now() - timedelta(days=days)))
+    
+    best_passages = {}
+    if compiled.text and f_orden == "Relevancia":
+        # Ranking: los emails más relevantes primero, con su mejor pasaje
+        ranked = get_ranking_index().search(compiled.text, limit=len(evidence))
+        positions = compiled.filter(columns, index=get_search_index(), positions=[hit['pos'] for hit in ranked],
+                                    match_text=False)
+        best_passages = {hit['pos']: hit['start'] for hit in ranked}
+    else:
+        # Índice invertido: el último término cuenta como prefijo mientras se escribe
+        positions = compiled.filter(columns, index=get_search_index(), prefix_last=True)
 
-# --- NUEVAS FUNCIONES PARA ANÁLISIS DE HILOS (THREAD INTELLIGENCE) ---
+    # Contador de resultados más visible
+    if len(positions) < len(evidence):
+        st.info(f"📊 **{len(positions)}** de **{len(evidence)}** emails coinciden con los filtros")
+    else:
+        st.success(f"📊 Mostrando los **{len(evidence)}** emails completos")
+    
+    st.markdown("<br>", unsafe_allow_html=True)
 
-def get_thread_content(creds, thread_id):
-    """Obtiene el contenido completo de un hilo específico de Gmail"""
-    try:
-        service = build('gmail', 'v1', credentials=creds)
-        # Traemos el hilo completo
-        thread = service.users().threads().get(userId='me', id=thread_id, format='full').execute()
-        messages = thread.get('messages', [])
-        
-        full_thread_text = ""
-        
-        for msg in messages:
-            # Extraer fecha
-            headers = msg['payload']['headers']
-            date = next((h['value'] for h in headers if h['name'].lower() == 'date'), "N/A")
-            sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), "Desconocido")
-            
-            # Extraer cuerpo (reutilizando tu parser existente)
-            body = parse_email_body(msg['payload'])
-            if not body: body = msg.get('snippet', '')
-            
-            full_thread_text += f"\n--- MENSAJE DEL {date} ---\nDE: {sender}\nCONTENIDO:\n{body[:2000]}\n"
+    # === VISUALIZACIÓN DE CARDS (PERSISTENTE) ===
+    if not positions:
+        st.markdown("""
+        <div style='text-align: center; padding: 60px 40px; background: white; border-radius: 15px; border: 2px dashed #e0e6ed; margin: 30px 0;'>
+            <div style='font-size: 64px; margin-bottom: 20px; opacity: 0.3;'>📭</div>
+            <h3 style='color: #5a6c7d; margin-bottom: 10px;'>No hay emails que coincidan</h3>
+            <p style='color: #95a5a6; font-size: 15px;'>
+                Intenta ajustar los filtros o buscar otro término
+            </p>
+        </div>
+        """, unsafe_allow_html=True)
+    else:
+        # Paginación: fuera de la página no se construye nada
+        start, end = explorer_page_window(len(positions), (query_text, f_fecha, f_orden))
+        for pos in positions[start:end]:
+            email = evidence[pos]
+            icon = "👤" if email['Origen'] == "CLIENTE" else "🏦"
+            color = "green" if email['Origen'] == "CLIENTE" else "blue"
             
-        return full_thread_text
-    except Exception as e:
-        return None
+            clip = " 📎" if email.get('Adjuntos') else ""
+            member = f" · {email['Miembro']}" if email.get('Miembro') else ""
+            card = st.expander(
+                f"{icon} {email['Fecha_Corta']} | {email['Asunto']}{clip}{member}",
+                key=f"card_{email['Id_Completo']}",
+                on_change="rerun"
+            )
+            # Cuerpo y resaltado solo al abrir la tarjeta (open es None si no hay seguimiento de estado)
+            if card.open is False:
+                continue
+            with card:
+                # Cabecera
+                st.markdown(f"""
+                <div class='email-header-box'>
+                    <b>De:</b> :{color}[{email['Origen']}] <br>
+                    <b>Fecha:</b> {email['Fecha']} <br>
+                    <b>Asunto:</b> {email['Asunto_Completo']}
+                </div>
+                """, unsafe_allow_html=True)
+                
+                # Pasaje más relevante (modo Relevancia)
+                passage = passage_text(email, best_passages[pos]) if pos in best_passages else None
+                if passage:
+                    marked = get_ranking_index().highlight_passage(passage, compiled.text)
+                    st.markdown(f"<div class='email-content'>🎯 <i>…{marked}…</i></div>", unsafe_allow_html=True)
+                
+                # Cuerpo con resaltado
+                body_show = email['Cuerpo']
+                if compiled.text:
+                    body_show = search.highlight(body_show, compiled.text, prefix_last=True)
+                
+                st.markdown(f"<div class='email-content'>{body_show}</div>", unsafe_allow_html=True)
+                st.markdown("<br>", unsafe_allow_html=True)
+                
+                render_thread_panel(email, target_email)
 
-@st.cache_data(show_spinner=False, ttl=3600)
-def analyze_thread_structure(thread_text):
-    """Genera el Timeline Visual y el Análisis Ejecutivo Profundo"""
-    client = OpenAI(api_key=OPENAI_API_KEY)
-    
-    # PROMPT DE ALTO NIVEL (SENIOR ANALYST ROLE)
-    prompt = """
-    Actúa como un Analista Senior de Información y UX Writer especializado en gestión ejecutiva.
-    Analiza el siguiente hilo de correos completo como una conversación única y orgánica.
-    
-    OBJETIVO:
-    Transformar el hilo en un informe de inteligencia visual. No quiero un resumen lineal.
-    Debes identificar intenciones ocultas, fricciones, quién impulsa y quién bloquea.
-    
-    INPUT: Texto completo del hilo de correos.
-    
-    OUTPUT: Genera una respuesta EXCLUSIVAMENTE en formato Markdown siguiendo esta estructura estricta:
-    
-    ### 🧭 Timeline del Hilo
-    (Genera una lista de hitos. Usa fechas aproximadas si no son exactas. NO resumas cada mail, solo hitos clave).
-    
-    * 🔵 **[DD/MM] – [Fase: Inicio / Seguimiento / Bloqueo / Escalado / Resolución]**
-        * **Actor:** [Nombre de la persona principal]
-        * **Hecho clave:** [Acción concisa. Ej: Solicita confirmación jurídica]
-        * **Impacto:** [Consecuencia real. Ej: El proceso depende ahora de un tercero]
-    
-    (Repite el bloque anterior para cada hito relevante del hilo)
-    
-    ---
-    
-    ### 📌 Estado Actual
-    * **Estado:** [PENDIENTE | BLOQUEADO | CERRADO] (Elige uno con criterio estricto)
-    * **Atasco:** [Explica brevemente dónde está el cuello de botella real o la pelota]
-    * **Responsable actual:** [Nombre de la persona que debe mover ficha ahora]
-    
-    ### 🧠 Conclusión Ejecutiva
-    [Párrafo de 3-4 líneas. Demuestra comprensión profunda. ¿Es un problema operativo, de decisión o de falta de información? ¿Qué riesgo hay si no se avanza? Ve más allá de lo evidente.]
-    
-    ### ▶️ Próximos Pasos
-    * 1. **Acción:** [Acción concreta] | **Responsable:** [Nombre] | **Objetivo:** [Para qué]
-    (Añade más si son necesarios)
-    """
-    
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o", 
-            messages=[
-                {"role": "system", "content": prompt}, 
-                {"role": "user", "content": thread_text}
-            ],
-            temperature=0.1 # Temperatura baja para máxima precisión y respeto al formato
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        return f"Error al generar inteligencia: {str(e)}"
-@st.cache_data(show_spinner=False, ttl=1800)
-def generate_meeting_brief(text_data, num_emails, target_email):
-    """Genera un Pre-Meeting Brief ejecutivo"""
-    client = OpenAI(api_key=OPENAI_API_KEY)
-    
-    prompt = f"""
-    Actúa como un Asistente Ejecutivo Senior de Banca Privada.
-    
-    El RM tiene una reunión próximamente con el cliente {target_email}.
-    Has analizado los últimos {num_emails} emails.
-    
-    Genera un PRE-MEETING BRIEF que se pueda leer en 60 segundos.
-    
-    Devuelve un JSON con esta estructura EXACTA:
-    
-    {{
-        "contexto_rapido": "2-3 líneas explicando el estado actual de la relación y el mood del cliente",
-        "temas_reunion": [
-            {{
-                "prioridad": "URGENTE|IMPORTANTE|INFORMATIVO",
-                "tema": "Título del tema",
-                "detalle": "Qué discutir o confirmar",
-                "contexto": "Por qué es relevante ahora"
-            }}
-        ],
-        "pendientes_cliente": [
-            "Acción 1 que el cliente debe hacer/enviar",
-            "Acción 2 pendiente del cliente"
-        ],
-        "pendientes_banco": [
-            "Acción 1 que tú/el banco debe hacer",
-            "Acción 2 pendiente de tu lado"
-        ],
-        "talking_points": [
-            "Frase exacta para abrir tema 1",
-            "Frase exacta para abrir tema 2"
-        ],
-        "timeline_reciente": [
-            {{
-                "fecha": "DD/MM",
-                "quien": "CLIENTE|BANCO",
-                "que_paso": "Descripción breve de la acción"
-            }}
-        ],
-        "documentos_mencionar": [
-            "Nombre de documento o email que debes referenciar en la reunión"
-        ]
-    }}
-    
-    IMPORTANTE:
-    - temas_reunion: Máximo 5, ordenados por prioridad
-    - timeline_reciente: Solo los últimos 5 hitos relevantes
-    - talking_points: Frases naturales y profesionales
-    - Sé específico, no genérico
-    """
-    
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            response_format={"type": "json_object"},
-            messages=[
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": text_data}
-            ],
-            temperature=0.3
-        )
-        result = json.loads(response.choices[0].message.content)
-        return result, None
-    except Exception as e:
-        return None, f"Error al generar brief: {str(e)}"
 # =============================================================================
 # SISTEMA DE AUTENTICACIÓN
 # =============================================================================
@@ -1432,25 +2304,31 @@ if not check_password():
 # --- UI PRINCIPAL ---
 if 'creds' not in st.session_state: st.session_state.creds = None
 if 'analysis_results' not in st.session_state: st.session_state.analysis_results = None
+if 'active_jobs' not in st.session_state: st.session_state.active_jobs = {}
+if 'job_notices' not in st.session_state: st.session_state.job_notices = []
+if 'prefetch' not in st.session_state: st.session_state.prefetch = PrefetchSession(budget=int(st.secrets.get("PREFETCH_BUDGET", 10)))
+if 'memory' not in st.session_state: st.session_state.memory = get_memory_budget().new_session()
 
 if 'code' in st.query_params and st.session_state.creds is None:
     st.session_state.creds = exchange_code(st.query_params['code'])
     st.query_params.clear()
     st.rerun()
 
-# Validar que las credenciales sigan siendo válidas
+# Las credenciales se renuevan en segundo plano antes de caducar (advisor.auth):
+# aquí solo se mira si la renovación falló sin remedio, sin llamar a Google.
 if st.session_state.creds:
-    try:
-        # Intentar construir el servicio para verificar credenciales
-        from googleapiclient.discovery import build
-        test_service = build('gmail', 'v1', credentials=st.session_state.creds)
-        # Si llegamos aquí, las credenciales son válidas
-    except Exception as e:
-        # Credenciales inválidas o expiradas
-        if "invalid_grant" in str(e).lower() or "invalid_client" in str(e).lower():
-            st.session_state.creds = None
-            st.warning("🔐 Tu sesión ha expirado. Por favor, vuelve a iniciar sesión.")
-            st.rerun()
+    auth = get_credential_manager()
+    if auth.error:
+        logout_google(auth.error)
+    if 'user_email' not in st.session_state:
+        # Usuario al que se atribuye el consumo de la IA (una vez por sesión)
+        try:
+            st.session_state.user_email = get_profile_email(session_credentials())
+        except Exception:
+            st.session_state.user_email = None
+
+if st.session_state.get('auth_notice') and not st.session_state.creds:
+    st.warning(st.session_state.pop('auth_notice'))
 
 # 1. PANTALLA LOGIN
 if not st.session_state.creds:
@@ -1467,7 +2345,7 @@ if not st.session_state.creds:
         st.markdown("<br>", unsafe_allow_html=True)
         _, auth_url = authorize_google()
         if auth_url: st.link_button("🔐 Iniciar Sesión Corporativa", auth_url, type="primary", use_container_width=True)
-        else: st.error("Falta client_secret.json")
+        else: st.error("Falta la configuración OAuth (GOOGLE_CREDENTIALS)")
 
 else:
     with st.sidebar:
@@ -1478,15 +2356,18 @@ else:
         </div>
         """, unsafe_allow_html=True)
         
+        # --- ALERTAS (escáner incremental del correo nuevo) ---
+        start_alert_scan()
+        st.fragment(render_alerts_panel, run_every=2.0 if st.session_state.get('alert_scan_job') else None)()
+        
         # --- CARTERA DE CLIENTES (NUEVO) ---
         st.markdown("### 📇 Cartera de Clientes")
-        client_history = load_history()
-        
-        selected_client = st.selectbox(
-            "Seleccionar cliente reciente:",
-            ["Nuevo Búsqueda"] + client_history,
-            index=0
-        )
+        selected_client = render_client_picker()
+        if selected_client != "Nuevo Búsqueda":
+            render_client_addresses(selected_client)
+        render_group_panel()
+        if st.button("🗺️ Vista de cartera", key="open_portfolio", use_container_width=True):
+            st.session_state.show_portfolio = True
         
         # Si selecciona un cliente del historial, lo ponemos en el estado para que rellene el input
         if selected_client != "Nuevo Búsqueda":
@@ -1494,6 +2375,12 @@ else:
         else:
             st.session_state.default_email = ""
             
+        st.toggle(
+            "🤖 Precalcular análisis IA",
+            key="prefetch_warm_ai",
+            help="Al seleccionar un cliente, además de precargar sus emails se lanza el análisis IA para que 'Analizar' sea instantáneo (consume créditos de OpenAI)"
+        )
+            
         st.markdown("---")
         
         # --- MODO DE ANÁLISIS (NUEVO) ---
@@ -1501,12 +2388,25 @@ else:
         
         analysis_mode = st.radio(
             "Modo de búsqueda:",
-            ["📊 Por número de emails", "📅 Por rango de fechas"],
+            ["📊 Por número de emails", "📅 Por rango de fechas", "📜 Historial completo"],
             index=0,
             key="analysis_mode"
         )
         
-        if analysis_mode == "📊 Por número de emails":
+        if analysis_mode == "📜 Historial completo":
+            st.slider(
+                "Años de historial",
+                min_value=1,
+                max_value=10,
+                value=HISTORY_YEARS,
+                key="history_years",
+                help="Años naturales, incluido el actual. Los meses cerrados se resumen una sola vez y se reutilizan"
+            )
+            st.caption("📚 Cada mes se resume una vez; solo el mes en curso se vuelve a revisar")
+            email_count = None
+            st.session_state.fecha_desde = None
+            st.session_state.fecha_hasta = None
+        elif analysis_mode == "📊 Por número de emails":
             email_count = st.slider(
                 "Número de emails",
                 min_value=5,
@@ -1634,12 +2534,66 @@ else:
             
             email_count = None
         
+        # --- PRECARGA ESPECULATIVA ---
+        # Al elegir un cliente de la cartera, adelantamos la descarga en segundo plano
+        prefetch_session = st.session_state.prefetch
+        if selected_client != "Nuevo Búsqueda" and analysis_mode != "📜 Historial completo":
+            client_addresses = get_client_registry().addresses(selected_client)
+            with session_attribution(selected_client):
+                prefetch_job = prefetch_session.request(
+                    get_job_manager(),
+                    make_fetch_key(
+                        selected_client,
+                        analysis_mode,
+                        email_count,
+                        st.session_state.get('fecha_desde'),
+                        st.session_state.get('fecha_hasta'),
+                        addresses=client_addresses
+                    ),
+                    run_prefetch_job,
+                    get_engine(),
+                    session_credentials(),
+                    selected_client,
+                    analysis_mode,
+                    email_count=email_count,
+                    fecha_desde=st.session_state.get('fecha_desde'),
+                    fecha_hasta=st.session_state.get('fecha_hasta'),
+                    warm_ai=st.session_state.get('prefetch_warm_ai', False),
+                    addresses=client_addresses
+                )
+            
+            if prefetch_job is None:
+                st.caption("⚡ Presupuesto de precarga agotado en esta sesión")
+            elif prefetch_job.status == JOB_DONE and not prefetch_job.result['emails'][1]:
+                st.caption(f"⚡ Datos de {selected_client} precargados")
+            elif not prefetch_job.finished:
+                st.caption(f"⚡ Precargando datos de {selected_client}... ({prefetch_session.remaining} precargas restantes)")
+        else:
+            prefetch_session.cancel(get_job_manager())
+        
         st.markdown("---")
+        render_performance_panel()
+        render_usage_panel()
+        render_memory_panel()
+        render_queue_panel()
         st.success("✓ Gmail Conectado")
+        render_token_status()
         if st.button("🚪 Cerrar Sesión", use_container_width=True):
-            st.session_state.creds = None
+            for job_id in st.session_state.active_jobs.values():
+                get_job_manager().cancel(job_id)
+            st.session_state.active_jobs = {}
+            st.session_state.prefetch.cancel(get_job_manager())
             st.session_state.analysis_results = None
-            st.rerun()
+            st.session_state.brief_result = None
+            st.session_state.history_results = None
+            st.session_state.show_portfolio = False
+            if st.session_state.get('alert_scan_job'):
+                get_job_manager().cancel(st.session_state.alert_scan_job)
+            st.session_state.alert_scan_job = None
+            st.session_state.alert_scan_result = None
+            st.session_state.alert_scan_checked = False
+            st.session_state.memory = get_memory_budget().new_session()
+            logout_google()
     
     st.markdown("""
 <div style='background: white; border: 1px solid #e2e8f0; padding: 48px 40px; border-radius: 8px; margin-bottom: 32px;'>
@@ -1687,234 +2641,164 @@ else:
             )
             st.stop()
         
-        # Limpiar y normalizar
-        target_email = target_email.strip().lower()
+        # Limpiar y normalizar (una dirección secundaria analiza al cliente completo)
+        registry = get_client_registry()
+        target_email = registry.resolve(target_email) or target_email.strip().lower()
         
-        # GUARDAR EN HISTORIAL
-        save_to_history(target_email)
+        # GUARDAR EN LA CARTERA
+        registry.touch(target_email)
+        addresses = registry.addresses(target_email)
         
-        # === INICIO DEL ANÁLISIS CON FEEDBACK MEJORADO ===
-        with st.spinner("🔄 Conectando con Gmail..."):
-            # Determinar parámetros según modo de análisis
-            mode = st.session_state.get('analysis_mode', '📊 Por número de emails')
-            
-            # Mostrar un placeholder con info contextual
-            info_placeholder = st.empty()
-            
-            try:
-                if mode == "📊 Por número de emails":
-                    with info_placeholder.container():
-                        st.markdown(f"""
-<div style='background: linear-gradient(135deg, #e3f2fd 0%, #bbdefb 100%); padding: 20px; border-radius: 12px; border-left: 4px solid #2196f3; text-align: center;'>
-    <div style='font-size: 32px; margin-bottom: 10px;'>📥</div>
-    <h4 style='color: #0d47a1; margin: 0 0 8px 0;'>Obteniendo emails de Gmail</h4>
-    <p style='color: #1565c0; margin: 0; font-size: 14px;'>
-        Buscando los últimos <strong>{email_count}</strong> emails de <strong>{target_email}</strong>
-    </p>
-</div>
-""", unsafe_allow_html=True)
-                    
-                    raw, ev, err = get_emails(
-                        st.session_state.creds, 
-                        target_email, 
-                        num_emails=email_count
-                    )
-                else:
-                    fecha_desde = st.session_state.get('fecha_desde')
-                    fecha_hasta = st.session_state.get('fecha_hasta')
-                    
-                    if not fecha_desde or not fecha_hasta:
-                        info_placeholder.empty()
-                        st.error("⚠️ Debes seleccionar un rango de fechas válido")
-                        st.stop()
-                    
-                    with info_placeholder.container():
-                        st.markdown(f"""
-<div style='background: linear-gradient(135deg, #e3f2fd 0%, #bbdefb 100%); padding: 20px; border-radius: 12px; border-left: 4px solid #2196f3; text-align: center;'>
-    <div style='font-size: 32px; margin-bottom: 10px;'>📅</div>
-    <h4 style='color: #0d47a1; margin: 0 0 8px 0;'>Buscando en rango de fechas</h4>
-    <p style='color: #1565c0; margin: 0; font-size: 14px;'>
-        Del <strong>{fecha_desde.strftime('%d/%m/%Y')}</strong> al <strong>{fecha_hasta.strftime('%d/%m/%Y')}</strong>
-    </p>
-</div>
-""", unsafe_allow_html=True)
-                    
-                    raw, ev, err = get_emails(
-                        st.session_state.creds, 
-                        target_email, 
-                        fecha_desde=fecha_desde,
-                        fecha_hasta=fecha_hasta
-                    )
-                
-                info_placeholder.empty()
-                
-                # === MANEJO DE ERRORES GMAIL ===
-                if err:
-                    show_error_box(
-                        "Error al obtener emails",
-                        err,
-                        suggestions=[
-                            "Verifica que el email esté bien escrito",
-                            "Asegúrate de tener permisos en Gmail",
-                            "Si el problema persiste, cierra sesión y vuelve a autenticarte"
-                        ]
-                    )
-                    st.stop()
-                
-                # === SI NO HAY EMAILS ===
-                if not raw or not ev:
-                    show_empty_state(
-                        "📭",
-                        "No se encontraron emails",
-                        f"No hay conversaciones con <strong>{target_email}</strong> en el período seleccionado",
-                        suggestions=[
-                            "Verifica que el email sea correcto",
-                            "Amplía el rango de fechas",
-                            'Prueba con "Por número de emails" en el sidebar'
-                        ]
-                    )
-                    st.stop()
-                
-                # === ANÁLISIS CON IA ===
-                with info_placeholder.container():
-                    st.markdown(f"""
-<div style='background: linear-gradient(135deg, #f3e5f5 0%, #e1bee7 100%); padding: 20px; border-radius: 12px; border-left: 4px solid #7b1fa2; text-align: center;'>
-    <div style='font-size: 32px; margin-bottom: 10px;'>🤖</div>
-    <h4 style='color: #4a148c; margin: 0 0 8px 0;'>Analizando con Inteligencia Artificial</h4>
-    <p style='color: #6a1b9a; margin: 0; font-size: 14px;'>
-        Procesando <strong>{len(ev)} emails</strong> con GPT-4o...<br>
-        <em style='font-size: 12px; opacity: 0.8;'>Esto puede tardar 10-15 segundos</em>
-    </p>
-</div>
-""", unsafe_allow_html=True)
-                
-                an, ai_err = analyze_with_ai(raw, len(ev))
-                
-                info_placeholder.empty()
-                
-                if ai_err:
-                    # === ACTIVAR MODO FALLBACK ===
-                    st.warning("⚠️ El análisis de IA no está disponible. Generando vista básica...")
-                    an = generate_fallback_analysis(ev, target_email)
-                    
-                    show_warning_box(
-                        "Modo Básico Activado",
-                        f"<strong>Motivo:</strong> {ai_err}",
-                        tips=[
-                            f"Los {len(ev)} emails se cargaron correctamente",
-                            'Usa el "Explorador Avanzado" para revisarlos manualmente',
-                            "El análisis de sentimiento se generará cuando OpenAI esté disponible"
-                        ]
-                    )
-                
-                # === ÉXITO ===
-                st.session_state.analysis_results = {
-                    'analysis': an, 
-                    'evidence': ev, 
-                    'target_email': target_email,
-                    'analysis_mode': mode,
-                    'email_count': email_count if mode == "📊 Por número de emails" else None,
-                    'fecha_desde': fecha_desde if mode == "📅 Por rango de fechas" else None,
-                    'fecha_hasta': fecha_hasta if mode == "📅 Por rango de fechas" else None
-                }
-                
-                show_success_box(
-                    "Análisis completado correctamente",
-                    "Los resultados ya están disponibles más abajo"
+        # Determinar parámetros según modo de análisis
+        mode = st.session_state.get('analysis_mode', '📊 Por número de emails')
+        fecha_desde = st.session_state.get('fecha_desde')
+        fecha_hasta = st.session_state.get('fecha_hasta')
+        
+        if mode == "📅 Por rango de fechas" and (not fecha_desde or not fecha_hasta):
+            st.error("⚠️ Debes seleccionar un rango de fechas válido")
+            st.stop()
+        
+        if mode == "📜 Historial completo":
+            # === HISTORIAL COMPLETO (resúmenes mensuales en segundo plano) ===
+            manager = get_job_manager()
+            previous_job_id = st.session_state.active_jobs.get('history')
+            if previous_job_id:
+                manager.cancel(previous_job_id)
+            years = st.session_state.get('history_years', HISTORY_YEARS)
+            with session_attribution(target_email):
+                job = manager.submit(
+                    run_history_job,
+                    get_engine(),
+                    session_credentials(),
+                    target_email,
+                    years=years,
+                    addresses=addresses,
+                    kind="history",
+                    label=f"Historial completo de {target_email} ({years} años)"
                 )
-                
-            except Exception as e:
-                # CAPTURA DE ERRORES INESPERADOS
-                show_error_box(
-                    "Error técnico inesperado",
-                    "Ha ocurrido un error que no pudimos anticipar. Por favor, contacta a soporte.",
-                    details=str(e)
+            st.session_state.active_jobs['history'] = job.id
+        else:
+            # === LANZAR ANÁLISIS EN SEGUNDO PLANO ===
+            # Sobrevive a los reruns: la sesión solo guarda el ID de la tarea
+            manager = get_job_manager()
+            previous_job_id = st.session_state.active_jobs.get('analysis')
+            if previous_job_id:
+                manager.cancel(previous_job_id)
+        
+            job_params = {
+                'email_count': email_count if mode == "📊 Por número de emails" else None,
+                'fecha_desde': fecha_desde if mode == "📅 Por rango de fechas" else None,
+                'fecha_hasta': fecha_hasta if mode == "📅 Por rango de fechas" else None
+            }
+        
+            # Reutilizar la precarga del cliente si coincide con lo que se pide
+            prefetch_job = st.session_state.prefetch.job_for(
+                manager,
+                make_fetch_key(target_email, mode, addresses=addresses, **job_params)
+            )
+        
+            with session_attribution(target_email):
+                job = manager.submit(
+                    run_analysis_job,
+                    get_engine(),
+                    session_credentials(),
+                    target_email,
+                    mode,
+                    prefetch_job=prefetch_job,
+                    addresses=addresses,
+                    kind="analysis",
+                    label=f"Analizando {target_email}" + (f" ({len(addresses)} direcciones)" if len(addresses) > 1 else ""),
+                    **job_params
                 )
-                st.stop()
-                st.stop()
+            st.session_state.active_jobs['analysis'] = job.id
+    
     # Manejar click en botón Brief
     if brief_btn and target_email:
         if '@' not in target_email:
             st.error("⚠️ Email inválido")
         else:
-            # Si ya hay un análisis previo, usarlo; si no, hacer análisis rápido
+            registry = get_client_registry()
+            target_email = registry.resolve(target_email) or target_email.strip().lower()
+            
+            # Si ya hay un análisis previo, usarlo; si no, el job hará un análisis rápido
+            evidence = None
+            brief_count = 15  # Análisis rápido: mismo valor que el precálculo nocturno
             if st.session_state.analysis_results and st.session_state.analysis_results.get('target_email') == target_email:
                 # Usar análisis existente
                 evidence = st.session_state.analysis_results['evidence']
-                raw_text = "\n".join([
-                    f"EMAIL {e['Nº']}: {e['Fecha']} | {e['Origen']} | {e['Asunto_Completo']} | {e['Cuerpo'][:500]}"
-                    for e in evidence
-                ])
-            else:
-                # Hacer análisis rápido (últimos 15 emails)
-                with st.spinner("📥 Obteniendo emails..."):
-                    raw_text, evidence, err = get_emails(st.session_state.creds, target_email, num_emails=15)
-                    
-                    if err:
-                        show_error_box(
-                            "Error al obtener emails",
-                            err,
-                            suggestions=[
-                                "Verifica que el email esté bien escrito",
-                                "Asegúrate de tener permisos en Gmail"
-                            ]
-                        )
-                        st.stop()
-                    
-                    if not raw_text or not evidence:
-                        show_empty_state(
-                            "📭",
-                            "No se encontraron emails",
-                            f"No hay conversaciones con <strong>{target_email}</strong>",
-                            suggestions=["Verifica que el email sea correcto"]
-                        )
-                        st.stop()
+                brief_count = st.session_state.analysis_results.get('email_count')
             
-            # Generar el brief
-            with st.spinner("📄 Generando Pre-Meeting Brief con IA..."):
-                brief_data, brief_err = generate_meeting_brief(raw_text, len(evidence), target_email)
-                
-                if brief_err:
-                    show_error_box(
-                        "Error al generar el brief",
-                        brief_err,
-                        suggestions=[
-                            "Verifica tu conexión con OpenAI",
-                            "Intenta con menos emails"
-                        ]
-                    )
-                    st.stop()
+            manager = get_job_manager()
+            previous_job_id = st.session_state.active_jobs.get('brief')
+            if previous_job_id:
+                manager.cancel(previous_job_id)
             
-            # === GENERAR PDF DIRECTAMENTE ===
-            try:
-                import tempfile
-                import os
-                
-                with st.spinner("🖨️ Generando PDF del Brief..."):
-                    # Usar directorio temporal del sistema
-                    temp_dir = tempfile.gettempdir()
-                    pdf_filename = f"brief_{target_email.replace('@', '_')}_{datetime.now().strftime('%Y%m%d_%H%M')}.pdf"
-                    pdf_path = os.path.join(temp_dir, pdf_filename)
-                    
-                    generate_brief_pdf(brief_data, target_email, pdf_path)
-                    
-                    # Leer el archivo para descarga
-                    with open(pdf_path, "rb") as pdf_file:
-                        pdf_bytes = pdf_file.read()
-                    
-                    # Limpiar archivo temporal
-                    try:
-                        os.remove(pdf_path)
-                    except:
-                        pass
-                
-                # === MOSTRAR RESULTADO COMPACTO ===
-                st.markdown("<br>", unsafe_allow_html=True)
-                
-                col_result1, col_result2, col_result3 = st.columns([1, 2, 1])
-                
-                with col_result2:
-                    st.markdown("""
+            with session_attribution(target_email):
+                job = manager.submit(
+                    run_brief_job,
+                    get_engine(),
+                    session_credentials(),
+                    target_email,
+                    evidence=evidence,
+                    num_emails=brief_count,
+                    addresses=registry.addresses(target_email),
+                    kind="brief",
+                    label=f"Pre-Meeting Brief de {target_email}"
+                )
+            st.session_state.active_jobs['brief'] = job.id
+    
+    # Análisis de un grupo familiar (botón del sidebar)
+    pending_group = st.session_state.pop('pending_group', None)
+    if pending_group:
+        registry = get_client_registry()
+        members = [(m['email'], registry.addresses(m['email'])) for m in registry.group(pending_group)]
+        mode = st.session_state.get('analysis_mode', '📊 Por número de emails')
+        job_params = {
+            'email_count': email_count if mode == "📊 Por número de emails" else None,
+            'fecha_desde': st.session_state.get('fecha_desde') if mode == "📅 Por rango de fechas" else None,
+            'fecha_hasta': st.session_state.get('fecha_hasta') if mode == "📅 Por rango de fechas" else None
+        }
+        if mode == "📅 Por rango de fechas" and (not job_params['fecha_desde'] or not job_params['fecha_hasta']):
+            st.error("⚠️ Debes seleccionar un rango de fechas válido")
+        elif members:
+            manager = get_job_manager()
+            previous_job_id = st.session_state.active_jobs.get('analysis')
+            if previous_job_id:
+                manager.cancel(previous_job_id)
+            with session_attribution(pending_group):
+                job = manager.submit(
+                    run_group_job,
+                    get_engine(),
+                    session_credentials(),
+                    pending_group,
+                    members,
+                    mode,
+                    kind="group_analysis",
+                    label=f"Analizando el grupo {pending_group} ({len(members)} miembros)",
+                    **job_params
+                )
+            st.session_state.active_jobs['analysis'] = job.id
+    
+    # === TAREAS EN CURSO Y RESULTADOS RECIENTES ===
+    collect_finished_jobs()
+    
+    if st.session_state.active_jobs:
+        # El panel se refresca solo cada segundo sin rerun completo de la página
+        st.fragment(render_job_status, run_every=1.0)()
+    
+    for notice in st.session_state.job_notices:
+        render_job_notice(notice)
+    st.session_state.job_notices = []
+    
+    brief_result = st.session_state.get('brief_result')
+    if brief_result:
+        # === MOSTRAR RESULTADO COMPACTO ===
+        st.markdown("<br>", unsafe_allow_html=True)
+        
+        col_result1, col_result2, col_result3 = st.columns([1, 2, 1])
+        
+        with col_result2:
+            st.markdown("""
 <div style='background: linear-gradient(135deg, #e8f5e9 0%, #c8e6c9 100%); padding: 40px; border-radius: 15px; text-align: center; box-shadow: 0 8px 24px rgba(46,125,50,0.15);'>
     <div style='font-size: 72px; margin-bottom: 20px;'>✅</div>
     <h2 style='color: #1b5e20; margin: 0 0 12px 0;'>Brief Generado</h2>
@@ -1923,35 +2807,27 @@ else:
     </p>
 </div>
 """, unsafe_allow_html=True)
-                    
-                    st.markdown("<br><br>", unsafe_allow_html=True)
-                    
-                    st.download_button(
-                        label="⬇️ Descargar Brief en PDF",
-                        data=pdf_bytes,
-                        file_name=pdf_filename,
-                        mime="application/pdf",
-                        use_container_width=True,
-                        type="primary"
-                    )
             
-            except Exception as e:
-                import traceback
-                error_details = traceback.format_exc()
-                
-                show_error_box(
-                    "Error al generar el PDF",
-                    f"No se pudo crear el documento: {str(e)}",
-                    details=error_details,
-                    suggestions=[
-                        "Verifica que reportlab esté instalado",
-                        "Reinicia Streamlit",
-                        "Intenta de nuevo"
-                    ]
-                )
+            st.markdown("<br><br>", unsafe_allow_html=True)
+            
+            st.download_button(
+                label="⬇️ Descargar Brief en PDF",
+                data=brief_result['pdf_bytes'],
+                file_name=brief_result['pdf_filename'],
+                mime="application/pdf",
+                use_container_width=True,
+                type="primary"
+            )
+    if st.session_state.get('show_portfolio'):
+        render_portfolio_view()
+    
+    if st.session_state.get('history_results'):
+        render_history_results(st.session_state.history_results)
+    
     if st.session_state.analysis_results:
         data = st.session_state.analysis_results['analysis']
         evidence = st.session_state.analysis_results['evidence']
+        st.session_state.memory.get('evidence')  # Marca la evidencia como recién usada (LRU)
         
         # === BADGE DE RESUMEN EJECUTIVO ===
         mode_used = st.session_state.analysis_results.get('analysis_mode', 'N/A')
@@ -1969,6 +2845,11 @@ else:
             else:
                 periodo_text = "Período personalizado"
         
+        if st.session_state.analysis_results.get('group'):
+            badge_client = f"👪 {st.session_state.analysis_results['group']} · {len(st.session_state.analysis_results.get('members', {}))} miembros"
+        else:
+            badge_client = f"📧 {st.session_state.analysis_results.get('target_email', '')}"
+        
         # Determinar color según urgencia (colores sutiles)
         if urgencia == 'Alta':
             badge_color = "#742a2a"
@@ -1997,7 +2878,7 @@ else:
             </div>
         </div>
         <div style='color: #718096; font-size: 13px; font-weight: 500;'>
-            📧 {st.session_state.analysis_results.get('target_email', '')}
+            {badge_client}
         </div>
     </div>
 </div>
@@ -2163,84 +3044,15 @@ else:
     <p style='color: #718096; font-size: 14px; margin: 8px 0 0 0;'>Análisis cronológico de la relación</p>
 </div>
 """, unsafe_allow_html=True)
-        sent_data = data.get('analisis_sentimiento', [])
-        limit = min(len(sent_data), len(evidence))
-        
-        if limit > 0:
-            df_chart = pd.DataFrame({
-                'Fecha': [e['Fecha'] for e in evidence[:limit]],
-                'Score': [s['sentimiento_score'] for s in sent_data[:limit]],
-                'Asunto': [e['Asunto'] for e in evidence[:limit]],
-                'Explicacion': [s.get('explicacion', '') for s in sent_data[:limit]],
-                'Origen': [e['Origen'] for e in evidence[:limit]],
-                'ID': [e['Id'] for e in evidence[:limit]] # Para referencia visual
-            })
-            
-            # Crear figura
-            fig = go.Figure()
-
-            # 1. Zonas de fondo (Semáforo Visual)
-            # Zona Éxito (Verde)
-            fig.add_hrect(y0=5, y1=11, line_width=0, fillcolor="rgba(46, 204, 113, 0.1)", layer="below")
-            # Zona Peligro (Rojo)
-            fig.add_hrect(y0=-11, y1=-5, line_width=0, fillcolor="rgba(231, 76, 60, 0.1)", layer="below")
-
-            # 2. Línea y Puntos
-            fig.add_trace(go.Scatter(
-                x=df_chart['Fecha'], 
-                y=df_chart['Score'], 
-                mode='lines+markers', 
-                name='Sentimiento',
-                # Línea curva suave y elegante
-                line=dict(color='#1a2b4b', width=3, shape='spline', smoothing=1.3),
-                # Marcadores dinámicos: Color según score, Tamaño según intensidad
-                marker=dict(
-                    size=[max(8, abs(s)*1.5) for s in df_chart['Score']], # Más grande si es más intenso
-                    color=df_chart['Score'], 
-                    colorscale='RdYlGn', # Rojo -> Amarillo -> Verde
-                    line=dict(width=2, color='white'), 
-                    showscale=False,
-                    cmin=-10, cmax=10
-                ),
-                # Tooltip Informativo HTML
-                customdata=df_chart[['Asunto', 'Explicacion', 'Origen', 'ID']],
-                hovertemplate="""
-                <b>%{customdata[2]}</b> (ID: %{customdata[3]})<br>
-                📅 %{x}<br>
-                ----------------<br>
-                <b>%{customdata[0]}</b><br>
-                <i>%{customdata[1]}</i><br>
-                ----------------<br>
-                🎯 Score: <b>%{y}</b>
-                <extra></extra>
-                """
-            ))
-
-            # 3. Línea Neutral
-            fig.add_hline(y=0, line_dash="dash", line_color="gray", opacity=0.5, annotation_text="Neutral (0)", annotation_position="bottom right")
-            
-            # 4. Diseño Limpio
-            fig.update_layout(
-                height=500, 
-                plot_bgcolor='rgba(255,255,255,0)', 
-                paper_bgcolor='white', 
-                yaxis=dict(
-                    range=[-11, 11], 
-                    title="Negativo ↔ Positivo", 
-                    showgrid=True, 
-                    gridcolor='rgba(0,0,0,0.05)'
-                ),
-                xaxis=dict(
-                    showgrid=False
-                ),
-                hovermode='closest', # Importante para ver el punto exacto
-                margin=dict(t=20, b=20, l=20, r=20)
-            )
-            
-            st.plotly_chart(fig, use_container_width=True)
-            
-            # Nota para el usuario sobre la interactividad
-            st.caption("💡 *Nota: Los puntos más grandes indican emociones más intensas. El fondo verde indica zona de confort, el rojo zona de riesgo.*")
+        render_sentiment_chart(data, evidence)
+        render_relationship_metrics()
+        
+        if st.session_state.analysis_results.get('members'):
+            st.markdown("#### 👪 Sentimiento por miembro")
+            render_member_panel(st.session_state.analysis_results['members'])
+        
+        if st.session_state.analysis_results.get('diff'):
+            render_snapshot_diff(st.session_state.analysis_results['diff'])
         
         # Separador antes de navegación
         st.markdown("<br><br>", unsafe_allow_html=True)
@@ -2414,224 +3226,10 @@ else:
             
             st.markdown("<br>", unsafe_allow_html=True)
             
-            st.text_area(
-                "Contenido del mensaje:",
-                value=data.get('borrador_respuesta', 'No disponible'),
-                height=400,
-                label_visibility="collapsed"
-            )
-            
-            st.markdown("<br>", unsafe_allow_html=True)
-            
-            col_btn1, col_btn2, col_btn3 = st.columns([2, 2, 1])
-            with col_btn1:
-                draft = data.get('borrador_respuesta', '')
-                gmail_compose_url = f"https://mail.google.com/mail/?view=cm&fs=1&to={st.session_state.analysis_results.get('target_email', '')}&su=Seguimiento"
-                st.link_button("📧 Abrir en Gmail", gmail_compose_url, use_container_width=True, type="primary")
-            with col_btn2:
-                st.button("📋 Copiar texto", use_container_width=True, key="copy_draft")
-            with col_btn3:
-                st.button("🔄", use_container_width=True, help="Regenerar borrador", key="regenerate_draft")
+            render_draft_editor(data.get('borrador_respuesta', 'No disponible'), st.session_state.analysis_results.get('target_email', ''))
         # --- VISTA 3: EXPLORADOR AVANZADO ---
         elif selected_view == NAV_EXPLORADOR:
-            # === PANEL DE FILTROS (MEJORADO) ===
-            st.markdown("""
-            <div style='background: white; padding: 20px 25px; border-radius: 12px; box-shadow: 0 2px 8px rgba(0,0,0,0.06); margin-bottom: 25px; border-left: 5px solid #004e98;'>
-                <h4 style='margin: 0 0 15px 0; color: #1a2b4b; font-size: 18px; display: flex; align-items: center;'>
-                    🔍 <span style='margin-left: 10px;'>Filtros de Búsqueda</span>
-                </h4>
-            </div>
-            """, unsafe_allow_html=True)
-            
-            # Inicializar valores por defecto si no existen
-            if 'f_origen_key' not in st.session_state:
-                st.session_state.f_origen_key = "Todos"
-            if 'f_texto_key' not in st.session_state:
-                st.session_state.f_texto_key = ""
-            if 'f_fecha_key' not in st.session_state:
-                st.session_state.f_fecha_key = "Todas"
-            
-            # Filtros en una sola línea compacta
-            f_col1, f_col2, f_col3, f_col4 = st.columns([2, 2, 2, 1])
-            with f_col1:
-                f_origen = st.selectbox(
-                    "Origen", 
-                    ["Todos", "CLIENTE", "BANCO"], 
-                    index=["Todos", "CLIENTE", "BANCO"].index(st.session_state.f_origen_key),
-                    key="f_origen_key"
-                )
-            with f_col2:
-                f_texto = st.text_input(
-                    "Buscar palabra clave", 
-                    value=st.session_state.f_texto_key,
-                    placeholder="Ej: inversión...", 
-                    key="f_texto_key"
-                )
-            with f_col3:
-                f_fecha = st.selectbox(
-                    "Fecha", 
-                    ["Todas", "7 días", "30 días"],
-                    index=["Todas", "7 días", "30 días"].index(st.session_state.f_fecha_key),
-                    key="f_fecha_key"
-                )
-            with f_col4:
-                st.markdown("<br>", unsafe_allow_html=True)  # Alinear verticalmente
-                if st.button("🔄 Limpiar", key="clear_filters", use_container_width=True):
-                    # Forzar reset borrando las keys del estado
-                    for key in ['f_origen_key', 'f_texto_key', 'f_fecha_key']:
-                        if key in st.session_state:
-                            del st.session_state[key]
-                    st.rerun()
-            
-            st.markdown("---")
-
-            # === LÓGICA DE FILTRADO ===
-            filtered_ev = evidence.copy()
-            if f_origen != "Todos":
-                filtered_ev = [e for e in filtered_ev if e['Origen'] == f_origen]
-            
-            if f_texto:
-                term = f_texto.lower()
-                filtered_ev = [e for e in filtered_ev if term in e['Asunto_Completo'].lower() or term in e['Cuerpo'].lower()]
-            
-            if f_fecha != "Todas":
-                days = 7 if "7" in f_fecha else 30
-                limit_date = datetime.now() - timedelta(days=days)
-                filtered_ev = [e for e in filtered_ev if datetime.strptime(e['Fecha'], '%Y-%m-%d %H:%M') >= limit_date]
-
-            # Contador de resultados más visible
-            if len(filtered_ev) < len(evidence):
-                st.info(f"📊 **{len(filtered_ev)}** de **{len(evidence)}** emails coinciden con los filtros")
-            else:
-                st.success(f"📊 Mostrando los **{len(evidence)}** emails completos")
-            
-            st.markdown("<br>", unsafe_allow_html=True)
-
-            # === VISUALIZACIÓN DE CARDS (PERSISTENTE) ===
-            if not filtered_ev:
-                st.markdown("""
-                <div style='text-align: center; padding: 60px 40px; background: white; border-radius: 15px; border: 2px dashed #e0e6ed; margin: 30px 0;'>
-                    <div style='font-size: 64px; margin-bottom: 20px; opacity: 0.3;'>📭</div>
-                    <h3 style='color: #5a6c7d; margin-bottom: 10px;'>No hay emails que coincidan</h3>
-                    <p style='color: #95a5a6; font-size: 15px;'>
-                        Intenta ajustar los filtros o buscar otro término
-                    </p>
-                </div>
-                """, unsafe_allow_html=True)
-            else:
-                for email in filtered_ev:
-                    icon = "👤" if email['Origen'] == "CLIENTE" else "🏦"
-                    color = "green" if email['Origen'] == "CLIENTE" else "blue"
-                    
-                    with st.expander(f"{icon} {email['Fecha_Corta']} | {email['Asunto']}"):
-                        # Cabecera
-                        st.markdown(f"""
-                        <div class='email-header-box'>
-                            <b>De:</b> :{color}[{email['Origen']}] <br>
-                            <b>Fecha:</b> {email['Fecha']} <br>
-                            <b>Asunto:</b> {email['Asunto_Completo']}
-                        </div>
-                        """, unsafe_allow_html=True)
-                        
-                        # Cuerpo con resaltado
-                        body_show = email['Cuerpo']
-                        if f_texto:
-                            import re
-                            body_show = re.sub(f"({re.escape(f_texto)})", r"<mark style='background:#fff9c4'>\1</mark>", body_show, flags=re.IGNORECASE)
-                        
-                        st.markdown(f"<div class='email-content'>{body_show}</div>", unsafe_allow_html=True)
-                        st.markdown("<br>", unsafe_allow_html=True)
-                        
-                        # --- ZONA DE ACCIONES (ESTADO PERSISTENTE) ---
-                        c_btn1, c_btn2 = st.columns([1, 2])
-                        analysis_key = f"thread_analysis_{email['Id']}"
-                        
-                        with c_btn1:
-                            gmail_url = f"https://mail.google.com/mail/u/0/#inbox/{email['Id_Completo']}"
-                            st.link_button("🔗 Abrir en Gmail", gmail_url, use_container_width=True)
-                        
-                        with c_btn2:
-                            # 1. BOTÓN DE ANÁLISIS (MEJORADO)
-                            button_label = "✅ Análisis cargado" if f"thread_analysis_{email['Id']}" in st.session_state else "🧶 Analizar Hilo Completo"
-                            button_type = "secondary" if f"thread_analysis_{email['Id']}" in st.session_state else "primary"
-                            
-                            if st.button(button_label, key=f"btn_{email['Id']}", use_container_width=True, type=button_type):
-                                # Mostrar placeholder mientras carga
-                                placeholder = st.empty()
-                                with placeholder.container():
-                                    st.markdown("""
-<div style='background: linear-gradient(135deg, #f3e5f5 0%, #e1bee7 100%); padding: 30px; border-radius: 12px; text-align: center; border-left: 4px solid #7b1fa2; box-shadow: 0 4px 12px rgba(123,31,162,0.1);'>
-    <div style='font-size: 48px; margin-bottom: 15px; animation: pulse 1.5s ease-in-out infinite;'>🧶</div>
-    <h4 style='color: #4a148c; margin: 0 0 10px 0;'>Analizando hilo completo...</h4>
-    <p style='color: #6a1b9a; font-size: 14px; margin: 0;'>Procesando conversación completa con IA</p>
-    <div style='width: 50%; height: 4px; background: rgba(123,31,162,0.2); border-radius: 2px; margin: 15px auto 0; overflow: hidden;'>
-        <div style='width: 100%; height: 100%; background: #7b1fa2; animation: loading 1.5s ease-in-out infinite;'></div>
-    </div>
-</div>
-
-<style>
-@keyframes pulse {
-    0%, 100% { opacity: 1; transform: scale(1); }
-    50% { opacity: 0.7; transform: scale(1.1); }
-}
-@keyframes loading {
-    0% { transform: translateX(-100%); }
-    100% { transform: translateX(100%); }
-}
-</style>
-""", unsafe_allow_html=True)
-                                
-                                try:
-                                    # API Call
-                                    service = build('gmail', 'v1', credentials=st.session_state.creds)
-                                    meta = service.users().messages().get(userId='me', id=email['Id_Completo'], format='minimal').execute()
-                                    thread_id = meta.get('threadId')
-                                    
-                                    # Backend Logic
-                                    thread_content = get_thread_content(st.session_state.creds, thread_id)
-                                    
-                                    if thread_content:
-                                        analysis = analyze_thread_structure(thread_content)
-                                        # 💾 GUARDADO EN ESTADO
-                                        st.session_state[analysis_key] = analysis
-                                        placeholder.empty()  # Limpiar el loading
-                                        st.rerun()  # Refrescar para mostrar resultado
-                                    else:
-                                        placeholder.empty()
-                                        st.error("No se pudo leer el hilo.")
-                                except Exception as e:
-                                    placeholder.empty()
-                                    st.error(f"Error técnico: {e}")
-
-                        # 2. VISUALIZADOR (Lee del estado)
-                        if analysis_key in st.session_state:
-                            st.markdown("<br>", unsafe_allow_html=True)
-                            
-                            # Header con botón de cerrar
-                            col_header1, col_header2 = st.columns([4, 1])
-                            with col_header1:
-                                st.markdown("""
-                                <div style='background: linear-gradient(135deg, #fff3e0 0%, #ffe0b2 100%); padding: 15px 20px; border-radius: 10px 10px 0 0; border-left: 5px solid #ef6c00;'>
-                                    <h4 style='color: #ef6c00; margin: 0; display: flex; align-items: center;'>
-                                        <span style='font-size: 24px; margin-right: 10px;'>🧶</span>
-                                        Inteligencia de Hilo
-                                    </h4>
-                                </div>
-                                """, unsafe_allow_html=True)
-                            with col_header2:
-                                if st.button("✕", key=f"close_{email['Id']}", help="Cerrar análisis"):
-                                    del st.session_state[analysis_key]
-                                    st.rerun()
-                            
-                            # Contenido del análisis en markdown nativo (mejor renderizado)
-                            st.markdown(f"""
-                            <div style='background-color: white; border: 2px solid #ffe0b2; border-top: none; padding: 25px; border-radius: 0 0 10px 10px; box-shadow: 0 4px 12px rgba(0,0,0,0.08);'>
-                            """, unsafe_allow_html=True)
-                            
-                            # Renderizar el markdown de la IA directamente
-                            st.markdown(st.session_state[analysis_key])
-                            
-                            st.markdown("</div>", unsafe_allow_html=True)
+            render_explorer(evidence, st.session_state.analysis_results.get('target_email', ''))
     else:
         # Fíjate que esta línea tiene sangría (espacios al principio) respecto al 'else'
         st.markdown("<br><br>", unsafe_allow_html=True)
@@ -0,0 +1,135 @@
+"""
+Coste de un rerun del dashboard: script completo vs. fragmento.
+
+Carga app.py con Streamlit AppTest y un análisis sintético ya en sesión, y
+mide tres interacciones del Explorador (escribir una palabra clave, cambiar el
+origen, limpiar filtros) y una edición del borrador:
+
+- "script completo": lo que costaba cada interacción antes de los fragmentos
+  (AppTest siempre vuelve a ejecutar el script entero).
+- "fragmento": duración del span ui.explorer / ui.draft_editor de la misma
+  interacción, que es lo único que Streamlit ejecuta ahora en el navegador.
+
+No llama a Gmail ni a OpenAI.
+
+Uso:
+    python benchmarks/rerun_timing.py --emails 200 --repeat 5
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from streamlit.testing.v1 import AppTest
+
+from advisor import telemetry
+
+GOOGLE_CREDENTIALS = (
+    '{"web": {"client_id": "bench", "client_secret": "bench", '
+    '"auth_uri": "https://accounts.google.com/o/oauth2/auth", '
+    '"token_uri": "https://oauth2.googleapis.com/token", '
+    '"redirect_uris": ["https://wealth-solutions-advisor.streamlit.app/"]}}'
+)
+
+
+class BenchCreds:
+    """Credenciales de mentira: basta con que build() no falle."""
+    token = "bench"
+    refresh_token = "bench"
+    expiry = None
+    valid = True
+    expired = False
+
+    def to_json(self):
+        return "{}"
+
+
+def sample_results(n):
+    evidence = []
+    for i in range(n):
+        evidence.append({
+            "Nº": i + 1,
+            "Id_Completo": f"bench{i:08d}",
+            "Id": f"bench{i:03d}",
+            "Fecha": f"2026-{1 + i % 12:02d}-{1 + i % 28:02d} 10:00",
+            "Fecha_Corta": f"{1 + i % 28} Ene",
+            "Origen": "CLIENTE" if i % 2 == 0 else "BANCO",
+            "Asunto": f"Consulta {i} sobre la cartera",
+            "Asunto_Completo": f"Consulta {i} sobre la cartera de inversión",
+            "Cuerpo": ("Buenos días, adjunto la documentación del fondo y las comisiones. " * 20)
+        })
+    analysis = {
+        "resumen_exhaustivo": "Resumen", "urgencia": "Media", "perfil_cliente": "Perfil",
+        "accion_recomendada": "Acción", "borrador_respuesta": "Estimado cliente,\n\nGracias.",
+        "analisis_sentimiento": [
+            {"email_num": i + 1, "sentimiento_score": (i % 11) - 5, "explicacion": "e"} for i in range(n)
+        ],
+        "insights_clave": ["Insight 1", "Insight 2", "Insight 3"]
+    }
+    return {
+        "analysis": analysis, "evidence": evidence, "target_email": "cliente@bench.com",
+        "analysis_mode": "📊 Por número de emails", "email_count": n, "fecha_desde": None, "fecha_hasta": None
+    }
+
+
+def make_app(n):
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=120)
+    at.secrets["OPENAI_KEY"] = "sk-bench"
+    at.secrets["GOOGLE_CREDENTIALS"] = GOOGLE_CREDENTIALS
+    at.session_state["password_correct"] = True
+    at.session_state["creds"] = BenchCreds()
+    at.session_state["analysis_results"] = sample_results(n)
+    at.run()
+    return at
+
+
+def last_span_ms(name):
+    spans = [s for s in telemetry.tracer.spans() if s.name == name]
+    return spans[-1].duration_ms if spans else float("nan")
+
+
+def timed(action, span_name):
+    """Ejecuta una interacción y devuelve (ms script completo, ms fragmento)."""
+    start = time.perf_counter()
+    action().run()
+    return (time.perf_counter() - start) * 1000, last_span_ms(span_name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--emails", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    os.chdir(ROOT)
+    at = make_app(args.emails)
+
+    at.radio(key="navigation_view").set_value("📬 Explorador Avanzado").run()
+    explorer = {"palabra clave": [], "origen": [], "limpiar": []}
+    keywords = ["comisiones", "cartera", "fondo"]  # Coinciden con todos los emails
+    for i in range(args.repeat):
+        keyword = keywords[i % len(keywords)]
+        explorer["palabra clave"].append(timed(lambda: at.text_input(key="f_texto_key").input(keyword), "ui.explorer"))
+        explorer["origen"].append(timed(lambda: at.selectbox(key="f_origen_key").select("CLIENTE"), "ui.explorer"))
+        explorer["limpiar"].append(timed(lambda: at.button(key="clear_filters").click(), "ui.explorer"))
+
+    at.radio(key="navigation_view").set_value("✉️ Generador de Respuesta").run()
+    draft = {"editar borrador": [
+        timed(lambda: at.text_area(key="draft_text").input(f"Borrador {i}"), "ui.draft_editor")
+        for i in range(args.repeat)
+    ]}
+
+    print(f"{args.emails} emails, {args.repeat} repeticiones (mediana en ms)")
+    print(f"{'interacción':<18}{'script completo':>18}{'fragmento':>12}{'ahorro':>10}")
+    for name, samples in {**explorer, **draft}.items():
+        full = statistics.median(s[0] for s in samples)
+        fragment = statistics.median(s[1] for s in samples)
+        print(f"{name:<18}{full:>18.1f}{fragment:>12.1f}{1 - fragment / full:>10.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Búsqueda del Explorador: escaneo de subcadenas vs. índice invertido.
+
+Genera N emails sintéticos largos y compara, por consulta, el filtro antiguo
+(lower() + ``in`` sobre asunto y cuerpo de cada email) con
+InvertedIndex.search. También mide lo que cuesta construir el índice.
+
+Uso:
+    python benchmarks/search_index.py --emails 500
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from advisor.search import InvertedIndex
+
+VOCABULARY = (
+    "fondo inversión comisiones cartera rentabilidad riesgo depósito transferencia "
+    "reunión documentación contrato firma hipoteca préstamo acciones bonos dividendos "
+    "fiscalidad herencia patrimonio liquidez mercado volatilidad gestor perfil"
+).split()
+
+QUERIES = ["comisiones", "comis", "fondo riesgo", "herencia OR hipoteca", "inversion"]
+
+
+def sample_evidence(n, words_per_email=400, seed=7):
+    rng = random.Random(seed)
+    return [{
+        "Asunto_Completo": " ".join(rng.choices(VOCABULARY, k=6)).capitalize(),
+        "Cuerpo": " ".join(rng.choices(VOCABULARY, k=words_per_email)),
+    } for _ in range(n)]
+
+
+def substring_scan(evidence, term):
+    term = term.lower()
+    return [e for e in evidence if term in e['Asunto_Completo'].lower() or term in e['Cuerpo'].lower()]
+
+
+def best_ms(fn, repeat=20):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, (time.perf_counter() - start) * 1000)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--emails", type=int, default=500)
+    args = parser.parse_args(argv)
+
+    evidence = sample_evidence(args.emails)
+    start = time.perf_counter()
+    index = InvertedIndex(evidence)
+    print(f"{args.emails} emails · índice construido en {(time.perf_counter() - start) * 1000:.1f} ms "
+          f"({len(index.vocabulary)} términos)")
+
+    print(f"{'consulta':<22}{'escaneo ms':>12}{'índice ms':>12}")
+    for query in QUERIES:
+        scan = best_ms(lambda: substring_scan(evidence, query))
+        indexed = best_ms(lambda: index.search(query, prefix_last=True))
+        print(f"{query:<22}{scan:>12.3f}{indexed:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
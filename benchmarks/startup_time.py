@@ -0,0 +1,125 @@
+"""
+Arranque en frío de las pantallas de entrada (contraseña y OAuth).
+
+Cada medición es un proceso nuevo con ``python -X importtime``: se importa
+Streamlit (el servidor ya lo tiene cargado), se marca el punto de partida y se
+ejecuta app.py con AppTest hasta la pantalla pedida. Se suman los tiempos de
+import que ocurren después de la marca, se mide el tiempo total del primer
+run y se comprueba que la app no cargó ninguna librería pesada (las que ya
+trae Streamlit, como plotly, no cuentan).
+
+Sale con código 1 si se pasa del presupuesto, para poder usarlo en CI:
+
+    python benchmarks/startup_time.py --repeat 5 --budget-ms 600
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MARKER = "--- app cold start ---"
+
+# Librerías que ninguna de las dos pantallas debe importar
+HEAVY_MODULES = ["pandas", "numpy", "plotly", "openai", "googleapiclient", "reportlab"]
+
+SCREENS = {
+    "contraseña": {},
+    "oauth": {"password_correct": True},
+}
+
+GOOGLE_CREDENTIALS = (
+    '{"web": {"client_id": "bench", "client_secret": "bench", '
+    '"auth_uri": "https://accounts.google.com/o/oauth2/auth", '
+    '"token_uri": "https://oauth2.googleapis.com/token", '
+    '"redirect_uris": ["https://wealth-solutions-advisor.streamlit.app/"]}}'
+)
+
+CHILD = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+sys.path.insert(0, {root!r})
+print({marker!r}, file=sys.stderr, flush=True)
+already_loaded = set(sys.modules)
+at = AppTest.from_file({app!r}, default_timeout=120)
+at.secrets["OPENAI_KEY"] = "sk-bench"
+at.secrets["GOOGLE_CREDENTIALS"] = {google!r}
+for key, value in {state!r}.items():
+    at.session_state[key] = value
+start = time.perf_counter()
+at.run()
+print(json.dumps({{
+    "run_ms": (time.perf_counter() - start) * 1000,
+    "exceptions": [e.value for e in at.exception],
+    "heavy": sorted(m for m in {heavy!r} if m in sys.modules and m not in already_loaded),
+}}))
+"""
+
+
+def import_ms_after_marker(stderr):
+    """Suma de los tiempos acumulados de los imports de primer nivel tras la marca."""
+    total_us = 0
+    seen_marker = False
+    for line in stderr.splitlines():
+        if line.strip() == MARKER:
+            seen_marker = True
+            continue
+        if not seen_marker or not line.startswith("import time:"):
+            continue
+        try:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            cumulative = int(cumulative)
+        except ValueError:
+            continue  # Cabecera "self [us] | cumulative | imported package"
+        if not name.startswith("  "):  # Solo primer nivel: los anidados ya están en su padre
+            total_us += cumulative
+    return total_us / 1000
+
+
+def measure(state):
+    child = CHILD.format(
+        root=ROOT, marker=MARKER, app=os.path.join(ROOT, "app.py"),
+        google=GOOGLE_CREDENTIALS, state=state, heavy=HEAVY_MODULES
+    )
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", child],
+        cwd=ROOT, capture_output=True, text=True, timeout=300
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr[-2000:])
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["import_ms"] = import_ms_after_marker(proc.stderr)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--budget-ms", type=float, default=600.0,
+                        help="Máximo para la mediana del primer run de cada pantalla")
+    args = parser.parse_args(argv)
+
+    failed = False
+    print(f"{'pantalla':<12}{'imports ms':>12}{'primer run ms':>16}  librerías pesadas")
+    for screen, state in SCREENS.items():
+        samples = [measure(state) for _ in range(args.repeat)]
+        import_ms = statistics.median(s["import_ms"] for s in samples)
+        run_ms = statistics.median(s["run_ms"] for s in samples)
+        heavy = sorted({m for s in samples for m in s["heavy"]})
+        errors = [e for s in samples for e in s["exceptions"]]
+        print(f"{screen:<12}{import_ms:>12.1f}{run_ms:>16.1f}  {', '.join(heavy) or '-'}")
+        if errors:
+            print(f"  ❌ excepciones: {errors[:1]}")
+        if run_ms > args.budget_ms or heavy or errors:
+            failed = True
+
+    print(f"Presupuesto: {args.budget_ms:.0f} ms por pantalla, sin {', '.join(HEAVY_MODULES)}")
+    print("❌ Fuera de presupuesto" if failed else "✅ Dentro de presupuesto")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
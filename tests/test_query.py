@@ -0,0 +1,44 @@
+"""Consultas de la barra del Explorador: cláusulas, texto libre y negación."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from advisor.query import EvidenceColumns, compile_query
+from advisor.search import InvertedIndex
+
+EVIDENCE = [
+    {'Fecha': '2026-01-10 09:00', 'Origen': 'CLIENTE', 'Asunto_Completo': 'Comisiones del fondo',
+     'Cuerpo': 'No entiendo las comisiones', 'Adjuntos': 0},
+    {'Fecha': '2026-02-03 12:30', 'Origen': 'BANCO', 'Asunto_Completo': 'Fondo garantizado',
+     'Cuerpo': 'Le envío el folleto del fondo', 'Adjuntos': 1},
+    {'Fecha': '2026-03-15 18:45', 'Origen': 'CLIENTE', 'Asunto_Completo': 'Reunión',
+     'Cuerpo': 'Quiero hablar del fondo garantizado', 'Adjuntos': 0},
+]
+
+
+def run(query_text, **kwargs):
+    columns = EvidenceColumns(EVIDENCE)
+    compiled, error = compile_query(query_text, columns)
+    return compiled.filter(columns, index=InvertedIndex(EVIDENCE), **kwargs), error
+
+
+def test_fields_and_free_text():
+    assert run("fondo from:cliente") == ([0, 2], None)
+    assert run("-has:adjunto after:2026-02-01") == ([2], None)
+    positions, error = run("score:muy from:nadie fondo")
+    assert positions == [0, 1, 2] and "score:muy" in error and "from:nadie" in error
+
+
+def test_negated_word_excludes_matching_emails():
+    assert run("-comisiones") == ([1, 2], None)
+    assert run("fondo -comisiones -folleto") == ([2], None)
+    assert run('-"fondo garantizado"') == ([0], None)
+    compiled, _ = compile_query("fondo -comisiones", EvidenceColumns(EVIDENCE))
+    assert compiled.text == "fondo" and compiled.excluded == ["comisiones"]
+
+
+def test_negation_applies_to_ranked_positions():
+    # Ranking: las posiciones ya vienen de buscar el texto; solo se resta lo negado
+    positions, _ = run("fondo -comisiones", positions=[2, 0, 1], match_text=False)
+    assert positions == [2, 1]
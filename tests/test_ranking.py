@@ -0,0 +1,38 @@
+"""Ranking por pasajes: el índice guardado con to_dict busca igual que el construido."""
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from advisor.evidence import EvidenceFrame
+from advisor.ranking import PASSAGE_STRIDE, RankingIndex, passage_text
+
+
+def email(num, origin, subject, body):
+    return {'Nº': num, 'Id_Completo': f"id{num}", 'Fecha': f"2026-01-{num:02d} 10:00", 'Origen': origin,
+            'Asunto_Completo': subject, 'Cuerpo': body, 'Adjuntos': 0}
+
+
+FILLER = " ".join(f"palabra{i}" for i in range(100))
+RECORDS = [
+    email(1, 'CLIENTE', "Consulta", f"{FILLER} no entiendo las comisiones del fondo garantizado"),
+    email(2, 'BANCO', "Comisiones del fondo", "Le adjunto el detalle de las comisiones de gestión"),
+    email(3, 'CLIENTE', "Reunión", "Podemos vernos el jueves para hablar de la hipoteca"),
+    email(4, 'CLIENTE', "Hipoteca", "Gracias por la información sobre el tipo fijo"),
+]
+
+
+def test_round_trip_keeps_search_and_best_passages():
+    evidence = EvidenceFrame.from_records(RECORDS)
+    index = RankingIndex(evidence)
+    restored = RankingIndex.from_dict(json.loads(json.dumps(index.to_dict())))
+
+    for query in ("comisiones del fondo", "hipoteka", "fondo garantizado", "nada parecido"):
+        assert restored.search(query) == index.search(query)
+
+    hits = {hit['pos']: hit['start'] for hit in restored.search("fondo garantizado")}
+    assert hits[0] > 0 and hits[0] % PASSAGE_STRIDE == 0   # Pasaje del final del cuerpo, no el asunto
+    assert "fondo garantizado" in passage_text(list(evidence)[0], hits[0])
+    assert (restored.passage_start == index.passage_start).all()
+    assert (restored.frequencies == index.frequencies).all()
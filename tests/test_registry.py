@@ -0,0 +1,51 @@
+"""Fusión de clientes al añadir como alias un cliente que ya estaba en la cartera."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from advisor.registry import ClientRegistry
+
+
+def analysis(urgency, *scores):
+    return {'urgencia': urgency, 'analisis_sentimiento': [{'sentimiento_score': s} for s in scores]}
+
+
+@pytest.fixture
+def registry(tmp_path):
+    registry = ClientRegistry(str(tmp_path / "registry.sqlite3"), legacy_path=None)
+    registry.record_analysis("ana@x.es", analysis("baja", 2, 4), emails_analyzed=10, analyzed_at=100.0)
+    registry.portfolio_row("ana@x.es")
+    registry.record_analysis("ana@gmail.com", analysis("alta", -4, -6), emails_analyzed=5, analyzed_at=200.0)
+    registry.portfolio_row("ana@gmail.com")
+    registry.add_alias("ana@gmail.com", "anita")
+    return registry
+
+
+def test_merge_keeps_newer_summary_aliases_and_swaps_matrix_row(registry):
+    assert registry.portfolio_rows() == {"ana@x.es": 0, "ana@gmail.com": 1}
+    assert registry.add_alias("ana@x.es", "ana@gmail.com") == (True, None)
+
+    client = registry.get("anita")
+    assert client['email'] == "ana@x.es"
+    assert (client['urgency'], client['avg_sentiment'], client['emails_analyzed']) == ("alta", -5.0, 5)
+    assert client['last_analyzed_at'] == 200.0
+    assert client['aliases'] == ["ana@gmail.com", "anita"]
+    assert registry.addresses("ana@gmail.com") == ["ana@x.es", "ana@gmail.com"]
+    assert len(registry) == 1
+    # La fila del análisis más reciente pasa al cliente que se queda
+    assert registry.portfolio_rows() == {"ana@x.es": 1}
+
+
+def test_merge_of_older_client_only_fills_gaps(registry):
+    registry.record_analysis("ana@empresa.es", {}, analyzed_at=300.0)   # Modo básico: sin urgencia ni sentimiento
+    assert registry.add_alias("ana@empresa.es", "ana@gmail.com") == (True, None)
+
+    client = registry.get("ana@empresa.es")
+    assert (client['urgency'], client['avg_sentiment'], client['emails_analyzed']) == ("alta", -5.0, 5)
+    assert client['last_analyzed_at'] == 300.0
+    assert client['aliases'] == ["ana@gmail.com", "anita"]
+    # Sin fila propia: se queda con la del cliente fusionado
+    assert registry.portfolio_rows() == {"ana@x.es": 0, "ana@empresa.es": 1}
@@ -0,0 +1,31 @@
+"""Resultados precalculados: caducidad y direcciones del cliente."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from advisor.snapshots import snapshot_scope
+from advisor.store import PrecomputeStore
+
+
+def test_load_requires_the_same_addresses(tmp_path):
+    store = PrecomputeStore(str(tmp_path))
+    addresses = ["ana@x.es"]
+    store.save("ana@x.es", 15, {'analysis': {}, 'evidence': [], 'scope': snapshot_scope(15, addresses=addresses)})
+
+    assert store.load("ana@x.es", 15, scope=snapshot_scope(15, addresses=addresses))
+    assert store.load("ana@x.es", 15)   # Sin scope: cualquiera
+    # Alias añadido después del precálculo: el resultado ya no sirve
+    assert store.load("ana@x.es", 15, scope=snapshot_scope(15, addresses=addresses + ["ana@gmail.com"])) is None
+
+
+def test_load_rejects_results_without_scope(tmp_path):
+    store = PrecomputeStore(str(tmp_path))
+    store.save("ana@x.es", 15, {'analysis': {}, 'evidence': []})   # Precálculo anterior al scope
+    assert store.load("ana@x.es", 15, scope=snapshot_scope(15)) is None
+
+
+def test_load_expires(tmp_path):
+    store = PrecomputeStore(str(tmp_path))
+    store.save("ana@x.es", 15, {'analysis': {}, 'evidence': [], 'scope': snapshot_scope(15)})
+    assert store.load("ana@x.es", 15, max_age_hours=0) is None
@@ -0,0 +1,194 @@
+"""Reservas, caducidad, reintentos y reanudación de la cola del precálculo."""
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from advisor import batch, workqueue
+from advisor.config import EngineConfig
+from advisor.workqueue import DONE, FAILED, LEASED, PENDING, SKIPPED, WorkQueue
+
+PARAMS = {'num_emails': 15}
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return WorkQueue(str(tmp_path / "queue.sqlite3"))
+
+
+def statuses(queue):
+    return {item['client']: item['status'] for item in queue.items("q")}
+
+
+# --- RESERVAS ---
+def test_lease_takes_highest_priority_first(queue):
+    queue.start_run("q", {"a@x": 1.0, "b@x": 5.0, "c@x": 3.0}, PARAMS, skipped=["d@x"])
+    leased = [queue.lease("q", "h:1")['client'] for _ in range(3)]
+    assert leased == ["b@x", "c@x", "a@x"]
+    assert queue.lease("q", "h:1") is None
+    assert statuses(queue)["d@x"] == SKIPPED
+
+
+def test_heartbeat_and_complete_only_for_the_owner(queue):
+    queue.start_run("q", {"a@x": 1.0}, PARAMS)
+    item = queue.lease("q", "h:1")
+    assert item['attempts'] == 1 and item['status'] == LEASED
+    assert not queue.heartbeat(item['id'], "h:2")
+    assert queue.heartbeat(item['id'], "h:1")
+    assert not queue.complete(item['id'], "h:2")
+    assert queue.complete(item['id'], "h:1", timings={'total_s': 1.0})
+    assert statuses(queue) == {"a@x": DONE}
+
+
+# --- CADUCIDAD ---
+def test_expired_lease_is_taken_over(queue):
+    queue.start_run("q", {"a@x": 1.0}, PARAMS)
+    first = queue.lease("q", "h:1", lease_seconds=0.05)
+    assert queue.lease("q", "h:2") is None   # Reserva vigente
+    time.sleep(0.1)
+    second = queue.lease("q", "h:2")
+    assert second['id'] == first['id'] and second['attempts'] == 2
+    assert not queue.complete(first['id'], "h:1")   # El primero perdió la reserva
+    assert queue.complete(second['id'], "h:2")
+
+
+def test_expired_lease_without_attempts_left_fails(queue):
+    queue.start_run("q", {"a@x": 1.0}, PARAMS)
+    for _ in range(workqueue.MAX_ATTEMPTS):
+        assert queue.lease("q", "h:1", lease_seconds=0.01) is not None
+        time.sleep(0.05)
+    assert queue.lease("q", "h:1") is None
+    item = queue.items("q")[0]
+    assert item['status'] == FAILED and item['attempts'] == workqueue.MAX_ATTEMPTS
+
+
+def test_recover_releases_leases_of_dead_processes(queue):
+    queue.start_run("q", {"a@x": 1.0, "b@x": 2.0}, PARAMS)
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    queue.lease("q", f"{workqueue.socket.gethostname()}:{dead.pid}")
+    queue.lease("q", workqueue.worker_id())   # Este proceso sigue vivo
+    assert queue.recover("q") == 1
+    item = queue.lease("q", "h:2")
+    assert item['client'] == "b@x" and item['attempts'] == 2
+
+
+# --- REINTENTOS ---
+def test_fail_retries_after_delay_then_fails(queue, monkeypatch):
+    queue.start_run("q", {"a@x": 1.0}, PARAMS)
+    item = queue.lease("q", "h:1")
+    assert queue.fail(item['id'], "boom", "h:1") == PENDING
+    assert queue.lease("q", "h:1") is None   # Espera RETRY_DELAY_S
+    assert queue.next_available("q") > time.time()
+
+    monkeypatch.setattr(workqueue, "RETRY_DELAY_S", 0)
+    queue.fail(item['id'], "boom", "h:1")   # Ya no está reservada: no cambia nada
+    with queue._connect() as conn:
+        conn.execute("UPDATE work_items SET available_at = 0")
+    item = queue.lease("q", "h:1")
+    assert item['attempts'] == 2
+    assert queue.fail(item['id'], "boom", "h:1") == FAILED
+    assert queue.fail(item['id'], "boom", "h:1") is None
+
+
+# --- EJECUCIONES ---
+def test_start_run_refuses_while_another_process_holds_leases(queue):
+    queue.start_run("q", {"a@x": 1.0, "b@x": 1.0}, PARAMS)
+    queue.lease("q", "h:1")
+    count, error = queue.start_run("q", {"c@x": 1.0}, {'num_emails': 30})
+    assert count == 0 and error
+    assert set(statuses(queue)) == {"a@x", "b@x"}
+
+
+def test_add_keeps_existing_items(queue):
+    queue.start_run("q", {"a@x": 1.0}, PARAMS)
+    item = queue.lease("q", "h:1")
+    assert queue.add("q", {"a@x": 9.0, "b@x": 1.0}, PARAMS) == 1
+    assert statuses(queue) == {"a@x": LEASED, "b@x": PENDING}
+    assert queue.complete(item['id'], "h:1")
+
+
+def test_stats(queue):
+    queue.start_run("q", {"a@x": 1.0, "b@x": 1.0}, PARAMS, skipped=["c@x"])
+    queue.complete(queue.lease("q", "h:1")['id'], "h:1")
+    stats = queue.stats("q")
+    assert (stats[PENDING], stats[DONE], stats[SKIPPED], stats['total']) == (1, 1, 1, 3)
+    assert stats['throughput_per_min'] > 0 and stats['eta_seconds'] is not None
+
+
+# --- PRECÁLCULO ---
+class FakeStore:
+    def __init__(self, fresh=()):
+        self.fresh = set(fresh)
+        self.saved = []
+
+    def load(self, client, num_emails, max_age_hours=None, scope=None):
+        return {} if client in self.fresh else None
+
+    def save(self, client, num_emails, payload):
+        self.saved.append(client)
+
+
+@pytest.fixture
+def precompute(tmp_path, monkeypatch):
+    """run_batch con hilos en vez de procesos y un worker falso (falla con los clientes bad*)."""
+    calls = []
+
+    def fake_client(client, token_path, config, num_emails, addresses=None):
+        calls.append(client)
+        if client.startswith("bad"):
+            return {'status': 'error', 'error': "Sin emails", 'timings': {}}
+        return {'status': 'done', 'payload': {}, 'error': None, 'timings': {'total_s': 0.1}}
+
+    monkeypatch.setattr(batch, "ProcessPoolExecutor", ThreadPoolExecutor)
+    monkeypatch.setattr(batch, "precompute_client", fake_client)
+    monkeypatch.setattr(workqueue, "RETRY_DELAY_S", 0)
+    config = EngineConfig(openai_api_key="k", queue_path=str(tmp_path / "queue.sqlite3"))
+    return config, calls
+
+
+def test_run_batch_retries_once_and_reports(precompute):
+    config, calls = precompute
+    logs = []
+    state = batch.run_batch(["a@x", "bad@x"], "token.json", config, workers=1, store=FakeStore(), log=logs.append)
+    assert calls.count("bad@x") == workqueue.MAX_ATTEMPTS
+    assert state['clients']["a@x"]['status'] == "done"
+    assert state['clients']["bad@x"]['status'] == "error"
+
+
+def test_run_batch_resumes_and_adds_new_clients(precompute):
+    config, calls = precompute
+    queue = WorkQueue(config.queue_path)
+    params = {'num_emails': batch.DEFAULT_NUM_EMAILS, 'max_age_hours': batch.DEFAULT_MAX_AGE_HOURS}
+    queue.start_run(batch.QUEUE_NAME, {"a@x": 1.0, "b@x": 1.0}, params)
+    queue.complete(queue.lease(batch.QUEUE_NAME)['id'])   # La ejecución anterior hizo a@x y se cayó
+
+    state = batch.run_batch(["a@x", "b@x", "c@x"], "token.json", config, workers=2, store=FakeStore(),
+                            log=lambda line: None)
+    assert sorted(calls) == ["b@x", "c@x"]
+    assert all(r['status'] == "done" for r in state['clients'].values())
+
+
+def test_run_batch_force_starts_a_new_run(precompute):
+    config, calls = precompute
+    queue = WorkQueue(config.queue_path)
+    params = {'num_emails': batch.DEFAULT_NUM_EMAILS, 'max_age_hours': batch.DEFAULT_MAX_AGE_HOURS}
+    queue.start_run(batch.QUEUE_NAME, {"a@x": 1.0}, params)
+
+    batch.run_batch(["a@x", "b@x"], "token.json", config, workers=1, store=FakeStore(fresh=["b@x"]),
+                    force=True, log=lambda line: None)
+    assert sorted(calls) == ["a@x", "b@x"]
+
+
+def test_run_batch_logs_lost_leases(precompute, monkeypatch):
+    config, calls = precompute
+    monkeypatch.setattr(WorkQueue, "complete", lambda self, *args, **kwargs: False)
+    logs = []
+    batch.run_batch(["a@x"], "token.json", config, workers=1, store=FakeStore(), log=logs.append)
+    assert any("reserva perdida" in line for line in logs)
+    assert not any(line.startswith("[  1/") for line in logs)